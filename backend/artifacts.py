@@ -0,0 +1,198 @@
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import shutil
+import time
+from typing import Optional, Dict, Tuple, Iterator
+from urllib.parse import quote
+
+# --- Artifact Store ---
+# 生成的字幕文件和服务端执行的输出视频按内容 SHA-256 保存，下载地址由内容决定：
+# 相同内容只存一份，ETag 就是内容哈希，客户端重新获取已缓存的文件只需一次 304。
+# 下载文件名属于每次保存（每个链接），写在下载地址中：同一内容以不同文件名保存时各个链接保留各自的文件名。
+# 文件旁边的 .json 保存第一次保存时的文件名和 MIME 类型，供不带文件名的地址使用；超过有效期未访问的文件被清理。
+
+ARTIFACT_ID_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+HASH_CHUNK_BYTES = 1024 * 1024
+MIME_TYPES = {".srt": "application/x-subrip", ".vtt": "text/vtt", ".ass": "text/x-ssa"}
+
+
+def guess_mime_type(filename: str) -> str:
+    ext = os.path.splitext(filename)[1].lower()
+    return MIME_TYPES.get(ext) or mimetypes.guess_type(filename)[0] or "application/octet-stream"
+
+
+class Artifact:
+    def __init__(self, artifact_id: str, path: str, filename: str, mime_type: str, size: int, created_at: float):
+        self.artifact_id = artifact_id
+        self.path = path
+        self.filename = filename
+        self.mime_type = mime_type
+        self.size = size
+        self.created_at = created_at
+
+    @property
+    def etag(self) -> str:
+        return f'"{self.artifact_id}"'
+
+    @property
+    def url(self) -> str:
+        return f"/api/artifacts/{self.artifact_id}/{quote(self.filename)}"
+
+    def to_dict(self) -> Dict:
+        return {
+            "artifact_id": self.artifact_id,
+            "filename": self.filename,
+            "mime_type": self.mime_type,
+            "size": self.size,
+            "url": self.url,
+        }
+
+
+class ArtifactStore:
+    def __init__(self, directory: str, ttl_seconds: float = 24 * 3600):
+        self.directory = directory
+        self.ttl_seconds = ttl_seconds
+        self._stats = {"stored": 0, "deduplicated": 0, "bytes_stored": 0}
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, artifact_id: str) -> str:
+        return os.path.join(self.directory, artifact_id[:2], artifact_id)
+
+    def _save(self, artifact_id: str, filename: str, mime_type: Optional[str], size: int, write) -> Artifact:
+        """write(path) 把内容写到 path；内容已存在时只更新访问时间，元数据保持第一次保存时的值"""
+        path = self._path(artifact_id)
+        mime_type = mime_type or guess_mime_type(filename)
+        if os.path.exists(path):
+            os.utime(path)
+            self._stats["deduplicated"] += 1
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            write(path)
+            self._stats["stored"] += 1
+            self._stats["bytes_stored"] += size
+        artifact = Artifact(artifact_id, path, filename, mime_type, size, time.time())
+        if not os.path.exists(f"{path}.json"):
+            temp_meta = f"{path}.json.{os.getpid()}.tmp"
+            with open(temp_meta, "w", encoding="utf-8") as f:
+                json.dump({"filename": filename, "mime_type": mime_type, "size": size, "created_at": artifact.created_at}, f, ensure_ascii=False)
+            os.replace(temp_meta, f"{path}.json")
+        return artifact
+
+    def put_bytes(self, data: bytes, filename: str, mime_type: Optional[str] = None) -> Artifact:
+        artifact_id = hashlib.sha256(data).hexdigest()
+
+        def write(path: str):
+            temp_path = f"{path}.{os.getpid()}.tmp"
+            with open(temp_path, "wb") as f:
+                f.write(data)
+            os.replace(temp_path, path)
+
+        return self._save(artifact_id, filename, mime_type, len(data), write)
+
+    def put_file(self, source_path: str, filename: str, mime_type: Optional[str] = None, move: bool = False) -> Artifact:
+        """保存已有文件；move 时移动（同一文件系统时不复制）"""
+        digest = hashlib.sha256()
+        with open(source_path, "rb") as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_BYTES), b""):
+                digest.update(chunk)
+        size = os.path.getsize(source_path)
+
+        def write(path: str):
+            temp_path = f"{path}.{os.getpid()}.tmp"
+            if move:
+                shutil.move(source_path, temp_path)
+            else:
+                shutil.copyfile(source_path, temp_path)
+            os.replace(temp_path, path)
+
+        artifact = self._save(digest.hexdigest(), filename, mime_type, size, write)
+        if move and os.path.exists(source_path):
+            os.remove(source_path)
+        return artifact
+
+    def get(self, artifact_id: str, filename: Optional[str] = None) -> Optional[Artifact]:
+        """filename 为下载地址中的文件名；没有时使用第一次保存时的文件名"""
+        if not ARTIFACT_ID_PATTERN.match(artifact_id or ""):
+            return None
+        path = self._path(artifact_id)
+        try:
+            with open(f"{path}.json", encoding="utf-8") as f:
+                meta = json.load(f)
+            size = os.path.getsize(path)
+        except (OSError, ValueError):
+            return None
+        # 访问即续期
+        os.utime(path)
+        if filename:
+            return Artifact(artifact_id, path, filename, guess_mime_type(filename), size, meta.get("created_at") or 0)
+        return Artifact(artifact_id, path, meta.get("filename") or artifact_id, meta.get("mime_type") or "application/octet-stream", size, meta.get("created_at") or 0)
+
+    def cleanup_expired(self) -> int:
+        """删除超过有效期未访问的文件"""
+        now = time.time()
+        removed = 0
+        for prefix in os.listdir(self.directory):
+            prefix_dir = os.path.join(self.directory, prefix)
+            if not os.path.isdir(prefix_dir):
+                continue
+            for name in os.listdir(prefix_dir):
+                if not ARTIFACT_ID_PATTERN.match(name):
+                    continue
+                path = os.path.join(prefix_dir, name)
+                try:
+                    if now - os.path.getmtime(path) > self.ttl_seconds:
+                        os.remove(path)
+                        if os.path.exists(f"{path}.json"):
+                            os.remove(f"{path}.json")
+                        removed += 1
+                except OSError:
+                    continue
+        return removed
+
+    def stats(self) -> Dict:
+        return {"ttl_seconds": self.ttl_seconds, **self._stats}
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match 可能是 * 或逗号分隔的多个 ETag（允许弱校验前缀 W/）"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """解析单个字节范围，返回 [start, end]（含 end）；没有或无法解析时返回 None（返回完整内容），
+    范围超出文件大小时抛出 ValueError（416）。多范围请求只返回完整内容"""
+    if not header:
+        return None
+    match = re.fullmatch(r"\s*bytes=(\d*)-(\d*)\s*", header)
+    if not match or (not match.group(1) and not match.group(2)):
+        return None
+    if not match.group(1):
+        # bytes=-N：最后 N 个字节
+        length = int(match.group(2))
+        if length == 0:
+            raise ValueError("empty suffix range")
+        return max(0, size - length), size - 1
+    start = int(match.group(1))
+    end = int(match.group(2)) if match.group(2) else size - 1
+    if start >= size or end < start:
+        raise ValueError("range not satisfiable")
+    return start, min(end, size - 1)
+
+
+def iter_file_range(path: str, start: int, end: int, chunk_size: int = 256 * 1024) -> Iterator[bytes]:
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = f.read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
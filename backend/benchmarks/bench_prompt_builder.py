@@ -0,0 +1,58 @@
+"""每个请求构建提示词和生成配置的开销对比：旧的逐请求构建 vs prompt_builder
+
+运行: cd backend && python benchmarks/bench_prompt_builder.py
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from google.genai import types
+from prompt_builder import (
+    generate_subtitle_file_declaration, execute_ffmpeg_with_optional_subtitles_declaration,
+    VIDEO_SYSTEM_INSTRUCTION, build_request_text, build_generate_config
+)
+
+USER_PROMPT = "生成中文字幕"
+FILENAME = "lecture_recording.mp4"
+TEMPERATURE = 0.3
+
+
+def legacy_setup():
+    """重构前 process_video_task_with_content 中每个请求执行的构建逻辑"""
+    tool_config_video = types.Tool(function_declarations=[
+        generate_subtitle_file_declaration,
+        execute_ffmpeg_with_optional_subtitles_declaration
+    ])
+    prompt_for_gemini = (
+        f"User request: '{USER_PROMPT}' (Video file: '{FILENAME}')\n\n"
+        + VIDEO_SYSTEM_INSTRUCTION
+    )
+    request_contents = [types.Part(text=prompt_for_gemini)]
+    config = types.GenerateContentConfig(
+        tools=[types.Tool(function_declarations=[
+            generate_subtitle_file_declaration,
+            execute_ffmpeg_with_optional_subtitles_declaration
+        ])],
+        tool_config=tool_config_video,
+        temperature=TEMPERATURE
+    )
+    return request_contents, config
+
+
+def builder_setup():
+    request_contents = [types.Part(text=build_request_text(USER_PROMPT, FILENAME))]
+    config = build_generate_config(TEMPERATURE)
+    return request_contents, config
+
+
+def main():
+    number = 2000
+    for name, fn in (("legacy", legacy_setup), ("prompt_builder", builder_setup)):
+        best = min(timeit.repeat(fn, number=number, repeat=5))
+        print(f"{name:>15}: {best / number * 1e6:8.1f} us/request")
+
+
+if __name__ == "__main__":
+    main()
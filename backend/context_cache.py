@@ -0,0 +1,73 @@
+import time
+from typing import Optional, Dict, Tuple, List
+
+# --- Gemini Explicit Context Caching ---
+# 为同一视频（按内容哈希）创建 Gemini cached content（视频 Part + 固定系统指令 + 工具声明），
+# 后续指令只发送用户请求文本，避免每次重新 tokenize 数千个视频 token。
+# 这里只维护缓存条目的生命周期，实际的 Gemini 调用由 main.py 负责；
+# 作废时返回被移除的条目，由调用方删除远端的 cached content（否则在 TTL 到期前一直计费存储）。
+
+
+class ContextCacheEntry:
+    def __init__(self, name: str, file_hash: str, model: str, ttl_seconds: float):
+        self.name = name
+        self.file_hash = file_hash
+        self.model = model
+        self.expire_at = time.time() + ttl_seconds
+
+    def remaining_seconds(self) -> float:
+        return self.expire_at - time.time()
+
+
+class ContextCacheManager:
+    def __init__(self, ttl_seconds: float, min_uses: int = 2, min_tokens: int = 4096, failure_backoff_seconds: float = 600):
+        self.ttl_seconds = ttl_seconds
+        # 同一视频被请求 min_uses 次后才创建缓存，一次性请求不付缓存存储费用
+        self.min_uses = min_uses
+        # 内容太短时 Gemini 拒绝创建缓存，而且也没有收益
+        self.min_tokens = min_tokens
+        self.failure_backoff_seconds = failure_backoff_seconds
+        self._entries: Dict[Tuple[str, str], ContextCacheEntry] = {}
+        self._use_counts: Dict[str, int] = {}
+        # 创建失败的视频在一段时间内不再尝试
+        self._failed_until: Dict[Tuple[str, str], float] = {}
+
+    def record_use(self, file_hash: str) -> int:
+        self._use_counts[file_hash] = self._use_counts.get(file_hash, 0) + 1
+        return self._use_counts[file_hash]
+
+    def get(self, file_hash: str, model: str) -> Optional[ContextCacheEntry]:
+        entry = self._entries.get((file_hash, model))
+        # 留出余量，避免请求途中缓存过期
+        if entry and entry.remaining_seconds() < 30:
+            del self._entries[(file_hash, model)]
+            return None
+        return entry
+
+    def needs_refresh(self, entry: ContextCacheEntry) -> bool:
+        """剩余时间不足一半时延长 TTL"""
+        return entry.remaining_seconds() < self.ttl_seconds / 2
+
+    def refreshed(self, entry: ContextCacheEntry):
+        entry.expire_at = time.time() + self.ttl_seconds
+
+    def should_create(self, file_hash: str, model: str, estimated_tokens: int) -> bool:
+        if estimated_tokens < self.min_tokens:
+            return False
+        if self._failed_until.get((file_hash, model), 0) > time.time():
+            return False
+        return self._use_counts.get(file_hash, 0) >= self.min_uses
+
+    def store(self, name: str, file_hash: str, model: str) -> ContextCacheEntry:
+        entry = ContextCacheEntry(name, file_hash, model, self.ttl_seconds)
+        self._entries[(file_hash, model)] = entry
+        return entry
+
+    def mark_failed(self, file_hash: str, model: str):
+        self._failed_until[(file_hash, model)] = time.time() + self.failure_backoff_seconds
+
+    def invalidate(self, file_hash: str, model: str) -> Optional[ContextCacheEntry]:
+        return self._entries.pop((file_hash, model), None)
+
+    def invalidate_file(self, file_hash: str) -> List[ContextCacheEntry]:
+        return [self._entries.pop(key) for key in [k for k in self._entries if k[0] == file_hash]]
@@ -0,0 +1,111 @@
+from typing import Optional, Dict
+
+from model_router import ROUTE_TRANSFORM, ROUTE_SUBTITLE, ROUTE_ANALYSIS, ROUTE_LONG_VIDEO, estimate_cost
+
+# --- Token / Cost Estimator ---
+# 调用 generate_content_stream 之前预估输入/输出 tokens、耗时和费用，用于单任务预算检查。
+# 请求完成后用 usage_metadata 的实际值按模型做指数滑动平均校准，下次预估更准确。
+
+# 各路由的典型输出 tokens
+EXPECTED_OUTPUT_TOKENS = {
+    ROUTE_TRANSFORM: 300,
+    ROUTE_ANALYSIS: 1200,
+    ROUTE_LONG_VIDEO: 2000,
+}
+# 字幕输出随视频时长增长：约每秒 5 tokens
+SUBTITLE_OUTPUT_TOKENS_PER_SECOND = 5
+SUBTITLE_MIN_OUTPUT_TOKENS = 500
+
+# 耗时模型：固定开销 + 输入处理 + 输出生成
+BASE_LATENCY_SECONDS = 2.0
+INPUT_TOKENS_PER_SECOND = 20000
+OUTPUT_TOKENS_PER_SECOND = 150
+
+
+class CostEstimate:
+    def __init__(self, model: str, route: str, input_tokens: int, output_tokens: int, latency_seconds: float,
+                 cost_usd: Optional[float], source: str, media_resolution: Optional[str] = None):
+        self.model = model
+        self.route = route
+        self.input_tokens = input_tokens
+        self.output_tokens = output_tokens
+        self.latency_seconds = latency_seconds
+        self.cost_usd = cost_usd
+        self.source = source  # count_tokens / duration / size
+        self.media_resolution = media_resolution
+
+    def to_dict(self) -> Dict:
+        return {
+            "model": self.model,
+            "input_tokens": self.input_tokens,
+            "output_tokens": self.output_tokens,
+            "latency_seconds": round(self.latency_seconds, 1),
+            "cost_usd": round(self.cost_usd, 6) if self.cost_usd is not None else None,
+            "source": self.source,
+            "media_resolution": self.media_resolution,
+        }
+
+
+class ModelCalibration:
+    """实际值 / 预估值 的滑动平均"""
+    def __init__(self):
+        self.samples = 0
+        self.input_ratio = 1.0
+        self.output_ratio = 1.0
+        self.latency_ratio = 1.0
+
+    def to_dict(self) -> Dict:
+        return {
+            "samples": self.samples,
+            "input_ratio": round(self.input_ratio, 3),
+            "output_ratio": round(self.output_ratio, 3),
+            "latency_ratio": round(self.latency_ratio, 3),
+        }
+
+
+class CostEstimator:
+    def __init__(self, smoothing: float = 0.2):
+        self.smoothing = smoothing
+        self._calibration: Dict[str, ModelCalibration] = {}
+
+    def expected_output_tokens(self, route: str, video_seconds: Optional[float]) -> int:
+        if route == ROUTE_SUBTITLE:
+            return max(SUBTITLE_MIN_OUTPUT_TOKENS, int((video_seconds or 0) * SUBTITLE_OUTPUT_TOKENS_PER_SECOND))
+        return EXPECTED_OUTPUT_TOKENS.get(route, EXPECTED_OUTPUT_TOKENS[ROUTE_ANALYSIS])
+
+    def estimate(self, model: str, route: str, input_tokens: int, video_seconds: Optional[float], source: str,
+                 media_resolution: Optional[str] = None) -> CostEstimate:
+        calibration = self._calibration.get(model) or ModelCalibration()
+        # count_tokens 的结果是准确值，不需要校准
+        if source != "count_tokens":
+            input_tokens = int(input_tokens * calibration.input_ratio)
+        output_tokens = int(self.expected_output_tokens(route, video_seconds) * calibration.output_ratio)
+        latency = (
+            BASE_LATENCY_SECONDS
+            + input_tokens / INPUT_TOKENS_PER_SECOND
+            + output_tokens / OUTPUT_TOKENS_PER_SECOND
+        ) * calibration.latency_ratio
+        return CostEstimate(
+            model, route, input_tokens, output_tokens, latency,
+            estimate_cost(model, input_tokens, output_tokens), source, media_resolution
+        )
+
+    def record_actual(self, estimate: CostEstimate, input_tokens: int, output_tokens: int, latency_seconds: float):
+        """用实际的 usage_metadata 和耗时校准该模型的预估"""
+        calibration = self._calibration.setdefault(estimate.model, ModelCalibration())
+        alpha = self.smoothing
+
+        def blend(current: float, predicted: float, actual: float) -> float:
+            if predicted <= 0 or actual <= 0:
+                return current
+            # 预估值已包含当前校准系数，换算回未校准的比例
+            return (1 - alpha) * current + alpha * current * (actual / predicted)
+
+        if estimate.source != "count_tokens":
+            calibration.input_ratio = blend(calibration.input_ratio, estimate.input_tokens, input_tokens)
+        calibration.output_ratio = blend(calibration.output_ratio, estimate.output_tokens, output_tokens)
+        calibration.latency_ratio = blend(calibration.latency_ratio, estimate.latency_seconds, latency_seconds)
+        calibration.samples += 1
+
+    def stats(self) -> Dict:
+        return {model: calibration.to_dict() for model, calibration in self._calibration.items()}
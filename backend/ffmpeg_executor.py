@@ -0,0 +1,397 @@
+import asyncio
+import os
+import re
+import shutil
+import time
+from typing import Optional, Dict, List, Callable
+
+from ffmpeg_validator import VALUE_OPTIONS, FLAG_OPTIONS, KNOWN_FILTERS, FONTS_DIR, parse_filtergraph, format_filtergraph, split_top_level
+from video_proxy import ffmpeg_available
+
+# --- Server-side FFmpeg Execution ---
+# 可选的服务端执行模式：工具调用的 command_array 在服务器上用原生 ffmpeg 执行（比 ffmpeg.wasm 快很多，
+# 前端也不用把原视频留在内存里）。每个任务在独立的工作目录中运行，只能读写目录内的文件；
+# 进度从 `-progress pipe:1` 的输出解析。进程数受信号量限制。
+
+# 会读写任意路径或网络的选项，服务端执行时拒绝；其余选项也必须在 VALUE_OPTIONS / FLAG_OPTIONS 中
+FORBIDDEN_OPTIONS = {
+    "filter_complex_script", "filter_script", "attach", "dump_attachment", "passlogfile", "sdp_file", "vstats_file",
+    "progress", "report", "stats_period",
+}
+ALLOWED_OPTIONS = (VALUE_OPTIONS | FLAG_OPTIONS) - FORBIDDEN_OPTIONS
+# 滤镜图选项的参数按滤镜检查
+FILTERGRAPH_OPTIONS = ("vf", "af", "filter", "filter_complex", "lavfi")
+# 输入只能是这些容器格式（-format_whitelist），上传的"视频"是 HLS 播放列表或 concat 列表时不会去读其他文件
+INPUT_FORMAT_WHITELIST = "mov,mp4,m4a,3gp,3g2,mj2,matroska,webm,avi,flv,mpegts,mpeg,ogg,wav,mp3,aac,flac,asf,srt,webvtt,ass"
+# 滤镜中读写文件的参数
+FILE_OPTIONS = {
+    "drawtext": {"fontfile", "textfile"},
+    "subtitles": {"filename", "f"},
+    "ass": {"filename", "f"},
+    "curves": {"psfile", "plot"},
+    "deshake": {"filename"},
+}
+# 不写参数名时 ffmpeg 按滤镜选项的声明顺序对应，列出到最后一个文件参数为止
+FILE_POSITIONAL_OPTIONS = {
+    "drawtext": ("fontfile", "text", "textfile"),
+    "subtitles": ("filename",),
+    "ass": ("filename",),
+    "curves": ("preset", "master", "red", "green", "blue", "all", "psfile", "plot"),
+    "deshake": ("x", "y", "w", "h", "rx", "ry", "edge", "blocksize", "contrast", "search", "filename"),
+}
+SUBTITLE_FILTERS = ("subtitles", "ass")
+FILTER_KEY_PATTERN = re.compile(r"^([A-Za-z0-9_\-/.]+)=")
+# 绝对路径、家目录和上级目录
+OUTSIDE_PATH_PATTERN = re.compile(r"^\s*[/~]|(^|[/\\])\.\.([/\\]|$)")
+# 日志中保留的 stderr 长度
+STDERR_TAIL_BYTES = 2000
+
+
+class CommandRejected(ValueError):
+    pass
+
+
+class ExecutionInput:
+    """服务端执行的输入视频：已落盘的文件或内存中的内容；input_filename 是命令中引用的文件名"""
+    def __init__(self, path: Optional[str] = None, content: Optional[bytes] = None, input_filename: Optional[str] = None, duration: Optional[float] = None):
+        self.path = path
+        self.content = content
+        self.input_filename = input_filename
+        self.duration = duration
+
+    @property
+    def available(self) -> bool:
+        return bool(self.path or self.content)
+
+
+class ExecutionResult:
+    def __init__(self, status: str, output_filename: Optional[str] = None, output_path: Optional[str] = None,
+                 output_bytes: int = 0, seconds: float = 0, speed: Optional[float] = None, error: Optional[str] = None):
+        self.status = status  # completed / failed / rejected
+        self.output_filename = output_filename
+        self.output_path = output_path
+        self.output_bytes = output_bytes
+        self.seconds = seconds
+        self.speed = speed
+        self.error = error
+
+    def to_dict(self) -> Dict:
+        return {
+            "status": self.status,
+            "output_filename": self.output_filename,
+            "output_bytes": self.output_bytes,
+            "seconds": round(self.seconds, 2),
+            "speed": self.speed,
+            "error": self.error,
+        }
+
+
+def _is_option(arg: str) -> bool:
+    return arg.startswith("-") and len(arg) > 1 and not re.match(r"^-\d", arg)
+
+
+def _is_plain_filename(name: str) -> bool:
+    return bool(name) and os.path.basename(name) == name and not name.startswith((".", "-")) and ":" not in name
+
+
+def unescape_filter_value(text: str) -> str:
+    """ffmpeg av_get_token 的一层解析：反斜杠转义下一个字符，单引号内原样保留，去掉首尾未转义的空白"""
+    result, index, trailing = [], 0, 0
+    text = text.lstrip(" \n\t\r")
+    while index < len(text):
+        char = text[index]
+        if char == "\\" and index + 1 < len(text):
+            result.append(text[index + 1])
+            index += 2
+            trailing = len(result)
+        elif char == "'":
+            end = text.find("'", index + 1)
+            end = len(text) if end < 0 else end
+            result.append(text[index + 1:end])
+            index = end + 1
+            trailing = len(result)
+        else:
+            result.append(char)
+            index += 1
+            if char not in " \n\t\r":
+                trailing = len(result)
+    return "".join(result[:trailing])
+
+
+def parse_filter_arguments(args: List[str]) -> List[tuple]:
+    """滤镜实际收到的参数 [(key 或 None, value)]：滤镜图解析去掉一层转义，av_opt_set_from_string 按 ':' 切分后每个值再去一层"""
+    arguments = []
+    for piece in split_top_level(unescape_filter_value(":".join(args)), ":"):
+        piece = piece.lstrip(" \n\t\r")
+        match = FILTER_KEY_PATTERN.match(piece)
+        if match:
+            arguments.append((match.group(1), unescape_filter_value(piece[match.end():])))
+        else:
+            arguments.append((None, unescape_filter_value(piece)))
+    return arguments
+
+
+def format_filter_arguments(arguments: List[tuple]) -> List[str]:
+    """parse_filter_arguments 的逆过程，两层都转义"""
+    args = []
+    for key, value in arguments:
+        value = re.sub(r"([\\':])", r"\\\1", value)
+        value = re.sub(r"([\\'\[\],;])", r"\\\1", value)
+        args.append(f"{key}={value}" if key else value)
+    return args
+
+
+def parse_progress_time(values: Dict[str, str]) -> Optional[float]:
+    """-progress 输出中的 out_time_us（旧版本 out_time_ms 实际也是微秒）"""
+    for key in ("out_time_us", "out_time_ms"):
+        value = values.get(key)
+        if value and value.lstrip("-").isdigit():
+            return max(0.0, int(value) / 1_000_000)
+    return None
+
+
+def parse_progress_speed(values: Dict[str, str]) -> Optional[float]:
+    match = re.match(r"^\s*(\d+(?:\.\d+)?)x", values.get("speed") or "")
+    return float(match.group(1)) if match else None
+
+
+class FfmpegExecutor:
+    def __init__(self, directory: str, ffmpeg_binary: str = "ffmpeg", max_workers: int = 2, timeout: float = 1800,
+                 ttl_seconds: float = 6 * 3600, fonts_dir: Optional[str] = None):
+        self.directory = directory
+        self.ffmpeg_binary = ffmpeg_binary
+        self.timeout = timeout
+        self.ttl_seconds = ttl_seconds
+        # 前端字体目录 /customfonts 在服务器上对应的目录；未配置时去掉 fontsdir 使用系统字体
+        self.fonts_dir = fonts_dir
+        self._workers = asyncio.Semaphore(max_workers)
+        self._stats = {"runs": 0, "completed": 0, "failed": 0, "rejected": 0, "seconds": 0.0, "output_bytes": 0}
+        os.makedirs(directory, exist_ok=True)
+
+    @property
+    def available(self) -> bool:
+        return ffmpeg_available(self.ffmpeg_binary)
+
+    def job_dir(self, job_id: str) -> str:
+        return os.path.join(self.directory, job_id)
+
+    def output_path(self, job_id: str, output_filename: str) -> Optional[str]:
+        if not _is_plain_filename(output_filename):
+            return None
+        path = os.path.join(self.job_dir(job_id), output_filename)
+        return path if os.path.isfile(path) else None
+
+    def prepare_command(self, command_array: List[str], input_names: List[str], subtitles_filename: Optional[str]) -> List[str]:
+        """检查命令只读写工作目录中的文件，返回实际执行的参数；不安全时抛出 CommandRejected"""
+        allowed_inputs = set(input_names) | ({subtitles_filename} if subtitles_filename else set())
+        args = []
+        outputs = []
+        # -f 出现在 -i 之前时指定的是输入格式
+        input_format = False
+        index = 0
+        while index < len(command_array):
+            arg = command_array[index]
+            if not _is_option(arg):
+                outputs.append(arg)
+                args.append(arg)
+                input_format = False
+                index += 1
+                continue
+            base = arg[1:].split(":", 1)[0]
+            if base not in ALLOWED_OPTIONS:
+                raise CommandRejected(f"不允许在服务器上使用选项 {arg}")
+            if base in FLAG_OPTIONS:
+                args.append(arg)
+                index += 1
+                continue
+            if index + 1 >= len(command_array):
+                raise CommandRejected(f"选项 {arg} 缺少参数值")
+            value = command_array[index + 1]
+            if base == "i":
+                if value not in allowed_inputs:
+                    raise CommandRejected(f"输入文件 {value} 不在工作目录中")
+                if input_format:
+                    raise CommandRejected("服务器上不允许指定输入格式")
+                args += ["-format_whitelist", INPUT_FORMAT_WHITELIST]
+            elif base == "f":
+                input_format = True
+            elif base in FILTERGRAPH_OPTIONS:
+                value = self._prepare_filtergraph(value, allowed_inputs, subtitles_filename)
+            elif base in ("x264-params", "x265-params") and any(
+                OUTSIDE_PATH_PATTERN.search(param.partition("=")[2]) for param in value.split(":")
+            ):
+                raise CommandRejected(f"{arg} 不能引用工作目录以外的文件")
+            args += [arg, value]
+            index += 2
+        if not outputs:
+            raise CommandRejected("缺少输出文件")
+        for output in outputs:
+            if not _is_plain_filename(output) or output in allowed_inputs:
+                raise CommandRejected(f"输出文件 {output} 必须是工作目录中的新文件")
+        return args
+
+    def _prepare_filtergraph(self, graph: str, allowed_inputs: set, subtitles_filename: Optional[str]) -> str:
+        """按 ffmpeg 的转义规则解析每个滤镜参数后检查：只允许已知滤镜，文件参数只能引用工作目录中的输入"""
+        chains = parse_filtergraph(graph)
+        for chain in chains:
+            for spec in chain:
+                name = spec.name.split("@", 1)[0]
+                if name not in KNOWN_FILTERS:
+                    raise CommandRejected(f"不允许在服务器上使用滤镜 {spec.name}")
+                arguments = []
+                changed = False
+                positional = FILE_POSITIONAL_OPTIONS.get(name, ())
+                for position, (key, value) in enumerate(parse_filter_arguments(spec.args)):
+                    # 有参数名的参数之后 ffmpeg 不再接受按位置的参数
+                    positional = positional if not key else ()
+                    option = key or (positional[position] if position < len(positional) else None)
+                    if option == "fontsdir" and name in SUBTITLE_FILTERS:
+                        # 前端字体目录换成服务器上的目录
+                        changed = True
+                        if self.fonts_dir:
+                            arguments.append((key, self.fonts_dir))
+                        continue
+                    if option == "fontfile" and value.startswith(FONTS_DIR + "/"):
+                        changed = True
+                        if self.fonts_dir:
+                            arguments.append((key, os.path.join(self.fonts_dir, os.path.basename(value))))
+                        continue
+                    if option in FILE_OPTIONS.get(name, ()):
+                        if name in SUBTITLE_FILTERS and value != subtitles_filename:
+                            raise CommandRejected(f"{spec.name} 滤镜只能引用生成的字幕文件")
+                        if value not in allowed_inputs:
+                            raise CommandRejected(f"{spec.name} 滤镜参数 {option} 只能引用工作目录中的输入文件")
+                    elif OUTSIDE_PATH_PATTERN.search(value):
+                        raise CommandRejected(f"{spec.name} 滤镜参数 {key or value} 不能引用工作目录以外的文件")
+                    arguments.append((key, value))
+                if changed:
+                    spec.args = format_filter_arguments(arguments)
+        return format_filtergraph(chains)
+
+    def _materialize(self, job_dir: str, input_names: List[str], source: ExecutionInput, subtitles_filename: Optional[str], subtitles_content: Optional[str]):
+        """把输入视频以所有可能的文件名放进工作目录（硬链接，跨文件系统时复制）"""
+        os.makedirs(job_dir, exist_ok=True)
+        first_path = None
+        for name in input_names:
+            path = os.path.join(job_dir, name)
+            if os.path.exists(path):
+                first_path = first_path or path
+                continue
+            if first_path:
+                os.link(first_path, path)
+            elif source.path:
+                try:
+                    os.link(source.path, path)
+                except OSError:
+                    shutil.copyfile(source.path, path)
+            else:
+                with open(path, "wb") as f:
+                    f.write(source.content)
+            first_path = first_path or path
+        if subtitles_filename and subtitles_content:
+            with open(os.path.join(job_dir, subtitles_filename), "w", encoding="utf-8") as f:
+                f.write(subtitles_content)
+
+    async def run(self, job_id: str, arguments: Dict, input_names: List[str], source: ExecutionInput,
+                  on_progress: Optional[Callable[[Dict], None]] = None) -> ExecutionResult:
+        """执行工具调用参数中的命令；on_progress 收到 {out_time, percent, speed}"""
+        self._stats["runs"] += 1
+        output_filename = arguments.get("output_filename")
+        subtitles_content = arguments.get("subtitles_content") or None
+        subtitles_filename = arguments.get("subtitles_filename") if subtitles_content else None
+        input_names = [name for name in dict.fromkeys(input_names) if _is_plain_filename(name)]
+        try:
+            if subtitles_filename and not _is_plain_filename(subtitles_filename):
+                raise CommandRejected(f"字幕文件名 {subtitles_filename} 不合法")
+            if not _is_plain_filename(output_filename or ""):
+                raise CommandRejected(f"输出文件名 {output_filename} 不合法")
+            command = self.prepare_command(arguments.get("command_array") or [], input_names, subtitles_filename)
+        except CommandRejected as e:
+            self._stats["rejected"] += 1
+            return ExecutionResult("rejected", output_filename, error=str(e))
+
+        job_dir = self.job_dir(job_id)
+        async with self._workers:
+            start_time = time.time()
+            await asyncio.to_thread(self._materialize, job_dir, input_names, source, subtitles_filename, subtitles_content)
+            status, error, speed = await self._run_process(command, job_dir, source.duration, on_progress)
+            seconds = time.time() - start_time
+
+        output_path = os.path.join(job_dir, output_filename)
+        if status == "completed" and not os.path.isfile(output_path):
+            status, error = "failed", f"ffmpeg 没有生成输出文件 {output_filename}"
+        # 输入副本和字幕文件只在执行期间需要
+        for name in input_names + ([subtitles_filename] if subtitles_filename else []):
+            if name != output_filename and os.path.exists(os.path.join(job_dir, name)):
+                os.remove(os.path.join(job_dir, name))
+        self._stats["seconds"] += seconds
+        if status != "completed":
+            self._stats["failed"] += 1
+            return ExecutionResult(status, output_filename, seconds=seconds, error=error)
+        output_bytes = os.path.getsize(output_path)
+        self._stats["completed"] += 1
+        self._stats["output_bytes"] += output_bytes
+        return ExecutionResult(status, output_filename, output_path, output_bytes, seconds, speed)
+
+    async def _run_process(self, command: List[str], cwd: str, duration: Optional[float], on_progress) -> tuple:
+        """返回 (status, error, speed)"""
+        try:
+            process = await asyncio.create_subprocess_exec(
+                self.ffmpeg_binary, "-hide_banner", "-nostdin", "-y", "-nostats", "-progress", "pipe:1", *command,
+                cwd=cwd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+            )
+        except FileNotFoundError:
+            return "failed", f"未找到 {self.ffmpeg_binary}", None
+
+        speed = None
+
+        async def read_progress():
+            nonlocal speed
+            values: Dict[str, str] = {}
+            async for raw_line in process.stdout:
+                key, _, value = raw_line.decode("utf-8", "replace").strip().partition("=")
+                values[key] = value
+                if key != "progress":
+                    continue
+                # 每个进度块以 progress=continue/end 结束
+                out_time = parse_progress_time(values)
+                speed = parse_progress_speed(values) or speed
+                if on_progress and out_time is not None:
+                    percent = min(100, int(out_time * 100 / duration)) if duration else None
+                    on_progress({"out_time": round(out_time, 2), "percent": 100 if value == "end" else percent, "speed": speed})
+                values = {}
+
+        try:
+            _, stderr, _ = await asyncio.wait_for(asyncio.gather(read_progress(), process.stderr.read(), process.wait()), self.timeout)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            return "failed", f"ffmpeg 执行超时 ({self.timeout}s)", speed
+        except BaseException:
+            # 任务被取消时结束子进程
+            if process.returncode is None:
+                process.kill()
+            raise
+        stderr = stderr[-STDERR_TAIL_BYTES:]
+        if process.returncode != 0:
+            message = stderr.decode("utf-8", "replace").strip()
+            print(f"[Executor] ffmpeg 执行失败 (exit {process.returncode}): {message[-500:]}")
+            return "failed", message[-500:] or f"ffmpeg exit {process.returncode}", speed
+        return "completed", None, speed
+
+    def cleanup_expired(self) -> int:
+        """删除超过有效期的任务工作目录"""
+        now = time.time()
+        removed = 0
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                if now - os.path.getmtime(path) > self.ttl_seconds:
+                    shutil.rmtree(path, ignore_errors=True)
+                    removed += 1
+            except OSError:
+                continue
+        return removed
+
+    def stats(self) -> Dict:
+        return {"available": self.available, **self._stats, "seconds": round(self._stats["seconds"], 2)}
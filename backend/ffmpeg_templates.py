@@ -0,0 +1,356 @@
+import os
+import re
+import unicodedata
+from collections import Counter
+from typing import Optional, Dict, List
+
+# --- FFmpeg Template Engine ---
+# 大多数工具调用只是少数几种固定操作（裁剪、缩放、转gif、静音、提取音频、变速、旋转、压缩、转格式）。
+# 这里用正则规则直接生成与 Gemini 工具调用相同结构的 command_array / output_filename，
+# 可以在调用 Gemini 之前作为快速路径，也可以在 Gemini 不可用时作为降级方案。
+# 只有指令中的每个部分都被规则识别时才算匹配，否则交给 Gemini。
+
+TOOL_NAME = "execute_ffmpeg_with_optional_subtitles"
+
+CLOCK = r"\d{1,2}:\d{2}(?::\d{2})?(?:\.\d+)?"
+DURATION = rf"(?:{CLOCK}|\d+(?:\.\d+)?\s*(?:分钟|分)(?:\s*\d+(?:\.\d+)?\s*秒钟?)?|\d+(?:\.\d+)?\s*(?:秒钟|秒|s|sec|seconds?)(?![a-z]))"
+NUMBER = r"\d+(?:\.\d+)?"
+FORMAT = r"(?<![a-z0-9])(?P<fmt>mp4|webm|mov|mkv|avi|mp3|wav|aac|m4a|flac)(?![a-z0-9])"
+
+AUDIO_FORMATS = {
+    "mp3": ["-c:a", "libmp3lame", "-q:a", "2"],
+    "wav": ["-c:a", "pcm_s16le"],
+    "aac": ["-c:a", "aac", "-b:a", "192k"],
+    "m4a": ["-c:a", "aac", "-b:a", "192k"],
+    "flac": ["-c:a", "flac"],
+}
+VIDEO_FORMATS = ("mp4", "mov", "mkv", "avi", "webm")
+# 这些容器之间可以直接复制 H.264/AAC 流，不需要重新编码
+COPY_COMPATIBLE = ("mp4", "mov", "mkv")
+
+# 不影响命令的连接词和口语词，匹配完所有操作后只允许剩下这些
+FILLER_PATTERN = re.compile(
+    r"帮我|帮忙|麻烦|请你|请|给我|一下|这个|这段|该|把|将|视频的|视频|影片|文件|格式|的|并且|并|然后|再|和|以及|同时|"
+    r"只保留|保留|截取|裁剪|剪切|剪辑|剪出|转换成|转换为|转成|转为|转换|导出为|导出|输出为|输出|保存为|改成|变成|做成|生成|"
+    r"降低到|降到|缩放到|缩小到|调整到|调整为|调整|改为|成|为|到|一个|个|我|想|要|需要|可以|吗|吧|呢|一份|"
+    r"\b(?:please|the|video|to|and|make|convert|it|a|an|into|file|as|of|me)\b"
+)
+
+
+def parse_duration(text: str) -> float:
+    """'1:20' / '1分20秒' / '20秒' / '20' 转换为秒"""
+    text = text.strip()
+    if ":" in text:
+        seconds = 0.0
+        for part in text.split(":"):
+            seconds = seconds * 60 + float(part)
+        return seconds
+    minutes = re.match(rf"({NUMBER})\s*(?:分钟|分)\s*(?:({NUMBER})\s*秒)?", text)
+    if minutes:
+        return float(minutes.group(1)) * 60 + float(minutes.group(2) or 0)
+    return float(re.match(NUMBER, text).group(0))
+
+
+def format_seconds(seconds: float) -> str:
+    return f"{seconds:g}"
+
+
+def atempo_chain(factor: float) -> List[str]:
+    """atempo 单个滤镜只支持 0.5~2.0，超出范围时串联多个"""
+    filters = []
+    while factor > 2.0:
+        filters.append("atempo=2.0")
+        factor /= 2.0
+    while factor < 0.5:
+        filters.append("atempo=0.5")
+        factor /= 0.5
+    filters.append(f"atempo={factor:g}")
+    return filters
+
+
+class TemplateMatch:
+    def __init__(self, operations: List[str], command_array: List[str], output_filename: str):
+        self.operations = operations
+        self.command_array = command_array
+        self.output_filename = output_filename
+
+    def to_result(self) -> Dict:
+        """与 Gemini 工具调用相同的结果结构"""
+        return {
+            "tool_call": {
+                "name": TOOL_NAME,
+                "arguments": {
+                    "command_array": self.command_array,
+                    "output_filename": self.output_filename,
+                    "subtitles_content": "",
+                    "subtitles_filename": ""
+                }
+            },
+            "template": {"operations": self.operations}
+        }
+
+
+class _Plan:
+    """解析过程中累积的命令参数"""
+    def __init__(self):
+        self.operations: List[str] = []
+        self.tags: List[str] = []
+        self.input_options: List[str] = []
+        self.output_options: List[str] = []
+        self.video_filters: List[str] = []
+        self.audio_filters: List[str] = []
+        self.output_ext: Optional[str] = None
+        self.scale_height: Optional[int] = None
+        self.scale_half = False
+        self.drop_audio = False
+        self.extract_audio = False
+        self.gif = False
+        self.compress = False
+        # 互斥的操作出现了多次（"前10秒和后10秒"、"720p 并缩小一半"），无法合成一条命令
+        self.conflicting = False
+
+    def add(self, operation: str, tag: str, exclusive: bool = False):
+        if exclusive and operation in self.operations:
+            self.conflicting = True
+        if operation not in self.operations:
+            self.operations.append(operation)
+            self.tags.append(tag)
+
+
+def _consume(text: str, pattern: str, handler) -> str:
+    """匹配到的片段交给 handler 处理，并从文本中移除"""
+    def replace(match):
+        handler(match)
+        return " "
+    return re.sub(pattern, replace, text)
+
+
+def parse_prompt(prompt: str) -> Optional[_Plan]:
+    """把指令解析为操作列表；存在无法识别的内容时返回 None"""
+    text = unicodedata.normalize("NFKC", prompt or "").lower()
+    plan = _Plan()
+
+    # --- 裁剪 ---
+    def skip_head(m):
+        plan.add("trim", "trimmed", exclusive=True)
+        plan.input_options += ["-ss", format_seconds(parse_duration(m.group("d")))]
+    text = _consume(text, rf"(?:去掉|删掉|删除|跳过|剪掉|去除|切掉)\s*(?:开头|开始|前面|前)\s*的?\s*(?P<d>{DURATION})", skip_head)
+
+    def time_range(m):
+        plan.add("trim", "trimmed", exclusive=True)
+        start = parse_duration(m.group("start"))
+        end = parse_duration(m.group("end"))
+        if end <= start:
+            raise ValueError("invalid range")
+        plan.input_options += ["-ss", format_seconds(start), "-to", format_seconds(end)]
+    text = _consume(text, rf"(?:从|第|from)?\s*(?P<start>{DURATION}|{NUMBER})\s*(?:到|至|~|-|to)\s*第?\s*(?P<end>{DURATION})", time_range)
+
+    def tail(m):
+        plan.add("trim", "trimmed", exclusive=True)
+        plan.input_options += ["-sseof", "-" + format_seconds(parse_duration(m.group("d")))]
+    text = _consume(text, rf"(?:最后|后|last)\s*(?P<d>{DURATION})", tail)
+
+    def head(m):
+        plan.add("trim", "trimmed", exclusive=True)
+        plan.output_options += ["-t", format_seconds(parse_duration(m.group("d")))]
+    text = _consume(text, rf"(?:前|开头|first)\s*(?P<d>{DURATION})", head)
+
+    # --- 音频 ---
+    def extract_audio(m):
+        plan.add("extract_audio", "audio")
+        plan.extract_audio = True
+    text = _consume(text, r"(?:提取|导出|分离|抽取|只要)出?\s*(?:其中的|里面的)?\s*(?:音频|声音|音轨)|extract\s+(?:the\s+)?audio", extract_audio)
+
+    def mute(m):
+        plan.add("mute", "muted")
+        plan.drop_audio = True
+    text = _consume(text, r"静音|(?:去掉|去除|删除|移除|删掉|消除|关掉)\s*(?:声音|音频|音轨)|mute|remove\s+(?:the\s+)?audio", mute)
+
+    # --- 变速 ---
+    def speed(m):
+        verb = m.group("verb") or m.group("verb2") or ""
+        slow = verb in ("减速", "慢放", "慢速", "慢动作")
+        factor = float(m.group("factor")) if m.group("factor") else (0.5 if slow else 2.0)
+        if slow and factor > 1:
+            factor = 1 / factor
+        if factor <= 0 or factor == 1:
+            raise ValueError("invalid speed")
+        plan.add("speed", f"{factor:g}x", exclusive=True)
+        plan.video_filters.append(f"setpts=PTS/{factor:g}")
+        plan.audio_filters += atempo_chain(factor)
+    text = _consume(
+        text,
+        rf"(?P<verb>加速|快放|快进|减速|慢放|慢速|慢动作)?\s*(?:到|为|成)?\s*(?P<factor>{NUMBER})\s*(?:倍速|倍|x)(?![a-z])(?:播放)?|(?P<verb2>加速|快放|减速|慢放|慢动作)(?:播放)?",
+        speed
+    )
+
+    # --- 旋转 / 翻转 / 倒放 ---
+    def rotate(filters: List[str], tag: str):
+        def handler(m):
+            plan.add("rotate", tag)
+            plan.video_filters.extend(filters)
+        return handler
+    text = _consume(text, r"(?:逆时针|向左)\s*旋转\s*90\s*度?|旋转\s*-90\s*度?", rotate(["transpose=2"], "rotated"))
+    text = _consume(text, r"旋转\s*180\s*度?|上下颠倒", rotate(["transpose=1", "transpose=1"], "rotated"))
+    text = _consume(text, r"(?:顺时针|向右)?\s*旋转\s*90\s*度?", rotate(["transpose=1"], "rotated"))
+    text = _consume(text, r"水平翻转|左右翻转|镜像|hflip", rotate(["hflip"], "flipped"))
+    text = _consume(text, r"垂直翻转|上下翻转|vflip", rotate(["vflip"], "flipped"))
+
+    def reverse(m):
+        plan.add("reverse", "reversed")
+        plan.video_filters.append("reverse")
+        plan.audio_filters.append("areverse")
+    text = _consume(text, r"倒放|倒序播放|反向播放|倒着播放|reverse", reverse)
+
+    # --- 尺寸 / 压缩 ---
+    def scale(m):
+        plan.add("scale", f"{m.group('h')}p", exclusive=True)
+        plan.scale_height = int(m.group("h"))
+    text = _consume(text, r"(?P<h>2160|1440|1080|720|540|480|360|240)\s*p(?![a-z])", scale)
+
+    def half(m):
+        plan.add("scale", "half", exclusive=True)
+        plan.scale_half = True
+    text = _consume(text, r"缩小一半|(?:分辨率|尺寸|大小)(?:缩小|减)?一半|一半(?:的)?(?:分辨率|尺寸|大小)|half\s+(?:size|resolution)", half)
+
+    def compress(m):
+        plan.add("compress", "compressed")
+        plan.compress = True
+    text = _consume(text, r"压缩|减小体积|缩小体积|减小文件大小|变小一点|变小|compress", compress)
+
+    # --- 输出格式 ---
+    def gif(m):
+        plan.add("gif", "gif")
+        plan.gif = True
+    text = _consume(text, r"gif|动图", gif)
+
+    def output_format(m):
+        fmt = m.group("fmt")
+        if plan.output_ext and plan.output_ext != fmt:
+            plan.conflicting = True
+        plan.output_ext = fmt
+        if fmt in AUDIO_FORMATS:
+            plan.add("extract_audio", "audio")
+            plan.extract_audio = True
+        else:
+            plan.add("convert", fmt)
+    # "把mp4转成gif"、"从mov转为mp4" 中前面的格式是原视频的格式
+    text = _consume(text, rf"(?:把|将|从|from)\s*(?:这个|这段)?\s*{FORMAT}", lambda m: None)
+    text = _consume(text, FORMAT, output_format)
+
+    if not plan.operations or plan.conflicting:
+        return None
+    leftover = FILLER_PATTERN.sub(" ", text)
+    if re.sub(r"[\W_]+", "", leftover):
+        return None
+    if plan.extract_audio and (plan.drop_audio or plan.gif or plan.video_filters and not plan.audio_filters):
+        return None
+    if plan.gif and plan.output_ext:
+        return None
+    return plan
+
+
+def build_command(plan: _Plan, input_filename: str, media_info: Optional[Dict] = None) -> TemplateMatch:
+    stem, input_ext = os.path.splitext(os.path.basename(input_filename))
+    input_ext = input_ext.lstrip(".").lower() or "mp4"
+    stem = re.sub(r"\s+", "_", stem) or "output"
+    has_audio = not media_info or bool(media_info.get("audio_streams"))
+    video = (media_info or {}).get("video") or {}
+
+    if plan.gif:
+        ext = "gif"
+    elif plan.extract_audio:
+        ext = plan.output_ext if plan.output_ext in AUDIO_FORMATS else "mp3"
+    else:
+        ext = plan.output_ext or (input_ext if input_ext in VIDEO_FORMATS else "mp4")
+
+    video_filters = list(plan.video_filters)
+    audio_filters = list(plan.audio_filters) if has_audio else []
+    if plan.scale_height:
+        video_filters.append(f"scale=-2:{plan.scale_height}")
+    elif plan.scale_half:
+        video_filters.append("scale=trunc(iw/4)*2:-2")
+
+    command = list(plan.input_options) + ["-i", input_filename] + list(plan.output_options)
+
+    if plan.gif:
+        if not plan.scale_height and not plan.scale_half:
+            width = min(480, video.get("width") or 480)
+            video_filters.append(f"scale={width}:-1:flags=lanczos")
+        video_filters.insert(0, "fps=10")
+        command += ["-vf", ",".join(video_filters), "-an", "-loop", "0"]
+    elif plan.extract_audio:
+        command += ["-vn"]
+        if audio_filters:
+            command += ["-af", ",".join(audio_filters)]
+        command += AUDIO_FORMATS[ext]
+    else:
+        if video_filters:
+            command += ["-vf", ",".join(video_filters)]
+        drop_audio = plan.drop_audio or not has_audio
+        if audio_filters and not drop_audio:
+            command += ["-af", ",".join(audio_filters)]
+        reencode_video = bool(video_filters) or plan.compress or ext not in COPY_COMPATIBLE or input_ext not in COPY_COMPATIBLE
+        if ext == "webm":
+            command += ["-c:v", "libvpx-vp9", "-crf", "36" if plan.compress else "32", "-b:v", "0", "-deadline", "realtime", "-cpu-used", "8"]
+        elif reencode_video:
+            command += ["-c:v", "libx264", "-preset", "veryfast", "-crf", "28" if plan.compress else "23", "-pix_fmt", "yuv420p"]
+        else:
+            command += ["-c:v", "copy"]
+        if drop_audio:
+            command += ["-an"]
+        elif ext == "webm":
+            command += ["-c:a", "libopus", "-b:a", "96k"]
+        elif audio_filters or plan.compress or reencode_video and ext not in COPY_COMPATIBLE:
+            command += ["-c:a", "aac", "-b:a", "96k" if plan.compress else "128k"]
+        else:
+            command += ["-c:a", "copy"]
+        if ext in ("mp4", "mov"):
+            command += ["-movflags", "+faststart"]
+
+    output_filename = f"{stem}_{'_'.join(plan.tags)}.{ext}"
+    if output_filename == os.path.basename(input_filename):
+        output_filename = f"{stem}_output.{ext}"
+    command.append(output_filename)
+    return TemplateMatch(plan.operations, command, output_filename)
+
+
+class FfmpegTemplateEngine:
+    """模板匹配入口，同时统计覆盖率"""
+    def __init__(self):
+        self.attempts = 0
+        self.matched = 0
+        self.served = Counter()
+        self.operations = Counter()
+
+    def match(self, prompt: str, input_filename: str, media_info: Optional[Dict] = None) -> Optional[TemplateMatch]:
+        self.attempts += 1
+        try:
+            plan = parse_prompt(prompt)
+        except ValueError:
+            plan = None
+        if not plan:
+            return None
+        self.matched += 1
+        self.operations.update(plan.operations)
+        return build_command(plan, input_filename, media_info)
+
+    def can_handle(self, prompt: str) -> bool:
+        """只判断能否匹配，不计入覆盖率统计"""
+        try:
+            return parse_prompt(prompt) is not None
+        except ValueError:
+            return False
+
+    def record_served(self, mode: str):
+        """mode: fast_path（直接返回）或 fallback（Gemini 不可用时降级）"""
+        self.served[mode] += 1
+
+    def stats(self) -> Dict:
+        return {
+            "attempts": self.attempts,
+            "matched": self.matched,
+            "coverage": round(self.matched / self.attempts, 4) if self.attempts else 0.0,
+            "served": dict(self.served),
+            "operations": dict(self.operations),
+        }
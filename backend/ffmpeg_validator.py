@@ -0,0 +1,545 @@
+import difflib
+import os
+import re
+import shlex
+from collections import Counter
+from typing import Optional, Dict, List
+
+from ffmpeg_templates import AUDIO_FORMATS
+
+# --- FFmpeg Command Validator ---
+# Gemini 返回的 command_array 直接交给前端的 ffmpeg.wasm 执行，参数错误要等用户看完AI回复后才报错。
+# 这里在返回前解析参数数组：输入文件名、选项、滤镜和滤镜参数、字幕滤镜语法、输出扩展名与编码器，
+# 能确定含义的常见错误直接修正；无法修正的问题（errors）交给调用方发起一次纯文本的修复请求。
+# 不认识的选项只记录为 warnings，不阻止执行。
+
+FONTS_DIR = "/customfonts"
+FONT_NAME = "Source Han Sans SC"
+
+# 需要一个参数值的选项（按 ':' 前的基础名匹配，如 -c:v、-b:a、-metadata:s:a:0）
+VALUE_OPTIONS = {
+    "i", "f", "c", "codec", "vcodec", "acodec", "scodec", "b", "q", "qscale", "crf", "cq", "qp", "preset", "tune", "profile",
+    "level", "pix_fmt", "vf", "af", "filter", "filter_complex", "lavfi", "map", "map_metadata", "map_chapters", "metadata",
+    "ss", "sseof", "t", "to", "r", "fpsmax", "s", "aspect", "ar", "ac", "ab", "vol", "frames", "vframes", "aframes",
+    "movflags", "loop", "stream_loop", "threads", "g", "keyint_min", "bf", "maxrate", "minrate", "bufsize", "x264-params",
+    "x265-params", "deadline", "cpu-used", "row-mt", "tile-columns", "speed", "sample_fmt", "channel_layout", "itsoffset",
+    "fs", "disposition", "strict", "max_muxing_queue_size", "vsync", "fps_mode", "async", "loglevel", "v", "timecode",
+    "start_number", "update", "segment_time", "hls_time", "hls_list_size", "pass", "tag", "vtag", "atag", "sws_flags",
+    "color_primaries", "color_trc", "colorspace", "color_range", "compression_level", "framerate", "video_size",
+    "pattern_type", "filter_complex_script", "attach", "dn", "force_key_frames", "avoid_negative_ts", "fflags",
+    "analyzeduration", "probesize", "bsf", "absf", "vbsf", "qmin", "qmax", "lossless", "quality", "b_strategy", "sc_threshold",
+}
+# 不带参数值的选项
+FLAG_OPTIONS = {
+    "y", "n", "an", "vn", "sn", "dn", "shortest", "hide_banner", "nostdin", "nostats", "stats", "re", "copyts",
+    "start_at_zero", "accurate_seek", "noaccurate_seek", "autorotate", "noautorotate", "benchmark", "xerror",
+    "ignore_unknown", "copy_unknown", "apad", "reinit_filter", "noreinit_filter",
+}
+# 写成 -vf 的选项和对应的流类型
+STREAM_FILTER_OPTIONS = {"vf": "v", "af": "a", "filter:v": "v", "filter:a": "a"}
+
+# ffmpeg.wasm core 构建中常用的滤镜
+KNOWN_FILTERS = {
+    "scale", "crop", "pad", "fps", "setpts", "trim", "split", "concat", "overlay", "drawtext", "drawbox", "subtitles", "ass",
+    "transpose", "hflip", "vflip", "rotate", "format", "setsar", "setdar", "fade", "palettegen", "paletteuse", "eq", "hue",
+    "boxblur", "gblur", "unsharp", "noise", "negate", "colorchannelmixer", "colorbalance", "curves", "lut", "lutyuv", "lutrgb",
+    "select", "thumbnail", "tile", "zoompan", "minterpolate", "framerate", "tpad", "reverse", "loop", "null", "copy",
+    "deinterlace", "yadif", "hqdn3d", "nlmeans", "delogo", "vignette", "chromakey", "colorkey", "blend", "xfade", "hstack",
+    "vstack", "xstack", "scale2ref", "showwaves", "showspectrum", "setfield", "fieldorder", "deshake", "edgedetect",
+    "atempo", "volume", "atrim", "asetpts", "afade", "aresample", "aformat", "amix", "amerge", "pan", "loudnorm", "dynaudnorm",
+    "highpass", "lowpass", "bandpass", "equalizer", "bass", "treble", "acompressor", "silenceremove", "areverse", "apad",
+    "aecho", "anull", "asplit", "adelay", "channelsplit", "join", "acrossfade", "silencedetect", "volumedetect",
+    "anlmdn", "afftdn", "rubberband", "asetrate", "aloop",
+}
+# 部分滤镜的命名参数，用于修正拼错的参数名（位置参数不检查）
+FILTER_OPTIONS = {
+    "scale": {"w", "h", "width", "height", "flags", "force_original_aspect_ratio", "force_divisible_by", "eval", "interl", "in_range", "out_range"},
+    "crop": {"w", "h", "x", "y", "out_w", "out_h", "keep_aspect", "exact"},
+    "pad": {"w", "h", "x", "y", "width", "height", "color", "aspect", "eval"},
+    "fps": {"fps", "start_time", "round", "eof_action"},
+    "subtitles": {"filename", "f", "original_size", "fontsdir", "alpha", "charenc", "stream_index", "si", "force_style", "wrap_unicode"},
+    "ass": {"filename", "f", "original_size", "fontsdir", "alpha", "shaping"},
+    "fade": {"type", "t", "start_frame", "s", "nb_frames", "n", "alpha", "start_time", "st", "duration", "d", "color", "c"},
+    "afade": {"type", "t", "start_sample", "ss", "nb_samples", "ns", "start_time", "st", "duration", "d", "curve"},
+    "trim": {"start", "end", "start_pts", "end_pts", "duration", "start_frame", "end_frame"},
+    "atrim": {"start", "end", "start_pts", "end_pts", "duration", "start_sample", "end_sample"},
+    "volume": {"volume", "precision", "eval", "replaygain"},
+    "loudnorm": {"I", "i", "LRA", "lra", "TP", "tp", "measured_I", "measured_LRA", "measured_TP", "measured_thresh", "offset", "linear", "dual_mono", "print_format"},
+    "transpose": {"dir", "passthrough"},
+    "rotate": {"angle", "a", "out_w", "ow", "out_h", "oh", "fillcolor", "c", "bilinear"},
+    "overlay": {"x", "y", "eof_action", "eval", "shortest", "format", "repeatlast", "alpha"},
+}
+
+# 输出扩展名允许的编码器；不在表中的扩展名不检查
+VIDEO_ENCODERS = {
+    "mp4": {"libx264", "libx265", "h264", "hevc", "mpeg4", "libaom-av1", "copy"},
+    "mov": {"libx264", "libx265", "h264", "hevc", "mpeg4", "prores", "prores_ks", "copy"},
+    "mkv": None,
+    "webm": {"libvpx", "libvpx-vp9", "vp8", "vp9", "libaom-av1", "av1", "copy"},
+    "gif": {"gif"},
+    "avi": {"mpeg4", "libx264", "mjpeg", "copy"},
+}
+AUDIO_ENCODERS = {
+    "mp4": {"aac", "libmp3lame", "mp3", "ac3", "copy", "libopus", "opus", "alac", "flac"},
+    "mov": {"aac", "libmp3lame", "mp3", "pcm_s16le", "alac", "copy"},
+    "webm": {"libopus", "opus", "libvorbis", "vorbis", "copy"},
+    "mp3": {"libmp3lame", "mp3", "copy"},
+    "m4a": {"aac", "alac", "copy"},
+    "aac": {"aac", "copy"},
+    "wav": {"pcm_s16le", "pcm_s24le", "pcm_s32le", "pcm_f32le", "pcm_u8", "copy"},
+    "flac": {"flac", "copy"},
+    "ogg": {"libvorbis", "vorbis", "libopus", "opus", "flac", "copy"},
+    "opus": {"libopus", "opus", "copy"},
+}
+DEFAULT_VIDEO_ENCODERS = {"mp4": "libx264", "mov": "libx264", "avi": "mpeg4", "webm": "libvpx-vp9", "mkv": "libx264"}
+DEFAULT_AUDIO_ENCODERS = {
+    "mp4": "aac", "mov": "aac", "webm": "libopus", "ogg": "libvorbis", "opus": "libopus", "mkv": "aac",
+    **{ext: options[1] for ext, options in AUDIO_FORMATS.items()},
+}
+AUDIO_ONLY_EXTENSIONS = set(AUDIO_ENCODERS) - set(VIDEO_ENCODERS)
+# 模型常写错的编码器名
+# 模型常用来指代上传视频的占位文件名
+PLACEHOLDER_INPUT = re.compile(r"^(?:input|in|video|source|input_video|inputvideo)(?:\.\w+)?$", re.I)
+ENCODER_ALIASES = {
+    "x264": "libx264", "h.264": "libx264", "avc": "libx264", "x265": "libx265", "h.265": "libx265",
+    "lame": "libmp3lame", "mp3lame": "libmp3lame", "libvpx9": "libvpx-vp9", "vpx-vp9": "libvpx-vp9", "libfdk_aac": "aac",
+}
+
+
+def split_top_level(text: str, separators: str) -> List[str]:
+    """按分隔符切分，跳过引号内和反斜杠转义的分隔符"""
+    parts, current, quoted, escaped = [], [], False, False
+    for char in text:
+        if escaped:
+            current.append(char)
+            escaped = False
+        elif char == "\\":
+            current.append(char)
+            escaped = True
+        elif char == "'":
+            current.append(char)
+            quoted = not quoted
+        elif char in separators and not quoted:
+            parts.append("".join(current))
+            current = []
+        else:
+            current.append(char)
+    parts.append("".join(current))
+    return parts
+
+
+class FilterSpec:
+    """滤镜图中的一个滤镜：[输入标签]名称=参数[输出标签]"""
+    LABELS = re.compile(r"^((?:\s*\[[^\]]*\])*)\s*(.*?)\s*((?:\[[^\]]*\]\s*)*)$", re.S)
+
+    def __init__(self, text: str):
+        match = self.LABELS.match(text)
+        self.inputs, body, self.outputs = match.group(1), match.group(2), match.group(3)
+        name, _, args = body.partition("=")
+        self.name = name.strip()
+        self.args = split_top_level(args, ":") if args else []
+
+    def __str__(self) -> str:
+        body = f"{self.name}={':'.join(self.args)}" if self.args else self.name
+        return f"{self.inputs}{body}{self.outputs}"
+
+
+def parse_filtergraph(graph: str) -> List[List[FilterSpec]]:
+    return [[FilterSpec(text) for text in split_top_level(chain, ",")] for chain in split_top_level(graph, ";")]
+
+
+def format_filtergraph(chains: List[List[FilterSpec]]) -> str:
+    return ";".join(",".join(str(spec) for spec in chain) for chain in chains)
+
+
+def _option_base(option: str) -> str:
+    return option[1:].split(":", 1)[0]
+
+
+def _extension(filename: str) -> str:
+    return os.path.splitext(filename)[1].lstrip(".").lower()
+
+
+class CommandValidation:
+    def __init__(self, command_array: List[str], output_filename: str):
+        self.command_array = command_array
+        self.output_filename = output_filename
+        self.fixes: List[str] = []
+        self.errors: List[str] = []
+        self.warnings: List[str] = []
+
+    @property
+    def valid(self) -> bool:
+        return not self.errors
+
+    def to_dict(self) -> Dict:
+        return {"valid": self.valid, "fixes": self.fixes, "errors": self.errors, "warnings": self.warnings}
+
+
+class _CommandChecker:
+    """一次校验过程：逐项检查并修正参数数组"""
+    def __init__(self, command_array, output_filename: Optional[str], input_names: List[str], subtitles_filename: Optional[str]):
+        self.input_names = [name for name in input_names if name]
+        self.subtitles_filename = subtitles_filename or None
+        self.args = self._normalize(command_array)
+        self.result = CommandValidation(self.args, output_filename or "")
+
+    def fix(self, message: str):
+        self.result.fixes.append(message)
+
+    def error(self, message: str):
+        self.result.errors.append(message)
+
+    def _normalize(self, command_array) -> List[str]:
+        if isinstance(command_array, str):
+            try:
+                args = shlex.split(command_array)
+            except ValueError:
+                args = command_array.split()
+        else:
+            args = [str(arg) for arg in command_array or []]
+        if args and os.path.basename(args[0]).lower() in ("ffmpeg", "ffmpeg.exe"):
+            args = args[1:]
+        return args
+
+    def run(self) -> CommandValidation:
+        if not self.args:
+            self.error("command_array 为空")
+            return self.result
+        self.check_options()
+        self.check_inputs()
+        self.merge_repeated_filters()
+        self.check_filters()
+        self.check_output()
+        self.check_codecs()
+        self.result.command_array = self.args
+        return self.result
+
+    def check_options(self):
+        """拼错的选项名；缺少参数值的选项"""
+        known = VALUE_OPTIONS | FLAG_OPTIONS
+        index = 0
+        while index < len(self.args):
+            arg = self.args[index]
+            if not arg.startswith("-") or len(arg) < 2 or re.match(r"^-\d", arg):
+                index += 1
+                continue
+            base = _option_base(arg)
+            if base not in known:
+                close = difflib.get_close_matches(base, known, n=1, cutoff=0.85)
+                if close:
+                    fixed = "-" + close[0] + arg[1 + len(base):]
+                    self.fix(f"选项 {arg} -> {fixed}")
+                    self.args[index] = arg = fixed
+                    base = close[0]
+                else:
+                    self.result.warnings.append(f"未知选项 {arg}")
+                    index += 1
+                    continue
+            if base in VALUE_OPTIONS:
+                if index + 1 >= len(self.args):
+                    self.error(f"选项 {arg} 缺少参数值")
+                index += 2
+            else:
+                index += 1
+
+    def _value_positions(self, *bases: str) -> List[int]:
+        """指定选项的参数值在数组中的位置"""
+        positions = []
+        index = 0
+        while index < len(self.args):
+            arg = self.args[index]
+            if arg.startswith("-") and len(arg) > 1 and not re.match(r"^-\d", arg):
+                base = _option_base(arg)
+                if base in VALUE_OPTIONS:
+                    if (base in bases or arg[1:] in bases) and index + 1 < len(self.args):
+                        positions.append(index + 1)
+                    index += 2
+                    continue
+            index += 1
+        return positions
+
+    def _positional_positions(self) -> List[int]:
+        """既不是选项也不是选项参数值的参数（输出文件）的位置"""
+        positions = []
+        index = 0
+        while index < len(self.args):
+            arg = self.args[index]
+            if arg.startswith("-") and len(arg) > 1 and not re.match(r"^-\d", arg):
+                index += 2 if _option_base(arg) in VALUE_OPTIONS else 1
+                continue
+            positions.append(index)
+            index += 1
+        return positions
+
+    def _input_correction(self, name: str, allowed: set, used: set) -> Optional[str]:
+        """明显是上传文件名写错时返回正确的文件名：大小写或个别字符不同，或者占位名（input.mp4）"""
+        close = difflib.get_close_matches(name, allowed, n=1, cutoff=0.8) or [a for a in allowed if a.lower() == name.lower()]
+        if close:
+            return close[0]
+        if PLACEHOLDER_INPUT.match(name) and self.input_names[0] not in used:
+            return self.input_names[0]
+        return None
+
+    def check_inputs(self):
+        """输入文件名必须是上传的视频或字幕文件；没有 -i 时补上。
+        只修正明显写错的文件名，其他输入（叠加的图片等）无法提供，报错交给修复请求"""
+        positions = self._value_positions("i")
+        if not positions:
+            if self.input_names:
+                self.args[:0] = ["-i", self.input_names[0]]
+                self.fix(f"补充输入文件 -i {self.input_names[0]}")
+            else:
+                self.error("缺少输入文件 -i")
+            return
+        allowed = set(self.input_names) | ({self.subtitles_filename} if self.subtitles_filename else set())
+        if not self.input_names:
+            return
+        for position in positions:
+            name = self.args[position]
+            if name in allowed or name.startswith(("color=", "anullsrc", "testsrc", "lavfi")) or (position >= 3 and self.args[position - 3] == "-f"):
+                continue
+            correction = self._input_correction(name, allowed, {self.args[p] for p in positions})
+            if correction:
+                self.fix(f"输入文件 {name} -> {correction}")
+                self.args[position] = correction
+            else:
+                self.error(f"输入文件 {name} 不存在，只能使用 {'、'.join(sorted(allowed))}")
+
+    def merge_repeated_filters(self):
+        """同一输出重复的 -vf / -af 只有最后一个生效，合并成一个滤镜链"""
+        for stream in ("v", "a"):
+            option_names = [name for name, kind in STREAM_FILTER_OPTIONS.items() if kind == stream]
+            positions = self._value_positions(*option_names)
+            if len(positions) < 2:
+                continue
+            merged = ",".join(self.args[position] for position in positions)
+            for position in reversed(positions[1:]):
+                del self.args[position - 1:position + 1]
+            self.args[positions[0]] = merged
+            self.fix(f"合并 {len(positions)} 个 -{stream}f 滤镜")
+
+    def check_filters(self):
+        for position in self._value_positions("vf", "af", "filter", "filter_complex", "lavfi"):
+            chains = parse_filtergraph(self.args[position])
+            for chain in chains:
+                for spec in chain:
+                    self._check_filter(spec)
+            self.args[position] = format_filtergraph(chains)
+
+    def _check_filter(self, spec: FilterSpec):
+        if not spec.name:
+            self.error("滤镜图中有空滤镜")
+            return
+        if spec.name not in KNOWN_FILTERS:
+            close = difflib.get_close_matches(spec.name, KNOWN_FILTERS, n=1, cutoff=0.75)
+            if not close:
+                self.error(f"未知滤镜 {spec.name}")
+                return
+            self.fix(f"滤镜 {spec.name} -> {close[0]}")
+            spec.name = close[0]
+        if spec.name in ("subtitles", "ass"):
+            self._check_subtitles_filter(spec)
+            return
+        options = FILTER_OPTIONS.get(spec.name)
+        if not options:
+            return
+        for index, arg in enumerate(spec.args):
+            key, sep, value = arg.partition("=")
+            if not sep or key in options:
+                continue
+            close = difflib.get_close_matches(key, options, n=1, cutoff=0.75)
+            if close:
+                self.fix(f"{spec.name} 参数 {key} -> {close[0]}")
+                spec.args[index] = f"{close[0]}={value}"
+            else:
+                self.error(f"{spec.name} 滤镜没有参数 {key}")
+
+    def _check_subtitles_filter(self, spec: FilterSpec):
+        """subtitles=<字幕文件>:fontsdir=/customfonts:force_style='Fontname=Source Han Sans SC'"""
+        filename = None
+        style_extra = []
+        args = []
+        for arg in spec.args:
+            key, sep, value = arg.partition("=")
+            if not sep and filename is None:
+                filename = arg
+            elif key in ("filename", "f"):
+                filename = value
+            elif key.lower() in ("fontsize", "font_size", "fontdir", "fonts_dir", "fontsdirs"):
+                if re.fullmatch(r"\d+(?:\.\d+)?", value.strip("'\"")):
+                    # subtitles 滤镜没有字号参数，字号写进 force_style
+                    style_extra.append(f"Fontsize={value.strip(chr(39) + chr(34))}")
+                    self.fix(f"subtitles 参数 {key}={value} 移入 force_style")
+                else:
+                    self.fix(f"subtitles 参数 {key} -> fontsdir")
+                    args.append(f"fontsdir={value}")
+            elif key == "fontsdir" or key == "force_style" or key in FILTER_OPTIONS[spec.name]:
+                args.append(arg)
+            else:
+                close = difflib.get_close_matches(key, FILTER_OPTIONS[spec.name], n=1, cutoff=0.75)
+                if close:
+                    self.fix(f"subtitles 参数 {key} -> {close[0]}")
+                    args.append(f"{close[0]}={value}")
+                else:
+                    self.error(f"subtitles 滤镜没有参数 {key}")
+
+        if filename:
+            filename = filename.strip("'\"")
+        if self.subtitles_filename and filename != self.subtitles_filename:
+            self.fix(f"字幕文件 {filename or '(缺失)'} -> {self.subtitles_filename}")
+            filename = self.subtitles_filename
+        elif not filename:
+            self.error("subtitles 滤镜缺少字幕文件名")
+            return
+        elif not self.subtitles_filename:
+            self.error(f"subtitles 滤镜引用了 {filename}，但没有生成字幕内容")
+
+        if not any(arg.startswith("fontsdir=") for arg in args):
+            args.append(f"fontsdir={FONTS_DIR}")
+            self.fix(f"补充 fontsdir={FONTS_DIR}")
+        style_index = next((i for i, arg in enumerate(args) if arg.startswith("force_style=")), None)
+        style = args[style_index].partition("=")[2].strip("'\"") if style_index is not None else ""
+        entries = [entry for entry in style.split(",") if entry] + style_extra
+        if not any(entry.lower().startswith("fontname=") for entry in entries):
+            entries.insert(0, f"Fontname={FONT_NAME}")
+            self.fix("force_style 补充 Fontname")
+        style_arg = f"force_style='{','.join(entries)}'"
+        if style_index is None:
+            args.append(style_arg)
+        else:
+            args[style_index] = style_arg
+        spec.args = [filename] + args
+
+    def check_output(self):
+        """最后一个参数必须是输出文件，且与 output_filename 一致；写在输出文件后面的选项移到它前面"""
+        positionals = self._positional_positions()
+        if positionals and positionals[-1] < len(self.args) - 1:
+            output_position = positionals[-1]
+            trailing = self.args[output_position + 1:]
+            self.args[output_position:] = trailing + [self.args[output_position]]
+            self.fix(f"输出文件之后的选项 {' '.join(trailing)} 移到输出文件之前")
+        last = self.args[-1] if self.args else None
+        input_values = {self.args[position] for position in self._value_positions("i")}
+        value_positions = set(self._value_positions(*VALUE_OPTIONS))
+        is_output = (
+            last is not None and not last.startswith("-") and last not in input_values
+            and (len(self.args) - 1) not in value_positions
+        )
+        output_filename = self.result.output_filename
+        if not is_output:
+            if not output_filename:
+                self.error("缺少输出文件")
+                return
+            self.args.append(output_filename)
+            self.fix(f"补充输出文件 {output_filename}")
+        elif last != output_filename:
+            if output_filename and _extension(output_filename) and not _extension(last):
+                self.fix(f"输出文件 {last} -> {output_filename}")
+                self.args[-1] = output_filename
+            else:
+                # 前端按 output_filename 读取结果，以命令中实际写出的文件为准
+                self.fix(f"output_filename {output_filename or '(缺失)'} -> {last}")
+                self.result.output_filename = last
+        if self.result.output_filename in self.input_names:
+            self.error(f"输出文件 {self.result.output_filename} 与输入文件同名")
+
+    def _codec_positions(self, stream: str) -> List[int]:
+        names = ("vcodec",) if stream == "v" else ("acodec",)
+        return self._value_positions(*names, f"c:{stream}", f"codec:{stream}")
+
+    def check_codecs(self):
+        """编码器名称和输出扩展名匹配；滤镜不能和 copy 同时使用"""
+        ext = _extension(self.result.output_filename)
+        has_video_filter = bool(self._value_positions("vf", "filter:v", "filter_complex", "lavfi"))
+        has_audio_filter = bool(self._value_positions("af", "filter:a"))
+        for position in self._value_positions("c", "codec"):
+            # -c copy 同时作用于音视频，滤镜存在时拆开
+            if self.args[position] == "copy" and (has_video_filter or has_audio_filter):
+                video = DEFAULT_VIDEO_ENCODERS.get(ext, "libx264") if has_video_filter else "copy"
+                audio = DEFAULT_AUDIO_ENCODERS.get(ext, "aac") if has_audio_filter else "copy"
+                self.args[position - 1:position + 1] = ["-c:v", video, "-c:a", audio]
+                self.fix(f"-c copy 与滤镜冲突，改为 -c:v {video} -c:a {audio}")
+                break
+
+        for stream, encoders, defaults, filtered in (
+            ("v", VIDEO_ENCODERS, DEFAULT_VIDEO_ENCODERS, has_video_filter),
+            ("a", AUDIO_ENCODERS, DEFAULT_AUDIO_ENCODERS, has_audio_filter),
+        ):
+            for position in self._codec_positions(stream):
+                codec = self.args[position]
+                if codec.lower() in ENCODER_ALIASES:
+                    self.fix(f"编码器 {codec} -> {ENCODER_ALIASES[codec.lower()]}")
+                    codec = self.args[position] = ENCODER_ALIASES[codec.lower()]
+                if codec == "copy" and filtered:
+                    replacement = defaults.get(ext, "libx264" if stream == "v" else "aac")
+                    self.fix(f"-c:{stream} copy 与滤镜冲突，改为 {replacement}")
+                    self.args[position] = replacement
+                    continue
+                allowed = encoders.get(ext)
+                if stream == "v" and ext in AUDIO_ONLY_EXTENSIONS:
+                    # 音频输出不需要视频编码器，去掉并加上 -vn
+                    del self.args[position - 1:position + 1]
+                    self.fix(f"音频输出 .{ext} 去掉视频编码器 {codec}")
+                    break
+                if allowed and codec not in allowed:
+                    replacement = defaults.get(ext)
+                    if replacement:
+                        self.fix(f".{ext} 不支持编码器 {codec}，改为 {replacement}")
+                        self.args[position] = replacement
+                    else:
+                        self.error(f".{ext} 不支持编码器 {codec}")
+
+        if ext in AUDIO_ONLY_EXTENSIONS and "-vn" not in self.args and not self._value_positions("filter_complex", "map"):
+            self.args.insert(len(self.args) - 1, "-vn")
+            self.fix(f"音频输出 .{ext} 补充 -vn")
+
+
+def validate_command(command_array, output_filename: Optional[str], input_names: List[str], subtitles_filename: Optional[str] = None) -> CommandValidation:
+    """校验并修正 command_array；input_names 第一个是替换错误输入文件名时使用的名称"""
+    return _CommandChecker(command_array, output_filename, input_names, subtitles_filename).run()
+
+
+def _message_kind(message: str) -> str:
+    """统计时按消息的第一个词归类，去掉具体文件名和参数值"""
+    return re.split(r"[\s=]", message, 1)[0]
+
+
+class FfmpegCommandValidator:
+    """校验入口，同时统计修正和修复情况"""
+    def __init__(self):
+        self.validated = 0
+        self.corrected = 0
+        self.invalid = 0
+        self.repaired = 0
+        self.repair_failures = 0
+        self.fixes = Counter()
+        self.errors = Counter()
+
+    def validate(self, command_array, output_filename: Optional[str], input_names: List[str], subtitles_filename: Optional[str] = None) -> CommandValidation:
+        validation = validate_command(command_array, output_filename, input_names, subtitles_filename)
+        self.validated += 1
+        if validation.fixes:
+            self.corrected += 1
+        if validation.errors:
+            self.invalid += 1
+        self.fixes.update(_message_kind(message) for message in validation.fixes)
+        self.errors.update(_message_kind(message) for message in validation.errors)
+        return validation
+
+    def record_repair(self, success: bool):
+        if success:
+            self.repaired += 1
+        else:
+            self.repair_failures += 1
+
+    def stats(self) -> Dict:
+        return {
+            "validated": self.validated,
+            "corrected": self.corrected,
+            "invalid": self.invalid,
+            "repaired": self.repaired,
+            "repair_failures": self.repair_failures,
+            "fixes": dict(self.fixes),
+            "errors": dict(self.errors),
+        }
@@ -0,0 +1,80 @@
+import re
+import unicodedata
+from typing import List
+
+# --- Local Intent Router ---
+# 在调用 Gemini 之前用关键词规则判断请求类型。纯格式/时间/尺寸变换（转gif、裁剪前10秒、压缩到720p）
+# 不需要模型"看"视频，只用 ffprobe 元数据走纯文本请求，省去上传和多模态推理。
+
+INTENT_ANALYSIS = "analysis"
+INTENT_SUBTITLE = "subtitle"
+INTENT_TRANSFORM = "transform"
+
+# 纯变换操作：只依赖时间、尺寸、格式等元数据
+TRANSFORM_PATTERNS = [
+    r"裁剪|剪切|截取|剪辑|切掉|剪掉|截断|trim|cut|(去掉|删掉|删除|跳过)(开头|开始|前面|前|结尾|最后|后)",
+    r"转成|转换|转为|导出为|格式|gif|mp3|mp4|webm|mov|wav|aac|avi|mkv|flac|m4a",
+    r"压缩|码率|比特率|体积|大小|crf|bitrate",
+    r"分辨率|\d{3,4}\s*p\b|缩放|尺寸|宽度|高度|scale|resize",
+    r"倍速|加速|减速|快放|慢放|慢动作|speed",
+    r"静音|去掉声音|去除声音|去掉音频|去除音频|移除音频|mute",
+    r"提取音频|提取声音|导出音频|音频提取|extract audio",
+    r"旋转|翻转|镜像|rotate|flip",
+    r"帧率|fps",
+    r"倒放|反转播放|reverse",
+    r"音量|volume",
+]
+
+# 时间范围本身不是操作，"前30秒讲了什么"是内容分析；只在出现变换操作时作为裁剪参数
+TIME_RANGE_PATTERN = r"前\s*\d+(\.\d+)?\s*(秒|分钟|s\b)|后\s*\d+(\.\d+)?\s*(秒|分钟)|\d+\s*秒到\s*\d+\s*秒|\d{1,2}:\d{2}"
+
+# 需要理解画面或语音内容的请求，必须把视频交给 Gemini
+CONTENT_PATTERNS = [
+    r"字幕|subtitle|srt|vtt|转录|听写|transcri",
+    r"讲了|说了|内容|分析|总结|概括|描述|识别|理解|看看|看一下|什么|哪些|为什么|怎么样|介绍",
+    r"精彩|高光|片头|片尾|广告|场景|镜头|人物|人脸|出现|包含|有.*的(部分|片段|地方)",
+    r"翻译|配音|解说|旁白|标题|封面",
+    r"summar|analy|describe|what|who|highlight|scene",
+]
+
+
+# 依赖镜头/场景切换时间点的请求：等待本地镜头边界索引并写入提示词
+SHOT_BOUNDARY_PATTERN = r"片头|片尾|场景|镜头|转场|分镜|分段|切分|切成|分开|拆分|scene|shot|chapter|segment"
+
+
+class IntentDecision:
+    def __init__(self, intent: str, needs_video: bool, matched: List[str], needs_shot_index: bool = False):
+        self.intent = intent
+        self.needs_video = needs_video
+        self.matched = matched
+        self.needs_shot_index = needs_shot_index
+
+    def to_dict(self):
+        return {"intent": self.intent, "needs_video": self.needs_video, "matched": self.matched, "needs_shot_index": self.needs_shot_index}
+
+
+def _matches(patterns: List[str], text: str) -> List[str]:
+    found = []
+    for pattern in patterns:
+        match = re.search(pattern, text)
+        if match:
+            found.append(match.group(0))
+    return found
+
+
+def classify_intent(prompt: str) -> IntentDecision:
+    text = unicodedata.normalize("NFKC", prompt or "").lower()
+    content_matches = _matches(CONTENT_PATTERNS, text)
+    transform_matches = _matches(TRANSFORM_PATTERNS, text)
+    if transform_matches:
+        transform_matches += _matches([TIME_RANGE_PATTERN], text)
+    needs_shot_index = re.search(SHOT_BOUNDARY_PATTERN, text) is not None
+
+    if re.search(r"字幕|subtitle|srt|vtt|转录|听写|transcri", text):
+        return IntentDecision(INTENT_SUBTITLE, True, content_matches)
+    if transform_matches and not content_matches:
+        return IntentDecision(INTENT_TRANSFORM, False, transform_matches, needs_shot_index)
+    if transform_matches:
+        # 变换请求但依赖画面内容（如"剪掉片头"），仍需要视频
+        return IntentDecision(INTENT_TRANSFORM, True, transform_matches + content_matches, needs_shot_index)
+    return IntentDecision(INTENT_ANALYSIS, True, content_matches, needs_shot_index)
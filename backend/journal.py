@@ -0,0 +1,234 @@
+import os
+import json
+import time
+import queue
+import threading
+from typing import Optional, Dict, List
+
+# --- Job Journal (Write-Ahead Log) ---
+# 每个任务一个 JSONL 文件，按顺序追加阶段变更、Google 文件引用和流式输出片段。
+# 进程崩溃重启后通过重放日志恢复任务状态，从最后完成的阶段继续执行。
+# 所有写盘都在单独的写入线程中进行，不阻塞事件循环：阶段切换等关键记录立即写入并 fsync，
+# 流式输出片段等非关键记录攒批写入（崩溃时最多丢失 flush_interval 秒内的片段）。
+
+TERMINAL_STAGES = ("complete", "error")
+
+
+class JobRecord:
+    """重放日志得到的任务快照"""
+    def __init__(self, task_id: str):
+        self.task_id: str = task_id
+        self.prompt: str = ""
+        self.video_filename: Optional[str] = None
+        self.video_mime_type: Optional[str] = None
+        self.file_hash: Optional[str] = None
+        self.spool_path: Optional[str] = None
+        self.video_session_id: Optional[str] = None
+        self.client_id: Optional[str] = None
+        self.sampling: Optional[Dict] = None
+        # 客户端提交时的选项，恢复时按原样执行
+        self.execute_on_server: bool = False
+        self.bypass_cache: bool = False
+        self.start_time: float = 0
+        self.stage: str = "idle"
+        self.percentage: int = 0
+        self.message: str = ""
+        self.google_file_name: Optional[str] = None
+        self.google_file_uri: Optional[str] = None
+        self.google_file_mime_type: Optional[str] = None
+        self.google_file_original_name: Optional[str] = None
+        self.google_file_is_proxy: bool = False
+        self.google_file_media_kind: str = "video"
+        self.partial_text: str = ""
+        self.result: Optional[Dict] = None
+        self.updated_at: float = 0
+
+    @property
+    def is_finished(self) -> bool:
+        return self.stage in TERMINAL_STAGES
+
+    def apply(self, entry: Dict):
+        """应用一条日志记录"""
+        event = entry.get("event")
+        self.updated_at = entry.get("ts", self.updated_at)
+        if event == "created":
+            self.prompt = entry.get("prompt", "")
+            self.video_filename = entry.get("video_filename")
+            self.video_mime_type = entry.get("video_mime_type")
+            self.file_hash = entry.get("file_hash")
+            self.spool_path = entry.get("spool_path")
+            self.video_session_id = entry.get("video_session_id")
+            self.client_id = entry.get("client_id")
+            self.sampling = entry.get("sampling")
+            self.execute_on_server = entry.get("execute_on_server", False)
+            self.bypass_cache = entry.get("bypass_cache", False)
+            self.start_time = entry.get("ts", 0)
+        elif event == "stage":
+            self.stage = entry.get("stage", self.stage)
+            self.percentage = entry.get("percentage", self.percentage)
+            self.message = entry.get("message", "")
+        elif event == "gemini_file":
+            self.google_file_name = entry.get("name")
+            self.google_file_uri = entry.get("uri")
+            self.google_file_mime_type = entry.get("mime_type")
+            self.google_file_original_name = entry.get("original_file_name")
+            self.google_file_is_proxy = entry.get("is_proxy", False)
+            self.google_file_media_kind = entry.get("media_kind", "video")
+            if entry.get("file_hash"):
+                self.file_hash = entry["file_hash"]
+        elif event == "stream_reset":
+            self.partial_text = ""
+        elif event == "stream":
+            self.partial_text += entry.get("text", "")
+        elif event == "result":
+            self.result = entry.get("result")
+
+
+class JobJournal:
+    """基于文件追加写的任务日志，线程安全；record 只入队，由写入线程写盘"""
+    def __init__(self, directory: str, retention_seconds: float = 24 * 3600, flush_interval: float = 0.5):
+        self.directory = directory
+        self.spool_directory = os.path.join(directory, "spool")
+        self.retention_seconds = retention_seconds
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._spool_paths: Dict[str, str] = {}
+        # (task_id, 日志行, 是否 fsync)；日志行为 None 表示任务结束、删除落盘的上传文件；threading.Event 表示 flush
+        self._queue: "queue.Queue" = queue.Queue()
+        os.makedirs(self.spool_directory, exist_ok=True)
+        self._writer = threading.Thread(target=self._write_loop, name="job-journal-writer", daemon=True)
+        self._writer.start()
+
+    def _path(self, task_id: str) -> str:
+        return os.path.join(self.directory, f"{task_id}.jsonl")
+
+    def record(self, task_id: str, event: str, durable: bool = True, **fields):
+        """追加一条日志；durable=True 时写入线程立即写入并 fsync，否则和后续记录一起批量写入"""
+        entry = {"ts": time.time(), "event": event, **fields}
+        self._queue.put((task_id, json.dumps(entry, ensure_ascii=False) + "\n", durable))
+
+    def finish(self, task_id: str):
+        """任务结束：之前的记录写完后删除落盘的上传文件"""
+        self._queue.put((task_id, None, True))
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """等待已入队的记录全部写盘"""
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def _write_loop(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.time() + self.flush_interval
+            # 非关键记录等一小段时间，和后续记录合并成一次写入
+            while not (isinstance(batch[-1], threading.Event) or batch[-1][2]):
+                try:
+                    batch.append(self._queue.get(timeout=max(0.0, deadline - time.time())))
+                except queue.Empty:
+                    break
+            self._write_batch(batch)
+
+    def _write_batch(self, batch: List):
+        lines: Dict[str, List[str]] = {}
+        durable_tasks = set()
+        finished_tasks = []
+        flushes = []
+        for item in batch:
+            if isinstance(item, threading.Event):
+                flushes.append(item)
+                continue
+            task_id, line, durable = item
+            if line is None:
+                finished_tasks.append(task_id)
+                continue
+            lines.setdefault(task_id, []).append(line)
+            if durable:
+                durable_tasks.add(task_id)
+        for task_id, task_lines in lines.items():
+            try:
+                with self._lock:
+                    with open(self._path(task_id), "a", encoding="utf-8") as f:
+                        f.write("".join(task_lines))
+                        f.flush()
+                        if task_id in durable_tasks:
+                            os.fsync(f.fileno())
+            except OSError as e:
+                # 日志写入失败不应影响任务本身
+                print(f"[Journal] 写入日志失败 [{task_id}]: {str(e)}")
+        for task_id in finished_tasks:
+            spool_path = self._spool_paths.pop(task_id, None)
+            if spool_path is None:
+                record = self.load(task_id)
+                spool_path = record.spool_path if record else None
+            try:
+                if spool_path and os.path.exists(spool_path):
+                    os.remove(spool_path)
+            except OSError as e:
+                print(f"[Journal] 删除上传文件失败 [{task_id}]: {str(e)}")
+        for done in flushes:
+            done.set()
+
+    def spool_video(self, task_id: str, content: bytes, suffix: str) -> Optional[str]:
+        """将上传内容落盘，崩溃后可以从此文件重新上传"""
+        path = os.path.join(self.spool_directory, f"{task_id}{suffix}")
+        try:
+            with open(path, "wb") as f:
+                f.write(content)
+                f.flush()
+                os.fsync(f.fileno())
+            self._spool_paths[task_id] = path
+            return path
+        except OSError as e:
+            print(f"[Journal] 保存上传文件失败 [{task_id}]: {str(e)}")
+            return None
+
+    def load(self, task_id: str) -> Optional[JobRecord]:
+        path = self._path(task_id)
+        if not os.path.exists(path):
+            return None
+        record = JobRecord(task_id)
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record.apply(json.loads(line))
+                except json.JSONDecodeError:
+                    # 崩溃时最后一行可能只写了一半，忽略即可
+                    print(f"[Journal] 忽略损坏的日志行 [{task_id}]")
+        return record
+
+    def load_all(self) -> List[JobRecord]:
+        records = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".jsonl"):
+                continue
+            record = self.load(name[:-len(".jsonl")])
+            if record:
+                records.append(record)
+        return records
+
+    def release_spool(self, record: JobRecord):
+        if record.spool_path and os.path.exists(record.spool_path):
+            os.remove(record.spool_path)
+
+    def discard(self, task_id: str):
+        record = self.load(task_id)
+        if record:
+            self.release_spool(record)
+        path = self._path(task_id)
+        with self._lock:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def cleanup_expired(self) -> int:
+        """删除超过保留时间的已结束任务日志"""
+        removed = 0
+        now = time.time()
+        for record in self.load_all():
+            if record.is_finished and now - record.updated_at > self.retention_seconds:
+                self.discard(record.task_id)
+                removed += 1
+        return removed
@@ -0,0 +1,206 @@
+import json
+import os
+import shutil
+import subprocess
+import time
+from typing import Optional, Dict, List
+
+from video_proxy import ffmpeg_available, FfmpegWorkerPool, PTS_TIME_PATTERN
+
+# --- Keyframe Sampling ---
+# 内容分析类指令（"这个视频讲了什么"）不必上传整个视频：本地用 ffmpeg 场景检测在镜头切换处提取关键帧，
+# 缩小后作为带时间戳的图片序列发送（可附带提取的音轨）。长视频的上传量和 tokens 都大幅减少，代价是看不到镜头内的动作细节。
+# 长时间没有镜头切换时按最大间隔补帧；关键帧按原始内容哈希缓存，同一视频只提取一次。
+
+INDEX_FILENAME = "index.json"
+FRAME_MIME_TYPE = "image/jpeg"
+
+
+class Keyframe:
+    def __init__(self, timestamp: float, path: str):
+        self.timestamp = timestamp
+        self.path = path
+
+    def to_dict(self) -> Dict:
+        return {"timestamp": round(self.timestamp, 3), "file": os.path.basename(self.path)}
+
+
+class KeyframeSet:
+    def __init__(self, file_hash: str, frames: List[Keyframe], extract_seconds: float = 0, cached: bool = False):
+        self.file_hash = file_hash
+        self.frames = frames
+        self.extract_seconds = extract_seconds
+        self.cached = cached
+
+    @property
+    def total_bytes(self) -> int:
+        return sum(os.path.getsize(frame.path) for frame in self.frames if os.path.exists(frame.path))
+
+    def to_dict(self) -> Dict:
+        return {
+            "frames": len(self.frames),
+            "timestamps": [round(frame.timestamp, 2) for frame in self.frames],
+            "total_bytes": self.total_bytes,
+            "extract_seconds": round(self.extract_seconds, 2),
+            "cached": self.cached,
+        }
+
+
+def build_keyframe_command(ffmpeg_binary: str, input_path: str, output_pattern: str, scene_threshold: float, min_gap: float, max_gap: float, height: int) -> list:
+    """第一帧、场景变化超过阈值（且距上一关键帧至少 min_gap 秒）以及距上一关键帧超过 max_gap 秒的帧；
+    showinfo 在 stderr 输出每个输出帧的 pts_time"""
+    select = (
+        f"isnan(prev_selected_t)"
+        f"+gte(t-prev_selected_t,{max_gap:g})"
+        f"+gt(scene,{scene_threshold:g})*gte(t-prev_selected_t,{min_gap:g})"
+    )
+    return [
+        ffmpeg_binary, "-hide_banner", "-nostats", "-y", "-i", input_path,
+        "-map", "0:v:0", "-an", "-sn", "-dn",
+        "-vf", f"select='{select}',scale=-2:'min({height},ih)',showinfo",
+        "-vsync", "vfr", "-q:v", "5",
+        output_pattern
+    ]
+
+
+def parse_frame_timestamps(stderr: str) -> List[float]:
+    return [float(match.group(1)) for line in stderr.splitlines() if "showinfo" in line for match in [PTS_TIME_PATTERN.search(line)] if match]
+
+
+def select_evenly(items: list, limit: int) -> list:
+    """保留首尾，均匀取 limit 个"""
+    if limit <= 0 or len(items) <= limit:
+        return items
+    if limit == 1:
+        return items[:1]
+    return [items[round(i * (len(items) - 1) / (limit - 1))] for i in range(limit)]
+
+
+class KeyframeExtractor:
+    def __init__(self, directory: str, ffmpeg_binary: str = "ffmpeg", max_workers: int = 2, scene_threshold: float = 0.3,
+                 min_gap: float = 1.0, max_gap: float = 30.0, max_frames: int = 48, height: int = 360,
+                 timeout: float = 600, ttl_seconds: float = 24 * 3600):
+        self.directory = directory
+        self.ffmpeg_binary = ffmpeg_binary
+        self.scene_threshold = scene_threshold
+        self.min_gap = min_gap
+        self.max_gap = max_gap
+        self.max_frames = max_frames
+        self.height = height
+        self.timeout = timeout
+        self.ttl_seconds = ttl_seconds
+        # 场景检测需要解码整个视频，限制同时运行的进程数；同一视频的并发请求等待同一次提取
+        self._pool = FfmpegWorkerPool(max_workers)
+        self._unusable: Dict[str, float] = {}
+        self._stats = {"extractions": 0, "cache_hits": 0, "failures": 0, "frames": 0, "extract_seconds": 0.0}
+        os.makedirs(directory, exist_ok=True)
+
+    @property
+    def available(self) -> bool:
+        return ffmpeg_available(self.ffmpeg_binary)
+
+    def _frames_dir(self, file_hash: str) -> str:
+        return os.path.join(self.directory, file_hash)
+
+    def get_cached(self, file_hash: Optional[str]) -> Optional[KeyframeSet]:
+        if not file_hash:
+            return None
+        frames_dir = self._frames_dir(file_hash)
+        try:
+            with open(os.path.join(frames_dir, INDEX_FILENAME), encoding="utf-8") as f:
+                index = json.load(f)
+            frames = [Keyframe(float(item["timestamp"]), os.path.join(frames_dir, item["file"])) for item in index["frames"]]
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+        if not frames or not all(os.path.exists(frame.path) for frame in frames):
+            return None
+        # 访问即续期
+        os.utime(frames_dir)
+        self._stats["cache_hits"] += 1
+        return KeyframeSet(file_hash, frames, cached=True)
+
+    async def get_or_extract(self, file_hash: str, input_path: str) -> Optional[KeyframeSet]:
+        """返回关键帧；提取失败时返回 None，调用方上传视频"""
+        if file_hash in self._unusable:
+            return None
+        cached = self.get_cached(file_hash)
+        if cached:
+            return cached
+        return await self._pool.run(file_hash, self._extract, file_hash, input_path)
+
+    def _extract(self, file_hash: str, input_path: str) -> Optional[KeyframeSet]:
+        frames_dir = self._frames_dir(file_hash)
+        temp_dir = f"{frames_dir}.{os.getpid()}.tmp"
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        os.makedirs(temp_dir)
+        command = build_keyframe_command(
+            self.ffmpeg_binary, input_path, os.path.join(temp_dir, "frame_%05d.jpg"),
+            self.scene_threshold, self.min_gap, self.max_gap, self.height
+        )
+        start_time = time.time()
+        try:
+            completed = subprocess.run(command, capture_output=True, timeout=self.timeout, check=True)
+        except FileNotFoundError:
+            print(f"[Keyframes] 未找到 {self.ffmpeg_binary}，上传视频")
+            return self._failed(file_hash, temp_dir)
+        except subprocess.TimeoutExpired:
+            print(f"[Keyframes] ffmpeg 关键帧提取超时 ({self.timeout}s): {input_path}")
+            return self._failed(file_hash, temp_dir)
+        except subprocess.CalledProcessError as e:
+            print(f"[Keyframes] ffmpeg 关键帧提取失败: {e.stderr.decode('utf-8', 'replace')[-500:]}")
+            return self._failed(file_hash, temp_dir)
+
+        paths = sorted(os.path.join(temp_dir, name) for name in os.listdir(temp_dir) if name.endswith(".jpg"))
+        timestamps = parse_frame_timestamps(completed.stderr.decode("utf-8", "replace"))
+        if not paths or len(timestamps) != len(paths):
+            print(f"[Keyframes] 提取到 {len(paths)} 帧、{len(timestamps)} 个时间戳，无法对应，上传视频")
+            return self._failed(file_hash, temp_dir)
+
+        frames = select_evenly([Keyframe(ts, path) for ts, path in zip(timestamps, paths)], self.max_frames)
+        kept = {frame.path for frame in frames}
+        for path in paths:
+            if path not in kept:
+                os.remove(path)
+        with open(os.path.join(temp_dir, INDEX_FILENAME), "w", encoding="utf-8") as f:
+            json.dump({"frames": [frame.to_dict() for frame in frames], "detected": len(paths), "scene_threshold": self.scene_threshold}, f)
+        shutil.rmtree(frames_dir, ignore_errors=True)
+        os.replace(temp_dir, frames_dir)
+
+        extract_seconds = time.time() - start_time
+        self._stats["extractions"] += 1
+        self._stats["frames"] += len(frames)
+        self._stats["extract_seconds"] += extract_seconds
+        frames = [Keyframe(frame.timestamp, os.path.join(frames_dir, os.path.basename(frame.path))) for frame in frames]
+        return KeyframeSet(file_hash, frames, extract_seconds, cached=False)
+
+    def _failed(self, file_hash: str, temp_dir: str) -> None:
+        self._stats["failures"] += 1
+        self._unusable[file_hash] = time.time()
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        return None
+
+    def cleanup_expired(self) -> int:
+        """删除超过有效期未使用的关键帧"""
+        now = time.time()
+        removed = 0
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                if os.path.isdir(path) and now - os.path.getmtime(path) > self.ttl_seconds:
+                    shutil.rmtree(path)
+                    removed += 1
+            except OSError:
+                continue
+        for key in [k for k, ts in self._unusable.items() if now - ts > self.ttl_seconds]:
+            del self._unusable[key]
+        return removed
+
+    def stats(self) -> Dict:
+        return {
+            "available": self.available,
+            "scene_threshold": self.scene_threshold,
+            "max_frames": self.max_frames,
+            "height": self.height,
+            **self._stats,
+            "extract_seconds": round(self._stats["extract_seconds"], 2),
+        }
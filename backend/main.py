@@ -1,8 +1,8 @@
 import os
 from google import genai
-from fastapi import FastAPI, File, UploadFile, HTTPException, Form
-from fastapi.responses import StreamingResponse
-from typing import Optional, AsyncGenerator, Dict
+from fastapi import FastAPI, File, UploadFile, HTTPException, Form, Request
+from fastapi.responses import StreamingResponse, FileResponse, Response, RedirectResponse
+from typing import Optional, AsyncGenerator, Dict, List, Callable
 from fastapi.middleware.cors import CORSMiddleware
 import tempfile
 import os
@@ -14,6 +14,42 @@ from google.genai import types
 import asyncio
 import json
 import uuid
+import itertools
+from contextlib import asynccontextmanager
+from urllib.parse import quote
+from journal import JobJournal, JobRecord
+from quotas import ClientQuotaManager, QuotaExceeded, resolve_client_id, hash_api_key, parse_trusted_proxies
+from rate_limiter import (
+    GeminiRateLimiter, InMemoryBucketBackend, SQLiteBucketBackend, BucketLimit,
+    parse_video_duration, estimate_request_tokens
+)
+from resilience import CircuitBreaker, CircuitOpenError, RetryPolicy, call_with_retry, is_retryable_error, is_rejected_error, never_retry
+from sessions import VideoSessionStore, VideoSession
+from result_cache import ResultCache, CachedResult, make_scope_key, make_cache_key
+from semantic_cache import SemanticPromptCache
+from context_cache import ContextCacheManager, ContextCacheEntry
+from google.genai import errors as genai_errors
+from prompt_builder import (
+    generate_subtitle_file_declaration, execute_ffmpeg_with_optional_subtitles_declaration,
+    video_system_instruction, VIDEO_TOOLS, TOOL_NAMES, build_request_text, build_generate_config,
+    METADATA_SYSTEM_INSTRUCTION, build_metadata_request_text,
+    build_subtitle_segment_request_text, build_subtitle_segment_config,
+    build_command_repair_request_text, build_command_repair_config, COMMAND_REPAIR_SYSTEM_INSTRUCTION,
+    build_keyframe_request_text, format_keyframe_label
+)
+from intent_router import classify_intent, INTENT_SUBTITLE, INTENT_ANALYSIS
+from media_probe import probe_media, ffprobe_available, format_media_info, MediaInfoCache
+from ffmpeg_templates import FfmpegTemplateEngine, TemplateMatch
+from ffmpeg_validator import FfmpegCommandValidator, CommandValidation
+from ffmpeg_executor import FfmpegExecutor, ExecutionInput
+from artifacts import ArtifactStore, Artifact, etag_matches, parse_range, iter_file_range
+from model_router import ModelRouter, RouteDecision, ROUTE_TRANSFORM, ROUTE_SUBTITLE, ROUTE_ANALYSIS, ROUTE_LONG_VIDEO
+from cost_estimator import CostEstimator, CostEstimate
+from video_sampling import VideoSampling, MEDIA_RESOLUTIONS, resolve_sampling, subtitle_segment_plan, segment_sampling
+from video_proxy import UploadProxyTranscoder, PROXY_VIDEO, PROXY_AUDIO
+from keyframes import KeyframeExtractor, KeyframeSet, FRAME_MIME_TYPE
+from shot_index import ShotIndexer, ShotIndex, format_shot_boundaries
+from subtitles import SrtCue, StreamingSrtParser, parse_srt, format_srt, fix_srt, merge_segment_cues
 
 # Load environment variables from .env file
 load_dotenv()
@@ -22,24 +58,57 @@ load_dotenv()
 class ProcessProgress:
     def __init__(self):
         self.task_id: str = ""
-        self.stage: str = "idle"  # idle, uploading, google_processing, ai_generating, streaming, complete, error
+        self.client_id: Optional[str] = None
+        self.video_session_id: Optional[str] = None
+        self.stage: str = "idle"  # idle, uploading, google_processing, ai_generating, streaming, executing, complete, error
         self.percentage: int = 0
         self.message: str = ""
         self.start_time: float = 0
         self.error_message: str = ""
         self.result: Optional[Dict] = None
+        # Gemini配额排队信息
+        self.estimated_tokens: int = 0
+        self.queue_wait_seconds: float = 0
+        self.model_route: Optional[Dict] = None
+        self.cost_estimate: Optional[Dict] = None
+        self.actual_usage: Optional[Dict] = None
+        self.upload_proxy: Optional[Dict] = None
+        # 关键帧模式发送的关键帧（数量、时间戳、大小）
+        self.keyframes: Optional[Dict] = None
+        # 本地场景检测得到的镜头边界索引
+        self.shot_index: Optional[Dict] = None
+        # ffprobe 元数据（时长、分辨率、编码、帧率、音轨、码率）
+        self.media_info: Optional[Dict] = None
+        # 服务端执行FFmpeg的进度（out_time / percent / speed）
+        self.ffmpeg_execution: Optional[Dict] = None
         # 流式响应支持
         self.streaming_text: str = ""
         self.is_streaming: bool = False
         self.stream_complete: bool = False
+        # 生成过程中已经完整的字幕，通过SSE逐条推送供前端预览
+        self.subtitle_cues: List[Dict] = []
+        # 已发布的字幕被整体替换（自动修复后）的次数，SSE据此重新发送完整列表
+        self.subtitle_cues_revision: int = 0
     
     def update(self, stage: str, percentage: int, message: str = ""):
+        stage_changed = stage != self.stage
         self.stage = stage
         self.percentage = percentage
         self.message = message
         if stage == "error":
             self.error_message = message
         print(f"Progress Update [{self.task_id}]: {stage} - {percentage}% - {message}")
+        if job_journal:
+            # 只在阶段切换时 fsync，同一阶段内的进度消息批量写入
+            job_journal.record(self.task_id, "stage", durable=stage_changed, stage=stage, percentage=percentage, message=message)
+            if stage in ("complete", "error"):
+                job_journal.finish(self.task_id)
+    
+    def set_result(self, result: Dict):
+        """设置最终结果并写入任务日志"""
+        self.result = result
+        if job_journal:
+            job_journal.record(self.task_id, "result", result=result)
     
     def append_streaming_text(self, text: str):
         """添加流式文本"""
@@ -50,33 +119,375 @@ class ProcessProgress:
         """标记流式完成"""
         self.is_streaming = False
         self.stream_complete = True
+    
+    def add_subtitle_cues(self, cues: List[SrtCue]):
+        """发布已经完整的字幕"""
+        for cue in cues:
+            self.subtitle_cues.append({"index": len(self.subtitle_cues) + 1, **cue.to_dict()})
+    
+    def replace_subtitle_cues(self, cues: List[SrtCue]):
+        """用最终（修复后）的字幕替换已发布的字幕；内容不变时不产生替换事件"""
+        replacement = [{"index": index, **cue.to_dict()} for index, cue in enumerate(cues, 1)]
+        if replacement != self.subtitle_cues:
+            self.subtitle_cues = replacement
+            self.subtitle_cues_revision += 1
 
 # 全局进度存储
 progress_store: Dict[str, ProcessProgress] = {}
 
-# --- Global State for Current Video (Simple In-Memory) ---
-class CurrentVideoState:
-    def __init__(self):
-        self.google_file_name: Optional[str] = None
-        self.original_file_name: Optional[str] = None
-        self.mime_type: Optional[str] = None
-        self.file_hash: Optional[str] = None  # 添加文件哈希用于缓存
-
-current_video_state = CurrentVideoState()
-
 # --- Helper Functions ---
 def calculate_file_hash(file_content: bytes) -> str:
     """计算文件内容的SHA256哈希值"""
     return hashlib.sha256(file_content).hexdigest()
 
+def gemini_file_key(file_hash: Optional[str], media_kind: str = PROXY_VIDEO) -> Optional[str]:
+    """Gemini文件缓存键：提取的音轨和视频分开缓存，避免后续看画面的指令用到纯音频文件"""
+    if not file_hash or media_kind == PROXY_VIDEO:
+        return file_hash
+    return f"{file_hash}:{media_kind}"
+
 # --- Global Variables & Configuration ---
 load_dotenv(os.path.join(os.path.dirname(__file__), '.env'))
 API_KEY = os.getenv("GOOGLE_API_KEY")
-MODEL_NAME = "gemini-2.5-flash" # Using a stable model name
+MODEL_NAME = os.getenv("MODEL_NAME", "gemini-2.5-flash") # Using a stable model name
+GENERATION_TEMPERATURE = 0.3
+
+# 任务日志配置：记录阶段变更，服务崩溃重启后可恢复未完成的任务
+JOB_JOURNAL_ENABLED = os.getenv("JOB_JOURNAL_ENABLED", "true").lower() == "true"
+JOB_JOURNAL_DIR = os.getenv("JOB_JOURNAL_DIR", os.path.join(os.path.dirname(__file__), "data", "journal"))
+JOB_JOURNAL_RETENTION_HOURS = float(os.getenv("JOB_JOURNAL_RETENTION_HOURS", "24"))
+
+# 单客户端配额（0 表示不限制）
+CLIENT_MAX_CONCURRENT_TASKS = int(os.getenv("CLIENT_MAX_CONCURRENT_TASKS", "2"))
+CLIENT_MAX_UPLOAD_MB_PER_MINUTE = int(os.getenv("CLIENT_MAX_UPLOAD_MB_PER_MINUTE", "1024"))
+CLIENT_MAX_GEMINI_RPM = int(os.getenv("CLIENT_MAX_GEMINI_RPM", "120"))
+# 按 X-API-Key 区分客户端时允许的密钥（逗号分隔）；未配置或密钥不匹配时按客户端IP计算配额
+CLIENT_API_KEY_HASHES = {hash_api_key(key.strip()) for key in os.getenv("CLIENT_API_KEYS", "").split(",") if key.strip()}
+# 反向代理地址或网段（逗号分隔），只有来自这些地址的请求才采用 X-Forwarded-For
+TRUSTED_PROXIES = parse_trusted_proxies(os.getenv("TRUSTED_PROXIES", ""))
+
+# Gemini全局限流（0 表示不限制）；RATE_LIMIT_BACKEND=sqlite 时多个worker进程共享预算
+GEMINI_UPLOAD_RPM = int(os.getenv("GEMINI_UPLOAD_RPM", "60"))
+GEMINI_FILES_GET_RPM = int(os.getenv("GEMINI_FILES_GET_RPM", "300"))
+GEMINI_GENERATE_RPM = int(os.getenv("GEMINI_GENERATE_RPM", "60"))
+GEMINI_GENERATE_TPM = int(os.getenv("GEMINI_GENERATE_TPM", "1000000"))
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")
+RATE_LIMIT_DB = os.getenv("RATE_LIMIT_DB", os.path.join(os.path.dirname(__file__), "data", "rate_limits.db"))
+
+# Gemini调用重试与熔断
+GEMINI_RETRY_MAX_ATTEMPTS = int(os.getenv("GEMINI_RETRY_MAX_ATTEMPTS", "4"))
+GEMINI_RETRY_BASE_DELAY = float(os.getenv("GEMINI_RETRY_BASE_DELAY", "1.0"))
+GEMINI_CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("GEMINI_CIRCUIT_FAILURE_THRESHOLD", "5"))
+GEMINI_CIRCUIT_RESET_SECONDS = float(os.getenv("GEMINI_CIRCUIT_RESET_SECONDS", "30"))
+
+# 视频会话与Gemini文件缓存的有效期（Gemini文件48小时后过期）
+VIDEO_SESSION_TTL_HOURS = float(os.getenv("VIDEO_SESSION_TTL_HOURS", "24"))
+GEMINI_FILE_TTL_HOURS = float(os.getenv("GEMINI_FILE_TTL_HOURS", "47"))
+
+# 结果缓存：相同视频+指令+模型配置直接返回上次结果
+RESULT_CACHE_ENABLED = os.getenv("RESULT_CACHE_ENABLED", "true").lower() == "true"
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "500"))
+RESULT_CACHE_TTL_HOURS = float(os.getenv("RESULT_CACHE_TTL_HOURS", "24"))
+
+# Gemini显式上下文缓存：同一视频多次提问时复用已tokenize的视频和系统指令
+CONTEXT_CACHE_ENABLED = os.getenv("CONTEXT_CACHE_ENABLED", "true").lower() == "true"
+CONTEXT_CACHE_TTL_SECONDS = int(os.getenv("CONTEXT_CACHE_TTL_SECONDS", "3600"))
+CONTEXT_CACHE_MIN_USES = int(os.getenv("CONTEXT_CACHE_MIN_USES", "2"))
+CONTEXT_CACHE_MIN_TOKENS = int(os.getenv("CONTEXT_CACHE_MIN_TOKENS", "4096"))
+
+# 语义缓存（可选）：同一视频上意图相同但说法不同的指令复用结果缓存
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "false").lower() == "true"
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.8"))
+
+# 本地意图路由：纯格式/时长/尺寸变换只发送ffprobe元数据，不上传视频
+INTENT_ROUTER_ENABLED = os.getenv("INTENT_ROUTER_ENABLED", "true").lower() == "true"
+FFPROBE_BINARY = os.getenv("FFPROBE_BINARY", "ffprobe")
+# ffprobe元数据按内容哈希缓存；目录为空时只缓存在内存中
+MEDIA_INFO_CACHE_DIR = os.getenv("MEDIA_INFO_CACHE_DIR", os.path.join(os.path.dirname(__file__), "data", "media_info"))
+MEDIA_INFO_CACHE_MAX_ENTRIES = int(os.getenv("MEDIA_INFO_CACHE_MAX_ENTRIES", "1000"))
+
+# 常见FFmpeg操作的本地模板：fast_path 在调用Gemini前直接返回，fallback 只在Gemini不可用或排队过久时使用，off 关闭
+FFMPEG_TEMPLATE_MODE = os.getenv("FFMPEG_TEMPLATE_MODE", "fast_path").lower()
+FFMPEG_TEMPLATE_MAX_WAIT_SECONDS = float(os.getenv("FFMPEG_TEMPLATE_MAX_WAIT_SECONDS", "10"))
+
+# 模型路由：FFmpeg命令生成用轻量模型，字幕用flash，深度分析用更强的模型；关闭时全部使用 MODEL_NAME
+MODEL_ROUTING_ENABLED = os.getenv("MODEL_ROUTING_ENABLED", "true").lower() == "true"
+MODEL_ROUTES = {
+    ROUTE_TRANSFORM: os.getenv("MODEL_ROUTE_TRANSFORM", "gemini-2.5-flash-lite"),
+    ROUTE_SUBTITLE: os.getenv("MODEL_ROUTE_SUBTITLE", MODEL_NAME),
+    ROUTE_ANALYSIS: os.getenv("MODEL_ROUTE_ANALYSIS", "gemini-2.5-pro"),
+    ROUTE_LONG_VIDEO: os.getenv("MODEL_ROUTE_LONG_VIDEO", MODEL_NAME),
+} if MODEL_ROUTING_ENABLED else {}
+MODEL_ROUTE_LONG_VIDEO_SECONDS = float(os.getenv("MODEL_ROUTE_LONG_VIDEO_SECONDS", "1200"))
+MODEL_ROUTE_MAX_WAIT_SECONDS = float(os.getenv("MODEL_ROUTE_MAX_WAIT_SECONDS", "15"))
+
+# 单任务预算：预估输入tokens或费用超出时先降低视频采样分辨率，仍超出则拒绝；0 表示不限制
+TASK_MAX_INPUT_TOKENS = int(os.getenv("TASK_MAX_INPUT_TOKENS", "1000000"))
+TASK_MAX_COST_USD = float(os.getenv("TASK_MAX_COST_USD", "0"))
+TASK_BUDGET_ACTION = os.getenv("TASK_BUDGET_ACTION", "downsample").lower()  # downsample / reject
+# 预估值达到预算的该比例时调用 count_tokens 精确计算
+PREFLIGHT_COUNT_TOKENS = os.getenv("PREFLIGHT_COUNT_TOKENS", "true").lower() == "true"
+PREFLIGHT_COUNT_TOKENS_RATIO = float(os.getenv("PREFLIGHT_COUNT_TOKENS_RATIO", "0.5"))
+
+# 视频采样：指令只涉及某一时间段时只发送该片段；生成FFmpeg命令时降低帧率和分辨率
+VIDEO_AUTO_CLIP = os.getenv("VIDEO_AUTO_CLIP", "true").lower() == "true"
+VIDEO_TRANSFORM_FPS = float(os.getenv("VIDEO_TRANSFORM_FPS", "0.5")) or None
+VIDEO_TRANSFORM_MEDIA_RESOLUTION = os.getenv("VIDEO_TRANSFORM_MEDIA_RESOLUTION", "low") or None
+
+# 上传分析代理：用本地ffmpeg把视频转成低分辨率、低帧率、单声道的代理后再上传，原视频仍在前端用于编辑
+VIDEO_PROXY_ENABLED = os.getenv("VIDEO_PROXY_ENABLED", "true").lower() == "true"
+VIDEO_PROXY_DIR = os.getenv("VIDEO_PROXY_DIR", os.path.join(os.path.dirname(__file__), "data", "proxies"))
+FFMPEG_BINARY = os.getenv("FFMPEG_BINARY", "ffmpeg")
+VIDEO_PROXY_WORKERS = int(os.getenv("VIDEO_PROXY_WORKERS", "2"))
+VIDEO_PROXY_HEIGHT = int(os.getenv("VIDEO_PROXY_HEIGHT", "480"))
+VIDEO_PROXY_FPS = float(os.getenv("VIDEO_PROXY_FPS", "2"))
+VIDEO_PROXY_MIN_MB = float(os.getenv("VIDEO_PROXY_MIN_MB", "20"))
+VIDEO_PROXY_TTL_HOURS = float(os.getenv("VIDEO_PROXY_TTL_HOURS", "48"))
+# 字幕请求只上传提取的音轨（16kHz单声道Opus），需要本地ffmpeg
+SUBTITLE_AUDIO_ONLY = os.getenv("SUBTITLE_AUDIO_ONLY", "true").lower() == "true"
+
+# 关键帧分析：内容分析指令用本地场景检测提取的关键帧（可附带音轨）代替整个视频；auto 时只对较长的视频启用，
+# always 对所有内容分析指令启用，off 关闭；请求参数 analysis_mode=video/keyframes 优先
+KEYFRAME_ANALYSIS_MODE = os.getenv("KEYFRAME_ANALYSIS_MODE", "auto").lower()
+KEYFRAME_MIN_SECONDS = float(os.getenv("KEYFRAME_MIN_SECONDS", "1200"))
+KEYFRAME_DIR = os.getenv("KEYFRAME_DIR", os.path.join(os.path.dirname(__file__), "data", "keyframes"))
+KEYFRAME_WORKERS = int(os.getenv("KEYFRAME_WORKERS", "2"))
+KEYFRAME_SCENE_THRESHOLD = float(os.getenv("KEYFRAME_SCENE_THRESHOLD", "0.3"))
+KEYFRAME_MAX_GAP_SECONDS = float(os.getenv("KEYFRAME_MAX_GAP_SECONDS", "30"))
+KEYFRAME_MAX_FRAMES = int(os.getenv("KEYFRAME_MAX_FRAMES", "48"))
+KEYFRAME_HEIGHT = int(os.getenv("KEYFRAME_HEIGHT", "360"))
+KEYFRAME_INCLUDE_AUDIO = os.getenv("KEYFRAME_INCLUDE_AUDIO", "true").lower() == "true"
+KEYFRAME_TTL_HOURS = float(os.getenv("KEYFRAME_TTL_HOURS", "48"))
+ANALYSIS_MODES = ("video", "keyframes")
+
+# 镜头边界索引：本地场景检测得到的镜头边界，按内容哈希缓存；涉及片头/场景/镜头/分段的指令等待生成并写入提示词，
+# 长视频字幕分段的切分点对齐到 SUBTITLE_SEGMENT_SNAP_SECONDS 内的镜头边界
+SHOT_INDEX_ENABLED = os.getenv("SHOT_INDEX_ENABLED", "true").lower() == "true"
+SHOT_INDEX_DIR = os.getenv("SHOT_INDEX_DIR", os.path.join(os.path.dirname(__file__), "data", "shots"))
+SHOT_INDEX_WORKERS = int(os.getenv("SHOT_INDEX_WORKERS", "2"))
+SHOT_INDEX_THRESHOLD = float(os.getenv("SHOT_INDEX_THRESHOLD", "0.3"))
+SHOT_INDEX_MIN_SHOT_SECONDS = float(os.getenv("SHOT_INDEX_MIN_SHOT_SECONDS", "1.0"))
+SHOT_INDEX_MAX_PROMPT_BOUNDARIES = int(os.getenv("SHOT_INDEX_MAX_PROMPT_BOUNDARIES", "100"))
+
+# 长视频字幕分段并行生成：每段引用同一个Gemini文件的不同时间范围，完成后平移时间戳合并
+SUBTITLE_SEGMENT_ENABLED = os.getenv("SUBTITLE_SEGMENT_ENABLED", "true").lower() == "true"
+SUBTITLE_SEGMENT_MIN_SECONDS = float(os.getenv("SUBTITLE_SEGMENT_MIN_SECONDS", "900"))
+SUBTITLE_SEGMENT_SECONDS = float(os.getenv("SUBTITLE_SEGMENT_SECONDS", "300"))
+SUBTITLE_SEGMENT_OVERLAP_SECONDS = float(os.getenv("SUBTITLE_SEGMENT_OVERLAP_SECONDS", "10"))
+SUBTITLE_SEGMENT_SNAP_SECONDS = float(os.getenv("SUBTITLE_SEGMENT_SNAP_SECONDS", "30"))
+SUBTITLE_SEGMENT_CONCURRENCY = int(os.getenv("SUBTITLE_SEGMENT_CONCURRENCY", "4"))
+# 字幕只依赖语音，分段请求用很低的帧率和分辨率采样画面
+SUBTITLE_SEGMENT_FPS = float(os.getenv("SUBTITLE_SEGMENT_FPS", "0.2"))
+SUBTITLE_SEGMENT_MEDIA_RESOLUTION = os.getenv("SUBTITLE_SEGMENT_MEDIA_RESOLUTION", "low") or None
+# 服务端修复模型输出的SRT格式（时间分隔符、多行/超长字幕、重叠、句末标点、序号）
+SUBTITLE_AUTOFIX_ENABLED = os.getenv("SUBTITLE_AUTOFIX_ENABLED", "true").lower() == "true"
+# 关闭自动修复时SRT格式规则（时间格式、序号）写进系统指令，由模型自己遵守
+SRT_FORMAT_IN_PROMPT = not SUBTITLE_AUTOFIX_ENABLED
+VIDEO_INSTRUCTION = video_system_instruction(SRT_FORMAT_IN_PROMPT)
+
+# 返回前校验并修正Gemini生成的FFmpeg参数数组；仍有错误时用轻量模型做一次纯文本修复（不附带视频）
+FFMPEG_VALIDATION_ENABLED = os.getenv("FFMPEG_VALIDATION_ENABLED", "true").lower() == "true"
+FFMPEG_REPAIR_ENABLED = os.getenv("FFMPEG_REPAIR_ENABLED", "true").lower() == "true"
+# 前端 ffmpeg.wasm 中输入视频固定写入的文件名
+FFMPEG_WASM_INPUT_FILENAME = "input.mp4"
+
+# 可选的服务端FFmpeg执行：请求带 execute_on_server 时，工具调用的命令在服务器上用原生ffmpeg执行，结果可直接下载
+FFMPEG_EXECUTION_ENABLED = os.getenv("FFMPEG_EXECUTION_ENABLED", "false").lower() == "true"
+FFMPEG_EXECUTION_DIR = os.getenv("FFMPEG_EXECUTION_DIR", os.path.join(os.path.dirname(__file__), "data", "jobs"))
+FFMPEG_EXECUTION_WORKERS = int(os.getenv("FFMPEG_EXECUTION_WORKERS", "2"))
+FFMPEG_EXECUTION_TIMEOUT_SECONDS = float(os.getenv("FFMPEG_EXECUTION_TIMEOUT_SECONDS", "1800"))
+FFMPEG_EXECUTION_TTL_HOURS = float(os.getenv("FFMPEG_EXECUTION_TTL_HOURS", "6"))
+# 字幕烧录使用的字体目录（对应前端的 /customfonts）；为空时使用系统字体
+FFMPEG_FONTS_DIR = os.getenv("FFMPEG_FONTS_DIR", "") or None
+
+# 产物库：生成的字幕和服务端输出按内容哈希保存，下载支持 Range 和 ETag
+ARTIFACT_STORE_ENABLED = os.getenv("ARTIFACT_STORE_ENABLED", "true").lower() == "true"
+ARTIFACT_DIR = os.getenv("ARTIFACT_DIR", os.path.join(os.path.dirname(__file__), "data", "artifacts"))
+ARTIFACT_TTL_HOURS = float(os.getenv("ARTIFACT_TTL_HOURS", "24"))
+# 后端在nginx之后时设置为 ARTIFACT_DIR 对应的 internal location（如 /_artifacts/），由nginx用sendfile发送文件
+ARTIFACT_ACCEL_REDIRECT_PREFIX = os.getenv("ARTIFACT_ACCEL_REDIRECT_PREFIX", "")
 
 if not API_KEY:
     raise RuntimeError("GOOGLE_API_KEY not found in .env file")
 
+job_journal: Optional[JobJournal] = (
+    JobJournal(JOB_JOURNAL_DIR, retention_seconds=JOB_JOURNAL_RETENTION_HOURS * 3600)
+    if JOB_JOURNAL_ENABLED else None
+)
+
+client_quotas = ClientQuotaManager(
+    max_concurrent_tasks=CLIENT_MAX_CONCURRENT_TASKS,
+    max_upload_bytes_per_minute=CLIENT_MAX_UPLOAD_MB_PER_MINUTE * 1024 * 1024,
+    max_gemini_requests_per_minute=CLIENT_MAX_GEMINI_RPM
+)
+
+def create_rate_limit_backend():
+    if RATE_LIMIT_BACKEND == "sqlite":
+        os.makedirs(os.path.dirname(RATE_LIMIT_DB), exist_ok=True)
+        return SQLiteBucketBackend(RATE_LIMIT_DB)
+    return InMemoryBucketBackend()
+
+def generate_limit_key(model: str) -> str:
+    """Gemini的生成配额按模型分别计算"""
+    return f"generate:{model}"
+
+gemini_rate_limiter = GeminiRateLimiter(create_rate_limit_backend(), {
+    "upload": [BucketLimit("rpm", GEMINI_UPLOAD_RPM)],
+    "files_get": [BucketLimit("rpm", GEMINI_FILES_GET_RPM)],
+    "caches": [BucketLimit("rpm", GEMINI_UPLOAD_RPM)],
+    **{
+        generate_limit_key(model): [
+            BucketLimit("rpm", GEMINI_GENERATE_RPM),
+            BucketLimit("tpm", GEMINI_GENERATE_TPM, unit="tokens")
+        ]
+        for model in {MODEL_NAME, *MODEL_ROUTES.values()}
+    },
+})
+
+model_router = ModelRouter(
+    MODEL_ROUTES,
+    default_model=MODEL_NAME,
+    long_video_seconds=MODEL_ROUTE_LONG_VIDEO_SECONDS,
+    max_wait_seconds=MODEL_ROUTE_MAX_WAIT_SECONDS,
+    wait_estimator=lambda model, tokens: gemini_rate_limiter.estimate_wait(generate_limit_key(model), tokens)
+)
+
+video_sessions = VideoSessionStore(
+    session_ttl_seconds=VIDEO_SESSION_TTL_HOURS * 3600,
+    file_ttl_seconds=GEMINI_FILE_TTL_HOURS * 3600
+)
+
+result_cache: Optional[ResultCache] = (
+    ResultCache(max_entries=RESULT_CACHE_MAX_ENTRIES, ttl_seconds=RESULT_CACHE_TTL_HOURS * 3600)
+    if RESULT_CACHE_ENABLED else None
+)
+
+context_cache: Optional[ContextCacheManager] = (
+    ContextCacheManager(
+        ttl_seconds=CONTEXT_CACHE_TTL_SECONDS,
+        min_uses=CONTEXT_CACHE_MIN_USES,
+        min_tokens=CONTEXT_CACHE_MIN_TOKENS
+    )
+    if CONTEXT_CACHE_ENABLED else None
+)
+
+semantic_cache: Optional[SemanticPromptCache] = (
+    SemanticPromptCache(threshold=SEMANTIC_CACHE_THRESHOLD)
+    if result_cache and SEMANTIC_CACHE_ENABLED else None
+)
+
+media_info_cache = MediaInfoCache(MEDIA_INFO_CACHE_DIR or None, max_entries=MEDIA_INFO_CACHE_MAX_ENTRIES)
+
+ffmpeg_templates: Optional[FfmpegTemplateEngine] = (
+    FfmpegTemplateEngine() if FFMPEG_TEMPLATE_MODE in ("fast_path", "fallback") else None
+)
+
+ffmpeg_validator: Optional[FfmpegCommandValidator] = (
+    FfmpegCommandValidator() if FFMPEG_VALIDATION_ENABLED else None
+)
+
+ffmpeg_executor: Optional[FfmpegExecutor] = (
+    FfmpegExecutor(
+        FFMPEG_EXECUTION_DIR,
+        ffmpeg_binary=FFMPEG_BINARY,
+        max_workers=FFMPEG_EXECUTION_WORKERS,
+        timeout=FFMPEG_EXECUTION_TIMEOUT_SECONDS,
+        ttl_seconds=FFMPEG_EXECUTION_TTL_HOURS * 3600,
+        fonts_dir=FFMPEG_FONTS_DIR
+    )
+    if FFMPEG_EXECUTION_ENABLED else None
+)
+
+artifact_store: Optional[ArtifactStore] = (
+    ArtifactStore(ARTIFACT_DIR, ttl_seconds=ARTIFACT_TTL_HOURS * 3600)
+    if ARTIFACT_STORE_ENABLED else None
+)
+
+cost_estimator = CostEstimator()
+
+upload_proxy: Optional[UploadProxyTranscoder] = (
+    UploadProxyTranscoder(
+        VIDEO_PROXY_DIR,
+        ffmpeg_binary=FFMPEG_BINARY,
+        max_workers=VIDEO_PROXY_WORKERS,
+        height=VIDEO_PROXY_HEIGHT,
+        fps=VIDEO_PROXY_FPS,
+        min_input_bytes=int(VIDEO_PROXY_MIN_MB * 1024 * 1024),
+        ttl_seconds=VIDEO_PROXY_TTL_HOURS * 3600
+    )
+    if VIDEO_PROXY_ENABLED else None
+)
+
+keyframe_extractor: Optional[KeyframeExtractor] = (
+    KeyframeExtractor(
+        KEYFRAME_DIR,
+        ffmpeg_binary=FFMPEG_BINARY,
+        max_workers=KEYFRAME_WORKERS,
+        scene_threshold=KEYFRAME_SCENE_THRESHOLD,
+        max_gap=KEYFRAME_MAX_GAP_SECONDS,
+        max_frames=KEYFRAME_MAX_FRAMES,
+        height=KEYFRAME_HEIGHT,
+        ttl_seconds=KEYFRAME_TTL_HOURS * 3600
+    )
+    if KEYFRAME_ANALYSIS_MODE in ("auto", "always") else None
+)
+
+shot_indexer: Optional[ShotIndexer] = (
+    ShotIndexer(
+        SHOT_INDEX_DIR or None,
+        ffmpeg_binary=FFMPEG_BINARY,
+        max_workers=SHOT_INDEX_WORKERS,
+        threshold=SHOT_INDEX_THRESHOLD,
+        min_shot_seconds=SHOT_INDEX_MIN_SHOT_SECONDS
+    )
+    if SHOT_INDEX_ENABLED else None
+)
+
+gemini_retry_policy = RetryPolicy(max_attempts=GEMINI_RETRY_MAX_ATTEMPTS, base_delay=GEMINI_RETRY_BASE_DELAY)
+gemini_circuit_breakers: Dict[str, CircuitBreaker] = {
+    endpoint: CircuitBreaker(
+        f"gemini.{endpoint}",
+        failure_threshold=GEMINI_CIRCUIT_FAILURE_THRESHOLD,
+        reset_timeout=GEMINI_CIRCUIT_RESET_SECONDS
+    )
+    for endpoint in ("upload", "files_get", "generate", "caches", "count_tokens")
+}
+# 各接口可以重试的错误：读取是幂等的；生成只在请求被拒绝时重试；上传和创建缓存不重试，避免重复创建文件和缓存
+gemini_retry_conditions: Dict[str, Callable[[Exception], bool]] = {
+    "files_get": is_retryable_error,
+    "count_tokens": is_retryable_error,
+    "generate": is_rejected_error,
+    "upload": never_retry,
+    "caches": never_retry,
+}
+
+async def call_gemini(progress: ProcessProgress, endpoint: str, fn, estimated_tokens: int = 0, limit_key: Optional[str] = None,
+                      should_retry: Optional[Callable[[Exception], bool]] = None, **kwargs):
+    """在线程池中调用Gemini客户端方法：经过熔断器和全局限流排队，计入客户端配额，按接口的重试条件自动重试。
+    limit_key 指定限流桶（生成接口按模型区分），默认与 endpoint 相同；should_retry 覆盖接口默认的重试条件"""
+    def on_wait(wait: float):
+        progress.queue_wait_seconds = wait
+        progress.update(progress.stage, progress.percentage, f"Gemini请求排队中，预计等待 {wait:.0f} 秒...")
+    
+    def on_retry(attempt: int, delay: float, error: Exception):
+        progress.update(progress.stage, progress.percentage, f"Gemini暂时不可用，{delay:.0f} 秒后第 {attempt} 次重试...")
+    
+    async def attempt():
+        await gemini_rate_limiter.acquire(limit_key or endpoint, estimated_tokens, on_wait=on_wait)
+        progress.queue_wait_seconds = 0
+        client_quotas.record_gemini_request(progress.client_id)
+        return await asyncio.to_thread(fn, **kwargs)
+    
+    return await call_with_retry(
+        attempt, gemini_retry_policy, gemini_circuit_breakers[endpoint], on_retry=on_retry, should_retry=should_retry or gemini_retry_conditions[endpoint]
+    )
+
+def start_content_stream(**kwargs):
+    """发起流式生成并预取第一个响应块，让连接错误和429在重试范围内抛出"""
+    stream = client.models.generate_content_stream(**kwargs)
+    first_chunk = next(stream, None)
+    return itertools.chain([first_chunk] if first_chunk is not None else [], stream)
+
 # Initialize the new client, this is the recommended approach for the new SDK
 client = genai.Client(api_key=API_KEY)
 
@@ -112,15 +523,27 @@ async def get_progress(task_id: str):
     progress = progress_store[task_id]
     return {
         "task_id": progress.task_id,
+        "video_session_id": progress.video_session_id,
         "stage": progress.stage,
         "percentage": progress.percentage,
         "message": progress.message,
         "error_message": progress.error_message,
         "elapsed_time": time.time() - progress.start_time if progress.start_time > 0 else 0,
         "result": progress.result,
+        "estimated_tokens": progress.estimated_tokens,
+        "queue_wait_seconds": progress.queue_wait_seconds,
+        "model_route": progress.model_route,
+        "cost_estimate": progress.cost_estimate,
+        "actual_usage": progress.actual_usage,
+        "upload_proxy": progress.upload_proxy,
+        "keyframes": progress.keyframes,
+        "shot_index": progress.shot_index,
+        "media_info": progress.media_info,
+        "ffmpeg_execution": progress.ffmpeg_execution,
         "streaming_text": progress.streaming_text,
         "is_streaming": progress.is_streaming,
-        "stream_complete": progress.stream_complete
+        "stream_complete": progress.stream_complete,
+        "subtitle_cues": progress.subtitle_cues
     }
 
 @app.get("/api/stream/{task_id}")
@@ -140,6 +563,19 @@ async def stream_ai_response(task_id: str):
             
         progress = progress_store[task_id]
         last_text_length = 0
+        last_cue_count = 0
+        last_cue_revision = progress.subtitle_cues_revision
+        
+        def cue_events() -> List[str]:
+            """新完成的字幕逐条发送；已发布的字幕被替换时发送完整列表"""
+            nonlocal last_cue_count, last_cue_revision
+            if progress.subtitle_cues_revision != last_cue_revision:
+                events = [create_sse_data({"type": "cues", "cues": progress.subtitle_cues})]
+            else:
+                events = [create_sse_data({"type": "cue", "cue": cue}) for cue in progress.subtitle_cues[last_cue_count:]]
+            last_cue_count = len(progress.subtitle_cues)
+            last_cue_revision = progress.subtitle_cues_revision
+            return events
         
         print(f"[SSE] 开始等待AI生成，当前阶段: {progress.stage}")
         
@@ -168,9 +604,15 @@ async def stream_ai_response(task_id: str):
                 })
                 last_text_length = current_text_length
             
+            # 发送新完成的字幕
+            for event in cue_events():
+                yield event
+            
             await asyncio.sleep(0.1)  # 100ms轮询间隔
         
         # 发送完成信号
+        for event in cue_events():
+            yield event
         if progress.stream_complete:
             yield create_sse_data({
                 "type": "complete", 
@@ -191,16 +633,231 @@ async def stream_ai_response(task_id: str):
         }
     )
 
+def request_client_id(request: Request) -> str:
+    return resolve_client_id(
+        request.headers, request.client.host if request.client else None, CLIENT_API_KEY_HASHES, TRUSTED_PROXIES
+    )
+
+@app.get("/api/quota")
+async def get_quota(request: Request):
+    """查看当前客户端的配额使用情况"""
+    client_id = request_client_id(request)
+    return client_quotas.usage(client_id)
+
+@app.get("/api/ffmpeg-templates/stats")
+async def get_ffmpeg_template_stats():
+    """本地FFmpeg模板的覆盖率统计"""
+    if not ffmpeg_templates:
+        return {"mode": FFMPEG_TEMPLATE_MODE}
+    return {"mode": FFMPEG_TEMPLATE_MODE, **ffmpeg_templates.stats()}
+
+@app.get("/api/ffmpeg-validation/stats")
+async def get_ffmpeg_validation_stats():
+    """FFmpeg命令校验的自动修正和修复请求统计"""
+    if not ffmpeg_validator:
+        return {"enabled": False}
+    return {"enabled": True, "repair_enabled": FFMPEG_REPAIR_ENABLED, **ffmpeg_validator.stats()}
+
+@app.get("/api/ffmpeg-execution/stats")
+async def get_ffmpeg_execution_stats():
+    """服务端FFmpeg执行的次数、耗时和输出大小"""
+    if not ffmpeg_executor:
+        return {"enabled": False}
+    return {"enabled": True, **ffmpeg_executor.stats()}
+
+@app.get("/api/ffmpeg-jobs/{task_id}/output")
+async def download_ffmpeg_output(task_id: str):
+    """下载服务端执行FFmpeg生成的文件"""
+    progress = progress_store.get(task_id)
+    execution = (progress.result or {}).get("server_execution") if progress else None
+    if not (ffmpeg_executor and execution and execution.get("status") == "completed"):
+        raise HTTPException(status_code=404, detail="Output not found")
+    if execution.get("artifact"):
+        return RedirectResponse(execution["artifact"]["url"])
+    path = ffmpeg_executor.output_path(task_id, execution["output_filename"])
+    if not path:
+        raise HTTPException(status_code=410, detail="Output expired")
+    return FileResponse(path, filename=execution["output_filename"])
+
+@app.get("/api/media-info/stats")
+async def get_media_info_stats():
+    """ffprobe元数据缓存的命中次数和实际运行次数"""
+    return {"ffprobe_available": ffprobe_available(FFPROBE_BINARY), **media_info_cache.stats()}
+
+@app.get("/api/artifacts/stats")
+async def get_artifact_stats():
+    """产物库保存和去重统计"""
+    if not artifact_store:
+        return {"enabled": False}
+    return {"enabled": True, **artifact_store.stats()}
+
+@app.get("/api/artifacts/{artifact_id}")
+@app.get("/api/artifacts/{artifact_id}/{filename}")
+async def download_artifact(artifact_id: str, request: Request, filename: Optional[str] = None):
+    """下载产物：ETag 为内容哈希，支持 If-None-Match（304）和单个 Range（206）；
+    地址中的 filename 是保存时的下载文件名"""
+    artifact: Optional[Artifact] = await asyncio.to_thread(artifact_store.get, artifact_id, filename) if artifact_store else None
+    if not artifact:
+        raise HTTPException(status_code=404, detail="Artifact not found")
+    headers = {
+        "ETag": artifact.etag,
+        # 地址由内容决定，内容不会改变
+        "Cache-Control": f"private, max-age={int(ARTIFACT_TTL_HOURS * 3600)}, immutable",
+        "Accept-Ranges": "bytes",
+        "Content-Disposition": f"attachment; filename*=utf-8''{quote(artifact.filename)}",
+    }
+    if etag_matches(request.headers.get("if-none-match"), artifact.etag):
+        return Response(status_code=304, headers=headers)
+    if ARTIFACT_ACCEL_REDIRECT_PREFIX:
+        # nginx 处理 Range 并用 sendfile 发送
+        relative_path = os.path.relpath(artifact.path, ARTIFACT_DIR).replace(os.sep, "/")
+        return Response(headers={**headers, "X-Accel-Redirect": ARTIFACT_ACCEL_REDIRECT_PREFIX.rstrip("/") + "/" + relative_path}, media_type=artifact.mime_type)
+    
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if if_range and if_range.strip() != artifact.etag:
+        # 客户端缓存的版本已经不同，返回完整内容
+        range_header = None
+    try:
+        byte_range = parse_range(range_header, artifact.size)
+    except ValueError:
+        return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{artifact.size}"})
+    if not byte_range:
+        # 完整内容由 FileResponse 发送（服务器支持 pathsend 扩展时不经过Python复制）
+        return FileResponse(artifact.path, media_type=artifact.mime_type, headers=headers)
+    start, end = byte_range
+    return StreamingResponse(
+        iter_file_range(artifact.path, start, end),
+        status_code=206,
+        media_type=artifact.mime_type,
+        headers={**headers, "Content-Range": f"bytes {start}-{end}/{artifact.size}", "Content-Length": str(end - start + 1)}
+    )
+
+@app.get("/api/model-routes/stats")
+async def get_model_route_stats():
+    """各模型路由的请求数、延迟和费用统计，以及预估值的校准系数"""
+    return {**model_router.stats(), "calibration": cost_estimator.stats()}
+
+@app.get("/api/video-proxy/stats")
+async def get_video_proxy_stats():
+    """上传分析代理的转码次数和节省的上传字节数"""
+    if not upload_proxy:
+        return {"enabled": False}
+    return {"enabled": True, **upload_proxy.stats()}
+
+@app.get("/api/keyframes/stats")
+async def get_keyframe_stats():
+    if not keyframe_extractor:
+        return {"enabled": False}
+    return {"enabled": True, "mode": KEYFRAME_ANALYSIS_MODE, "min_seconds": KEYFRAME_MIN_SECONDS, **keyframe_extractor.stats()}
+
+@app.get("/api/video-sessions/{video_session_id}")
+async def get_video_session(video_session_id: str, request: Request):
+    """查看视频会话信息"""
+    session = video_sessions.get(video_session_id, request_client_id(request))
+    if not session:
+        raise HTTPException(status_code=404, detail="Video session not found")
+    info = session.to_dict()
+    info["gemini_file_cached"] = video_sessions.find_file(session.file_hash) is not None
+    return info
+
+@app.get("/api/video-sessions/{video_session_id}/shots")
+async def get_video_session_shots(video_session_id: str, request: Request):
+    """视频的镜头边界索引；还没有生成时如果会话保留了本地副本就现在生成"""
+    if not shot_indexer:
+        raise HTTPException(status_code=404, detail="镜头索引未启用")
+    session = video_sessions.get(video_session_id, request_client_id(request))
+    if not session or not session.file_hash:
+        raise HTTPException(status_code=404, detail="Video session not found")
+    shot_index = shot_indexer.get(session.file_hash)
+    if not shot_index and shot_indexer.available and session.local_video_path and os.path.exists(session.local_video_path):
+        shot_index = await shot_indexer.get_or_build(session.file_hash, session.local_video_path, (session.media_info or {}).get("duration"))
+    if not shot_index:
+        raise HTTPException(status_code=404, detail="该视频还没有镜头索引")
+    return {
+        "video_session_id": session.session_id,
+        **shot_index.to_dict(),
+        "shots": [{"start": round(start, 3), "end": round(end, 3) if end is not None else None} for start, end in shot_index.shots],
+    }
+
+@app.get("/api/shot-index/stats")
+async def get_shot_index_stats():
+    if not shot_indexer:
+        return {"enabled": False}
+    return {"enabled": True, **shot_indexer.stats()}
+
+def parse_sampling_options(clip_start: Optional[float], clip_end: Optional[float], sample_fps: Optional[float], media_resolution: Optional[str], analysis_mode: Optional[str] = None) -> Dict:
+    """校验请求级的视频采样参数"""
+    if clip_start is not None and clip_start < 0:
+        raise HTTPException(status_code=400, detail="clip_start 不能为负数")
+    if clip_end is not None and clip_end <= (clip_start or 0):
+        raise HTTPException(status_code=400, detail="clip_end 必须大于 clip_start")
+    if sample_fps is not None and not 0 < sample_fps <= 24:
+        raise HTTPException(status_code=400, detail="sample_fps 必须在 (0, 24] 范围内")
+    if media_resolution and media_resolution.lower() not in MEDIA_RESOLUTIONS:
+        raise HTTPException(status_code=400, detail=f"media_resolution 必须是 {', '.join(MEDIA_RESOLUTIONS)} 之一")
+    if analysis_mode and analysis_mode.lower() not in ANALYSIS_MODES:
+        raise HTTPException(status_code=400, detail=f"analysis_mode 必须是 {', '.join(ANALYSIS_MODES)} 之一")
+    options = {
+        "clip_start": clip_start,
+        "clip_end": clip_end,
+        "fps": sample_fps,
+        "media_resolution": media_resolution.lower() if media_resolution else None,
+        "analysis_mode": analysis_mode.lower() if analysis_mode else None,
+    }
+    return {key: value for key, value in options.items() if value is not None}
+
 @app.post("/api/start-processing")
-async def start_processing(prompt: str = Form(...), video_file: Optional[UploadFile] = File(None)):
+async def start_processing(request: Request, prompt: str = Form(...), video_file: Optional[UploadFile] = File(None), video_session_id: Optional[str] = Form(None), bypass_cache: bool = Form(False), clip_start: Optional[float] = Form(None), clip_end: Optional[float] = Form(None), sample_fps: Optional[float] = Form(None), media_resolution: Optional[str] = Form(None), execute_on_server: bool = Form(False), analysis_mode: Optional[str] = Form(None)):
     """启动异步处理任务并返回任务ID"""
     task_id = str(uuid.uuid4())
+    sampling_options = parse_sampling_options(clip_start, clip_end, sample_fps, media_resolution, analysis_mode)
+    
+    # 读取视频内容之前先检查客户端配额
+    client_id = request_client_id(request)
+    # Gemini持续故障时快速失败，不再堆积新任务（本地模板能处理的指令除外）
+    generate_breaker = gemini_circuit_breakers["generate"]
+    if generate_breaker.state == "open" and not (ffmpeg_templates and ffmpeg_templates.can_handle(prompt)):
+        retry_after = generate_breaker.retry_after()
+        raise HTTPException(
+            status_code=503,
+            detail="AI服务暂时不可用，请稍后重试",
+            headers={"Retry-After": str(int(retry_after) + 1)}
+        )
+    
+    upload_bytes = 0
+    if video_file and video_file.filename:
+        upload_bytes = video_file.size or int(request.headers.get("content-length", 0))
+    try:
+        client_quotas.acquire(client_id, task_id, upload_bytes)
+    except QuotaExceeded as e:
+        print(f"Quota exceeded for {client_id}: {e.message}")
+        headers = {"Retry-After": str(int(e.retry_after) + 1)} if e.retry_after else None
+        raise HTTPException(status_code=e.status_code, detail=e.message, headers=headers)
+    
     progress = ProcessProgress()
     progress.task_id = task_id
+    progress.client_id = client_id
     progress.start_time = time.time()
     progress.update("starting", 0, "开始处理请求...")
     progress_store[task_id] = progress
     
+    # 上传新视频时沿用该客户端自己的会话或创建新会话；不带视频时必须引用该客户端已有的会话
+    if video_file and video_file.filename:
+        video_sessions.cleanup_expired()
+        if upload_proxy:
+            await asyncio.to_thread(upload_proxy.cleanup_expired)
+        if keyframe_extractor:
+            await asyncio.to_thread(keyframe_extractor.cleanup_expired)
+        if ffmpeg_executor:
+            await asyncio.to_thread(ffmpeg_executor.cleanup_expired)
+        if artifact_store:
+            await asyncio.to_thread(artifact_store.cleanup_expired)
+        session = video_sessions.get_or_create(video_session_id, client_id)
+    else:
+        session = video_sessions.get(video_session_id, client_id)
+    progress.video_session_id = session.session_id if session else None
+    
     # 预先读取视频文件内容，避免后台任务中的文件句柄关闭问题
     video_content = None
     video_mime_type = None
@@ -215,321 +872,1237 @@ async def start_processing(prompt: str = Form(...), video_file: Optional[UploadF
         except Exception as e:
             print(f"Error reading video file in start_processing: {str(e)}")
             progress.update("error", 0, f"读取视频文件失败: {str(e)}")
+            client_quotas.release(client_id, task_id)
             return {"error": f"读取视频文件失败: {str(e)}"}
     
+    # 写入任务日志，上传内容落盘以便崩溃后恢复（同时作为上传Google的源文件）
+    spool_path = None
+    if job_journal:
+        if video_content and video_filename:
+            spool_path = await asyncio.to_thread(
+                job_journal.spool_video, task_id, video_content, os.path.splitext(video_filename)[1]
+            )
+        job_journal.record(
+            task_id, "created",
+            prompt=prompt,
+            video_filename=video_filename,
+            video_mime_type=video_mime_type,
+            video_session_id=progress.video_session_id,
+            client_id=client_id,
+            spool_path=spool_path,
+            sampling=sampling_options,
+            execute_on_server=execute_on_server,
+            bypass_cache=bypass_cache
+        )
+    
     # 启动后台任务，传递已读取的文件内容而不是文件对象
-    asyncio.create_task(process_video_task_with_content(task_id, prompt, video_content, video_mime_type, video_filename))
-    
-    return {"task_id": task_id}
-
-# --- Tool Definition for Subtitle Generation Only ---
-generate_subtitle_file_declaration = types.FunctionDeclaration(
-    name="generate_subtitle_file",
-    description=(
-        "Generates ONLY a subtitle file (.srt) for the video WITHOUT any video processing. "
-        "Use this tool when the user specifically asks to 'generate subtitles', 'create subtitle file', "
-        "'make srt file', or wants subtitles without modifying the video. "
-        "This tool does NOT process the video - it only analyzes the video content and creates subtitle text."
-    ),
-    parameters=types.Schema(
-        type=types.Type.OBJECT,
-        properties={
-            "subtitles_content": types.Schema(
-                type=types.Type.STRING,
-                description="The complete SRT subtitle content following the exact format requirements."
-            ),
-            "subtitles_filename": types.Schema(
-                type=types.Type.STRING,
-                description="The filename for the subtitle file (e.g., 'video_subtitles.srt', 'chinese_subs.srt')."
-            ),
-            "description": types.Schema(
-                type=types.Type.STRING,
-                description="A brief description of the subtitle content (e.g., 'Generated Chinese subtitles for the video content')."
+    task = asyncio.create_task(process_video_task_with_content(task_id, prompt, video_content, video_mime_type, video_filename, spool_path=spool_path, video_session_id=progress.video_session_id, use_result_cache=not bypass_cache, sampling_options=sampling_options, execute_on_server=execute_on_server))
+    task.add_done_callback(lambda _: client_quotas.release(client_id, task_id))
+    
+    return {"task_id": task_id, "video_session_id": progress.video_session_id}
+
+@app.on_event("shutdown")
+async def flush_job_journal():
+    """退出前写完任务日志中攒批的记录"""
+    if job_journal:
+        await asyncio.to_thread(job_journal.flush, 5)
+
+@app.on_event("startup")
+async def recover_journaled_tasks():
+    """服务启动时重放任务日志，恢复已完成任务的结果并继续执行未完成的任务"""
+    if not job_journal:
+        return
+    removed = await asyncio.to_thread(job_journal.cleanup_expired)
+    if removed:
+        print(f"[Journal] 清理过期任务日志 {removed} 个")
+    
+    records = await asyncio.to_thread(job_journal.load_all)
+    for record in sorted(records, key=lambda r: r.updated_at):
+        progress = ProcessProgress()
+        progress.task_id = record.task_id
+        progress.start_time = record.start_time
+        progress.stage = record.stage
+        progress.percentage = record.percentage
+        progress.message = record.message
+        progress.result = record.result
+        progress.streaming_text = record.partial_text
+        progress.video_session_id = record.video_session_id
+        progress.client_id = record.client_id
+        progress_store[record.task_id] = progress
+        
+        # 恢复视频会话及其Google文件引用，供后续引用该会话的请求使用
+        if record.google_file_name and record.file_hash:
+            video_sessions.register_file(
+                gemini_file_key(record.file_hash, record.google_file_media_kind),
+                record.google_file_name, record.google_file_mime_type, record.google_file_is_proxy
             )
-        },
-        required=["subtitles_content", "subtitles_filename", "description"] 
-    )
-)
+            if record.video_session_id:
+                session = video_sessions.restore(record.video_session_id, record.client_id)
+                video_sessions.attach_video(session, record.file_hash, record.google_file_original_name, record.google_file_mime_type)
+        
+        if record.is_finished:
+            progress.stream_complete = record.stage == "complete"
+            if record.stage == "error":
+                progress.error_message = record.message
+            continue
+        
+        print(f"[Journal] 恢复未完成任务 {record.task_id}，上次阶段: {record.stage} ({record.percentage}%)")
+        await resume_journaled_task(record, progress)
+
+async def resume_journaled_task(record: JobRecord, progress: ProcessProgress):
+    """从最后完成的阶段继续执行任务"""
+    video_content = None
+    if record.spool_path and os.path.exists(record.spool_path):
+        video_content = await asyncio.to_thread(read_file_bytes, record.spool_path)
+    
+    if not video_content and not record.google_file_name and record.video_filename:
+        progress.update("error", 0, "服务重启后无法恢复任务：上传的视频已丢失，请重新提交")
+        return
+    
+    progress.update("resuming", record.percentage, f"服务重启，从阶段 {record.stage} 恢复任务...")
+    asyncio.create_task(process_video_task_with_content(
+        record.task_id,
+        record.prompt,
+        video_content,
+        record.video_mime_type,
+        record.video_filename,
+        spool_path=record.spool_path if video_content else None,
+        resume_file_name=record.google_file_name,
+        video_session_id=record.video_session_id,
+        use_result_cache=not record.bypass_cache,
+        sampling_options=record.sampling,
+        execute_on_server=record.execute_on_server
+    ))
+
+async def wait_until_file_active(progress: ProcessProgress, file_obj: types.File, base_percent: int, max_percent: int, message: str) -> types.File:
+    """轮询Gemini文件状态直到不再是PROCESSING"""
+    wait_cycles = 0
+    while file_obj.state and file_obj.state.name == "PROCESSING":
+        wait_cycles += 1
+        # 动态更新进度和消息，让用户知道仍在处理
+        progress_percent = min(base_percent + wait_cycles * 2, max_percent)
+        progress.update("google_processing", progress_percent, f"{message} ({wait_cycles}s)")
+        
+        print(f"File {file_obj.name} is still PROCESSING. Waiting 1 seconds... (cycle {wait_cycles})")
+        await asyncio.sleep(1)
+        
+        retrieved_file = await call_gemini(progress, "files_get", client.files.get, name=file_obj.name)
+        if retrieved_file and retrieved_file.state:
+            file_obj = retrieved_file
+            print(f"Updated file state: {file_obj.name} is now {file_obj.state.name}")
+        else:
+            print(f"Warning: client.files.get for {file_obj.name} returned invalid data or state. Retrying...")
+    return file_obj
+
+async def delete_context_caches(entries: List[ContextCacheEntry]):
+    """删除作废的远端 cached content；失败（如已过期）只记录日志"""
+    for entry in entries:
+        try:
+            await asyncio.to_thread(client.caches.delete, name=entry.name)
+            print(f"[ContextCache] 已删除缓存 {entry.name}")
+        except Exception as e:
+            print(f"[ContextCache] 删除缓存 {entry.name} 失败: {str(e)}")
 
-# --- Tool Definition for Video + Subtitles --- 
-execute_ffmpeg_with_optional_subtitles_declaration = types.FunctionDeclaration(
-    name="execute_ffmpeg_with_optional_subtitles",
-    description=(
-        "Executes an FFmpeg command in the user's web browser using FFmpeg.wasm and can optionally include subtitles. "
-        "Use this tool when the user asks to perform video manipulations like trimming, converting, adding subtitles, etc. "
-        "The input video file is always named 'input.mp4' in the FFmpeg.wasm environment. "
-        "Provide the full FFmpeg command string, the desired output filename for the video, "
-        "the content of the subtitles (if requested or appropriate, in SRT or VTT format), "
-        "and a filename for the subtitles (e.g., 'subs.srt' or 'subs.vtt'). "
-        "If subtitles are not requested or not applicable, subtitles_content and subtitles_filename can be omitted or empty."
-    ),
-    parameters=types.Schema(
-        type=types.Type.OBJECT,
-        properties={
-            "command_array": types.Schema(
-                type=types.Type.ARRAY,
-                items=types.Schema(type=types.Type.STRING),
-                description="The FFmpeg command arguments as an array of strings (without 'ffmpeg' at the beginning). For subtitles, use EXACT syntax: 'subtitles=filename.srt:fontsdir=/customfonts:force_style=\\'Fontname=Source Han Sans SC\\'' (CRITICAL: use 'fontsdir' NOT 'fontsize'). Example: ['-i', 'input.mp4', '-vf', 'subtitles=subs.srt:fontsdir=/customfonts:force_style=\\'Fontname=Source Han Sans SC\\'', 'output.mp4']"
-            ),
-            "output_filename": types.Schema(
-                type=types.Type.STRING,
-                description="The desired name for the output video file, e.g., 'output_with_subs.mp4', 'trimmed_video.mp4'."
-            ),
-            "subtitles_content": types.Schema(
-                type=types.Type.STRING,
-                description="The actual content of the subtitles (e.g., SRT or VTT format). Omit or leave empty if no subtitles are generated."
-            ),
-            "subtitles_filename": types.Schema(
-                type=types.Type.STRING,
-                description="The filename for the subtitles (e.g., 'subs.srt', 'subs.vtt'). Omit or leave empty if no subtitles are generated. This filename should be used in the command_string if burning subtitles."
+async def invalidate_context_cache(file_hash: str, model: Optional[str] = None):
+    """作废本地条目并删除远端缓存；model 为空时作废该文件所有模型的缓存"""
+    if not context_cache:
+        return
+    if model:
+        entry = context_cache.invalidate(file_hash, model)
+        entries = [entry] if entry else []
+    else:
+        entries = context_cache.invalidate_file(file_hash)
+    await delete_context_caches(entries)
+
+async def get_or_create_context_cache(progress: ProcessProgress, file_hash: str, video_file_part: types.Part, model: str) -> Optional[str]:
+    """返回可用的 cached content 名称；不满足条件或创建失败时返回 None，调用方回退到普通请求"""
+    context_cache.record_use(file_hash)
+    entry = context_cache.get(file_hash, model)
+    if entry:
+        if context_cache.needs_refresh(entry):
+            try:
+                await call_gemini(
+                    progress, "caches", client.caches.update,
+                    # 续期是幂等的
+                    should_retry=is_retryable_error,
+                    name=entry.name,
+                    config=types.UpdateCachedContentConfig(ttl=f"{CONTEXT_CACHE_TTL_SECONDS}s")
+                )
+                context_cache.refreshed(entry)
+            except Exception as e:
+                print(f"[ContextCache] 延长缓存 {entry.name} 失败，回退到普通请求: {str(e)}")
+                await invalidate_context_cache(file_hash, model)
+                return None
+        return entry.name
+    
+    if not context_cache.should_create(file_hash, model, progress.estimated_tokens):
+        return None
+    
+    try:
+        create_start_time = time.time()
+        cached_content = await call_gemini(
+            progress, "caches", client.caches.create,
+            model=f'models/{model}',
+            config=types.CreateCachedContentConfig(
+                display_name=f"video-{file_hash[:16]}",
+                contents=[types.Content(role="user", parts=[video_file_part])],
+                system_instruction=VIDEO_INSTRUCTION,
+                tools=VIDEO_TOOLS,
+                ttl=f"{CONTEXT_CACHE_TTL_SECONDS}s"
             )
-        },
-        required=["command_array", "output_filename"] 
+        )
+        print(f"PERF: client.caches.create took {time.time() - create_start_time:.2f} seconds. Cache: {cached_content.name}")
+        context_cache.store(cached_content.name, file_hash, model)
+        return cached_content.name
+    except Exception as e:
+        print(f"[ContextCache] 创建缓存失败，回退到普通请求: {str(e)}")
+        context_cache.mark_failed(file_hash, model)
+        return None
+
+def lookup_cached_result(scope_key: str, cache_key: str, prompt: str) -> Optional[tuple]:
+    """先精确匹配，再在同一作用域内做语义匹配；返回 (缓存结果, 缓存标记)"""
+    cached = result_cache.get(cache_key)
+    if cached:
+        return cached, {"hit": True, "type": "exact", "cached_at": cached.created_at}
+    if semantic_cache:
+        match = semantic_cache.find(scope_key, prompt)
+        if match:
+            entry, similarity = match
+            cached = result_cache.get(entry.cache_key)
+            if cached:
+                return cached, {
+                    "hit": True,
+                    "type": "semantic",
+                    "similarity": round(similarity, 3),
+                    "matched_prompt": entry.prompt,
+                    "cached_at": cached.created_at
+                }
+            # 结果已被淘汰，同步移除语义索引
+            semantic_cache.remove(scope_key, entry.cache_key)
+    return None
+
+def store_cached_result(file_hash: str, model: str, generation_config: Dict, prompt: str, result: Dict, streaming_text: str):
+    """按实际生成结果的模型保存，只有路由到同一模型的请求才会命中"""
+    scope_key = make_scope_key(file_hash, model, generation_config)
+    cache_key = make_cache_key(scope_key, prompt)
+    result_cache.put(cache_key, result, streaming_text)
+    if semantic_cache:
+        semantic_cache.add(scope_key, prompt, cache_key)
+
+async def replay_cached_result(progress: ProcessProgress, cached: CachedResult, cache_info: Dict, execution_input: Optional[ExecutionInput] = None):
+    """通过现有的进度/SSE通道直接回放缓存结果"""
+    progress.update("ai_generating", 60, "命中结果缓存...")
+    progress.streaming_text = cached.streaming_text
+    arguments = (cached.result.get("subtitle_generation") or cached.result.get("tool_call") or {}).get("arguments") or {}
+    if arguments.get("subtitles_content"):
+        progress.add_subtitle_cues(parse_srt(arguments["subtitles_content"]))
+    progress.complete_streaming()
+    result = dict(cached.result)
+    result["cache"] = cache_info
+    message = "命中语义缓存，直接返回相似指令的结果" if cache_info["type"] == "semantic" else "命中缓存，直接返回结果"
+    await complete_tool_call(progress, result, message, execution_input)
+
+async def finish_with_template(progress: ProcessProgress, template_match: TemplateMatch, mode: str, message: str, execution_input: Optional[ExecutionInput] = None):
+    """用本地模板生成的命令结束任务，结果结构与Gemini工具调用相同"""
+    print(f"[Template] 任务 {progress.task_id} 使用模板 ({mode}): {template_match.operations} -> {template_match.command_array}")
+    ffmpeg_templates.record_served(mode)
+    progress.complete_streaming()
+    await complete_tool_call(progress, template_match.to_result(), message, execution_input)
+
+def resolve_execution_input(video_content: Optional[bytes], spool_path: Optional[str], session: Optional[VideoSession]) -> ExecutionInput:
+    """服务端执行的输入：任务日志落盘的上传文件、内存中的上传内容或会话保留的本地副本"""
+    if spool_path and os.path.exists(spool_path):
+        return ExecutionInput(path=spool_path)
+    if video_content:
+        return ExecutionInput(content=video_content)
+    if session and session.local_video_path and os.path.exists(session.local_video_path):
+        return ExecutionInput(path=session.local_video_path)
+    return ExecutionInput()
+
+async def execute_on_server(progress: ProcessProgress, arguments: Dict, execution_input: ExecutionInput) -> Dict:
+    """在服务器上执行工具调用的命令，返回 server_execution 结果；不可用时返回原因，由前端改用 ffmpeg.wasm"""
+    if not (ffmpeg_executor and ffmpeg_executor.available):
+        return {"status": "unavailable", "error": "服务器未启用FFmpeg执行"}
+    if not execution_input.available:
+        return {"status": "unavailable", "error": "服务器上没有该视频，请重新上传"}
+    progress.update("executing", 92, "服务器执行FFmpeg...")
+    last_percent = None
+
+    def on_progress(update: Dict):
+        nonlocal last_percent
+        progress.ffmpeg_execution = update
+        percent = update.get("percent")
+        if percent is not None and percent != last_percent:
+            last_percent = percent
+            progress.update("executing", 92 + percent * 7 // 100, f"服务器执行FFmpeg {percent}%")
+
+    input_names = [name for name in (execution_input.input_filename, FFMPEG_WASM_INPUT_FILENAME) if name]
+    result = await ffmpeg_executor.run(progress.task_id, arguments, input_names, execution_input, on_progress)
+    print(f"PERF: server ffmpeg {result.status} in {result.seconds:.2f} seconds (speed: {result.speed}), output {result.output_bytes} bytes")
+    execution = result.to_dict()
+    if result.status == "completed" and artifact_store:
+        # 输出移入产物库，工作目录中不再保留
+        artifact = await asyncio.to_thread(artifact_store.put_file, result.output_path, result.output_filename, move=True)
+        execution["artifact"] = artifact.to_dict()
+        execution["download_url"] = artifact.url
+    elif result.status == "completed":
+        execution["download_url"] = f"/api/ffmpeg-jobs/{progress.task_id}/output"
+    return execution
+
+def store_subtitle_artifact(result: Dict) -> Dict:
+    """字幕内容存入产物库，结果中附上下载地址"""
+    for key in ("subtitle_generation", "tool_call"):
+        arguments = (result.get(key) or {}).get("arguments") or {}
+        if arguments.get("subtitles_content"):
+            filename = os.path.basename(arguments.get("subtitles_filename") or "") or "subtitles.srt"
+            artifact = artifact_store.put_bytes(arguments["subtitles_content"].encode("utf-8"), filename)
+            return {**result, "artifacts": {**result.get("artifacts", {}), "subtitles": artifact.to_dict()}}
+    return result
+
+async def complete_tool_call(progress: ProcessProgress, result: Dict, message: str, execution_input: Optional[ExecutionInput] = None):
+    """设置工具调用结果并结束任务；请求了服务端执行（execution_input 不为空）时先执行命令。
+    生成的字幕同时存入产物库"""
+    if artifact_store:
+        result = await asyncio.to_thread(store_subtitle_artifact, result)
+    if execution_input and "tool_call" in result:
+        if result.get("command_validation", {}).get("errors"):
+            execution = {"status": "skipped", "error": "FFmpeg命令校验未通过"}
+        else:
+            execution = await execute_on_server(progress, result["tool_call"]["arguments"], execution_input)
+        result = {**result, "server_execution": execution}
+        if execution["status"] == "completed":
+            message = f"{message}，已在服务器上执行"
+    progress.set_result(result)
+    progress.update("complete", 100, message)
+
+def read_file_bytes(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+def retain_session_video(session: VideoSession, video_content: bytes, suffix: str) -> str:
+    """为会话保留一份本地视频副本，之后的指令需要看画面时再上传"""
+    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix, prefix="session_") as tmp:
+        tmp.write(video_content)
+    video_sessions.retain_local_video(session, tmp.name)
+    return tmp.name
+
+def write_temp_file(content: bytes, suffix: str) -> str:
+    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
+        tmp.write(content)
+        return tmp.name
+
+async def probe_video_media(session: Optional[VideoSession], video_content: Optional[bytes], video_filename: Optional[str], file_hash: Optional[str] = None, spool_path: Optional[str] = None, retain_local_copy: bool = False) -> Optional[Dict]:
+    """获取视频的ffprobe元数据，按内容哈希缓存，同一内容只运行一次ffprobe；没有新上传时使用会话中保存的结果。
+    retain_local_copy 时为会话保留一份本地副本，之后的指令需要看画面时再上传"""
+    if not (video_content and video_filename):
+        if session and not session.media_info:
+            # 服务重启后恢复的会话从磁盘缓存读取
+            session.media_info = media_info_cache.get(session.file_hash)
+        return session.media_info if session else None
+    suffix = os.path.splitext(video_filename)[1]
+    local_copy_path = None
+    if session and retain_local_copy and (ffprobe_available(FFPROBE_BINARY) or media_info_cache.get(file_hash)):
+        local_copy_path = await asyncio.to_thread(retain_session_video, session, video_content, suffix)
+
+    async def probe() -> Optional[Dict]:
+        if not ffprobe_available(FFPROBE_BINARY):
+            return None
+        temp_file_path = None
+        if local_copy_path:
+            probe_path = local_copy_path
+        elif spool_path and os.path.exists(spool_path):
+            probe_path = spool_path
+        else:
+            temp_file_path = await asyncio.to_thread(write_temp_file, video_content, suffix)
+            probe_path = temp_file_path
+        try:
+            probe_start_time = time.time()
+            info = await asyncio.to_thread(probe_media, probe_path, FFPROBE_BINARY)
+            print(f"PERF: ffprobe took {time.time() - probe_start_time:.2f} seconds.")
+            return info
+        finally:
+            if temp_file_path and os.path.exists(temp_file_path):
+                os.remove(temp_file_path)
+
+    media_info = await media_info_cache.get_or_probe(file_hash, probe) if file_hash else await probe()
+    if session:
+        if media_info:
+            session.media_info = media_info
+        elif retain_local_copy:
+            video_sessions.release_local_video(session)
+    return media_info
+
+def use_keyframe_mode(intent_name: str, sampling: VideoSampling, media_info: Optional[Dict], analysis_mode: Optional[str]) -> bool:
+    """内容分析指令是否用关键帧代替视频：请求参数优先，auto 时只对足够长的视频启用。
+    指定了片段、帧率或分辨率的请求以及纯音频文件仍然发送原文件"""
+    if not keyframe_extractor or analysis_mode == "video" or intent_name != INTENT_ANALYSIS:
+        return False
+    if not sampling.is_default or (media_info and not media_info.get("video")):
+        return False
+    if analysis_mode == "keyframes" or KEYFRAME_ANALYSIS_MODE == "always":
+        return True
+    duration = (media_info or {}).get("duration")
+    return bool(duration) and duration >= KEYFRAME_MIN_SECONDS
+
+@asynccontextmanager
+async def local_video_input(session: Optional[VideoSession], video_content: Optional[bytes], video_filename: Optional[str], spool_path: Optional[str] = None):
+    """本地 ffmpeg 处理用的输入文件：任务日志落盘文件 > 临时文件 > 会话保留的本地副本；都没有时为 None"""
+    temp_file_path = None
+    if video_content and spool_path and os.path.exists(spool_path):
+        input_path = spool_path
+    elif video_content and video_filename:
+        temp_file_path = await asyncio.to_thread(write_temp_file, video_content, os.path.splitext(video_filename)[1])
+        input_path = temp_file_path
+    elif session and session.local_video_path and os.path.exists(session.local_video_path):
+        input_path = session.local_video_path
+    else:
+        input_path = None
+    try:
+        yield input_path
+    finally:
+        if temp_file_path and os.path.exists(temp_file_path):
+            os.remove(temp_file_path)
+
+async def resolve_keyframes(progress: ProcessProgress, session: Optional[VideoSession], video_content: Optional[bytes], video_filename: Optional[str], file_hash: Optional[str], spool_path: Optional[str] = None) -> Optional[KeyframeSet]:
+    """关键帧：按内容哈希缓存；没有缓存时从新上传的内容或会话保留的本地副本提取。无法提取时返回 None"""
+    keyframe_set = keyframe_extractor.get_cached(file_hash)
+    if keyframe_set or not file_hash or not keyframe_extractor.available:
+        return keyframe_set
+    async with local_video_input(session, video_content, video_filename, spool_path) as input_path:
+        if not input_path:
+            return None
+        progress.update("uploading", 10, "提取场景关键帧，只发送关键帧代替整个视频...")
+        keyframe_set = await keyframe_extractor.get_or_extract(file_hash, input_path)
+    if keyframe_set:
+        print(f"PERF: keyframe extraction took {keyframe_set.extract_seconds:.2f} seconds, {len(keyframe_set.frames)} frames, {keyframe_set.total_bytes} bytes.")
+    return keyframe_set
+
+async def resolve_shot_index(progress: ProcessProgress, session: Optional[VideoSession], video_content: Optional[bytes], video_filename: Optional[str], file_hash: Optional[str], spool_path: Optional[str] = None, media_info: Optional[Dict] = None, build: bool = False) -> Optional[ShotIndex]:
+    """镜头边界索引：已有时直接返回；build 时在本地运行场景检测（每个视频内容只运行一次）。无法生成时返回 None"""
+    if not shot_indexer or not file_hash:
+        return None
+    shot_index = shot_indexer.get(file_hash)
+    if shot_index or not build or not shot_indexer.available or (media_info and not media_info.get("video")):
+        return shot_index
+    async with local_video_input(session, video_content, video_filename, spool_path) as input_path:
+        if not input_path:
+            return None
+        progress.update("initializing", 5, "检测镜头切换点...")
+        shot_index = await shot_indexer.get_or_build(file_hash, input_path, (media_info or {}).get("duration"))
+    if shot_index and not shot_index.cached:
+        print(f"PERF: shot boundary detection took {shot_index.build_seconds:.2f} seconds, {len(shot_index.boundaries)} cuts.")
+    return shot_index
+
+def build_keyframe_parts(keyframe_set: KeyframeSet) -> List[types.Part]:
+    """每个关键帧前面加一行时间戳"""
+    parts = []
+    for frame in keyframe_set.frames:
+        parts.append(types.Part(text=format_keyframe_label(frame.timestamp)))
+        parts.append(types.Part.from_bytes(data=read_file_bytes(frame.path), mime_type=FRAME_MIME_TYPE))
+    return parts
+
+def exceeds_budget(estimate: CostEstimate) -> bool:
+    if TASK_MAX_INPUT_TOKENS and estimate.input_tokens > TASK_MAX_INPUT_TOKENS:
+        return True
+    return bool(TASK_MAX_COST_USD and estimate.cost_usd is not None and estimate.cost_usd > TASK_MAX_COST_USD)
+
+async def preflight_estimate(progress: ProcessProgress, route_decision: RouteDecision, video_seconds: Optional[float], size_bytes: Optional[int], prompt_chars: int, count_contents: Optional[list] = None, sampling: Optional[VideoSampling] = None) -> Optional[CostEstimate]:
+    """调用生成接口前预估输入tokens、耗时和费用并检查单任务预算。
+    超出预算时先尝试降低视频采样分辨率，仍超出则更新进度为 error 并返回 None"""
+    sampling = sampling or VideoSampling()
+    has_video = video_seconds is not None or bool(size_bytes)
+    # 只发送片段时按片段时长估算
+    sampled_seconds = sampling.effective_duration(video_seconds)
+    heuristic_tokens = estimate_request_tokens(
+        sampled_seconds, size_bytes=size_bytes, prompt_chars=prompt_chars, tokens_per_second=sampling.tokens_per_second(sampled_seconds)
     )
-)
+    source = "duration" if video_seconds is not None else ("size" if size_bytes else "prompt")
+    estimate = cost_estimator.estimate(
+        route_decision.model, route_decision.route, heuristic_tokens, sampled_seconds, source, sampling.media_resolution
+    )
+    
+    # 预估接近预算时用 count_tokens 精确计算（多一次往返，所以只在必要时调用）
+    if count_contents and PREFLIGHT_COUNT_TOKENS and TASK_MAX_INPUT_TOKENS and estimate.input_tokens >= TASK_MAX_INPUT_TOKENS * PREFLIGHT_COUNT_TOKENS_RATIO:
+        try:
+            counted = await call_gemini(
+                progress, "count_tokens", client.models.count_tokens,
+                model=f'models/{route_decision.model}',
+                contents=count_contents
+            )
+            if counted.total_tokens:
+                # count_tokens 不包含系统指令和工具声明
+                estimate = cost_estimator.estimate(
+                    route_decision.model, route_decision.route, counted.total_tokens + prompt_chars, sampled_seconds, "count_tokens",
+                    sampling.media_resolution
+                )
+        except Exception as e:
+            print(f"[Preflight] count_tokens 失败，使用估算值: {str(e)}")
+    
+    if exceeds_budget(estimate) and has_video and TASK_BUDGET_ACTION == "downsample" and sampling.media_resolution != "low" and not sampling.audio_only:
+        low_sampling = VideoSampling(sampling.start_offset, sampling.end_offset, sampling.fps, "low", keyframes=sampling.keyframes, keyframe_audio=sampling.keyframe_audio)
+        low_tokens = estimate_request_tokens(
+            sampled_seconds, size_bytes=size_bytes, prompt_chars=prompt_chars, tokens_per_second=low_sampling.tokens_per_second(sampled_seconds)
+        )
+        if estimate.source == "count_tokens":
+            # 按估算的比例缩放精确值
+            low_tokens = int(estimate.input_tokens * low_tokens / heuristic_tokens)
+        low_estimate = cost_estimator.estimate(
+            route_decision.model, route_decision.route, low_tokens, sampled_seconds, estimate.source, "low"
+        )
+        if not exceeds_budget(low_estimate):
+            print(f"[Preflight] 预估 {estimate.input_tokens} tokens 超出预算，降低视频采样分辨率后约 {low_estimate.input_tokens} tokens")
+            estimate = low_estimate
+    
+    progress.cost_estimate = estimate.to_dict()
+    if exceeds_budget(estimate):
+        cost_text = f"，约 ${estimate.cost_usd:.3f}" if estimate.cost_usd is not None else ""
+        progress.update("error", 0, f"预计消耗约 {estimate.input_tokens} 输入tokens{cost_text}，超出单任务预算，请缩短视频后重试")
+        return None
+    progress.estimated_tokens = estimate.input_tokens
+    print(f"[Preflight] {route_decision.model}: 预计输入 {estimate.input_tokens} / 输出 {estimate.output_tokens} tokens, 耗时约 {estimate.latency_seconds:.0f}s ({estimate.source})")
+    return estimate
 
-async def process_video_task_with_content(task_id: str, prompt: str, video_content: Optional[bytes], video_mime_type: Optional[str], video_filename: Optional[str]):
-    """异步处理视频的后台任务，接受已读取的文件内容"""
-    progress = progress_store[task_id]
+def autofix_subtitles(content: Optional[str], filename: Optional[str] = None) -> tuple:
+    """修复SRT格式问题，返回 (修复后的内容, 修复报告)；VTT或无法解析的内容原样返回"""
+    if not (SUBTITLE_AUTOFIX_ENABLED and content):
+        return content, None
+    if (filename or "").lower().endswith(".vtt") or content.lstrip().startswith("WEBVTT"):
+        return content, None
+    fixed, report = fix_srt(content)
+    if not report.output_cues:
+        return content, None
+    if report.changed:
+        print(f"[Subtitles] 修复字幕格式 ({report.input_cues} -> {report.output_cues} 条): {report.fixes}")
+    return fixed, report.to_dict()
+
+def validate_command_arguments(arguments: Dict, input_filename: str) -> CommandValidation:
+    subtitles_filename = arguments.get("subtitles_filename") if arguments.get("subtitles_content") else None
+    return ffmpeg_validator.validate(
+        arguments.get("command_array"), arguments.get("output_filename"),
+        [input_filename, FFMPEG_WASM_INPUT_FILENAME], subtitles_filename
+    )
+
+async def repair_ffmpeg_command(progress: ProcessProgress, prompt: str, input_filename: str, media_info: Optional[Dict], arguments: Dict, validation: CommandValidation) -> Optional[Dict]:
+    """把校验错误交给轻量模型重新生成命令（纯文本请求），返回新的工具调用参数；失败时返回 None"""
+    repair_route = RouteDecision(ROUTE_TRANSFORM, model_router.configured_model(ROUTE_TRANSFORM), "ffmpeg command repair")
+    request_text = build_command_repair_request_text(
+        prompt, input_filename, validation.command_array, validation.output_filename, validation.errors,
+        format_media_info(media_info) if media_info else None, arguments.get("subtitles_filename") if arguments.get("subtitles_content") else None
+    )
+    estimated_tokens = estimate_request_tokens(None, prompt_chars=len(COMMAND_REPAIR_SYSTEM_INSTRUCTION) + len(request_text))
+    repair_start_time = time.time()
+    try:
+        response = await call_gemini(
+            progress,
+            "generate",
+            client.models.generate_content,
+            estimated_tokens=estimated_tokens,
+            limit_key=generate_limit_key(repair_route.model),
+            model=f'models/{repair_route.model}',
+            contents=[types.Content(parts=[types.Part(text=request_text)])],
+            config=build_command_repair_config(GENERATION_TEMPERATURE)
+        )
+    except Exception as e:
+        print(f"[Validator] FFmpeg命令修复请求失败: {str(e)}")
+        model_router.record(repair_route, 0, 0, 0, success=False)
+        return None
+    usage = response.usage_metadata
+    input_tokens = (usage.prompt_token_count if usage else None) or estimated_tokens
+    output_tokens = (usage.candidates_token_count or 0) if usage else 0
+    model_router.record(repair_route, time.time() - repair_start_time, input_tokens, output_tokens)
+    print(f"PERF: ffmpeg command repair ({repair_route.model}) took {time.time() - repair_start_time:.2f} seconds, input {input_tokens} / output {output_tokens} tokens")
+    for function_call in response.function_calls or []:
+        if function_call.name == execute_ffmpeg_with_optional_subtitles_declaration.name:
+            repaired = dict(function_call.args or {})
+            # 修复请求只改命令，字幕内容沿用原结果
+            repaired["subtitles_content"] = arguments.get("subtitles_content", "")
+            repaired["subtitles_filename"] = arguments.get("subtitles_filename", "")
+            return repaired
+    return None
+
+async def validate_ffmpeg_tool_call(progress: ProcessProgress, result: Dict, prompt: str, input_filename: str, media_info: Optional[Dict]) -> Dict:
+    """校验工具调用中的 command_array：常见错误直接修正，仍无效时发起一次修复请求；
+    修复失败时返回修正后的命令并附带错误列表，由前端决定是否执行"""
+    if not ffmpeg_validator or "tool_call" not in result:
+        return result
+    arguments = result["tool_call"]["arguments"]
+    validation = validate_command_arguments(arguments, input_filename)
+    if validation.errors:
+        print(f"[Validator] FFmpeg命令校验失败: {validation.errors}")
+    if validation.errors and FFMPEG_REPAIR_ENABLED:
+        progress.update("ai_generating", 92, "修复FFmpeg命令...")
+        repaired = await repair_ffmpeg_command(progress, prompt, input_filename, media_info, arguments, validation)
+        repaired_validation = validate_command_arguments(repaired, input_filename) if repaired else None
+        ffmpeg_validator.record_repair(bool(repaired_validation and repaired_validation.valid))
+        if repaired_validation and repaired_validation.valid:
+            print(f"[Validator] FFmpeg命令已修复: {repaired_validation.command_array}")
+            arguments = repaired
+            validation = repaired_validation
+            validation.fixes.insert(0, "repair: 重新生成命令")
+    elif validation.fixes:
+        print(f"[Validator] 修正FFmpeg命令: {validation.fixes}")
+    result["tool_call"]["arguments"] = {
+        **arguments,
+        "command_array": validation.command_array,
+        "output_filename": validation.output_filename,
+    }
+    if validation.fixes or validation.errors or validation.warnings:
+        result["command_validation"] = validation.to_dict()
+    return result
+
+def record_generation_usage(progress: ProcessProgress, route_decision: RouteDecision, request_estimate: Optional[CostEstimate], latency_seconds: float, input_tokens: int, output_tokens: int, has_usage: bool):
+    """按路由记录实际延迟、tokens 和费用，有真实用量时校准预估"""
+    request_cost = model_router.record(route_decision, latency_seconds, input_tokens, output_tokens)
+    if has_usage and request_estimate:
+        cost_estimator.record_actual(request_estimate, input_tokens, output_tokens, latency_seconds)
+    progress.actual_usage = {
+        "input_tokens": input_tokens,
+        "output_tokens": output_tokens,
+        "latency_seconds": round(latency_seconds, 1),
+        "cost_usd": round(request_cost, 6) if request_cost is not None else None,
+    }
+    print(f"PERF: route {route_decision.route} ({route_decision.model}) input {input_tokens} / output {output_tokens} tokens, cost ${request_cost or 0:.5f}")
+
+def plan_subtitle_segments(intent_name: str, duration: Optional[float], sampling: VideoSampling, shot_index: Optional[ShotIndex] = None) -> Optional[list]:
+    """长视频的字幕请求返回分段计划，否则返回 None；有镜头索引时切分点对齐到附近的镜头边界"""
+    if not (SUBTITLE_SEGMENT_ENABLED and intent_name == INTENT_SUBTITLE):
+        return None
+    return subtitle_segment_plan(
+        duration, sampling, SUBTITLE_SEGMENT_MIN_SECONDS, SUBTITLE_SEGMENT_SECONDS, SUBTITLE_SEGMENT_OVERLAP_SECONDS,
+        snap_points=shot_index.boundary_times if shot_index else None, snap_window=SUBTITLE_SEGMENT_SNAP_SECONDS
+    )
+
+def subtitle_segment_sampling(sampling: VideoSampling) -> VideoSampling:
+    """分段请求的采样设置：请求参数优先，否则使用低帧率、低分辨率"""
+    return segment_sampling(sampling, SUBTITLE_SEGMENT_FPS, SUBTITLE_SEGMENT_MEDIA_RESOLUTION)
+
+def subtitle_call_arguments(response: types.GenerateContentResponse) -> Dict:
+    """取出 generate_subtitle_file 的参数；模型直接返回文本时把文本当作 SRT"""
+    for function_call in response.function_calls or []:
+        if function_call.name == generate_subtitle_file_declaration.name:
+            return dict(function_call.args or {})
+    candidate = response.candidates[0] if response.candidates else None
+    parts = candidate.content.parts if candidate and candidate.content and candidate.content.parts else []
+    return {"subtitles_content": "".join(part.text for part in parts if part.text)}
+
+async def generate_subtitle_segments(progress: ProcessProgress, route_decision: RouteDecision, file_object: types.File, segments: list, prompt: str, input_filename: str, sampling: VideoSampling) -> tuple:
+    """长视频字幕分段并发生成（受限流器约束），合并后返回 (结果, 输入tokens, 输出tokens, 是否有真实用量)。
+    任一片段失败时取消其余片段并抛出异常"""
+    semaphore = asyncio.Semaphore(SUBTITLE_SEGMENT_CONCURRENCY)
+    config = build_subtitle_segment_config(GENERATION_TEMPERATURE, sampling.media_resolution, SRT_FORMAT_IN_PROMPT)
+    completed = 0
+    segment_cues: List[Optional[List[SrtCue]]] = [None] * len(segments)
     
+    def publish_ready_cues():
+        """前面连续几段都完成后，发布这部分合并后的字幕（到下一段重叠区域的中点为止）"""
+        ready = 0
+        while ready < len(segments) and segment_cues[ready] is not None:
+            ready += 1
+        if not ready:
+            return
+        merged = merge_segment_cues(segments[:ready], segment_cues[:ready])
+        if ready < len(segments):
+            boundary = (segments[ready - 1][1] + segments[ready][0]) / 2
+            merged = [cue for cue in merged if cue.start < boundary]
+        progress.add_subtitle_cues(merged[len(progress.subtitle_cues):])
+    
+    async def run_segment(index: int, start: float, end: float):
+        nonlocal completed
+        segment_sampling = VideoSampling(start, end, sampling.fps, sampling.media_resolution, sampling.source)
+        request_text = build_subtitle_segment_request_text(prompt, input_filename, start, end, index + 1, len(segments))
+        video_part = types.Part(
+            file_data={'file_uri': file_object.uri, 'mime_type': file_object.mime_type},
+            video_metadata=segment_sampling.video_metadata()
+        )
+        estimated_tokens = estimate_request_tokens(
+            end - start, prompt_chars=len(VIDEO_INSTRUCTION) + len(request_text), tokens_per_second=segment_sampling.tokens_per_second()
+        )
+        async with semaphore:
+            segment_start_time = time.time()
+            response = await call_gemini(
+                progress,
+                "generate",
+                client.models.generate_content,
+                estimated_tokens=estimated_tokens,
+                limit_key=generate_limit_key(route_decision.model),
+                model=f'models/{route_decision.model}',
+                contents=[types.Content(parts=[types.Part(text=request_text), video_part])],
+                config=config
+            )
+        arguments = subtitle_call_arguments(response)
+        cues = [cue.shifted(start) for cue in parse_srt(arguments.get("subtitles_content", ""))]
+        segment_cues[index] = cues
+        publish_ready_cues()
+        completed += 1
+        print(f"PERF: subtitle segment {index + 1}/{len(segments)} ({start:.0f}s-{end:.0f}s) took {time.time() - segment_start_time:.2f} seconds, {len(cues)} cues")
+        progress.update("streaming", 75 + 15 * completed // len(segments), f"分段生成字幕 ({completed}/{len(segments)})...")
+        return cues, arguments, response.usage_metadata
+    
+    tasks = [asyncio.create_task(run_segment(index, start, end)) for index, (start, end) in enumerate(segments)]
     try:
-        progress.update("initializing", 2, "初始化处理流程...")
-        print(f"Received prompt for video processing: {prompt}, and video: {video_filename if video_filename else 'No new video file provided (will attempt to use previous)'}")
-        
-        file_object_for_gemini: Optional[types.File] = None
-        original_video_filename_for_prompt: str = "input.mp4" # Default
-        temp_file_path = None # Initialize for cleanup
+        results = await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+    
+    merged = merge_segment_cues(segments, [cues for cues, _, _ in results])
+    first_arguments = next((arguments for _, arguments, _ in results if arguments.get("subtitles_filename")), {})
+    subtitles_content, subtitle_fixes = autofix_subtitles(format_srt(merged))
+    # 边生成边发布的是修复前的字幕，这里换成最终结果
+    progress.replace_subtitle_cues(parse_srt(subtitles_content))
+    usages = [usage for _, _, usage in results if usage]
+    input_tokens = sum(usage.prompt_token_count or 0 for usage in usages)
+    output_tokens = sum((usage.candidates_token_count or 0) + (usage.thoughts_token_count or 0) for usage in usages)
+    result = {
+        "subtitle_generation": {
+            "name": generate_subtitle_file_declaration.name,
+            "arguments": {
+                "subtitles_content": subtitles_content,
+                "subtitles_filename": first_arguments.get("subtitles_filename") or "subtitles.srt",
+                "description": f"{first_arguments.get('description') or '字幕'}（分 {len(segments)} 段生成）"
+            }
+        }
+    }
+    if subtitle_fixes:
+        result["subtitle_fixes"] = subtitle_fixes
+    return result, input_tokens, output_tokens, len(usages) == len(results)
+
+async def resolve_gemini_file(progress: ProcessProgress, session: Optional[VideoSession], video_content: Optional[bytes], video_mime_type: Optional[str], video_filename: Optional[str], file_hash: Optional[str], spool_path: Optional[str] = None, resume_file_name: Optional[str] = None, media_info: Optional[Dict] = None, media_kind: str = PROXY_VIDEO) -> Optional[types.File]:
+    """确定本次请求使用的Gemini文件：恢复的文件 > 相同内容的已上传文件 > 新上传 > 会话中的文件。
+    新上传时如果启用了分析代理，上传转码后的代理文件；media_kind 为 audio 时上传提取的音轨，
+    提取失败时回退到视频。失败时已更新进度为 error，返回 None"""
+    file_object_for_gemini: Optional[types.File] = None
+    temp_file_path = None # Initialize for cleanup
+    
+    # 从任务日志恢复：如果之前上传的文件仍为ACTIVE，直接跳过上传阶段
+    if resume_file_name:
+        try:
+            retrieved_file = await call_gemini(progress, "files_get", client.files.get, name=resume_file_name)
+        except Exception as e:
+            print(f"[Journal] 恢复文件 {resume_file_name} 查询失败: {str(e)}")
+            retrieved_file = None
+        if retrieved_file and retrieved_file.state and retrieved_file.state.name == "ACTIVE":
+            progress.update("google_processing", 50, "已恢复之前上传的文件，跳过上传")
+            file_object_for_gemini = retrieved_file
 
-        if video_content and video_filename: # New video file is provided
-            # 计算文件哈希以检查是否是同一个文件
-            new_file_hash = calculate_file_hash(video_content)
+    if file_object_for_gemini:
+        pass
+    elif video_content and video_filename: # New video file is provided
+        # 相同内容（无论来自哪个会话）复用已上传的Gemini文件
+        new_file_hash = file_hash
+        file_key = gemini_file_key(new_file_hash, media_kind)
+        cached_file = video_sessions.find_file(file_key)
+        
+        if cached_file:
+            progress.update("google_processing", 20, f"检测到相同视频文件，使用缓存: {video_filename}")
+            print(f"Same video file detected (hash: {new_file_hash[:8]}...), using cached version: {cached_file.google_file_name}")
             
-            # 检查是否是同一个文件
-            if (current_video_state.file_hash == new_file_hash and 
-                current_video_state.google_file_name and 
-                current_video_state.original_file_name == video_filename):
-                
-                progress.update("google_processing", 20, f"检测到相同视频文件，使用缓存: {video_filename}")
-                print(f"Same video file detected (hash: {new_file_hash[:8]}...), using cached version: {current_video_state.google_file_name}")
-                
-                # 验证缓存的文件是否仍然有效
-                retrieved_file = await asyncio.to_thread(client.files.get, name=current_video_state.google_file_name)
-                if retrieved_file and retrieved_file.state and retrieved_file.state.name == "ACTIVE":
-                    progress.update("google_processing", 50, "缓存文件验证通过")
-                    file_object_for_gemini = retrieved_file
-                    original_video_filename_for_prompt = current_video_state.original_file_name
-                else:
-                    progress.update("uploading", 5, "缓存文件无效，重新上传")
-                    print(f"Cached file is invalid, re-uploading: {current_video_state.google_file_name}")
-                    # 清除无效缓存
-                    current_video_state.google_file_name = None
-                    current_video_state.file_hash = None
-                    # 继续执行上传逻辑
+            # 验证缓存的文件是否仍然有效
+            retrieved_file = await call_gemini(progress, "files_get", client.files.get, name=cached_file.google_file_name)
+            if retrieved_file and retrieved_file.state and retrieved_file.state.name == "ACTIVE":
+                progress.update("google_processing", 50, "缓存文件验证通过")
+                file_object_for_gemini = retrieved_file
+            else:
+                progress.update("uploading", 5, "缓存文件无效，重新上传")
+                print(f"Cached file is invalid, re-uploading: {cached_file.google_file_name}")
+                # 清除无效缓存，继续执行上传逻辑
+                video_sessions.invalidate_file(file_key)
+                await invalidate_context_cache(file_key)
+        else:
+            progress.update("uploading", 5, f"开始处理新视频文件: {video_filename}")
+            print(f"Processing new video file: {video_filename} (hash: {new_file_hash[:8]}...)")
+        
+        # 如果没有有效的缓存文件，则上传新文件
+        if not file_object_for_gemini:
+            if spool_path and os.path.exists(spool_path):
+                # 任务日志已将上传内容落盘，直接复用，无需再写临时文件
+                upload_source_path = spool_path
             else:
-                progress.update("uploading", 5, f"开始处理新视频文件: {video_filename}")
-                print(f"Processing new video file: {video_filename} (hash: {new_file_hash[:8]}...)")
-            
-            # 如果没有有效的缓存文件，则上传新文件
-            if not file_object_for_gemini:
                 progress.update("uploading", 10, "保存临时文件...")
                 # Create temp file
                 file_suffix = os.path.splitext(video_filename)[1]
                 with tempfile.NamedTemporaryFile(delete=False, suffix=file_suffix) as tmp:
                     tmp.write(video_content)
                     temp_file_path = tmp.name
-                
+                upload_source_path = temp_file_path
                 print(f"Video content (size: {len(video_content)}) saved to temp file: {temp_file_path}")
-                
-                progress.update("google_processing", 15, f"上传到Google服务器: {video_filename}")
-                print(f"Uploading temporary video file to Google: {video_filename}, mime_type: {video_mime_type}")
+            
+            upload_mime_type = video_mime_type
+            is_proxy = False
+            proxy = None
+            if media_kind == PROXY_AUDIO and upload_proxy and upload_proxy.can_extract_audio(media_info):
+                # 字幕请求只需要语音：上传提取的音轨
+                progress.update("uploading", 12, "提取音轨，字幕生成只上传音频...")
+                proxy = await upload_proxy.get_or_create(new_file_hash, upload_source_path, len(video_content), PROXY_AUDIO)
+                if not proxy:
+                    print(f"[Proxy] 音轨提取失败，回退到上传视频: {video_filename}")
+                    file_key = gemini_file_key(new_file_hash, PROXY_VIDEO)
+            elif media_kind == PROXY_AUDIO:
+                file_key = gemini_file_key(new_file_hash, PROXY_VIDEO)
+            if not proxy and upload_proxy and upload_proxy.should_transcode(len(video_content), media_info):
+                # 上传低码率分析代理而不是原视频
+                progress.update("uploading", 12, "生成低码率分析代理，减少上传数据量...")
+                proxy = await upload_proxy.get_or_create(new_file_hash, upload_source_path, len(video_content))
+            if proxy:
+                print(f"PERF: upload {proxy.kind} proxy {'cache hit' if proxy.cached else f'transcode took {proxy.transcode_seconds:.2f} seconds'}, {proxy.original_bytes} -> {proxy.proxy_bytes} bytes ({proxy.ratio:.1f}x)")
+                progress.upload_proxy = proxy.to_dict()
+                upload_source_path = proxy.path
+                upload_mime_type = proxy.mime_type
+                is_proxy = True
+            
+            progress.update("google_processing", 15, f"上传到Google服务器: {video_filename}")
+            print(f"Uploading {'proxy' if is_proxy else 'temporary'} video file to Google: {video_filename}, mime_type: {upload_mime_type}")
 
-                upload_config = types.UploadFileConfig(
-                    mime_type=video_mime_type,
-                    display_name=video_filename
-                )
-                upload_start_time = time.time()
-                
-                uploaded_file_obj = await asyncio.to_thread(
-                    client.files.upload,
-                    file=temp_file_path,
-                    config=upload_config
-                )
-                
-                upload_duration = time.time() - upload_start_time
-                print(f"PERF: client.files.upload took {upload_duration:.2f} seconds.")
-                print(f"Initial file upload response. Name: {uploaded_file_obj.name}, Display Name: {uploaded_file_obj.display_name}, URI: {uploaded_file_obj.uri}, State: {uploaded_file_obj.state.name if uploaded_file_obj.state else 'UNKNOWN'}")
-                
-                progress.update("google_processing", 30, "等待Google处理文件...")
-                # Wait for file to be processed
-                processing_wait_start_time = time.time()
-                wait_cycles = 0
-                while uploaded_file_obj.state and uploaded_file_obj.state.name == "PROCESSING":
-                    wait_cycles += 1
-                    # 动态更新进度和消息，让用户知道仍在处理
-                    progress_percent = min(30 + wait_cycles * 2, 45)  # 从30%逐渐增加到45%
-                    progress.update("google_processing", progress_percent, f"Google正在处理文件... ({wait_cycles}s)")
-                    
-                    print(f"File {uploaded_file_obj.name} is still PROCESSING. Waiting 1 seconds... (cycle {wait_cycles})")
-                    await asyncio.sleep(1)
-                    
-                    retrieved_file = await asyncio.to_thread(client.files.get, name=uploaded_file_obj.name)
-                    if retrieved_file and retrieved_file.state:
-                        uploaded_file_obj = retrieved_file
-                        print(f"Updated file state: {uploaded_file_obj.name} is now {uploaded_file_obj.state.name}")
-                    else:
-                        print(f"Warning: client.files.get for {uploaded_file_obj.name} returned invalid data or state. Retrying...")
-                
-                processing_wait_duration = time.time() - processing_wait_start_time
-                print(f"PERF: File state change from PROCESSING to ACTIVE took {processing_wait_duration:.2f} seconds.")
-                
-                if not (uploaded_file_obj.state and uploaded_file_obj.state.name == "ACTIVE"):
-                    progress.update("error", 0, f"上传的文件 {uploaded_file_obj.name} 未能变为可用状态")
-                    return
-                
-                progress.update("google_processing", 50, "文件已准备就绪")
-                print(f"File {uploaded_file_obj.name} is ACTIVE.")
-                current_video_state.google_file_name = uploaded_file_obj.name
-                current_video_state.original_file_name = video_filename
-                current_video_state.mime_type = video_mime_type
-                current_video_state.file_hash = new_file_hash  # 保存文件哈希
-                file_object_for_gemini = uploaded_file_obj
-                original_video_filename_for_prompt = video_filename
-
-                # Clean up temp file
-                if temp_file_path and os.path.exists(temp_file_path):
-                    os.remove(temp_file_path)
-                    print(f"Temporary file {temp_file_path} deleted.")
-                        
-        elif current_video_state.google_file_name:
-            progress.update("google_processing", 20, f"使用已上传的视频: {current_video_state.original_file_name}")
-            print(f"No new video file. Using last uploaded: {current_video_state.google_file_name} (Original: {current_video_state.original_file_name})")
-            original_video_filename_for_prompt = current_video_state.original_file_name or "input.mp4"
+            upload_config = types.UploadFileConfig(
+                mime_type=upload_mime_type,
+                display_name=video_filename
+            )
+            upload_start_time = time.time()
             
-            retrieved_file = await asyncio.to_thread(client.files.get, name=current_video_state.google_file_name)
-            wait_cycles = 0
-            while retrieved_file.state and retrieved_file.state.name == "PROCESSING":
-                wait_cycles += 1
-                # 动态更新进度，让用户知道正在验证文件状态
-                progress_percent = min(20 + wait_cycles, 40)
-                progress.update("google_processing", progress_percent, f"验证已缓存文件状态... ({wait_cycles}s)")
-                
-                print(f"File {retrieved_file.name} is PROCESSING. Waiting 1 seconds... (cycle {wait_cycles})")
-                await asyncio.sleep(1)
-                retrieved_file = await asyncio.to_thread(client.files.get, name=current_video_state.google_file_name)
+            uploaded_file_obj = await call_gemini(
+                progress,
+                "upload",
+                client.files.upload,
+                file=upload_source_path,
+                config=upload_config
+            )
+            
+            upload_duration = time.time() - upload_start_time
+            print(f"PERF: client.files.upload took {upload_duration:.2f} seconds.")
+            print(f"Initial file upload response. Name: {uploaded_file_obj.name}, Display Name: {uploaded_file_obj.display_name}, URI: {uploaded_file_obj.uri}, State: {uploaded_file_obj.state.name if uploaded_file_obj.state else 'UNKNOWN'}")
             
-            if not (retrieved_file.state and retrieved_file.state.name == "ACTIVE"):
-                progress.update("error", 0, f"之前上传的文件 {current_video_state.google_file_name} 不可用，请重新上传")
+            progress.update("google_processing", 30, "等待Google处理文件...")
+            # Wait for file to be processed
+            processing_wait_start_time = time.time()
+            uploaded_file_obj = await wait_until_file_active(progress, uploaded_file_obj, 30, 45, "Google正在处理文件...")
+            processing_wait_duration = time.time() - processing_wait_start_time
+            print(f"PERF: File state change from PROCESSING to ACTIVE took {processing_wait_duration:.2f} seconds.")
+            
+            if not (uploaded_file_obj.state and uploaded_file_obj.state.name == "ACTIVE"):
+                progress.update("error", 0, f"上传的文件 {uploaded_file_obj.name} 未能变为可用状态")
                 return
             
-            progress.update("google_processing", 50, "已确认文件可用状态")
-            print(f"Successfully retrieved and confirmed ACTIVE status for {current_video_state.google_file_name}")
-            file_object_for_gemini = retrieved_file
-        else:
-            progress.update("error", 0, "未提供视频文件且未找到之前上传的视频")
-            return
+            progress.update("google_processing", 50, "文件已准备就绪")
+            print(f"File {uploaded_file_obj.name} is ACTIVE.")
+            video_sessions.register_file(file_key, uploaded_file_obj.name, upload_mime_type, is_proxy=is_proxy)
+            file_object_for_gemini = uploaded_file_obj
 
-        # 验证 file_object_for_gemini 是否被正确设置
-        if not file_object_for_gemini:
-            progress.update("error", 0, "内部错误：文件对象未能正确设置")
-            print("ERROR: file_object_for_gemini is None - this should not happen")
-            return
+            # Clean up temp file
+            if temp_file_path and os.path.exists(temp_file_path):
+                os.remove(temp_file_path)
+                print(f"Temporary file {temp_file_path} deleted.")
+                    
+    elif session and (video_sessions.find_file(gemini_file_key(session.file_hash, media_kind)) or video_sessions.find_file(session.file_hash)):
+        file_key = gemini_file_key(session.file_hash, media_kind)
+        if not video_sessions.find_file(file_key):
+            file_key = session.file_hash
+        cached_file = video_sessions.find_file(file_key)
+        progress.update("google_processing", 20, f"使用会话中已上传的视频: {session.original_file_name}")
+        print(f"No new video file. Using session {session.session_id}: {cached_file.google_file_name} (Original: {session.original_file_name})")
+        
+        retrieved_file = await call_gemini(progress, "files_get", client.files.get, name=cached_file.google_file_name)
+        # 动态更新进度，让用户知道正在验证文件状态
+        retrieved_file = await wait_until_file_active(progress, retrieved_file, 20, 40, "验证已缓存文件状态...")
+        
+        if not (retrieved_file.state and retrieved_file.state.name == "ACTIVE"):
+            video_sessions.invalidate_file(file_key)
+            await invalidate_context_cache(file_key)
+            progress.update("error", 0, f"之前上传的文件 {cached_file.google_file_name} 不可用，请重新上传")
+            return None
+        
+        progress.update("google_processing", 50, "已确认文件可用状态")
+        print(f"Successfully retrieved and confirmed ACTIVE status for {cached_file.google_file_name}")
+        file_object_for_gemini = retrieved_file
+    else:
+        progress.update("error", 0, "未提供视频文件，且该视频会话中没有可用的视频，请重新上传")
+        return None
 
-        # --- At this point, file_object_for_gemini and original_video_filename_for_prompt are set ---
-        progress.update("ai_generating", 60, "准备AI分析和指令生成...")
-
-        # --- Construct the prompt for Gemini ---
-        tool_config_video = types.Tool(function_declarations=[
-            generate_subtitle_file_declaration,
-            execute_ffmpeg_with_optional_subtitles_declaration
-        ])
-        user_natural_language_prompt = prompt
-        fixed_ffmpeg_input_filename = original_video_filename_for_prompt
-
-        prompt_for_gemini = (
-            f"User request: '{user_natural_language_prompt}' (Video file: '{fixed_ffmpeg_input_filename}')\n\n"
-            f"Response types:\n"
-            f"• Content analysis (understand/analyze video) → Text response in Chinese only\n"
-            f"• Subtitle generation (generate subtitles/srt) → Use generate_subtitle_file tool\n"
-            f"• Video processing (edit/convert video) → Use execute_ffmpeg_with_optional_subtitles tool\n\n"
-            f"Tool usage:\n"
-            f"• For video processing: Input file is '{fixed_ffmpeg_input_filename}'\n"
-            f"• For subtitle burning: Use `subtitles=<filename>:fontsdir=/customfonts:force_style='Fontname=Source Han Sans SC'`\n\n"
-            f"**SRT Format Requirements**:\n"
-            f"```\n"
-            f"1\n"
-            f"00:00:01,500 --> 00:00:04,200\n"
-            f"首先打开软件，然后选择设置\n"
-            f"\n"
-            f"2\n"
-            f"00:00:05,000 --> 00:00:07,800\n"
-            f"这里有三个选项：音频、视频、字幕\n"
-            f"\n"
-            f"3\n"
-            f"00:00:08,000 --> 00:00:10,500\n"
-            f"我们有Flux Guidance，默认2.5\n"
-            f"\n"
-            f"4\n"
-            f"00:00:11,000 --> 00:00:13,500\n"
-            f"Conditioning ZeroOut用于消除负面提示\n"
-            f"\n"
-            f"```\n\n"
-            f"**Key Rules**:\n"
-            f"• Time format: HH:MM:SS,mmm --> HH:MM:SS,mmm (comma not period)\n"
-            f"• Text: 8-20 Chinese characters max per line, ONE LINE ONLY per subtitle\n"
-            f"• NO multi-line text in single subtitle - split into separate subtitles\n"
-            f"• Punctuation: Use , : ; within sentence, NO . ? ! at end\n"
-            f"• Empty line after each subtitle block\n"
-            f"• Sequential numbering: 1, 2, 3...\n\n"
-            f"Examples:\n"
-            f"✅ 然后我有这个节点，它是进入的 (single line)\n"
-            f"❌ 然后我有这个叫做 Reference Latent 的节点它是进入 Conditioning (too long)\n"
-            f"❌ 今天天气很好。(period at end)\n"
-            f"❌ Multi-line text like:\n"
-            f"   这个工作流没什么难的\n"
-            f"   我们有Flux Guidance (WRONG - must split into separate subtitles)\n\n"
-            f"IMPORTANT: For content analysis, always respond in Chinese. Respond based on request type."
-        )
+    # 验证 file_object_for_gemini 是否被正确设置
+    if not file_object_for_gemini:
+        progress.update("error", 0, "内部错误：文件对象未能正确设置")
+        print("ERROR: file_object_for_gemini is None - this should not happen")
+        return None
+    return file_object_for_gemini
 
-        # Explicitly create a Part for the video file, referencing it by URI and MIME type
-        video_file_part = types.Part(
-            file_data={
-                'file_uri': file_object_for_gemini.uri,
-                'mime_type': file_object_for_gemini.mime_type
+async def process_video_task_with_content(task_id: str, prompt: str, video_content: Optional[bytes], video_mime_type: Optional[str], video_filename: Optional[str], spool_path: Optional[str] = None, resume_file_name: Optional[str] = None, video_session_id: Optional[str] = None, use_result_cache: bool = True, sampling_options: Optional[Dict] = None, execute_on_server: bool = False):
+    """异步处理视频的后台任务，接受已读取的文件内容"""
+    progress = progress_store[task_id]
+    template_match: Optional[TemplateMatch] = None
+    route_decision: Optional[RouteDecision] = None
+    execution_input: Optional[ExecutionInput] = None
+    
+    try:
+        progress.update("initializing", 2, "初始化处理流程...")
+        print(f"Received prompt for video processing: {prompt}, and video: {video_filename if video_filename else 'No new video file provided (will use video session)'}, session: {video_session_id}")
+        
+        session = video_sessions.get(video_session_id)
+        if execute_on_server:
+            execution_input = resolve_execution_input(video_content, spool_path, session)
+        original_video_filename_for_prompt: str = "input.mp4" # Default
+        resolved_file_hash: Optional[str] = None
+        
+        # 先确定视频内容哈希和提示词中的文件名，用于结果缓存查找（命中时无需上传）
+        if video_content and video_filename:
+            resolved_file_hash = calculate_file_hash(video_content)
+            original_video_filename_for_prompt = video_filename
+            if session:
+                video_sessions.attach_video(session, resolved_file_hash, video_filename, video_mime_type)
+        elif session and session.file_hash:
+            resolved_file_hash = session.file_hash
+            original_video_filename_for_prompt = session.original_file_name or "input.mp4"
+        
+        if execution_input:
+            execution_input.input_filename = original_video_filename_for_prompt
+        intent = classify_intent(prompt)
+        sampling_options = dict(sampling_options or {})
+        analysis_mode = sampling_options.pop("analysis_mode", None)
+        sampling = resolve_sampling(
+            prompt, intent.intent, intent.needs_video,
+            auto_clip=VIDEO_AUTO_CLIP,
+            transform_fps=VIDEO_TRANSFORM_FPS,
+            transform_media_resolution=VIDEO_TRANSFORM_MEDIA_RESOLUTION,
+            **sampling_options
+        )
+        if not sampling.is_default:
+            print(f"[Sampling] 任务 {task_id} 视频采样设置: {sampling.to_dict()}")
+        # ffprobe元数据：用于纯变换指令的路由、上传前的预算检查和结果缓存查找时的模型路由
+        route_without_video = INTENT_ROUTER_ENABLED and not intent.needs_video
+        media_info = await probe_video_media(session, video_content, video_filename, resolved_file_hash, spool_path, retain_local_copy=route_without_video)
+        progress.media_info = media_info
+        
+        # 结果缓存按生成结果的模型区分作用域：查找时按时长和当前排队情况路由（与上传前的预算检查相同），
+        # 保存时使用实际选中的模型
+        result_cache_config: Optional[Dict] = None
+        if result_cache and resolved_file_hash:
+            result_cache_config = {
+                "temperature": GENERATION_TEMPERATURE,
+                "tools": TOOL_NAMES,
+                # 文件名会写入FFmpeg命令，必须参与缓存键
+                "input_filename": original_video_filename_for_prompt,
+                "sampling": [sampling.start_offset, sampling.end_offset, sampling.fps, sampling.media_resolution],
+                "analysis_mode": analysis_mode
             }
+            if use_result_cache:
+                lookup_route = await model_router.choose(intent.intent, (media_info or {}).get("duration"), 0)
+                result_scope_key = make_scope_key(resolved_file_hash, lookup_route.model, result_cache_config)
+                cache_hit = lookup_cached_result(result_scope_key, make_cache_key(result_scope_key, prompt), prompt)
+                if cache_hit:
+                    cached, cache_info = cache_hit
+                    print(f"Result cache hit ({cache_info['type']}) for task {task_id} (hash: {resolved_file_hash[:8]}...)")
+                    await replay_cached_result(progress, cached, cache_info, execution_input)
+                    return
+        # 纯变换指令（转格式、裁剪、缩放等）只需要元数据，跳过上传和多模态推理
+        metadata_only = route_without_video and media_info is not None
+        if route_without_video and not media_info:
+            print(f"[IntentRouter] 无法获取视频元数据，回退到上传视频: {intent.matched}")
+        if execution_input and media_info:
+            execution_input.duration = media_info.get("duration")
+        # 依赖镜头切换时间点的指令等待本地镜头索引；已有索引时其他指令（字幕除外）也附上
+        shot_index = await resolve_shot_index(
+            progress, session, video_content, video_filename, resolved_file_hash, spool_path, media_info,
+            build=intent.needs_shot_index and intent.intent != INTENT_SUBTITLE
         )
+        shot_boundaries = None
+        if shot_index:
+            progress.shot_index = shot_index.to_dict()
+            if intent.intent != INTENT_SUBTITLE:
+                shot_boundaries = format_shot_boundaries(shot_index, SHOT_INDEX_MAX_PROMPT_BOUNDARIES)
+
+        # 常见FFmpeg操作（裁剪、转gif、静音、变速等）由本地模板直接生成命令
+        if ffmpeg_templates:
+            template_match = ffmpeg_templates.match(
+                prompt, original_video_filename_for_prompt, media_info
+            )
+        if template_match and FFMPEG_TEMPLATE_MODE == "fast_path":
+            await finish_with_template(progress, template_match, "fast_path", "已使用内置模板生成FFmpeg命令", execution_input)
+            return
+
+        # 较长视频的内容分析只发送场景关键帧（和音轨），不上传整个视频
+        keyframe_set: Optional[KeyframeSet] = None
+        if not metadata_only and use_keyframe_mode(intent.intent, sampling, media_info, analysis_mode):
+            keyframe_set = await resolve_keyframes(progress, session, video_content, video_filename, resolved_file_hash, spool_path)
+            if not keyframe_set:
+                print(f"[Keyframes] 任务 {task_id} 无法提取关键帧，回退到上传视频")
+
+        file_object_for_gemini: Optional[types.File] = None
+        cached_content_name = None
+        if metadata_only:
+            print(f"[IntentRouter] 任务 {task_id} 判定为纯变换指令 {intent.matched}，仅发送元数据")
+            progress.update("ai_generating", 60, "指令只涉及格式/时长/尺寸变换，根据视频元数据生成命令，无需上传视频")
+            request_text = build_metadata_request_text(prompt, original_video_filename_for_prompt, format_media_info(media_info), shot_boundaries)
+            request_contents = [types.Part(text=request_text)]
+            progress.estimated_tokens = estimate_request_tokens(
+                None, prompt_chars=len(METADATA_SYSTEM_INSTRUCTION) + len(request_text)
+            )
+            route_decision = await model_router.choose(intent.intent, media_info.get("duration"), progress.estimated_tokens)
+            request_estimate = await preflight_estimate(
+                progress, route_decision, None, None, len(METADATA_SYSTEM_INSTRUCTION) + len(request_text)
+            )
+            if not request_estimate:
+                return
+            generate_config = build_generate_config(GENERATION_TEMPERATURE, metadata_only=True)
+            uncached_request_contents = request_contents
+            uncached_generate_config = generate_config
+        elif keyframe_set:
+            print(f"[Keyframes] 任务 {task_id} 使用 {len(keyframe_set.frames)} 个场景关键帧代替视频 ({keyframe_set.total_bytes} 字节)")
+            progress.keyframes = keyframe_set.to_dict()
+            if session and video_content and not session.local_video_path and not video_sessions.find_file(resolved_file_hash):
+                # 视频本身没有上传，保留本地副本供后续需要看画面的指令使用
+                await asyncio.to_thread(retain_session_video, session, video_content, os.path.splitext(video_filename)[1])
+            # 附带音轨：已经上传过或可以本地提取时才上传
+            if KEYFRAME_INCLUDE_AUDIO and (not media_info or media_info.get("audio_streams")) and resolved_file_hash and (
+                    video_sessions.find_file(gemini_file_key(resolved_file_hash, PROXY_AUDIO))
+                    or (video_content and upload_proxy and upload_proxy.can_extract_audio(media_info))):
+                file_object_for_gemini = await resolve_gemini_file(
+                    progress, session, video_content, video_mime_type, video_filename, resolved_file_hash,
+                    spool_path=spool_path, media_info=media_info, media_kind=PROXY_AUDIO
+                )
+                if not file_object_for_gemini:
+                    return
+                if not (file_object_for_gemini.mime_type or "").startswith("audio/"):
+                    # 音轨提取失败时回退上传了视频，本次只发送关键帧
+                    file_object_for_gemini = None
+            progress.update("ai_generating", 60, "准备AI分析和指令生成...")
+            sampling = VideoSampling(
+                source="request" if analysis_mode else "intent",
+                keyframes=len(keyframe_set.frames),
+                keyframe_audio=file_object_for_gemini is not None
+            )
+            request_text = build_keyframe_request_text(
+                prompt, original_video_filename_for_prompt, len(keyframe_set.frames),
+                original_media=format_media_info(media_info) if media_info else None, has_audio=sampling.keyframe_audio,
+                shot_boundaries=shot_boundaries
+            )
+            request_contents = [types.Part(text=request_text), *await asyncio.to_thread(build_keyframe_parts, keyframe_set)]
+            if file_object_for_gemini:
+                request_contents.append(types.Part(file_data={
+                    'file_uri': file_object_for_gemini.uri,
+                    'mime_type': file_object_for_gemini.mime_type
+                }))
+            video_duration = (media_info or {}).get("duration") or keyframe_set.frames[-1].timestamp
+            prompt_chars = len(VIDEO_INSTRUCTION) + len(request_text)
+            progress.estimated_tokens = estimate_request_tokens(
+                video_duration, prompt_chars=prompt_chars, tokens_per_second=sampling.tokens_per_second(video_duration)
+            )
+            route_decision = await model_router.choose(intent.intent, video_duration, progress.estimated_tokens)
+            request_estimate = await preflight_estimate(
+                progress, route_decision, video_duration, None, prompt_chars,
+                count_contents=[types.Content(parts=request_contents)],
+                sampling=sampling
+            )
+            if not request_estimate:
+                return
+            expected_wait = await gemini_rate_limiter.estimate_wait(generate_limit_key(route_decision.model), progress.estimated_tokens)
+            if expected_wait > 0:
+                progress.queue_wait_seconds = expected_wait
+            generate_config = build_generate_config(GENERATION_TEMPERATURE, media_resolution=request_estimate.media_resolution, srt_format_rules=SRT_FORMAT_IN_PROMPT)
+            uncached_request_contents = request_contents
+            uncached_generate_config = generate_config
+        else:
+            if not video_content and session and session.local_video_path and not video_sessions.find_file(session.file_hash):
+                # 之前的指令只用了元数据，视频尚未上传：从保留的本地副本上传
+                print(f"[IntentRouter] 会话 {session.session_id} 的视频尚未上传，使用本地副本: {session.local_video_path}")
+                video_content = await asyncio.to_thread(read_file_bytes, session.local_video_path)
+                video_filename = session.original_file_name
+                video_mime_type = session.mime_type
+            # 长视频字幕分段生成：各段引用同一个视频文件的不同时间范围，所以上传视频而不是音轨
+            probed_duration = (media_info or {}).get("duration")
+            subtitle_segments = plan_subtitle_segments(intent.intent, probed_duration, sampling, shot_index)
+            if subtitle_segments:
+                sampling = subtitle_segment_sampling(sampling)
+            # 字幕请求只需要语音：有可用的音轨（已上传或可以本地提取）时只上传音频
+            video_sampling = sampling
+            media_kind = PROXY_VIDEO
+            if (SUBTITLE_AUDIO_ONLY and not subtitle_segments and intent.intent == INTENT_SUBTITLE and not sampling.has_video_metadata and resolved_file_hash and (
+                    video_sessions.find_file(gemini_file_key(resolved_file_hash, PROXY_AUDIO))
+                    or (video_content and upload_proxy and upload_proxy.can_extract_audio(media_info)))):
+                media_kind = PROXY_AUDIO
+                sampling = VideoSampling(source="intent", audio_only=True)
+            if media_info and media_info.get("duration"):
+                # 上传前用ffprobe时长做一次预算检查，明显超出预算的视频不必上传
+                upload_route = await model_router.choose(intent.intent, media_info["duration"], 0)
+                if not await preflight_estimate(
+                    progress, upload_route, media_info["duration"], None, len(VIDEO_INSTRUCTION) + len(prompt), sampling=sampling
+                ):
+                    return
+            file_object_for_gemini = await resolve_gemini_file(
+                progress, session, video_content, video_mime_type, video_filename, resolved_file_hash,
+                spool_path=spool_path, resume_file_name=resume_file_name, media_info=media_info, media_kind=media_kind
+            )
+            if not file_object_for_gemini:
+                return
+            if (file_object_for_gemini.mime_type or "").startswith("audio/") and media_kind == PROXY_AUDIO:
+                print(f"[Proxy] 任务 {task_id} 字幕生成只使用音轨: {file_object_for_gemini.name}")
+                if session and video_content and not session.local_video_path and not video_sessions.find_file(resolved_file_hash):
+                    # 视频本身没有上传，保留本地副本供后续需要看画面的指令使用
+                    await asyncio.to_thread(retain_session_video, session, video_content, os.path.splitext(video_filename)[1])
+            else:
+                # 音轨提取失败时回退到了视频
+                media_kind = PROXY_VIDEO
+                sampling = video_sampling
+                if session and session.local_video_path:
+                    video_sessions.release_local_video(session)
+            if not probed_duration and media_kind == PROXY_VIDEO:
+                # 没有ffprobe时长时按上传后的文件时长规划分段
+                subtitle_segments = plan_subtitle_segments(intent.intent, parse_video_duration(file_object_for_gemini), sampling, shot_index)
+                if subtitle_segments:
+                    sampling = subtitle_segment_sampling(sampling)
+            file_key = gemini_file_key(resolved_file_hash, media_kind)
+            file_ref = video_sessions.find_file(file_key)
+            is_proxy_file = bool(file_ref and file_ref.is_proxy and file_ref.google_file_name == file_object_for_gemini.name)
+
+            # --- At this point, file_object_for_gemini and original_video_filename_for_prompt are set ---
+            if job_journal:
+                # 记录可用的Google文件引用，崩溃恢复时可跳过上传阶段
+                job_journal.record(
+                    task_id, "gemini_file",
+                    name=file_object_for_gemini.name,
+                    uri=file_object_for_gemini.uri,
+                    mime_type=file_object_for_gemini.mime_type,
+                    original_file_name=original_video_filename_for_prompt,
+                    file_hash=resolved_file_hash,
+                    is_proxy=is_proxy_file,
+                    media_kind=media_kind
+                )
+            progress.update("ai_generating", 60, "准备AI分析和指令生成...")
+
+            # --- Construct the prompt for Gemini ---
+            # 固定规则和工具在 prompt_builder 中预先构建，这里只拼接用户指令和文件名
+            segment = (sampling.start_offset, sampling.end_offset) if sampling.start_offset is not None or sampling.end_offset is not None else None
+            # 附上原视频的元数据，模型不用猜测时长和分辨率；上传的是缩小后的代理或音轨时滤镜坐标按原视频计算
+            request_text = build_request_text(
+                prompt, original_video_filename_for_prompt, segment,
+                is_proxy=is_proxy_file, original_media=format_media_info(media_info) if media_info else None,
+                audio_only=sampling.audio_only, shot_boundaries=shot_boundaries
+            )
+
+            # Explicitly create a Part for the video file, referencing it by URI and MIME type
+            # video_metadata 控制片段起止和采样帧率
+            video_file_part = types.Part(
+                file_data={
+                    'file_uri': file_object_for_gemini.uri,
+                    'mime_type': file_object_for_gemini.mime_type
+                },
+                video_metadata=sampling.video_metadata()
+            )
         
-        request_contents = [
-            types.Part(text=prompt_for_gemini),
-            video_file_part
-        ]
+            request_contents = [
+                types.Part(text=request_text),
+                video_file_part
+            ]
+
+            # 按视频时长估算本次请求的输入tokens，用于TPM限流
+            # 音频文件没有 video_metadata，用ffprobe时长；文件大小只对视频有参考意义
+            video_duration = parse_video_duration(file_object_for_gemini) or (media_info or {}).get("duration")
+            file_size_bytes = None if sampling.audio_only else file_object_for_gemini.size_bytes
+            progress.estimated_tokens = estimate_request_tokens(
+                video_duration,
+                size_bytes=file_size_bytes,
+                prompt_chars=len(VIDEO_INSTRUCTION) + len(request_text),
+                tokens_per_second=sampling.tokens_per_second(video_duration)
+            )
+            route_decision = await model_router.choose(intent.intent, video_duration, progress.estimated_tokens)
+            request_estimate = await preflight_estimate(
+                progress, route_decision, video_duration, file_size_bytes,
+                len(VIDEO_INSTRUCTION) + len(request_text),
+                count_contents=[types.Content(parts=request_contents)],
+                sampling=sampling
+            )
+            if not request_estimate:
+                return
+            
+            if subtitle_segments:
+                progress.model_route = route_decision.to_dict()
+                print(f"[ModelRouter] 任务 {task_id} 路由 {route_decision.route} -> {route_decision.model} ({route_decision.reason})，字幕分 {len(subtitle_segments)} 段生成")
+                progress.update("streaming", 75, f"视频较长，分 {len(subtitle_segments)} 段并行生成字幕...")
+                segments_start_time = time.time()
+                result, input_tokens, output_tokens, has_usage = await generate_subtitle_segments(
+                    progress, route_decision, file_object_for_gemini, subtitle_segments, prompt, original_video_filename_for_prompt, sampling
+                )
+                segments_duration = time.time() - segments_start_time
+                print(f"PERF: segmented subtitle generation took {segments_duration:.2f} seconds.")
+                record_generation_usage(
+                    progress, route_decision, request_estimate, segments_duration,
+                    input_tokens or progress.estimated_tokens, output_tokens, has_usage
+                )
+                progress.complete_streaming()
+                if result_cache_config:
+                    store_cached_result(resolved_file_hash, route_decision.model, result_cache_config, prompt, result, progress.streaming_text)
+                await complete_tool_call(progress, result, "字幕分段生成完成")
+                return
+            expected_wait = await gemini_rate_limiter.estimate_wait(generate_limit_key(route_decision.model), progress.estimated_tokens)
+            if expected_wait > 0:
+                progress.queue_wait_seconds = expected_wait
+        
+            generate_config = build_generate_config(GENERATION_TEMPERATURE, media_resolution=request_estimate.media_resolution, srt_format_rules=SRT_FORMAT_IN_PROMPT)
+        
+            # 同一视频的后续指令使用显式上下文缓存：只发送用户请求，视频和固定规则从缓存读取
+            # （自定义片段/帧率/分辨率的请求不能使用按默认采样缓存的内容）
+            if context_cache and resolved_file_hash and not sampling.has_video_metadata and not request_estimate.media_resolution:
+                cached_content_name = await get_or_create_context_cache(progress, file_key, video_file_part, route_decision.model)
+            uncached_request_contents = request_contents
+            uncached_generate_config = generate_config
+            if cached_content_name:
+                request_contents = [types.Part(text=request_text)]
+                generate_config = build_generate_config(GENERATION_TEMPERATURE, cached_content_name)
+
+        progress.model_route = route_decision.to_dict()
+        print(f"[ModelRouter] 任务 {task_id} 路由 {route_decision.route} -> {route_decision.model} ({route_decision.reason})")
+        if template_match and await gemini_rate_limiter.estimate_wait(generate_limit_key(route_decision.model), progress.estimated_tokens) > FFMPEG_TEMPLATE_MAX_WAIT_SECONDS:
+            await finish_with_template(progress, template_match, "fallback", "AI服务排队较久，已使用内置模板生成FFmpeg命令", execution_input)
+            return
 
         # --- Call Gemini API with Streaming and Process Response ---
         progress.update("ai_generating", 75, "开始流式AI生成...")
         progress.update("streaming", 75, "AI正在分析视频...")
-        print(f"Sending to Gemini with streaming multimodal prompt (using file: {file_object_for_gemini.name if file_object_for_gemini else 'N/A'}) and tool: {execute_ffmpeg_with_optional_subtitles_declaration.name}")
+        print(f"Sending to Gemini with streaming {'metadata-only' if metadata_only else 'multimodal'} prompt (using file: {file_object_for_gemini.name if file_object_for_gemini else 'N/A'}) and tool: {execute_ffmpeg_with_optional_subtitles_declaration.name}")
         
         generate_content_start_time = time.time()
         
         # 使用流式API
-        stream = await asyncio.to_thread(
-            client.models.generate_content_stream,
-            model=f'models/{MODEL_NAME}',
-            contents=[types.Content(parts=request_contents)],
-            config=types.GenerateContentConfig(
-                tools=[types.Tool(function_declarations=[
-                    generate_subtitle_file_declaration,
-                    execute_ffmpeg_with_optional_subtitles_declaration
-                ])],
-                tool_config=tool_config_video,
-                temperature=0.3
+        try:
+            stream = await call_gemini(
+                progress,
+                "generate",
+                start_content_stream,
+                estimated_tokens=progress.estimated_tokens,
+                limit_key=generate_limit_key(route_decision.model),
+                model=f'models/{route_decision.model}',
+                contents=[types.Content(parts=request_contents)],
+                config=generate_config
+            )
+        except genai_errors.ClientError as e:
+            if not cached_content_name or e.code not in (400, 403, 404):
+                raise
+            # 缓存已过期或被删除：作废缓存条目，透明回退到完整的多模态请求
+            print(f"[ContextCache] 使用缓存 {cached_content_name} 生成失败，回退到普通请求: {str(e)}")
+            await invalidate_context_cache(file_key, route_decision.model)
+            stream = await call_gemini(
+                progress,
+                "generate",
+                start_content_stream,
+                estimated_tokens=progress.estimated_tokens,
+                limit_key=generate_limit_key(route_decision.model),
+                model=f'models/{route_decision.model}',
+                contents=[types.Content(parts=uncached_request_contents)],
+                config=uncached_generate_config
             )
-        )
         
         # 处理流式响应
         accumulated_response = None
         tool_call_result = None
+        progress.streaming_text = ""
+        progress.replace_subtitle_cues([])
+        if job_journal:
+            job_journal.record(task_id, "stream_reset", durable=False)
         
+        usage_metadata = None
+        # 文本形式返回的SRT边生成边解析
+        srt_parser = StreamingSrtParser()
         for chunk in stream:
+            if chunk.usage_metadata:
+                usage_metadata = chunk.usage_metadata
             if chunk.candidates and len(chunk.candidates) > 0:
                 candidate = chunk.candidates[0]
                 
@@ -540,12 +2113,15 @@ async def process_video_task_with_content(task_id: str, prompt: str, video_conte
                             # Gemini返回的文本块，我们需要人工创建流式效果
                             chunk_text = part.text
                             print(f"Gemini返回文本块 (长度: {len(chunk_text)}): {repr(chunk_text)}")
+                            if job_journal:
+                                job_journal.record(task_id, "stream", durable=False, text=chunk_text)
                             
                             # 逐字符添加，创建流式效果
                             for char in chunk_text:
                                 progress.append_streaming_text(char)
                                 # 小延迟以创建打字机效果（实际项目中可以调整或去掉）
                                 await asyncio.sleep(0.02)  # 20ms每字符
+                            progress.add_subtitle_cues(srt_parser.feed(chunk_text))
                         
                         # 处理工具调用
                         elif hasattr(part, 'function_call') and part.function_call:
@@ -559,6 +2135,8 @@ async def process_video_task_with_content(task_id: str, prompt: str, video_conte
                                 description = args.get("description", "")
                                 
                                 print(f"Gemini subtitle generation tool call received: {function_call.name} with args: {args}")
+                                subtitles_content, subtitle_fixes = autofix_subtitles(subtitles_content, subtitles_filename)
+                                progress.replace_subtitle_cues(parse_srt(subtitles_content))
                                 tool_call_result = {
                                     "subtitle_generation": {
                                         "name": function_call.name,
@@ -569,6 +2147,8 @@ async def process_video_task_with_content(task_id: str, prompt: str, video_conte
                                         }
                                     }
                                 }
+                                if subtitle_fixes:
+                                    tool_call_result["subtitle_fixes"] = subtitle_fixes
                                 
                             elif function_call.name == execute_ffmpeg_with_optional_subtitles_declaration.name:
                                 # 处理视频处理工具
@@ -579,6 +2159,9 @@ async def process_video_task_with_content(task_id: str, prompt: str, video_conte
                                 subtitles_filename = args.get("subtitles_filename", "")
                                 
                                 print(f"Gemini video processing tool call received: {function_call.name} with args: {args}")
+                                subtitles_content, subtitle_fixes = autofix_subtitles(subtitles_content, subtitles_filename)
+                                if subtitles_content:
+                                    progress.replace_subtitle_cues(parse_srt(subtitles_content))
                                 tool_call_result = {
                                     "tool_call": {
                                         "name": function_call.name,
@@ -590,12 +2173,20 @@ async def process_video_task_with_content(task_id: str, prompt: str, video_conte
                                         }
                                     }
                                 }
+                                if subtitle_fixes:
+                                    tool_call_result["subtitle_fixes"] = subtitle_fixes
                 
                 # 保存最后的candidate用于最终检查
                 accumulated_response = candidate
         
+        progress.add_subtitle_cues(srt_parser.finish())
+        
         generate_content_duration = time.time() - generate_content_start_time
         print(f"PERF: client.models.generate_content_stream took {generate_content_duration:.2f} seconds.")
+        # 按路由记录实际延迟、tokens 和费用；拿不到 usage_metadata 时用预估值
+        input_tokens = (usage_metadata.prompt_token_count if usage_metadata else None) or progress.estimated_tokens
+        output_tokens = ((usage_metadata.candidates_token_count or 0) + (usage_metadata.thoughts_token_count or 0)) if usage_metadata else 0
+        record_generation_usage(progress, route_decision, request_estimate, generate_content_duration, input_tokens, output_tokens, usage_metadata is not None)
         
         # 完成流式传输
         progress.complete_streaming()
@@ -603,14 +2194,18 @@ async def process_video_task_with_content(task_id: str, prompt: str, video_conte
         
         # 处理最终结果
         if tool_call_result:
-            # 工具调用结果
-            progress.result = tool_call_result
-            progress.update("complete", 100, "工具调用完成")
+            tool_call_result = await validate_ffmpeg_tool_call(progress, tool_call_result, prompt, original_video_filename_for_prompt, media_info)
+            # 工具调用结果（缓存中不包含服务端执行的结果）
+            if result_cache_config:
+                store_cached_result(resolved_file_hash, route_decision.model, result_cache_config, prompt, tool_call_result, progress.streaming_text)
+            await complete_tool_call(progress, tool_call_result, "工具调用完成", execution_input)
             return
         elif progress.streaming_text:
             # 文本响应
             result = {"text_response": progress.streaming_text.strip()}
-            progress.result = result
+            progress.set_result(result)
+            if result_cache_config:
+                store_cached_result(resolved_file_hash, route_decision.model, result_cache_config, prompt, result, progress.streaming_text)
             progress.update("complete", 100, "文本分析完成")
             return
         else:
@@ -628,8 +2223,23 @@ async def process_video_task_with_content(task_id: str, prompt: str, video_conte
 
 
 
+    except CircuitOpenError as e:
+        print(f"Error in process_video_task: {str(e)}")
+        if route_decision and not route_decision.recorded:
+            model_router.record(route_decision, 0, 0, 0, success=False)
+        if template_match:
+            await finish_with_template(progress, template_match, "fallback", "AI服务暂时不可用，已使用内置模板生成FFmpeg命令", execution_input)
+        else:
+            progress.update("error", 0, f"AI服务暂时不可用，请在 {int(e.retry_after) + 1} 秒后重试")
     except Exception as e:
         print(f"Error in process_video_task: {str(e)}")
-        progress.update("error", 0, f"处理过程中出现错误: {str(e)}")
+        if route_decision and not route_decision.recorded:
+            model_router.record(route_decision, 0, 0, 0, success=False)
+        if template_match and is_retryable_error(e):
+            await finish_with_template(progress, template_match, "fallback", "AI服务繁忙，已使用内置模板生成FFmpeg命令", execution_input)
+        elif is_retryable_error(e):
+            progress.update("error", 0, f"AI服务繁忙，多次重试后仍失败: {str(e)}")
+        else:
+            progress.update("error", 0, f"处理过程中出现错误: {str(e)}")
 
 
@@ -0,0 +1,214 @@
+import asyncio
+import json
+import os
+import re
+import shutil
+import subprocess
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Optional, Dict, List, Callable, Awaitable
+
+# --- Media Probe ---
+# 用本地 ffprobe 读取视频元数据（时长、分辨率、编码、帧率、音轨、码率）。
+# 调用方负责放到线程池执行，这里是同步实现。
+# 元数据按内容哈希缓存（内存 + 磁盘），相同内容重复上传或服务重启后不再运行 ffprobe。
+
+
+def _parse_frame_rate(value: Optional[str]) -> Optional[float]:
+    """ffprobe 的帧率形如 '30000/1001'"""
+    if not value or value == "0/0":
+        return None
+    try:
+        if "/" in value:
+            num, den = value.split("/", 1)
+            return round(float(num) / float(den), 3) if float(den) else None
+        return float(value)
+    except ValueError:
+        return None
+
+
+def _to_float(value) -> Optional[float]:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _to_int(value) -> Optional[int]:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def summarize_probe(data: Dict) -> Dict:
+    """把 ffprobe 的 JSON 输出整理成精简的元数据"""
+    fmt = data.get("format", {})
+    streams: List[Dict] = data.get("streams", [])
+    video_stream = next((s for s in streams if s.get("codec_type") == "video" and not s.get("disposition", {}).get("attached_pic")), None)
+    audio_streams = [s for s in streams if s.get("codec_type") == "audio"]
+
+    info = {
+        "duration": _to_float(fmt.get("duration")),
+        "size_bytes": _to_int(fmt.get("size")),
+        "bit_rate": _to_int(fmt.get("bit_rate")),
+        "format_name": fmt.get("format_name"),
+        "video": None,
+        "audio_streams": [
+            {
+                "codec": s.get("codec_name"),
+                "channels": s.get("channels"),
+                "sample_rate": _to_int(s.get("sample_rate")),
+                "language": s.get("tags", {}).get("language"),
+            }
+            for s in audio_streams
+        ],
+    }
+    if video_stream:
+        info["video"] = {
+            "codec": video_stream.get("codec_name"),
+            "width": video_stream.get("width"),
+            "height": video_stream.get("height"),
+            "fps": _parse_frame_rate(video_stream.get("avg_frame_rate")) or _parse_frame_rate(video_stream.get("r_frame_rate")),
+            "pix_fmt": video_stream.get("pix_fmt"),
+            "bit_rate": _to_int(video_stream.get("bit_rate")),
+        }
+        if info["duration"] is None:
+            info["duration"] = _to_float(video_stream.get("duration"))
+    return info
+
+
+@lru_cache(maxsize=4)
+def ffprobe_available(ffprobe_binary: str = "ffprobe") -> bool:
+    return shutil.which(ffprobe_binary) is not None
+
+
+def probe_media(path: str, ffprobe_binary: str = "ffprobe", timeout: float = 30) -> Optional[Dict]:
+    """运行 ffprobe，失败（未安装、超时、无法解析）时返回 None"""
+    try:
+        completed = subprocess.run(
+            [ffprobe_binary, "-v", "error", "-print_format", "json", "-show_format", "-show_streams", path],
+            capture_output=True,
+            timeout=timeout,
+            check=True
+        )
+        return summarize_probe(json.loads(completed.stdout or b"{}"))
+    except FileNotFoundError:
+        print(f"[Probe] 未找到 {ffprobe_binary}，跳过元数据提取")
+    except subprocess.TimeoutExpired:
+        print(f"[Probe] ffprobe 超时 ({timeout}s): {path}")
+    except subprocess.CalledProcessError as e:
+        print(f"[Probe] ffprobe 失败: {e.stderr.decode('utf-8', 'replace')[:500]}")
+    except json.JSONDecodeError:
+        print(f"[Probe] 无法解析 ffprobe 输出: {path}")
+    return None
+
+
+def format_media_info(info: Optional[Dict]) -> str:
+    """生成写入提示词的元数据描述"""
+    if not info:
+        return "Media metadata: unavailable"
+    parts = []
+    if info.get("duration") is not None:
+        parts.append(f"duration {info['duration']:.2f}s")
+    video = info.get("video")
+    if video:
+        if video.get("width") and video.get("height"):
+            parts.append(f"resolution {video['width']}x{video['height']}")
+        if video.get("fps"):
+            parts.append(f"{video['fps']:g} fps")
+        if video.get("codec"):
+            parts.append(f"video codec {video['codec']}")
+    audio_streams = info.get("audio_streams") or []
+    if audio_streams:
+        audio = audio_streams[0]
+        parts.append(f"audio {audio.get('codec')} {audio.get('channels')}ch {audio.get('sample_rate')}Hz")
+        if len(audio_streams) > 1:
+            parts.append(f"{len(audio_streams)} audio streams")
+    else:
+        parts.append("no audio stream")
+    if info.get("bit_rate"):
+        parts.append(f"bitrate {info['bit_rate'] // 1000}kbps")
+    return "Media metadata: " + ", ".join(parts)
+
+
+class MediaInfoCache:
+    def __init__(self, directory: Optional[str] = None, max_entries: int = 1000):
+        # directory 为空时只缓存在内存中
+        self.directory = directory
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Dict]" = OrderedDict()
+        # 同一内容的并发请求等待同一次 ffprobe
+        self._pending: Dict[str, asyncio.Future] = {}
+        self._stats = {"hits": 0, "misses": 0, "probes": 0}
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _path(self, file_hash: str) -> Optional[str]:
+        if not self.directory or not re.fullmatch(r"[0-9a-f]+", file_hash):
+            return None
+        return os.path.join(self.directory, f"{file_hash}.json")
+
+    def get(self, file_hash: Optional[str]) -> Optional[Dict]:
+        if not file_hash:
+            return None
+        info = self._entries.get(file_hash)
+        if info is None:
+            path = self._path(file_hash)
+            try:
+                with open(path, encoding="utf-8") as f:
+                    info = json.load(f)
+            except (TypeError, OSError, ValueError):
+                return None
+            self._remember(file_hash, info)
+        else:
+            self._entries.move_to_end(file_hash)
+        return info
+
+    def put(self, file_hash: str, info: Dict):
+        self._remember(file_hash, info)
+        path = self._path(file_hash)
+        if path:
+            temp_path = f"{path}.{os.getpid()}.tmp"
+            try:
+                with open(temp_path, "w", encoding="utf-8") as f:
+                    json.dump(info, f)
+                os.replace(temp_path, path)
+            except OSError as e:
+                print(f"[Probe] 无法写入元数据缓存 {path}: {e}")
+
+    def _remember(self, file_hash: str, info: Dict):
+        self._entries[file_hash] = info
+        self._entries.move_to_end(file_hash)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def get_or_probe(self, file_hash: str, probe: Callable[[], Awaitable[Optional[Dict]]]) -> Optional[Dict]:
+        """命中缓存时直接返回；否则运行 probe()，成功的结果写入缓存（失败不缓存，下次重试）"""
+        info = self.get(file_hash)
+        if info is not None:
+            self._stats["hits"] += 1
+            return info
+        pending = self._pending.get(file_hash)
+        if pending:
+            self._stats["hits"] += 1
+            return await asyncio.shield(pending)
+        self._stats["misses"] += 1
+        future = asyncio.get_running_loop().create_future()
+        self._pending[file_hash] = future
+        try:
+            info = await probe()
+            self._stats["probes"] += 1
+            if info:
+                self.put(file_hash, info)
+            future.set_result(info)
+            return info
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()
+            raise
+        finally:
+            self._pending.pop(file_hash, None)
+
+    def stats(self) -> Dict:
+        return {"entries": len(self._entries), "persistent": bool(self.directory), **self._stats}
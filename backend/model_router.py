@@ -0,0 +1,123 @@
+from typing import Optional, Dict, Callable, Awaitable
+
+# --- Model Routing ---
+# 按请求意图、视频时长和当前限流余量为每个请求选择模型：
+# 简单的FFmpeg命令生成用轻量模型，字幕用 flash，深度内容分析用更强的模型。
+# 每条路由记录请求数、延迟、tokens 和费用，用于根据数据调整策略。
+
+ROUTE_TRANSFORM = "transform"
+ROUTE_SUBTITLE = "subtitle"
+ROUTE_ANALYSIS = "analysis"
+ROUTE_LONG_VIDEO = "long_video"
+
+# 每百万 tokens 的美元价格 (输入, 输出)，用于费用估算
+MODEL_PRICING = {
+    "gemini-2.5-flash-lite": (0.10, 0.40),
+    "gemini-2.5-flash": (0.30, 2.50),
+    "gemini-2.5-pro": (1.25, 10.00),
+    "gemini-2.0-flash": (0.10, 0.40),
+    "gemini-2.0-flash-lite": (0.075, 0.30),
+}
+
+
+def estimate_cost(model: str, input_tokens: int, output_tokens: int) -> Optional[float]:
+    pricing = MODEL_PRICING.get(model)
+    if not pricing:
+        return None
+    return (input_tokens * pricing[0] + output_tokens * pricing[1]) / 1_000_000
+
+
+class RouteDecision:
+    def __init__(self, route: str, model: str, reason: str):
+        self.route = route
+        self.model = model
+        self.reason = reason
+        self.recorded = False
+
+    def to_dict(self) -> Dict:
+        return {"route": self.route, "model": self.model, "reason": self.reason}
+
+
+class RouteStats:
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.total_latency = 0.0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.cost = 0.0
+
+    def to_dict(self) -> Dict:
+        completed = self.requests - self.errors
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "avg_latency_seconds": round(self.total_latency / completed, 3) if completed else None,
+            "input_tokens": self.input_tokens,
+            "output_tokens": self.output_tokens,
+            "cost_usd": round(self.cost, 6),
+            "avg_cost_usd": round(self.cost / completed, 6) if completed else None,
+        }
+
+
+class ModelRouter:
+    def __init__(self, routes: Dict[str, str], default_model: str, long_video_seconds: float, max_wait_seconds: float,
+                 wait_estimator: Callable[[str, int], Awaitable[float]]):
+        self.routes = routes
+        self.default_model = default_model
+        # 超过该时长的分析请求换成吞吐更高的模型，避免长时间生成超时
+        self.long_video_seconds = long_video_seconds
+        # 选中模型的限流排队超过该值时改用默认模型
+        self.max_wait_seconds = max_wait_seconds
+        self.wait_estimator = wait_estimator
+        self._stats: Dict[tuple, RouteStats] = {}
+
+    def route_for_intent(self, intent: Optional[str]) -> str:
+        if intent == ROUTE_TRANSFORM:
+            return ROUTE_TRANSFORM
+        if intent == ROUTE_SUBTITLE:
+            return ROUTE_SUBTITLE
+        return ROUTE_ANALYSIS
+
+    def configured_model(self, route: str) -> str:
+        return self.routes.get(route) or self.default_model
+
+    async def choose(self, intent: Optional[str], video_seconds: Optional[float], estimated_tokens: int) -> RouteDecision:
+        route = self.route_for_intent(intent)
+        reason = f"intent={intent or 'unknown'}"
+        if route == ROUTE_ANALYSIS and video_seconds and video_seconds > self.long_video_seconds:
+            route = ROUTE_LONG_VIDEO
+            reason = f"video {video_seconds:.0f}s > {self.long_video_seconds:.0f}s"
+        model = self.configured_model(route)
+        if model != self.default_model:
+            wait = await self.wait_estimator(model, estimated_tokens)
+            if wait > self.max_wait_seconds and await self.wait_estimator(self.default_model, estimated_tokens) < wait:
+                reason = f"{model} queue {wait:.0f}s, fallback to {self.default_model}"
+                model = self.default_model
+        return RouteDecision(route, model, reason)
+
+    def record(self, decision: RouteDecision, latency_seconds: float, input_tokens: int, output_tokens: int, success: bool = True) -> Optional[float]:
+        """记录一次请求的实际延迟、tokens 和费用，返回本次费用"""
+        decision.recorded = True
+        stats = self._stats.setdefault((decision.route, decision.model), RouteStats())
+        stats.requests += 1
+        if not success:
+            stats.errors += 1
+            return None
+        stats.total_latency += latency_seconds
+        stats.input_tokens += input_tokens
+        stats.output_tokens += output_tokens
+        cost = estimate_cost(decision.model, input_tokens, output_tokens)
+        if cost is not None:
+            stats.cost += cost
+        return cost
+
+    def stats(self) -> Dict:
+        return {
+            "routes": {route: self.configured_model(route) for route in (ROUTE_TRANSFORM, ROUTE_SUBTITLE, ROUTE_ANALYSIS, ROUTE_LONG_VIDEO)},
+            "default_model": self.default_model,
+            "usage": [
+                {"route": route, "model": model, **stats.to_dict()}
+                for (route, model), stats in sorted(self._stats.items())
+            ],
+        }
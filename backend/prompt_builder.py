@@ -0,0 +1,310 @@
+import json
+from functools import lru_cache
+from typing import Optional, Tuple
+
+from google.genai import types
+
+from video_sampling import MEDIA_RESOLUTIONS
+
+# --- Prompt & Config Builder ---
+# 静态的系统指令、工具声明和生成配置在模块加载时构建一次，
+# 每个请求只需拼接用户指令和文件名。
+
+# --- Tool Definition for Subtitle Generation Only ---
+generate_subtitle_file_declaration = types.FunctionDeclaration(
+    name="generate_subtitle_file",
+    description=(
+        "Generates ONLY a subtitle file (.srt) for the video WITHOUT any video processing. "
+        "Use this tool when the user specifically asks to 'generate subtitles', 'create subtitle file', "
+        "'make srt file', or wants subtitles without modifying the video. "
+        "This tool does NOT process the video - it only analyzes the video content and creates subtitle text."
+    ),
+    parameters=types.Schema(
+        type=types.Type.OBJECT,
+        properties={
+            "subtitles_content": types.Schema(
+                type=types.Type.STRING,
+                description="The complete SRT subtitle content following the exact format requirements."
+            ),
+            "subtitles_filename": types.Schema(
+                type=types.Type.STRING,
+                description="The filename for the subtitle file (e.g., 'video_subtitles.srt', 'chinese_subs.srt')."
+            ),
+            "description": types.Schema(
+                type=types.Type.STRING,
+                description="A brief description of the subtitle content (e.g., 'Generated Chinese subtitles for the video content')."
+            )
+        },
+        required=["subtitles_content", "subtitles_filename", "description"] 
+    )
+)
+
+# --- Tool Definition for Video + Subtitles --- 
+execute_ffmpeg_with_optional_subtitles_declaration = types.FunctionDeclaration(
+    name="execute_ffmpeg_with_optional_subtitles",
+    description=(
+        "Executes an FFmpeg command in the user's web browser using FFmpeg.wasm and can optionally include subtitles. "
+        "Use this tool when the user asks to perform video manipulations like trimming, converting, adding subtitles, etc. "
+        "The input video file is always named 'input.mp4' in the FFmpeg.wasm environment. "
+        "Provide the full FFmpeg command string, the desired output filename for the video, "
+        "the content of the subtitles (if requested or appropriate, in SRT or VTT format), "
+        "and a filename for the subtitles (e.g., 'subs.srt' or 'subs.vtt'). "
+        "If subtitles are not requested or not applicable, subtitles_content and subtitles_filename can be omitted or empty."
+    ),
+    parameters=types.Schema(
+        type=types.Type.OBJECT,
+        properties={
+            "command_array": types.Schema(
+                type=types.Type.ARRAY,
+                items=types.Schema(type=types.Type.STRING),
+                description="The FFmpeg command arguments as an array of strings (without 'ffmpeg' at the beginning). For subtitles, use EXACT syntax: 'subtitles=filename.srt:fontsdir=/customfonts:force_style=\\'Fontname=Source Han Sans SC\\'' (CRITICAL: use 'fontsdir' NOT 'fontsize'). Example: ['-i', 'input.mp4', '-vf', 'subtitles=subs.srt:fontsdir=/customfonts:force_style=\\'Fontname=Source Han Sans SC\\'', 'output.mp4']"
+            ),
+            "output_filename": types.Schema(
+                type=types.Type.STRING,
+                description="The desired name for the output video file, e.g., 'output_with_subs.mp4', 'trimmed_video.mp4'."
+            ),
+            "subtitles_content": types.Schema(
+                type=types.Type.STRING,
+                description="The actual content of the subtitles (e.g., SRT or VTT format). Omit or leave empty if no subtitles are generated."
+            ),
+            "subtitles_filename": types.Schema(
+                type=types.Type.STRING,
+                description="The filename for the subtitles (e.g., 'subs.srt', 'subs.vtt'). Omit or leave empty if no subtitles are generated. This filename should be used in the command_string if burning subtitles."
+            )
+        },
+        required=["command_array", "output_filename"] 
+    )
+)
+
+# --- Fixed System Instruction ---
+# 与每次请求无关的规则放在 system_instruction 中；使用上下文缓存时只需 tokenize 一次
+VIDEO_INSTRUCTION_HEADER = (
+    "You receive a user request about the attached video, together with the video's filename.\n\n"
+    "Response types:\n"
+    "• Content analysis (understand/analyze video) → Text response in Chinese only\n"
+    "• Subtitle generation (generate subtitles/srt) → Use generate_subtitle_file tool\n"
+    "• Video processing (edit/convert video) → Use execute_ffmpeg_with_optional_subtitles tool\n\n"
+    "Tool usage:\n"
+    "• For video processing: Input file is the video filename given in the user request\n"
+    "• For subtitle burning: Use `subtitles=<filename>:fontsdir=/customfonts:force_style='Fontname=Source Han Sans SC'`\n\n"
+    "**SRT Format Requirements**:\n"
+    "```\n"
+    "1\n"
+    "00:00:01,500 --> 00:00:04,200\n"
+    "首先打开软件，然后选择设置\n"
+    "\n"
+    "2\n"
+    "00:00:05,000 --> 00:00:07,800\n"
+    "这里有三个选项：音频、视频、字幕\n"
+    "```\n\n"
+    "**Key Rules**:\n"
+)
+VIDEO_INSTRUCTION_FOOTER = (
+    "• Text: 8-20 Chinese characters max per subtitle, ONE LINE ONLY - split longer sentences into separate subtitles\n"
+    "• Punctuation: Use , : ; within sentence, NO . ? ! at end\n\n"
+    "IMPORTANT: For content analysis, always respond in Chinese. Respond based on request type."
+)
+# 时间格式、序号和空行默认由服务端 fix_srt 修复；关闭自动修复（SUBTITLE_AUTOFIX_ENABLED=false）时写进系统指令
+SRT_FORMAT_RULES = (
+    "• Time format: HH:MM:SS,mmm --> HH:MM:SS,mmm (comma not period)\n"
+    "• Sequential numbering: 1, 2, 3... with an empty line after each subtitle block\n"
+    "• Subtitles in time order, each ending before the next one starts\n"
+)
+VIDEO_SYSTEM_INSTRUCTION = VIDEO_INSTRUCTION_HEADER + VIDEO_INSTRUCTION_FOOTER
+VIDEO_SYSTEM_INSTRUCTION_WITH_SRT_FORMAT = VIDEO_INSTRUCTION_HEADER + SRT_FORMAT_RULES + VIDEO_INSTRUCTION_FOOTER
+
+
+def video_system_instruction(srt_format_rules: bool = False) -> str:
+    return VIDEO_SYSTEM_INSTRUCTION_WITH_SRT_FORMAT if srt_format_rules else VIDEO_SYSTEM_INSTRUCTION
+
+
+VIDEO_TOOLS = [types.Tool(function_declarations=[
+    generate_subtitle_file_declaration,
+    execute_ffmpeg_with_optional_subtitles_declaration
+])]
+TOOL_NAMES = [
+    generate_subtitle_file_declaration.name,
+    execute_ffmpeg_with_optional_subtitles_declaration.name
+]
+
+
+# --- Metadata-only Instruction ---
+# 纯格式/时间/尺寸变换不需要看画面，只把 ffprobe 元数据作为文本发送，不上传视频
+METADATA_SYSTEM_INSTRUCTION = (
+    "You receive a user request to transform a video, the video's filename and its technical metadata "
+    "(duration, resolution, frame rate, codecs, audio streams). You cannot see the video content.\n\n"
+    "Always use the execute_ffmpeg_with_optional_subtitles tool to build the FFmpeg command.\n"
+    "• Input file is the video filename given in the user request\n"
+    "• Use the metadata to pick correct timestamps, scale factors and codecs (e.g. do not map audio when there is no audio stream)\n"
+    "• Do not generate subtitles\n\n"
+    "IMPORTANT: If the request cannot be fulfilled from metadata alone, explain briefly in Chinese instead of calling the tool."
+)
+
+METADATA_TOOLS = [types.Tool(function_declarations=[
+    execute_ffmpeg_with_optional_subtitles_declaration
+])]
+
+
+def build_request_text(user_prompt: str, input_filename: str, segment: Optional[Tuple[Optional[float], Optional[float]]] = None, is_proxy: bool = False, original_media: Optional[str] = None, audio_only: bool = False, shot_boundaries: Optional[str] = None) -> str:
+    """每个请求唯一变化的部分：用户指令、视频文件名、原视频的元数据和镜头边界；只发送部分片段时说明片段范围，
+    附件是低码率代理或提取的音轨时说明这一点"""
+    text = (
+        f"User request: '{user_prompt}' (Video file: '{input_filename}')\n"
+        f"For video processing, the input file is '{input_filename}'."
+    )
+    if segment:
+        start, end = segment
+        text += (
+            f"\nOnly the segment from {start or 0:g}s to {f'{end:g}s' if end is not None else 'the end'} of the video is attached. "
+            "Express all timestamps relative to the start of the full original video."
+        )
+    if audio_only:
+        text += (
+            "\nOnly the audio track extracted from the input video is attached. "
+            "Subtitle timestamps on the audio timeline match the original video."
+        )
+        if original_media:
+            text += f" Original {original_media[0].lower()}{original_media[1:]}."
+    elif is_proxy:
+        text += "\nThe attached video is a downscaled, low frame rate preview of the input file."
+        if original_media:
+            text += f" Original {original_media[0].lower()}{original_media[1:]}."
+        text += " Use the original resolution for any pixel coordinates or sizes in FFmpeg filters."
+    elif original_media:
+        text += f"\n{original_media}"
+    if shot_boundaries:
+        text += f"\n{shot_boundaries}"
+    return text
+
+
+def format_keyframe_label(timestamp: float) -> str:
+    return f"Keyframe at {timestamp:.2f}s:"
+
+
+def build_keyframe_request_text(user_prompt: str, input_filename: str, frame_count: int, original_media: Optional[str] = None, has_audio: bool = False, shot_boundaries: Optional[str] = None) -> str:
+    """关键帧模式：附件是按时间顺序排列、各自标注时间戳的关键帧，以及可选的音轨"""
+    text = (
+        f"User request: '{user_prompt}' (Video file: '{input_filename}')\n"
+        f"For video processing, the input file is '{input_filename}'.\n"
+        f"Instead of the video, {frame_count} keyframes sampled at scene changes are attached in chronological order, "
+        "each preceded by its timestamp in the original video."
+    )
+    if has_audio:
+        text += " The full audio track of the video is attached after the keyframes."
+    else:
+        text += " No audio is attached."
+    if original_media:
+        text += f" Original {original_media[0].lower()}{original_media[1:]}."
+    if shot_boundaries:
+        text += f"\n{shot_boundaries}"
+    return text
+
+
+def build_metadata_request_text(user_prompt: str, input_filename: str, media_description: str, shot_boundaries: Optional[str] = None) -> str:
+    """纯文本请求：用户指令 + 文件名 + 元数据描述（+ 镜头边界）"""
+    text = f"User request: '{user_prompt}' (Video file: '{input_filename}')\n{media_description}\n"
+    if shot_boundaries:
+        text += f"{shot_boundaries}\n"
+    return text + f"The input file is '{input_filename}'."
+
+
+def build_command_repair_request_text(user_prompt: str, input_filename: str, command_array: list, output_filename: str, errors: list, media_description: Optional[str] = None, subtitles_filename: Optional[str] = None) -> str:
+    """命令修复请求：原指令 + 被拒绝的命令 + 校验错误"""
+    text = (
+        f"User request: '{user_prompt}' (Video file: '{input_filename}')\n"
+        f"The input file is '{input_filename}'.\n"
+    )
+    if media_description:
+        text += f"{media_description}\n"
+    if subtitles_filename:
+        text += f"Subtitles file: '{subtitles_filename}'\n"
+    text += (
+        f"Rejected command_array: {json.dumps(command_array, ensure_ascii=False)}\n"
+        f"Output filename: '{output_filename}'\n"
+        "Validation errors:\n" + "\n".join(f"- {error}" for error in errors)
+    )
+    return text
+
+
+def build_subtitle_segment_request_text(user_prompt: str, input_filename: str, start: float, end: float, index: int, total: int) -> str:
+    """长视频分段生成字幕时单个片段的请求；时间戳相对片段开头，由服务端平移到全片时间轴"""
+    return (
+        f"User request: '{user_prompt}' (Video file: '{input_filename}')\n"
+        f"This is part {index} of {total} of a long video: only the segment from {start:g}s to {end:g}s is attached.\n"
+        "Generate subtitles for the speech in this segment only. "
+        "Timestamps must be relative to the start of the attached segment (the segment starts at 00:00:00,000). "
+        "Include sentences that are cut off at the segment boundaries."
+    )
+
+
+# --- FFmpeg Command Repair ---
+# 校验发现无法自动修正的参数错误时，只发送原指令、错误命令和错误列表重新生成命令，不再附带视频
+COMMAND_REPAIR_SYSTEM_INSTRUCTION = (
+    "You fix FFmpeg commands that failed validation before running in FFmpeg.wasm in the user's browser. "
+    "You receive the user's request, the input filename, the rejected command and the validation errors. "
+    "You cannot see the video.\n\n"
+    "Always call execute_ffmpeg_with_optional_subtitles with a corrected command_array that does what the user asked.\n"
+    "• Keep everything that was not reported as an error\n"
+    "• Use only standard FFmpeg options and filters\n"
+    "• For subtitle burning use `subtitles=<filename>:fontsdir=/customfonts:force_style='Fontname=Source Han Sans SC'`\n"
+    "• Keep subtitles_content and subtitles_filename unchanged if they were provided"
+)
+
+COMMAND_REPAIR_TOOL_CONFIG = types.ToolConfig(
+    function_calling_config=types.FunctionCallingConfig(
+        mode=types.FunctionCallingConfigMode.ANY,
+        allowed_function_names=[execute_ffmpeg_with_optional_subtitles_declaration.name]
+    )
+)
+
+
+@lru_cache(maxsize=4)
+def build_command_repair_config(temperature: float) -> types.GenerateContentConfig:
+    return types.GenerateContentConfig(
+        system_instruction=COMMAND_REPAIR_SYSTEM_INSTRUCTION,
+        tools=METADATA_TOOLS,
+        tool_config=COMMAND_REPAIR_TOOL_CONFIG,
+        temperature=temperature
+    )
+
+# --- Subtitle Segment Config ---
+# 分段生成时强制调用 generate_subtitle_file，保证每段都返回完整的 SRT 文本
+SUBTITLE_SEGMENT_TOOLS = [types.Tool(function_declarations=[generate_subtitle_file_declaration])]
+SUBTITLE_SEGMENT_TOOL_CONFIG = types.ToolConfig(
+    function_calling_config=types.FunctionCallingConfig(
+        mode=types.FunctionCallingConfigMode.ANY,
+        allowed_function_names=[generate_subtitle_file_declaration.name]
+    )
+)
+
+
+@lru_cache(maxsize=8)
+def build_subtitle_segment_config(temperature: float, media_resolution: Optional[str] = None, srt_format_rules: bool = False) -> types.GenerateContentConfig:
+    return types.GenerateContentConfig(
+        system_instruction=video_system_instruction(srt_format_rules),
+        tools=SUBTITLE_SEGMENT_TOOLS,
+        tool_config=SUBTITLE_SEGMENT_TOOL_CONFIG,
+        temperature=temperature,
+        media_resolution=MEDIA_RESOLUTIONS.get(media_resolution)
+    )
+
+
+@lru_cache(maxsize=16)
+def build_generate_config(temperature: float, cached_content: Optional[str] = None, metadata_only: bool = False, media_resolution: Optional[str] = None,
+                          srt_format_rules: bool = False) -> types.GenerateContentConfig:
+    """生成配置按参数缓存复用；使用 cached content 时系统指令和工具已在缓存中，不能重复传入。
+    media_resolution 为 low / medium / high，low 约为默认 tokens 的 1/3；srt_format_rules 见 SRT_FORMAT_RULES"""
+    if cached_content:
+        return types.GenerateContentConfig(cached_content=cached_content, temperature=temperature)
+    if metadata_only:
+        return types.GenerateContentConfig(
+            system_instruction=METADATA_SYSTEM_INSTRUCTION,
+            tools=METADATA_TOOLS,
+            temperature=temperature
+        )
+    return types.GenerateContentConfig(
+        system_instruction=video_system_instruction(srt_format_rules),
+        tools=VIDEO_TOOLS,
+        temperature=temperature,
+        media_resolution=MEDIA_RESOLUTIONS.get(media_resolution)
+    )
@@ -0,0 +1,197 @@
+import time
+import hashlib
+import ipaddress
+from collections import deque
+from typing import Optional, Dict, Set, Deque, Tuple, List, Iterable
+
+# --- Per-Client Quotas ---
+# 按客户端（服务器验证过的 API Key / IP）限制并发任务数、每分钟上传字节数和每分钟Gemini请求数，
+# 防止单个用户占满事件循环、线程池和Gemini配额。所有方法只在事件循环线程中调用。
+# 没有会话维度：视频会话由服务器为某个客户端创建并归属于它，按会话计数只会让同一客户端用多个会话绕过限制。
+
+# 客户端数量达到该值后，新增客户端时清理空闲的客户端（之后按数量翻倍再清理）
+MIN_SWEEP_CLIENTS = 1024
+
+QUOTA_WINDOW_SECONDS = 60
+
+
+class SlidingWindowCounter:
+    """滑动窗口计数器，统计最近 window 秒内的累计量"""
+    def __init__(self, window: float = QUOTA_WINDOW_SECONDS):
+        self.window = window
+        self._events: Deque[Tuple[float, int]] = deque()
+        self._total = 0
+
+    def _prune(self, now: float):
+        while self._events and now - self._events[0][0] >= self.window:
+            _, amount = self._events.popleft()
+            self._total -= amount
+
+    def add(self, amount: int = 1, now: Optional[float] = None):
+        now = now if now is not None else time.time()
+        self._prune(now)
+        self._events.append((now, amount))
+        self._total += amount
+
+    def total(self, now: Optional[float] = None) -> int:
+        self._prune(now if now is not None else time.time())
+        return self._total
+
+    def seconds_until_below(self, limit: int, now: Optional[float] = None) -> float:
+        """返回累计量降到 limit 以下还需等待的秒数"""
+        now = now if now is not None else time.time()
+        self._prune(now)
+        remaining = self._total
+        if remaining < limit:
+            return 0.0
+        for ts, amount in self._events:
+            remaining -= amount
+            if remaining < limit:
+                return max(0.0, ts + self.window - now)
+        return 0.0
+
+
+class ClientUsage:
+    def __init__(self):
+        self.active_tasks: Set[str] = set()
+        self.upload_bytes = SlidingWindowCounter()
+        self.gemini_requests = SlidingWindowCounter()
+
+    def idle(self, now: Optional[float] = None) -> bool:
+        """没有进行中的任务，窗口内也没有用量：删除后不影响任何限制"""
+        return not self.active_tasks and not self.upload_bytes.total(now) and not self.gemini_requests.total(now)
+
+
+class QuotaExceeded(Exception):
+    """status_code 429 表示稍后重试可以成功；413 表示这个请求永远无法满足"""
+    def __init__(self, message: str, retry_after: float = 0, status_code: int = 429):
+        super().__init__(message)
+        self.message = message
+        self.retry_after = retry_after
+        self.status_code = status_code
+
+
+class ClientQuotaManager:
+    """客户端配额管理；限制值为 0 表示不限制"""
+    def __init__(self, max_concurrent_tasks: int, max_upload_bytes_per_minute: int, max_gemini_requests_per_minute: int):
+        self.max_concurrent_tasks = max_concurrent_tasks
+        self.max_upload_bytes_per_minute = max_upload_bytes_per_minute
+        self.max_gemini_requests_per_minute = max_gemini_requests_per_minute
+        self._clients: Dict[str, ClientUsage] = {}
+        self._sweep_at = MIN_SWEEP_CLIENTS
+
+    def _usage(self, client_id: str) -> ClientUsage:
+        if client_id not in self._clients:
+            if len(self._clients) >= self._sweep_at:
+                self.sweep()
+                self._sweep_at = max(MIN_SWEEP_CLIENTS, 2 * len(self._clients))
+            self._clients[client_id] = ClientUsage()
+        return self._clients[client_id]
+
+    def sweep(self) -> int:
+        """删除空闲的客户端，返回删除的数量"""
+        now = time.time()
+        idle = [client_id for client_id, usage in self._clients.items() if usage.idle(now)]
+        for client_id in idle:
+            del self._clients[client_id]
+        return len(idle)
+
+    def check_admission(self, client_id: str, upload_bytes: int = 0):
+        """检查是否允许该客户端启动新任务，超限时抛出 QuotaExceeded"""
+        usage = self._usage(client_id)
+        if self.max_concurrent_tasks and len(usage.active_tasks) >= self.max_concurrent_tasks:
+            raise QuotaExceeded(f"并发任务数已达上限 ({self.max_concurrent_tasks})，请等待当前任务完成", retry_after=5)
+        if self.max_upload_bytes_per_minute and upload_bytes:
+            if upload_bytes > self.max_upload_bytes_per_minute:
+                raise QuotaExceeded(
+                    f"文件大小 ({upload_bytes / (1024 * 1024):.0f}MB) 超过每分钟上传上限 ({self.max_upload_bytes_per_minute // (1024 * 1024)}MB)，"
+                    "重试也无法上传，请压缩或剪短视频后再试",
+                    status_code=413
+                )
+            used = usage.upload_bytes.total()
+            if used + upload_bytes > self.max_upload_bytes_per_minute:
+                wait = usage.upload_bytes.seconds_until_below(self.max_upload_bytes_per_minute - upload_bytes + 1)
+                raise QuotaExceeded("每分钟上传流量已达上限，请稍后再试", retry_after=wait)
+        if self.max_gemini_requests_per_minute:
+            if usage.gemini_requests.total() >= self.max_gemini_requests_per_minute:
+                wait = usage.gemini_requests.seconds_until_below(self.max_gemini_requests_per_minute)
+                raise QuotaExceeded("每分钟AI请求数已达上限，请稍后再试", retry_after=wait)
+
+    def acquire(self, client_id: str, task_id: str, upload_bytes: int = 0):
+        """检查并占用配额（检查与占用之间没有 await，保证原子性）"""
+        self.check_admission(client_id, upload_bytes)
+        usage = self._usage(client_id)
+        usage.active_tasks.add(task_id)
+        if upload_bytes:
+            usage.upload_bytes.add(upload_bytes)
+
+    def release(self, client_id: str, task_id: str):
+        usage = self._clients.get(client_id)
+        if usage:
+            usage.active_tasks.discard(task_id)
+            if usage.idle():
+                del self._clients[client_id]
+
+    def record_gemini_request(self, client_id: Optional[str]):
+        if client_id:
+            self._usage(client_id).gemini_requests.add(1)
+
+    def usage(self, client_id: str) -> Dict:
+        # 查询不创建记录
+        usage = self._clients.get(client_id) or ClientUsage()
+        return {
+            "client_id": client_id,
+            "active_tasks": len(usage.active_tasks),
+            "max_concurrent_tasks": self.max_concurrent_tasks,
+            "upload_bytes_last_minute": usage.upload_bytes.total(),
+            "max_upload_bytes_per_minute": self.max_upload_bytes_per_minute,
+            "gemini_requests_last_minute": usage.gemini_requests.total(),
+            "max_gemini_requests_per_minute": self.max_gemini_requests_per_minute,
+        }
+
+
+def hash_api_key(api_key: str) -> str:
+    # 不保存原始密钥
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+
+
+def parse_trusted_proxies(text: str) -> List:
+    """逗号分隔的代理地址或网段（如 127.0.0.1,10.0.0.0/8）"""
+    networks = []
+    for item in text.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        try:
+            networks.append(ipaddress.ip_network(item, strict=False))
+        except ValueError:
+            print(f"[Quota] 忽略无效的代理地址 {item}")
+    return networks
+
+
+def _is_trusted_proxy(address: Optional[str], trusted_proxies: Iterable) -> bool:
+    try:
+        ip = ipaddress.ip_address((address or "").strip())
+    except ValueError:
+        return False
+    return any(ip in network for network in trusted_proxies)
+
+
+def resolve_client_id(headers, client_host: Optional[str], api_key_hashes: Set[str] = frozenset(), trusted_proxies: Iterable = ()) -> str:
+    """识别客户端：API Key 只有在服务器配置的密钥中才采用，否则按客户端IP。
+    X-Forwarded-For 只在连接来自受信任的代理时采用，从右往左跳过受信任的代理，取第一个外部地址"""
+    api_key = headers.get("x-api-key")
+    if api_key and api_key_hashes:
+        key_hash = hash_api_key(api_key)
+        if key_hash in api_key_hashes:
+            return "key:" + key_hash
+    address = client_host
+    if _is_trusted_proxy(address, trusted_proxies):
+        for hop in reversed((headers.get("x-forwarded-for") or "").split(",")):
+            hop = hop.strip()
+            if not hop:
+                continue
+            address = hop
+            if not _is_trusted_proxy(hop, trusted_proxies):
+                break
+    return "ip:" + (address or "unknown")
@@ -0,0 +1,163 @@
+import os
+import re
+import time
+import sqlite3
+import asyncio
+import threading
+from urllib.request import pathname2url
+from typing import Optional, Dict, List, Tuple, Callable
+
+# --- Gemini Rate Limiter ---
+# 按接口类别（upload / files_get / generate）维护令牌桶，超出 RPM/TPM 预算时排队等待，
+# 而不是直接打到 Gemini 触发 429。令牌采用"预约"方式扣减（可以为负），
+# 因此排队天然按先来先服务，并且可以提前算出预计等待时间。
+
+# Gemini 视频默认采样：约 258 tokens/帧 (1fps) + 32 tokens/秒音频
+VIDEO_TOKENS_PER_SECOND = 290
+PROMPT_BASE_TOKENS = 1200
+# 拿不到时长时，按约 8Mbps 码率从文件大小估算
+FALLBACK_BYTES_PER_SECOND = 1024 * 1024
+
+
+def refill_tokens(tokens: float, updated_at: float, now: float, capacity: float, refill_per_second: float) -> float:
+    return min(capacity, tokens + (now - updated_at) * refill_per_second)
+
+
+class InMemoryBucketBackend:
+    """进程内令牌桶状态"""
+    # 只操作内存，可以直接在事件循环中调用
+    blocking = False
+
+    def __init__(self):
+        self._state: Dict[str, Tuple[float, float]] = {}
+        self._lock = threading.Lock()
+
+    def reserve(self, key: str, amount: float, capacity: float, refill_per_second: float) -> float:
+        """预约 amount 个令牌，返回需要等待的秒数"""
+        with self._lock:
+            now = time.time()
+            tokens, updated_at = self._state.get(key, (capacity, now))
+            tokens = refill_tokens(tokens, updated_at, now, capacity, refill_per_second) - min(amount, capacity)
+            self._state[key] = (tokens, now)
+            return max(0.0, -tokens / refill_per_second)
+
+    def estimate(self, key: str, amount: float, capacity: float, refill_per_second: float) -> float:
+        """不预约，只计算现在预约 amount 个令牌需要等待的秒数"""
+        now = time.time()
+        tokens, updated_at = self._state.get(key, (capacity, now))
+        tokens = refill_tokens(tokens, updated_at, now, capacity, refill_per_second) - min(amount, capacity)
+        return max(0.0, -tokens / refill_per_second)
+
+
+class SQLiteBucketBackend:
+    """基于 SQLite 的共享令牌桶，供同一台机器上的多个 worker 进程共用预算"""
+    # 会等待其他进程的写锁，由 GeminiRateLimiter 放到线程池中调用
+    blocking = True
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        with sqlite3.connect(self.path) as conn:
+            # WAL 模式下只读的估算查询不会被预约的写事务阻塞
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL, updated_at REAL)")
+        self._read_only_uri = "file:" + pathname2url(os.path.abspath(path)) + "?mode=ro"
+
+    def reserve(self, key: str, amount: float, capacity: float, refill_per_second: float) -> float:
+        with self._lock:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            try:
+                # IMMEDIATE 事务保证跨进程的读-改-写是原子的
+                conn.execute("BEGIN IMMEDIATE")
+                now = time.time()
+                row = conn.execute("SELECT tokens, updated_at FROM buckets WHERE key = ?", (key,)).fetchone()
+                tokens, updated_at = row if row else (capacity, now)
+                tokens = refill_tokens(tokens, updated_at, now, capacity, refill_per_second) - min(amount, capacity)
+                conn.execute("INSERT OR REPLACE INTO buckets (key, tokens, updated_at) VALUES (?, ?, ?)", (key, tokens, now))
+                conn.execute("COMMIT")
+                return max(0.0, -tokens / refill_per_second)
+            finally:
+                conn.close()
+
+    def estimate(self, key: str, amount: float, capacity: float, refill_per_second: float) -> float:
+        """只读查询，不开写事务"""
+        conn = sqlite3.connect(self._read_only_uri, uri=True, timeout=1)
+        try:
+            row = conn.execute("SELECT tokens, updated_at FROM buckets WHERE key = ?", (key,)).fetchone()
+        finally:
+            conn.close()
+        now = time.time()
+        tokens, updated_at = row if row else (capacity, now)
+        tokens = refill_tokens(tokens, updated_at, now, capacity, refill_per_second) - min(amount, capacity)
+        return max(0.0, -tokens / refill_per_second)
+
+
+class BucketLimit:
+    """一个令牌桶限制，如 generate 接口每分钟 60 次请求"""
+    def __init__(self, name: str, per_minute: int, unit: str = "requests"):
+        self.name = name
+        self.per_minute = per_minute
+        self.unit = unit  # requests 或 tokens
+
+    @property
+    def refill_per_second(self) -> float:
+        return self.per_minute / 60.0
+
+
+class GeminiRateLimiter:
+    def __init__(self, backend, limits: Dict[str, List[BucketLimit]]):
+        self.backend = backend
+        # 限制值为 0 的桶视为不限制
+        self.limits = {
+            endpoint: [limit for limit in endpoint_limits if limit.per_minute > 0]
+            for endpoint, endpoint_limits in limits.items()
+        }
+
+    def _reserve(self, endpoint: str, estimated_tokens: int, dry_run: bool) -> float:
+        wait = 0.0
+        for limit in self.limits.get(endpoint, []):
+            amount = estimated_tokens if limit.unit == "tokens" else 1
+            if amount <= 0:
+                continue
+            call = self.backend.estimate if dry_run else self.backend.reserve
+            wait = max(wait, call(f"{endpoint}:{limit.name}", amount, limit.per_minute, limit.refill_per_second))
+        return wait
+
+    async def _run(self, endpoint: str, estimated_tokens: int, dry_run: bool) -> float:
+        if self.backend.blocking:
+            return await asyncio.to_thread(self._reserve, endpoint, estimated_tokens, dry_run)
+        return self._reserve(endpoint, estimated_tokens, dry_run)
+
+    async def estimate_wait(self, endpoint: str, estimated_tokens: int = 0) -> float:
+        """不占用配额，仅估算当前排队等待时间"""
+        return await self._run(endpoint, estimated_tokens, dry_run=True)
+
+    async def acquire(self, endpoint: str, estimated_tokens: int = 0, on_wait: Optional[Callable[[float], None]] = None) -> float:
+        """预约令牌并在超出预算时等待，返回实际等待秒数"""
+        wait = await self._run(endpoint, estimated_tokens, dry_run=False)
+        if wait > 0:
+            print(f"[RateLimiter] {endpoint} 超出预算，排队等待 {wait:.1f}s (预估 {estimated_tokens} tokens)")
+            if on_wait:
+                on_wait(wait)
+            await asyncio.sleep(wait)
+        return wait
+
+
+def parse_video_duration(file_obj) -> Optional[float]:
+    """从 Gemini File 的 video_metadata 中读取时长（如 '12.5s'）"""
+    metadata = getattr(file_obj, "video_metadata", None) or {}
+    duration = metadata.get("videoDuration") or metadata.get("video_duration")
+    if not duration:
+        return None
+    match = re.match(r"^([\d.]+)s?$", str(duration))
+    return float(match.group(1)) if match else None
+
+
+def estimate_request_tokens(duration_seconds: Optional[float], size_bytes: Optional[int] = None, prompt_chars: int = 0, tokens_per_second: Optional[float] = None) -> int:
+    """按视频时长估算一次多模态请求的输入 tokens；tokens_per_second 用于自定义采样帧率/分辨率"""
+    if duration_seconds is None and size_bytes:
+        duration_seconds = size_bytes / FALLBACK_BYTES_PER_SECOND
+    if tokens_per_second is None:
+        tokens_per_second = VIDEO_TOKENS_PER_SECOND
+    video_tokens = int((duration_seconds or 0) * tokens_per_second)
+    return PROMPT_BASE_TOKENS + prompt_chars + video_tokens
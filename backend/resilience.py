@@ -0,0 +1,150 @@
+import time
+import random
+import asyncio
+from typing import Optional, Callable, Awaitable, Any
+
+import httpx
+from google.genai import errors
+
+# --- Resilience Layer ---
+# 对 Gemini 调用做错误分类：429/5xx/超时/网络错误可重试，其余（参数错误、权限等）直接失败。
+# 可重试错误按带抖动的指数退避重试；持续失败时熔断器打开，新任务直接快速失败。
+# 只有幂等的读取（files.get、count_tokens）对所有暂时性错误重试；生成只在服务端明确没有处理请求时重试，
+# 上传和创建缓存这类会在服务端留下资源的调用不重试。
+
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+# 限流和过载：请求被拒绝，没有被处理
+REJECTED_STATUS_CODES = {429, 503}
+
+
+def is_retryable_error(error: Exception) -> bool:
+    """判断错误是否为暂时性错误"""
+    if isinstance(error, errors.APIError):
+        return error.code in RETRYABLE_STATUS_CODES
+    if isinstance(error, (httpx.TimeoutException, httpx.TransportError)):
+        return True
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    return False
+
+
+def is_rejected_error(error: Exception) -> bool:
+    """服务端明确没有处理请求的错误（限流、过载、连接未建立），非幂等调用重试也不会重复执行"""
+    if isinstance(error, errors.APIError):
+        return error.code in REJECTED_STATUS_CODES
+    return isinstance(error, (httpx.ConnectError, httpx.ConnectTimeout, ConnectionRefusedError))
+
+
+def never_retry(error: Exception) -> bool:
+    return False
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"Circuit '{name}' is open, retry after {retry_after:.0f}s")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """连续失败达到阈值后打开，冷却期结束后放行一次试探请求（半开）"""
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.consecutive_failures = 0
+        self.opened_at: Optional[float] = None
+        self._half_open_probe = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.time() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def retry_after(self) -> float:
+        if self.opened_at is None:
+            return 0
+        return max(0.0, self.reset_timeout - (time.time() - self.opened_at))
+
+    def before_call(self):
+        state = self.state
+        if state == "open":
+            raise CircuitOpenError(self.name, self.retry_after())
+        if state == "half_open":
+            # 半开状态只放行一个试探请求
+            if self._half_open_probe:
+                raise CircuitOpenError(self.name, 1)
+            self._half_open_probe = True
+
+    def record_cancelled(self):
+        """调用被取消，没有结果：释放试探名额，否则熔断器会一直停在半开状态拒绝所有请求"""
+        self._half_open_probe = False
+
+    def record_success(self):
+        if self.opened_at is not None:
+            print(f"[Circuit] {self.name} 恢复正常，熔断器关闭")
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self._half_open_probe = False
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        self._half_open_probe = False
+        if self.opened_at is not None or self.consecutive_failures >= self.failure_threshold:
+            self.opened_at = time.time()
+            print(f"[Circuit] {self.name} 连续失败 {self.consecutive_failures} 次，熔断 {self.reset_timeout:.0f}s")
+
+
+class RetryPolicy:
+    def __init__(self, max_attempts: int = 4, base_delay: float = 1.0, max_delay: float = 20.0):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def backoff(self, attempt: int) -> float:
+        """full jitter：在 [0, min(max_delay, base * 2^attempt)] 中随机取值"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+
+async def call_with_retry(
+    attempt_fn: Callable[[], Awaitable[Any]],
+    policy: RetryPolicy,
+    breaker: Optional[CircuitBreaker] = None,
+    on_retry: Optional[Callable[[int, float, Exception], None]] = None,
+    should_retry: Callable[[Exception], bool] = is_retryable_error
+) -> Any:
+    """执行 attempt_fn，should_retry 判定可重试的错误按策略重试（默认所有暂时性错误，只适用于幂等调用）；
+    每次尝试都经过熔断器"""
+    attempt = 0
+    while True:
+        if breaker:
+            breaker.before_call()
+        try:
+            result = await attempt_fn()
+        except Exception as e:
+            retryable = is_retryable_error(e)
+            if breaker:
+                # 非暂时性错误说明服务本身可达，不计入熔断
+                if retryable:
+                    breaker.record_failure()
+                else:
+                    breaker.record_success()
+            attempt += 1
+            if not should_retry(e) or attempt >= policy.max_attempts:
+                raise
+            delay = policy.backoff(attempt)
+            print(f"[Retry] 第 {attempt} 次失败 ({type(e).__name__}: {str(e)[:200]})，{delay:.1f}s 后重试")
+            if on_retry:
+                on_retry(attempt, delay, e)
+            await asyncio.sleep(delay)
+            continue
+        except BaseException:
+            if breaker:
+                breaker.record_cancelled()
+            raise
+        if breaker:
+            breaker.record_success()
+        return result
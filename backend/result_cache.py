@@ -0,0 +1,82 @@
+import re
+import json
+import time
+import hashlib
+import unicodedata
+from collections import OrderedDict
+from typing import Optional, Dict
+
+# --- Result Cache ---
+# 相同视频 + 相同指令 + 相同模型/生成配置的请求直接返回上次的结果，
+# 跳过 generate_content_stream。按 LRU + TTL 淘汰。
+
+TRAILING_PUNCTUATION = "。！？!?.，,；;～~ "
+
+
+def normalize_prompt(prompt: str) -> str:
+    """规范化指令：全角转半角、去除首尾空白和结尾标点、合并空白、小写"""
+    text = unicodedata.normalize("NFKC", prompt or "")
+    text = re.sub(r"\s+", " ", text).strip().lower()
+    return text.rstrip(TRAILING_PUNCTUATION)
+
+
+def make_scope_key(file_hash: str, model: str, generation_config: Dict) -> str:
+    """同一视频 + 模型 + 生成配置构成一个缓存作用域，语义缓存也按作用域检索"""
+    payload = json.dumps({
+        "file_hash": file_hash,
+        "model": model,
+        "config": generation_config,
+    }, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def make_cache_key(scope_key: str, prompt: str) -> str:
+    payload = f"{scope_key}\n{normalize_prompt(prompt)}"
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class CachedResult:
+    def __init__(self, result: Dict, streaming_text: str):
+        self.result = result
+        self.streaming_text = streaming_text
+        self.created_at = time.time()
+        self.hits = 0
+
+
+class ResultCache:
+    def __init__(self, max_entries: int = 500, ttl_seconds: float = 24 * 3600):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, CachedResult]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[CachedResult]:
+        entry = self._entries.get(key)
+        if entry and time.time() - entry.created_at > self.ttl_seconds:
+            del self._entries[key]
+            entry = None
+        if not entry:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        entry.hits += 1
+        self.hits += 1
+        return entry
+
+    def put(self, key: str, result: Dict, streaming_text: str):
+        self._entries[key] = CachedResult(result, streaming_text)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, key: str):
+        self._entries.pop(key, None)
+
+    def stats(self) -> Dict:
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
@@ -0,0 +1,153 @@
+import re
+import math
+from collections import Counter, OrderedDict
+from typing import Optional, Dict, List, Tuple
+
+from result_cache import normalize_prompt
+
+# --- Semantic Prompt Cache ---
+# 用户对同一视频的同一意图有很多种说法（"加字幕"、"生成字幕文件"、"帮我做个srt"）。
+# 这里用字符 n-gram 向量 + 余弦相似度在同一缓存作用域（视频哈希 + 模型配置）内查找近似指令，
+# 命中时复用结果缓存中的结果。不依赖任何模型，纯本地计算。
+
+# 不改变意图的口语化词
+FILLER_WORDS = ["帮我", "帮忙", "麻烦", "请你", "请", "给我", "一下", "一个", "个", "吧", "呢", "please", "pls"]
+
+# 同义表达统一成同一个写法，只替换整个词（"加"是"生成"，"加速"不是）
+SYNONYMS = {
+    "字幕文件": "字幕",
+    "srt": "字幕",
+    "subtitles": "字幕",
+    "subtitle": "字幕",
+    "制作": "生成",
+    "做": "生成",
+    "加": "生成",
+    "加上": "生成",
+    "添加": "生成",
+    "创建": "生成",
+    "转换成": "转成",
+    "转换为": "转成",
+    "转为": "转成",
+    "剪切": "裁剪",
+    "截取": "裁剪",
+}
+
+LANGUAGE_TERMS = ["中文", "英文", "日文", "韩文", "法文", "德文", "西班牙文", "双语", "繁体", "简体"]
+# 方向、否定和操作词必须完全一致："顺时针"和"逆时针"、"保留声音"和"不要声音"、"压缩"和"压缩并静音"都不是同一个请求
+DIRECTION_TERMS = [
+    "顺时针", "逆时针", "左", "右", "上", "下", "前", "后", "开头", "结尾", "末尾", "中间", "水平", "垂直", "横屏", "竖屏",
+    "放大", "缩小", "加速", "减速", "加快", "放慢", "快", "慢", "倒放", "提高", "降低", "增加", "减少",
+]
+NEGATION_TERMS = ["不要", "不用", "不", "没有", "无", "别", "勿", "去掉", "去除", "删除", "删掉", "移除", "关闭"]
+OPERATION_TERMS = [
+    "字幕", "裁剪", "转成", "压缩", "静音", "旋转", "翻转", "镜像", "水印", "拼接", "合并", "提取", "音频", "音轨",
+    "声音", "配乐", "调速", "变速", "模糊", "马赛克", "滤镜", "截图", "封面", "分辨率", "帧率", "码率", "配音", "翻译",
+    "总结", "摘要", "分析", "描述", "烧录", "硬字幕", "软字幕", "调色", "亮度", "对比度", "降噪", "音量", "循环",
+]
+KEY_TERMS = set(LANGUAGE_TERMS + DIRECTION_TERMS + NEGATION_TERMS + OPERATION_TERMS)
+
+# 分词词表：按最长匹配切分中文，词表外的汉字单独成词
+VOCABULARY = KEY_TERMS | set(SYNONYMS) | set(SYNONYMS.values()) | {word for word in FILLER_WORDS if not word.isascii()}
+MAX_WORD_LENGTH = max(len(word) for word in VOCABULARY)
+TOKEN_PATTERN = re.compile(r"\d+(?:\.\d+)?|[a-z]+|[^\W\d_a-z]", re.UNICODE)
+
+NGRAM_SIZES = (1, 2, 3)
+
+
+def tokenize_prompt(prompt: str) -> List[str]:
+    """规范化后分词：数字、英文单词整体成词，中文按词表最长匹配；去掉口语化词，同义词整词替换"""
+    text = normalize_prompt(prompt)
+    tokens = []
+    index = 0
+    while index < len(text):
+        word = next(
+            (text[index:index + size] for size in range(MAX_WORD_LENGTH, 1, -1) if text[index:index + size] in VOCABULARY), None
+        )
+        if word is None:
+            match = TOKEN_PATTERN.match(text, index)
+            if not match:
+                # 空白和标点
+                index += 1
+                continue
+            word = match.group(0)
+        index += len(word)
+        if word in FILLER_WORDS:
+            continue
+        tokens.append(SYNONYMS.get(word, word))
+    return tokens
+
+
+def canonicalize_prompt(prompt: str) -> str:
+    return "".join(tokenize_prompt(prompt))
+
+
+def embed_prompt(prompt: str) -> Dict[str, float]:
+    """字符 n-gram 词频向量（L2 归一化）"""
+    text = canonicalize_prompt(prompt)
+    grams = Counter()
+    for n in NGRAM_SIZES:
+        for i in range(len(text) - n + 1):
+            grams[text[i:i + n]] += 1
+    norm = math.sqrt(sum(v * v for v in grams.values())) or 1.0
+    return {gram: count / norm for gram, count in grams.items()}
+
+
+def cosine_similarity(a: Dict[str, float], b: Dict[str, float]) -> float:
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(value * b.get(gram, 0.0) for gram, value in a.items())
+
+
+def extract_key_terms(prompt: str) -> List[str]:
+    """必须完全一致的关键词：数字（时长、分辨率、倍速等）、英文单词（格式名）、语言、方向、否定和操作。
+    "裁剪前10秒"和"裁剪前20秒"、"转成gif"和"转成mp4"、"中文字幕"和"英文字幕"都不是同一个请求"""
+    return sorted(token for token in tokenize_prompt(prompt) if token in KEY_TERMS or token[0].isascii())
+
+
+class SemanticEntry:
+    def __init__(self, prompt: str, cache_key: str):
+        self.prompt = prompt
+        self.cache_key = cache_key
+        self.vector = embed_prompt(prompt)
+        self.key_terms = extract_key_terms(prompt)
+
+
+class SemanticPromptCache:
+    def __init__(self, threshold: float = 0.8, max_entries_per_scope: int = 50, max_scopes: int = 1000):
+        self.threshold = threshold
+        self.max_entries_per_scope = max_entries_per_scope
+        self.max_scopes = max_scopes
+        # 按最近使用排序，超过 max_scopes 时淘汰最久未用的作用域
+        self._scopes: "OrderedDict[str, List[SemanticEntry]]" = OrderedDict()
+
+    def add(self, scope_key: str, prompt: str, cache_key: str):
+        entries = self._scopes.setdefault(scope_key, [])
+        self._scopes.move_to_end(scope_key)
+        while len(self._scopes) > self.max_scopes:
+            self._scopes.popitem(last=False)
+        entries[:] = [e for e in entries if e.cache_key != cache_key]
+        entries.append(SemanticEntry(prompt, cache_key))
+        if len(entries) > self.max_entries_per_scope:
+            del entries[0]
+
+    def find(self, scope_key: str, prompt: str) -> Optional[Tuple[SemanticEntry, float]]:
+        """返回作用域内最相似且超过阈值的历史指令"""
+        entries = self._scopes.get(scope_key)
+        if not entries:
+            return None
+        self._scopes.move_to_end(scope_key)
+        vector = embed_prompt(prompt)
+        key_terms = extract_key_terms(prompt)
+        best: Optional[Tuple[SemanticEntry, float]] = None
+        for entry in entries:
+            if entry.key_terms != key_terms:
+                continue
+            similarity = cosine_similarity(vector, entry.vector)
+            if similarity >= self.threshold and (best is None or similarity > best[1]):
+                best = (entry, similarity)
+        return best
+
+    def remove(self, scope_key: str, cache_key: str):
+        entries = self._scopes.get(scope_key)
+        if entries:
+            entries[:] = [e for e in entries if e.cache_key != cache_key]
@@ -0,0 +1,131 @@
+import os
+import time
+import uuid
+from typing import Optional, Dict
+
+# --- Video Sessions ---
+# 首次上传视频时创建会话并返回 video_session_id，后续指令显式引用该会话，
+# 不再依赖进程全局的"最后上传的视频"。Gemini 文件按内容哈希缓存，
+# 不同会话上传相同内容时共用同一个 Gemini 文件。
+# 会话 ID 由服务器生成，会话属于创建它的客户端（resolve_client_id），其他客户端引用时视为不存在。
+
+
+class GeminiFileRef:
+    """已上传到 Gemini 的文件引用"""
+    def __init__(self, file_hash: str, google_file_name: str, mime_type: Optional[str], is_proxy: bool = False):
+        self.file_hash = file_hash
+        self.google_file_name = google_file_name
+        self.mime_type = mime_type
+        # 上传的是低码率分析代理而不是原视频
+        self.is_proxy = is_proxy
+        self.created_at = time.time()
+
+
+class VideoSession:
+    def __init__(self, session_id: str, owner: Optional[str] = None):
+        self.session_id = session_id
+        self.owner = owner
+        self.file_hash: Optional[str] = None
+        self.original_file_name: Optional[str] = None
+        self.mime_type: Optional[str] = None
+        # ffprobe 元数据，纯变换指令只需要这些信息
+        self.media_info: Optional[Dict] = None
+        # 只按元数据处理、尚未上传到Gemini时保留的本地视频副本，后续需要看画面时再上传
+        self.local_video_path: Optional[str] = None
+        self.created_at = time.time()
+        self.last_used_at = self.created_at
+
+    def to_dict(self) -> Dict:
+        return {
+            "video_session_id": self.session_id,
+            "file_hash": self.file_hash,
+            "original_file_name": self.original_file_name,
+            "mime_type": self.mime_type,
+            "media_info": self.media_info,
+            "created_at": self.created_at,
+            "last_used_at": self.last_used_at,
+        }
+
+
+class VideoSessionStore:
+    def __init__(self, session_ttl_seconds: float, file_ttl_seconds: float):
+        self.session_ttl_seconds = session_ttl_seconds
+        # Gemini 文件默认 48 小时后过期
+        self.file_ttl_seconds = file_ttl_seconds
+        self._sessions: Dict[str, VideoSession] = {}
+        self._files_by_hash: Dict[str, GeminiFileRef] = {}
+
+    def create(self, owner: Optional[str] = None) -> VideoSession:
+        session = VideoSession(str(uuid.uuid4()), owner)
+        self._sessions[session.session_id] = session
+        return session
+
+    def get(self, session_id: Optional[str], owner: Optional[str] = None) -> Optional[VideoSession]:
+        """owner 为请求方的客户端ID；会话属于其他客户端时返回 None（不区分不存在和无权访问）"""
+        if not session_id:
+            return None
+        session = self._sessions.get(session_id)
+        if not session:
+            return None
+        if time.time() - session.last_used_at > self.session_ttl_seconds:
+            self.release_local_video(self._sessions.pop(session_id))
+            return None
+        if owner is not None and session.owner != owner:
+            return None
+        session.last_used_at = time.time()
+        return session
+
+    def get_or_create(self, session_id: Optional[str], owner: Optional[str] = None) -> VideoSession:
+        """沿用该客户端自己的会话；否则创建新会话（不采用客户端传入的ID）"""
+        return self.get(session_id, owner) or self.create(owner)
+
+    def restore(self, session_id: str, owner: Optional[str]) -> VideoSession:
+        """服务重启后按任务日志恢复会话，保留原来的ID和所属客户端"""
+        session = self._sessions.get(session_id)
+        if not session:
+            session = self._sessions[session_id] = VideoSession(session_id, owner)
+        return session
+
+    def attach_video(self, session: VideoSession, file_hash: str, original_file_name: str, mime_type: Optional[str]):
+        if session.file_hash != file_hash:
+            session.media_info = None
+            self.release_local_video(session)
+        session.file_hash = file_hash
+        session.original_file_name = original_file_name
+        session.mime_type = mime_type
+        session.last_used_at = time.time()
+
+    def retain_local_video(self, session: VideoSession, path: str):
+        self.release_local_video(session)
+        session.local_video_path = path
+
+    def release_local_video(self, session: VideoSession):
+        if session.local_video_path and os.path.exists(session.local_video_path):
+            os.remove(session.local_video_path)
+        session.local_video_path = None
+
+    def register_file(self, file_hash: str, google_file_name: str, mime_type: Optional[str], is_proxy: bool = False) -> GeminiFileRef:
+        ref = GeminiFileRef(file_hash, google_file_name, mime_type, is_proxy)
+        self._files_by_hash[file_hash] = ref
+        return ref
+
+    def find_file(self, file_hash: Optional[str]) -> Optional[GeminiFileRef]:
+        if not file_hash:
+            return None
+        ref = self._files_by_hash.get(file_hash)
+        if ref and time.time() - ref.created_at > self.file_ttl_seconds:
+            del self._files_by_hash[file_hash]
+            return None
+        return ref
+
+    def invalidate_file(self, file_hash: str):
+        self._files_by_hash.pop(file_hash, None)
+
+    def cleanup_expired(self) -> int:
+        now = time.time()
+        expired = [sid for sid, s in self._sessions.items() if now - s.last_used_at > self.session_ttl_seconds]
+        for sid in expired:
+            self.release_local_video(self._sessions.pop(sid))
+        for file_hash in [h for h, ref in self._files_by_hash.items() if now - ref.created_at > self.file_ttl_seconds]:
+            del self._files_by_hash[file_hash]
+        return len(expired)
@@ -0,0 +1,232 @@
+import json
+import os
+import re
+import subprocess
+import time
+from collections import OrderedDict
+from typing import Optional, Dict, List, Tuple
+
+from video_proxy import ffmpeg_available, FfmpegWorkerPool, PTS_TIME_PATTERN
+
+# --- Shot Boundary Index ---
+# 用本地 ffmpeg 的场景变化分数（相邻帧缩小后的像素差）找出镜头切换点，每个视频内容只计算一次，按内容哈希缓存在内存和磁盘。
+# "剪掉开头的片头"、"把每个场景分开"这类依赖时间点的指令把镜头边界写入提示词，模型不必每次从整个视频推断切换位置；
+# 长视频字幕分段时切分点也对齐到附近的镜头边界。
+
+SCENE_SCORE_PATTERN = re.compile(r"lavfi\.scene_score=(\d+(?:\.\d+)?)")
+
+
+def build_scene_score_command(ffmpeg_binary: str, input_path: str, threshold: float, analysis_width: int) -> list:
+    """缩小后计算场景分数，只输出超过阈值的帧的时间和分数（metadata=print 写到 stdout）"""
+    return [
+        ffmpeg_binary, "-hide_banner", "-nostats", "-v", "error", "-i", input_path,
+        "-map", "0:v:0", "-an", "-sn", "-dn",
+        "-vf", f"scale={analysis_width}:-2,select='gt(scene,{threshold:g})',metadata=print:file=-",
+        "-f", "null", "-"
+    ]
+
+
+def parse_scene_scores(output: str) -> List[Tuple[float, float]]:
+    """metadata=print 的输出：每帧一行 frame/pts/pts_time，接着是该帧的元数据"""
+    boundaries = []
+    timestamp = None
+    for line in output.splitlines():
+        match = PTS_TIME_PATTERN.search(line)
+        if match:
+            timestamp = float(match.group(1))
+            continue
+        match = SCENE_SCORE_PATTERN.search(line)
+        if match and timestamp is not None:
+            boundaries.append((timestamp, float(match.group(1))))
+            timestamp = None
+    return boundaries
+
+
+def merge_close_boundaries(boundaries: List[Tuple[float, float]], min_shot_seconds: float) -> List[Tuple[float, float]]:
+    """相距不到 min_shot_seconds 的边界（闪光、快速转场）只保留分数最高的一个；紧挨开头的边界丢弃"""
+    merged: List[Tuple[float, float]] = []
+    for timestamp, score in sorted(boundaries):
+        if timestamp < min_shot_seconds:
+            continue
+        if merged and timestamp - merged[-1][0] < min_shot_seconds:
+            if score > merged[-1][1]:
+                merged[-1] = (timestamp, score)
+            continue
+        merged.append((timestamp, score))
+    return merged
+
+
+class ShotIndex:
+    def __init__(self, file_hash: str, boundaries: List[Tuple[float, float]], duration: Optional[float] = None,
+                 threshold: Optional[float] = None, build_seconds: float = 0, cached: bool = False):
+        self.file_hash = file_hash
+        # (镜头开始时间, 场景分数)，按时间排序
+        self.boundaries = boundaries
+        self.duration = duration
+        self.threshold = threshold
+        self.build_seconds = build_seconds
+        self.cached = cached
+
+    @property
+    def boundary_times(self) -> List[float]:
+        return [timestamp for timestamp, _ in self.boundaries]
+
+    @property
+    def shots(self) -> List[Tuple[float, Optional[float]]]:
+        """各镜头的 [start, end)；时长未知时最后一个镜头的 end 为 None"""
+        starts = [0.0] + self.boundary_times
+        ends = self.boundary_times + [self.duration]
+        return list(zip(starts, ends))
+
+    def to_dict(self) -> Dict:
+        return {
+            "shot_count": len(self.boundaries) + 1,
+            "duration": self.duration,
+            "threshold": self.threshold,
+            "boundaries": [{"time": round(timestamp, 3), "score": round(score, 3)} for timestamp, score in self.boundaries],
+            "build_seconds": round(self.build_seconds, 2),
+            "cached": self.cached,
+        }
+
+    def to_cache(self) -> Dict:
+        return {"boundaries": self.boundaries, "duration": self.duration, "threshold": self.threshold}
+
+
+def format_shot_boundaries(shot_index: ShotIndex, limit: int = 100) -> str:
+    """写入提示词的镜头边界；超过 limit 个时只保留分数最高的"""
+    boundaries = shot_index.boundaries
+    if len(boundaries) > limit:
+        boundaries = sorted(sorted(boundaries, key=lambda b: b[1], reverse=True)[:limit])
+    if not boundaries:
+        return "Shot boundaries: no scene cuts detected, the video is a single continuous shot."
+    times = ", ".join(f"{timestamp:.2f}" for timestamp, _ in boundaries)
+    text = f"Shot boundaries detected by scene analysis (seconds): {times}."
+    if len(boundaries) < len(shot_index.boundaries):
+        text += f" Only the {len(boundaries)} strongest of {len(shot_index.boundaries)} cuts are listed."
+    return text + " Align cuts and segments to these boundaries where they match the request."
+
+
+class ShotIndexer:
+    def __init__(self, directory: Optional[str] = None, ffmpeg_binary: str = "ffmpeg", max_workers: int = 2, threshold: float = 0.3,
+                 min_shot_seconds: float = 1.0, analysis_width: int = 320, timeout: float = 900, max_entries: int = 500,
+                 retry_seconds: float = 3600):
+        # directory 为空时只缓存在内存中
+        self.directory = directory
+        self.ffmpeg_binary = ffmpeg_binary
+        self.threshold = threshold
+        self.min_shot_seconds = min_shot_seconds
+        self.analysis_width = analysis_width
+        self.timeout = timeout
+        self.max_entries = max_entries
+        # 计算失败的视频在这段时间内不再重试
+        self.retry_seconds = retry_seconds
+        # 场景检测需要解码整个视频，限制同时运行的进程数；同一视频的并发请求等待同一次计算
+        self._pool = FfmpegWorkerPool(max_workers)
+        self._entries: "OrderedDict[str, ShotIndex]" = OrderedDict()
+        self._failed: Dict[str, float] = {}
+        self._stats = {"hits": 0, "builds": 0, "failures": 0, "build_seconds": 0.0}
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    @property
+    def available(self) -> bool:
+        return ffmpeg_available(self.ffmpeg_binary)
+
+    def _path(self, file_hash: str) -> Optional[str]:
+        if not self.directory or not re.fullmatch(r"[0-9a-f]+", file_hash):
+            return None
+        return os.path.join(self.directory, f"{file_hash}.json")
+
+    def get(self, file_hash: Optional[str]) -> Optional[ShotIndex]:
+        if not file_hash:
+            return None
+        shot_index = self._entries.get(file_hash)
+        if shot_index is None:
+            path = self._path(file_hash)
+            try:
+                with open(path, encoding="utf-8") as f:
+                    data = json.load(f)
+                shot_index = ShotIndex(
+                    file_hash, [(float(t), float(s)) for t, s in data["boundaries"]], data.get("duration"), data.get("threshold"), cached=True
+                )
+            except (TypeError, OSError, ValueError, KeyError):
+                return None
+            self._remember(shot_index)
+        else:
+            self._entries.move_to_end(file_hash)
+        self._stats["hits"] += 1
+        return shot_index
+
+    def _remember(self, shot_index: ShotIndex):
+        self._entries[shot_index.file_hash] = shot_index
+        self._entries.move_to_end(shot_index.file_hash)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _persist(self, shot_index: ShotIndex):
+        path = self._path(shot_index.file_hash)
+        if not path:
+            return
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump(shot_index.to_cache(), f)
+            os.replace(temp_path, path)
+        except OSError as e:
+            print(f"[ShotIndex] 无法写入镜头索引缓存 {path}: {e}")
+
+    async def get_or_build(self, file_hash: str, input_path: str, duration: Optional[float] = None) -> Optional[ShotIndex]:
+        """命中缓存时直接返回；否则运行场景检测。失败时返回 None"""
+        shot_index = self.get(file_hash)
+        if shot_index:
+            return shot_index
+        if time.time() - self._failed.get(file_hash, 0) < self.retry_seconds:
+            return None
+        shot_index = await self._pool.run(file_hash, self._build_and_persist, file_hash, input_path, duration)
+        if shot_index and file_hash not in self._entries:
+            self._remember(ShotIndex(file_hash, shot_index.boundaries, shot_index.duration, shot_index.threshold, cached=True))
+        return shot_index
+
+    def _build_and_persist(self, file_hash: str, input_path: str, duration: Optional[float]) -> Optional[ShotIndex]:
+        shot_index = self._build(file_hash, input_path, duration)
+        if shot_index:
+            self._persist(shot_index)
+        return shot_index
+
+    def _build(self, file_hash: str, input_path: str, duration: Optional[float]) -> Optional[ShotIndex]:
+        command = build_scene_score_command(self.ffmpeg_binary, input_path, self.threshold, self.analysis_width)
+        start_time = time.time()
+        try:
+            completed = subprocess.run(command, capture_output=True, timeout=self.timeout, check=True)
+        except FileNotFoundError:
+            print(f"[ShotIndex] 未找到 {self.ffmpeg_binary}，不生成镜头索引")
+            return self._build_failed(file_hash)
+        except subprocess.TimeoutExpired:
+            print(f"[ShotIndex] 场景检测超时 ({self.timeout}s): {input_path}")
+            return self._build_failed(file_hash)
+        except subprocess.CalledProcessError as e:
+            print(f"[ShotIndex] 场景检测失败: {e.stderr.decode('utf-8', 'replace')[-500:]}")
+            return self._build_failed(file_hash)
+
+        boundaries = merge_close_boundaries(parse_scene_scores(completed.stdout.decode("utf-8", "replace")), self.min_shot_seconds)
+        if duration:
+            boundaries = [(t, s) for t, s in boundaries if t < duration - self.min_shot_seconds]
+        build_seconds = time.time() - start_time
+        self._stats["builds"] += 1
+        self._stats["build_seconds"] += build_seconds
+        return ShotIndex(file_hash, boundaries, duration, self.threshold, build_seconds)
+
+    def _build_failed(self, file_hash: str) -> None:
+        self._stats["failures"] += 1
+        self._failed[file_hash] = time.time()
+        return None
+
+    def stats(self) -> Dict:
+        return {
+            "available": self.available,
+            "threshold": self.threshold,
+            "entries": len(self._entries),
+            "persistent": bool(self.directory),
+            **self._stats,
+            "build_seconds": round(self._stats["build_seconds"], 2),
+        }
@@ -0,0 +1,330 @@
+import re
+from typing import Dict, List, Optional, Tuple
+
+# --- Subtitles (SRT) ---
+# SRT 解析（支持流式增量解析，生成过程中逐条输出字幕）、规则检查与格式化，
+# 以及长视频分段生成字幕：按时间切成有重叠的片段分别生成，
+# 再把各段的时间戳平移到全片时间轴、去掉重叠区域的重复字幕并重新编号。
+
+TIMESTAMP = r"(\d{1,2}):(\d{2}):(\d{2})[,.](\d{1,3})"
+TIMING_LINE = re.compile(rf"^\s*{TIMESTAMP}\s*-->\s*{TIMESTAMP}")
+# 系统指令要求的严格格式：HH:MM:SS,mmm --> HH:MM:SS,mmm
+STRICT_TIMING_LINE = re.compile(r"^\d{2}:\d{2}:\d{2},\d{3} --> \d{2}:\d{2}:\d{2},\d{3}$")
+CJK = re.compile(r"[\u3400-\u9fff\uf900-\ufaff]")
+
+# 与 VIDEO_SYSTEM_INSTRUCTION 中的规则一致：中文每条 8-20 字、单行、句末不用 . ? !
+MIN_CUE_CHARS = 8
+MAX_CUE_CHARS = 20
+FORBIDDEN_ENDINGS = ".。?？!！"
+
+
+class SrtCue:
+    def __init__(self, start: float, end: float, text: str, issues: Optional[List[str]] = None):
+        self.start = start
+        self.end = end
+        self.text = text
+        self.issues: List[str] = issues or []
+
+    def shifted(self, offset: float) -> "SrtCue":
+        return SrtCue(self.start + offset, self.end + offset, self.text, list(self.issues))
+
+    def to_dict(self) -> Dict:
+        return {
+            "start": round(self.start, 3),
+            "end": round(self.end, 3),
+            "start_time": format_timestamp(self.start),
+            "end_time": format_timestamp(self.end),
+            "text": self.text,
+            "issues": self.issues,
+        }
+
+
+def parse_timestamp(hours: str, minutes: str, seconds: str, millis: str) -> float:
+    return int(hours) * 3600 + int(minutes) * 60 + int(seconds) + int(millis.ljust(3, "0")) / 1000
+
+
+def format_timestamp(seconds: float) -> str:
+    millis = max(0, int(round(seconds * 1000)))
+    hours, millis = divmod(millis, 3600_000)
+    minutes, millis = divmod(millis, 60_000)
+    secs, millis = divmod(millis, 1000)
+    return f"{hours:02d}:{minutes:02d}:{secs:02d},{millis:03d}"
+
+
+def cue_issues(cue: SrtCue, timing_line: str = "") -> List[str]:
+    """按字幕规则检查一条字幕，返回问题列表"""
+    issues = []
+    if timing_line and not STRICT_TIMING_LINE.match(timing_line.strip()):
+        issues.append("timestamp_format")
+    if cue.end <= cue.start:
+        issues.append("non_positive_duration")
+    if "\n" in cue.text:
+        issues.append("multi_line")
+    if CJK.search(cue.text):
+        length = len(re.sub(r"\s", "", cue.text))
+        if length > MAX_CUE_CHARS:
+            issues.append("too_long")
+        elif length < MIN_CUE_CHARS:
+            issues.append("too_short")
+    if cue.text and cue.text[-1] in FORBIDDEN_ENDINGS:
+        issues.append("ending_punctuation")
+    return issues
+
+
+class StreamingSrtParser:
+    """增量解析 SRT：每次 feed 一段文本，返回其中已经完整的字幕（后面出现空行或下一条时间行）。
+    以时间行为准，忽略序号；没有文本的字幕块被丢弃"""
+    def __init__(self):
+        self._buffer = ""
+        self._current: Optional[SrtCue] = None
+        self._timing_line = ""
+        self._lines: List[str] = []
+        # 文本后面的纯数字行可能是下一条的序号，看到下一行才能确定
+        self._pending_number: Optional[str] = None
+        self.cue_count = 0
+
+    def feed(self, text: str) -> List[SrtCue]:
+        self._buffer += (text or "").replace("\r\n", "\n")
+        completed = []
+        while "\n" in self._buffer:
+            line, self._buffer = self._buffer.split("\n", 1)
+            completed.extend(self._process_line(line))
+        return completed
+
+    def finish(self) -> List[SrtCue]:
+        """流结束：处理最后不完整的一行并输出最后一条字幕"""
+        completed = []
+        if self._buffer:
+            line, self._buffer = self._buffer, ""
+            completed.extend(self._process_line(line))
+        if self._pending_number is not None:
+            self._lines.append(self._pending_number)
+            self._pending_number = None
+        completed.extend(self._emit())
+        return completed
+
+    def _process_line(self, raw_line: str) -> List[SrtCue]:
+        match = TIMING_LINE.match(raw_line)
+        if match:
+            self._pending_number = None
+            completed = self._emit()
+            groups = match.groups()
+            self._current = SrtCue(parse_timestamp(*groups[:4]), parse_timestamp(*groups[4:]), "")
+            self._timing_line = raw_line
+            self._lines = []
+            return completed
+        if self._current is None:
+            return []
+        line = raw_line.strip()
+        if not line:
+            self._pending_number = None
+            return self._emit() if self._lines else []
+        if self._pending_number is not None:
+            self._lines.append(self._pending_number)
+            self._pending_number = None
+        if line.isdigit() and self._lines:
+            self._pending_number = line
+        else:
+            self._lines.append(line)
+        return []
+
+    def _emit(self) -> List[SrtCue]:
+        cue, lines = self._current, self._lines
+        self._current, self._lines = None, []
+        if not cue or not lines:
+            return []
+        cue.text = "\n".join(lines)
+        cue.issues = cue_issues(cue, self._timing_line)
+        self.cue_count += 1
+        return [cue]
+
+
+def parse_srt(content: str) -> List[SrtCue]:
+    """宽松解析完整的 SRT 文本"""
+    parser = StreamingSrtParser()
+    return parser.feed(content) + parser.finish()
+
+
+def format_srt(cues: List[SrtCue]) -> str:
+    return "".join(
+        f"{index}\n{format_timestamp(cue.start)} --> {format_timestamp(cue.end)}\n{cue.text}\n\n"
+        for index, cue in enumerate(cues, 1)
+    )
+
+
+# --- Validation & Auto-fix ---
+# 模型输出的 SRT 常见问题（时间分隔符用句点、多行字幕、超长、重叠、序号错乱、句末标点）
+# 会导致浏览器端 FFmpeg 的 subtitles 滤镜出错；服务端统一修复，不必为格式问题重新生成。
+
+MAX_LATIN_CUE_CHARS = 42
+MIN_CUE_SECONDS = 0.3
+SECONDS_PER_CHAR = 0.25
+SPLIT_PUNCTUATION = "，,、；;：: "
+
+
+def _cue_length(text: str) -> int:
+    return len(re.sub(r"\s", "", text)) if CJK.search(text) else len(text)
+
+
+def _max_chars(text: str) -> int:
+    return MAX_CUE_CHARS if CJK.search(text) else MAX_LATIN_CUE_CHARS
+
+
+def _split_text(text: str, max_chars: int) -> List[str]:
+    """按字数预算切分，尽量在标点或空格处断开（断点处的标点去掉）"""
+    pieces = []
+    while _cue_length(text) > max_chars:
+        target = len(text) // -(-_cue_length(text) // max_chars)
+        window = max(2, max_chars // 3)
+        candidates = [i for i in range(max(1, target - window), min(len(text) - 1, target + window) + 1) if text[i] in SPLIT_PUNCTUATION]
+        split_at = min(candidates, key=lambda i: abs(i - target)) if candidates else target
+        head, text = text[:split_at].strip(SPLIT_PUNCTUATION), text[split_at:].strip(SPLIT_PUNCTUATION)
+        if head:
+            pieces.append(head)
+    if text:
+        pieces.append(text)
+    return pieces
+
+
+def _split_cue(cue: SrtCue, texts: List[str]) -> List[SrtCue]:
+    """按字数比例分配时间"""
+    total = sum(max(1, _cue_length(t)) for t in texts)
+    duration = cue.end - cue.start
+    result, start = [], cue.start
+    for text in texts:
+        end = start + duration * max(1, _cue_length(text)) / total
+        result.append(SrtCue(start, end, text))
+        start = end
+    result[-1].end = cue.end
+    return result
+
+
+class SrtFixReport:
+    def __init__(self):
+        self.input_cues = 0
+        self.output_cues = 0
+        self.fixes: Dict[str, int] = {}
+
+    def add(self, fix: str, count: int = 1):
+        if count:
+            self.fixes[fix] = self.fixes.get(fix, 0) + count
+
+    @property
+    def changed(self) -> bool:
+        return bool(self.fixes)
+
+    def to_dict(self) -> Dict:
+        return {"input_cues": self.input_cues, "output_cues": self.output_cues, "fixes": self.fixes}
+
+
+def fix_srt(content: str) -> Tuple[str, SrtFixReport]:
+    """解析并修复 SRT：统一时间格式、按字数拆分多行/超长字幕并按比例分配时间、
+    修正非正时长和重叠、去掉句末标点并重新编号"""
+    report = SrtFixReport()
+    cues = parse_srt(content)
+    report.input_cues = len(cues)
+    report.add("timestamp_format", sum(1 for cue in cues if "timestamp_format" in cue.issues))
+    if cues and list(content_indexes(content)) != list(range(1, len(cues) + 1)):
+        report.add("numbering")
+
+    if any(a.start > b.start for a, b in zip(cues, cues[1:])):
+        report.add("order")
+
+    fixed: List[SrtCue] = []
+    for cue in sorted(cues, key=lambda c: c.start):
+        texts = []
+        lines = [line.strip() for line in cue.text.split("\n") if line.strip()]
+        if len(lines) > 1:
+            report.add("multi_line")
+        for line in lines:
+            parts = _split_text(line, _max_chars(line))
+            if len(parts) > 1:
+                report.add("too_long")
+            texts.extend(parts)
+        stripped = [text.rstrip(FORBIDDEN_ENDINGS).rstrip() for text in texts]
+        report.add("ending_punctuation", sum(1 for a, b in zip(texts, stripped) if a != b))
+        texts = [text for text in stripped if text]
+        if not texts:
+            report.add("empty")
+            continue
+        if cue.end <= cue.start:
+            report.add("non_positive_duration")
+            cue.end = cue.start + max(1.0, SECONDS_PER_CHAR * sum(_cue_length(t) for t in texts))
+        fixed.extend(_split_cue(cue, texts) if len(texts) > 1 else [SrtCue(cue.start, cue.end, texts[0])])
+
+    overlaps = 0
+    for current, following in zip(fixed, fixed[1:]):
+        if current.end > following.start:
+            overlaps += 1
+            current.end = following.start
+            if current.end - current.start < MIN_CUE_SECONDS:
+                # 同时开始的字幕：给前一条留出最短显示时间，后一条顺延
+                current.end = current.start + MIN_CUE_SECONDS
+                following.start = current.end
+                following.end = max(following.end, following.start + MIN_CUE_SECONDS)
+    report.add("overlap", overlaps)
+    report.output_cues = len(fixed)
+    return format_srt(fixed), report
+
+
+def content_indexes(content: str):
+    """SRT 中时间行前面的序号"""
+    previous = None
+    for line in (content or "").replace("\r\n", "\n").split("\n"):
+        if TIMING_LINE.match(line) and previous is not None and previous.strip().isdigit():
+            yield int(previous.strip())
+        previous = line
+
+
+# --- Segmented Generation ---
+
+def _snap_split(target: float, lower: float, snap_points: Optional[List[float]], snap_window: float) -> float:
+    """切分点移到 snap_window 内最近的镜头边界（必须在 lower 之后），附近没有时保持不变"""
+    candidates = [p for p in snap_points or [] if abs(p - target) <= snap_window and p > lower]
+    return min(candidates, key=lambda p: abs(p - target)) if candidates else target
+
+
+def plan_segments(duration: float, segment_seconds: float, overlap_seconds: float,
+                  snap_points: Optional[List[float]] = None, snap_window: float = 0) -> List[Tuple[float, float]]:
+    """把 [0, duration] 切成长度约 segment_seconds、相邻片段重叠 overlap_seconds 的片段；
+    最后一段太短时并入前一段。给出 snap_points（镜头边界）时切分点对齐到附近的边界"""
+    if duration <= segment_seconds:
+        return [(0.0, duration)]
+    segments = []
+    start = 0.0
+    while start < duration:
+        next_start = _snap_split(start + segment_seconds, start + segment_seconds / 2, snap_points, snap_window)
+        end = min(duration, next_start + overlap_seconds)
+        if duration - end < segment_seconds / 4:
+            end = duration
+        segments.append((start, end))
+        if end >= duration:
+            break
+        start = next_start
+    return segments
+
+
+def _normalize_text(text: str) -> str:
+    return re.sub(r"[\s,，。.!！?？、:：;；\"'“”‘’]", "", text).lower()
+
+
+def merge_segment_cues(segments: List[Tuple[float, float]], segment_cues: List[List[SrtCue]], duplicate_window: float = 2.0) -> List[SrtCue]:
+    """合并各片段的字幕（时间戳已是全片时间）。
+    相邻片段的重叠区域以中点为界各取一半，再去掉边界附近文本相同的重复字幕"""
+    merged: List[SrtCue] = []
+    for index, cues in enumerate(segment_cues):
+        lower = (segments[index - 1][1] + segments[index][0]) / 2 if index > 0 else float("-inf")
+        upper = (segments[index][1] + segments[index + 1][0]) / 2 if index + 1 < len(segments) else float("inf")
+        for cue in sorted(cues, key=lambda c: c.start):
+            if not lower <= cue.start < upper:
+                continue
+            if merged and _normalize_text(merged[-1].text) == _normalize_text(cue.text) and cue.start - merged[-1].start < duplicate_window:
+                merged[-1].end = max(merged[-1].end, cue.end)
+                continue
+            merged.append(SrtCue(cue.start, cue.end, cue.text, list(cue.issues)))
+    merged.sort(key=lambda c: c.start)
+    # 片段边界处的字幕可能与下一条重叠，截断到下一条开始
+    for current, following in zip(merged, merged[1:]):
+        if current.end > following.start:
+            current.end = max(current.start, following.start)
+    return merged
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# 后端模块是平铺导入的（main.py 同目录），测试时同样从 backend 目录导入
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,69 @@
+import os
+
+import pytest
+
+from artifacts import ArtifactStore, etag_matches, iter_file_range, parse_range
+
+ETAG = '"' + "a" * 64 + '"'
+
+
+def test_etag_matches():
+    assert etag_matches(ETAG, ETAG)
+    assert etag_matches(f'"other", W/{ETAG}', ETAG)
+    assert etag_matches(" * ", ETAG)
+    assert not etag_matches(None, ETAG)
+    assert not etag_matches("", ETAG)
+    assert not etag_matches('"other"', ETAG)
+    assert not etag_matches("a" * 64, ETAG)
+
+
+def test_parse_range():
+    assert parse_range(None, 100) is None
+    assert parse_range("bytes=0-9", 100) == (0, 9)
+    assert parse_range("bytes=90-", 100) == (90, 99)
+    assert parse_range("bytes=50-500", 100) == (50, 99)
+    assert parse_range("bytes=-10", 100) == (90, 99)
+    assert parse_range("bytes=-500", 100) == (0, 99)
+    # 无法解析或多范围时返回完整内容
+    assert parse_range("bytes=-", 100) is None
+    assert parse_range("bytes=0-9,20-29", 100) is None
+    assert parse_range("items=0-9", 100) is None
+
+
+@pytest.mark.parametrize("header", ["bytes=100-", "bytes=100-200", "bytes=20-10", "bytes=-0"])
+def test_parse_range_not_satisfiable(header):
+    with pytest.raises(ValueError):
+        parse_range(header, 100)
+
+
+def test_put_file_moves_and_deduplicates(tmp_path):
+    store = ArtifactStore(str(tmp_path / "artifacts"))
+    source = tmp_path / "output.mp4"
+    source.write_bytes(b"0123456789")
+    artifact = store.put_file(str(source), "output.mp4", move=True)
+    assert not source.exists()
+    assert artifact.mime_type == "video/mp4"
+    assert b"".join(iter_file_range(artifact.path, 2, 5, chunk_size=3)) == b"2345"
+
+    duplicate = tmp_path / "copy.mp4"
+    duplicate.write_bytes(b"0123456789")
+    assert store.put_file(str(duplicate), "copy.mp4", move=True).artifact_id == artifact.artifact_id
+    assert not duplicate.exists()
+    assert store.stats()["deduplicated"] == 1
+    assert os.path.getsize(store.get(artifact.artifact_id).path) == 10
+
+
+def test_each_link_keeps_its_filename(tmp_path):
+    store = ArtifactStore(str(tmp_path))
+    first = store.put_bytes(b"1\n00:00:01,000 --> 00:00:02,000\nhello\n\n", "字幕 1.srt")
+    second = store.put_bytes(b"1\n00:00:01,000 --> 00:00:02,000\nhello\n\n", "other.vtt")
+    assert first.artifact_id == second.artifact_id
+    assert first.url == f"/api/artifacts/{first.artifact_id}/%E5%AD%97%E5%B9%95%201.srt"
+    assert second.url == f"/api/artifacts/{first.artifact_id}/other.vtt"
+    assert store.get(first.artifact_id, "字幕 1.srt").filename == "字幕 1.srt"
+    assert store.get(first.artifact_id, "other.vtt").mime_type == "text/vtt"
+    # 不带文件名的地址使用第一次保存时的文件名，之后的保存不会覆盖
+    legacy = store.get(first.artifact_id)
+    assert (legacy.filename, legacy.mime_type) == ("字幕 1.srt", "application/x-subrip")
+    assert store.get("0" * 64) is None
+    assert store.get("../etc/passwd") is None
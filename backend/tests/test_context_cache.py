@@ -0,0 +1,50 @@
+from context_cache import ContextCacheManager
+
+MODEL = "gemini-2.5-flash"
+
+
+def test_created_only_after_min_uses_and_tokens():
+    manager = ContextCacheManager(ttl_seconds=3600, min_uses=2, min_tokens=4096)
+    manager.record_use("hash")
+    assert not manager.should_create("hash", MODEL, 10000)
+    manager.record_use("hash")
+    assert manager.should_create("hash", MODEL, 10000)
+    assert not manager.should_create("hash", MODEL, 4095)
+    assert not manager.should_create("other", MODEL, 10000)
+
+
+def test_failure_backoff_is_per_model():
+    manager = ContextCacheManager(ttl_seconds=3600, min_uses=1, failure_backoff_seconds=600)
+    manager.record_use("hash")
+    manager.mark_failed("hash", MODEL)
+    assert not manager.should_create("hash", MODEL, 10000)
+    assert manager.should_create("hash", "gemini-2.5-pro", 10000)
+    manager._failed_until[("hash", MODEL)] -= 601
+    assert manager.should_create("hash", MODEL, 10000)
+
+
+def test_refresh_and_expiry():
+    manager = ContextCacheManager(ttl_seconds=3600)
+    entry = manager.store("cachedContents/1", "hash", MODEL)
+    assert manager.get("hash", MODEL) is entry
+    assert not manager.needs_refresh(entry)
+    entry.expire_at -= 1801
+    assert manager.needs_refresh(entry)
+    manager.refreshed(entry)
+    assert not manager.needs_refresh(entry)
+    # 快要过期的条目不再使用
+    entry.expire_at = entry.expire_at - 3600 + 29
+    assert manager.get("hash", MODEL) is None
+
+
+def test_invalidate_returns_removed_entries():
+    manager = ContextCacheManager(ttl_seconds=3600)
+    flash = manager.store("cachedContents/1", "hash", MODEL)
+    pro = manager.store("cachedContents/2", "hash", "gemini-2.5-pro")
+    other = manager.store("cachedContents/3", "other", MODEL)
+    assert manager.invalidate("hash", MODEL) is flash
+    assert manager.invalidate("hash", MODEL) is None
+    manager.store("cachedContents/4", "hash", MODEL)
+    assert sorted(entry.name for entry in manager.invalidate_file("hash")) == ["cachedContents/2", "cachedContents/4"]
+    assert manager.get("hash", "gemini-2.5-pro") is None and pro.name == "cachedContents/2"
+    assert manager.get("other", MODEL) is other
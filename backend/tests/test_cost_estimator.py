@@ -0,0 +1,58 @@
+import pytest
+
+from cost_estimator import (
+    BASE_LATENCY_SECONDS, EXPECTED_OUTPUT_TOKENS, INPUT_TOKENS_PER_SECOND, OUTPUT_TOKENS_PER_SECOND,
+    SUBTITLE_MIN_OUTPUT_TOKENS, CostEstimator,
+)
+from model_router import ROUTE_ANALYSIS, ROUTE_LONG_VIDEO, ROUTE_SUBTITLE, ROUTE_TRANSFORM, estimate_cost
+
+
+def test_expected_output_tokens_per_route():
+    estimator = CostEstimator()
+    assert estimator.expected_output_tokens(ROUTE_TRANSFORM, 600) == EXPECTED_OUTPUT_TOKENS[ROUTE_TRANSFORM]
+    assert estimator.expected_output_tokens(ROUTE_LONG_VIDEO, 600) == EXPECTED_OUTPUT_TOKENS[ROUTE_LONG_VIDEO]
+    assert estimator.expected_output_tokens("unknown", None) == EXPECTED_OUTPUT_TOKENS[ROUTE_ANALYSIS]
+    # 字幕输出随时长增长，短视频有下限
+    assert estimator.expected_output_tokens(ROUTE_SUBTITLE, 600) == 3000
+    assert estimator.expected_output_tokens(ROUTE_SUBTITLE, 10) == SUBTITLE_MIN_OUTPUT_TOKENS
+    assert estimator.expected_output_tokens(ROUTE_SUBTITLE, None) == SUBTITLE_MIN_OUTPUT_TOKENS
+
+
+def test_estimate_without_calibration():
+    estimate = CostEstimator().estimate("gemini-2.5-flash", ROUTE_ANALYSIS, 100_000, 300, "duration", "low")
+    assert (estimate.input_tokens, estimate.output_tokens) == (100_000, 1200)
+    assert estimate.latency_seconds == pytest.approx(
+        BASE_LATENCY_SECONDS + 100_000 / INPUT_TOKENS_PER_SECOND + 1200 / OUTPUT_TOKENS_PER_SECOND
+    )
+    assert estimate.cost_usd == pytest.approx(estimate_cost("gemini-2.5-flash", 100_000, 1200))
+    assert estimate.to_dict()["media_resolution"] == "low"
+    assert CostEstimator().estimate("unknown-model", ROUTE_ANALYSIS, 1000, None, "size").cost_usd is None
+
+
+def test_calibration_moves_towards_actual_usage():
+    estimator = CostEstimator(smoothing=0.5)
+    estimate = estimator.estimate("gemini-2.5-flash", ROUTE_ANALYSIS, 100_000, 300, "duration")
+    estimator.record_actual(estimate, 200_000, 600, estimate.latency_seconds)
+    calibration = estimator.stats()["gemini-2.5-flash"]
+    assert calibration == {"samples": 1, "input_ratio": 1.5, "output_ratio": 0.75, "latency_ratio": 1.0}
+
+    calibrated = estimator.estimate("gemini-2.5-flash", ROUTE_ANALYSIS, 100_000, 300, "duration")
+    assert (calibrated.input_tokens, calibrated.output_tokens) == (150_000, 900)
+    # 其他模型不受影响
+    assert estimator.estimate("gemini-2.5-pro", ROUTE_ANALYSIS, 100_000, 300, "duration").input_tokens == 100_000
+
+
+def test_count_tokens_input_is_not_calibrated():
+    estimator = CostEstimator(smoothing=0.5)
+    estimator.record_actual(estimator.estimate("gemini-2.5-flash", ROUTE_ANALYSIS, 100_000, 300, "duration"), 200_000, 1200, 1.0)
+    counted = estimator.estimate("gemini-2.5-flash", ROUTE_ANALYSIS, 100_000, 300, "count_tokens")
+    assert counted.input_tokens == 100_000
+    estimator.record_actual(counted, 50_000, 1200, 1.0)
+    assert estimator.stats()["gemini-2.5-flash"]["input_ratio"] == 1.5
+
+
+def test_missing_usage_keeps_calibration():
+    estimator = CostEstimator()
+    estimate = estimator.estimate("gemini-2.5-flash", ROUTE_TRANSFORM, 1000, None, "size")
+    estimator.record_actual(estimate, 0, 0, 0)
+    assert estimator.stats()["gemini-2.5-flash"] == {"samples": 1, "input_ratio": 1.0, "output_ratio": 1.0, "latency_ratio": 1.0}
@@ -0,0 +1,57 @@
+import asyncio
+import threading
+
+from keyframes import parse_frame_timestamps, select_evenly
+from shot_index import parse_scene_scores, merge_close_boundaries
+from video_proxy import FfmpegWorkerPool
+
+
+def test_parse_frame_timestamps_only_reads_showinfo_lines():
+    stderr = "\n".join([
+        "[Parsed_showinfo_2 @ 0x1] n:   0 pts:      0 pts_time:0       duration:1",
+        "frame=    2 fps=0.0 q=-0.0 pts_time:9.9",
+        "[Parsed_showinfo_2 @ 0x1] n:   1 pts:  12800 pts_time:12.5    duration:1",
+    ])
+    assert parse_frame_timestamps(stderr) == [0.0, 12.5]
+
+
+def test_select_evenly_keeps_first_and_last():
+    assert select_evenly(list(range(10)), 4) == [0, 3, 6, 9]
+    assert select_evenly([1, 2], 5) == [1, 2]
+
+
+def test_parse_scene_scores_and_merge():
+    output = "\n".join([
+        "frame:0    pts:100   pts_time:4",
+        "lavfi.scene_score=0.45",
+        "frame:1    pts:110   pts_time:4.4",
+        "lavfi.scene_score=0.9",
+        "frame:2    pts:300   pts_time:12",
+        "lavfi.scene_score=0.35",
+    ])
+    boundaries = parse_scene_scores(output)
+    assert boundaries == [(4.0, 0.45), (4.4, 0.9), (12.0, 0.35)]
+    assert merge_close_boundaries(boundaries, 1.0) == [(4.4, 0.9), (12.0, 0.35)]
+    assert merge_close_boundaries([(0.5, 0.9)], 1.0) == []
+
+
+def test_worker_pool_runs_concurrent_requests_once():
+    calls = []
+    release = threading.Event()
+
+    def work(value):
+        calls.append(value)
+        release.wait(5)
+        return value * 2
+
+    async def main():
+        pool = FfmpegWorkerPool(1)
+        first = asyncio.create_task(pool.run("key", work, 21))
+        await asyncio.sleep(0.05)
+        second = asyncio.create_task(pool.run("key", work, 21))
+        await asyncio.sleep(0.05)
+        release.set()
+        return await asyncio.gather(first, second)
+
+    assert asyncio.run(main()) == [42, 42]
+    assert calls == [21]
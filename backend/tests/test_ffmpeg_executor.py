@@ -0,0 +1,97 @@
+import pytest
+
+from ffmpeg_executor import (
+    FfmpegExecutor, CommandRejected, INPUT_FORMAT_WHITELIST, unescape_filter_value, parse_filter_arguments, format_filter_arguments
+)
+from ffmpeg_validator import parse_filtergraph
+
+
+@pytest.fixture
+def executor(tmp_path):
+    return FfmpegExecutor(str(tmp_path), fonts_dir="/srv/fonts")
+
+
+def prepare(executor, *args, subtitles_filename=None):
+    return executor.prepare_command(["-i", "input.mp4", *args], ["input.mp4"], subtitles_filename)
+
+
+def test_unescape_filter_value():
+    assert unescape_filter_value(r"\/etc/passwd") == "/etc/passwd"
+    assert unescape_filter_value("'a:b'\\:c  ") == "a:b:c"
+    assert unescape_filter_value(r"  x\ ") == "x "
+
+
+def test_parse_filter_arguments_matches_ffmpeg_levels():
+    args = parse_filtergraph(r"drawtext=fontfile=a.ttf:text='Hello\, world\: 1':24")[0][0].args
+    assert parse_filter_arguments(args) == [("fontfile", "a.ttf"), ("text", "Hello, world: 1"), (None, "24")]
+
+
+def test_format_filter_arguments_round_trip():
+    arguments = [("text", "a:b, c'd [x]"), (None, "back\\slash")]
+    graph = "drawtext=" + ":".join(format_filter_arguments(arguments))
+    assert parse_filter_arguments(parse_filtergraph(graph)[0][0].args) == arguments
+
+
+@pytest.mark.parametrize("graph", [
+    r"drawtext=textfile=\/etc/passwd",
+    r"drawtext=text=hi:textfile='/etc/passwd'",
+    r"drawtext=\/etc/passwd:text=hi",
+    r"drawtext=fontfile=font.ttf",
+    r"metadata=mode=print:file=\/tmp/pwn.txt",
+    "lut3d=/etc/passwd",
+    "movie=/etc/passwd",
+    "sendcmd=f=cmds.txt",
+    r"curves=psfile=..\/..\/x.acv",
+    "curves=none:::::::/tmp/plot.txt",
+    r"deshake=filename=\/tmp/log",
+    "subtitles=input.mp4",
+    r"subtitles=f=\/etc/passwd",
+    "drawbox=color=red:t=/etc/x",
+])
+def test_rejects_files_outside_job(executor, graph):
+    with pytest.raises(CommandRejected):
+        prepare(executor, "-vf", graph, "out.mp4", subtitles_filename="subs.srt")
+
+
+@pytest.mark.parametrize("args", [
+    ["-unknown", "out.mp4"],
+    ["-filter_complex_script", "graph.txt", "out.mp4"],
+    ["-attach", "input.mp4", "out.mp4"],
+    ["-x264-params", "stats=/tmp/x264.log", "out.mp4"],
+    ["-c", "copy", "/tmp/out.mp4"],
+    ["-c", "copy", "input.mp4"],
+])
+def test_rejects_options(executor, args):
+    with pytest.raises(CommandRejected):
+        prepare(executor, *args)
+
+
+def test_rejects_forced_input_format(executor):
+    with pytest.raises(CommandRejected):
+        executor.prepare_command(["-f", "concat", "-i", "input.mp4", "out.mp4"], ["input.mp4"], None)
+
+
+def test_accepts_common_command(executor):
+    command = prepare(executor, "-vf", "scale=1280:-2,setsar=1", "-c:v", "libx264", "-crf", "23", "-dn", "-f", "mp4", "out.mp4")
+    assert command == [
+        "-format_whitelist", INPUT_FORMAT_WHITELIST, "-i", "input.mp4",
+        "-vf", "scale=1280:-2,setsar=1", "-c:v", "libx264", "-crf", "23", "-dn", "-f", "mp4", "out.mp4"
+    ]
+
+
+def test_rewrites_font_paths(executor):
+    command = prepare(
+        executor, "-vf", "subtitles=subs.srt:fontsdir=/customfonts:force_style='Fontname=X,Fontsize=24'", "out.mp4",
+        subtitles_filename="subs.srt"
+    )
+    arguments = parse_filter_arguments(parse_filtergraph(command[5])[0][0].args)
+    assert arguments == [(None, "subs.srt"), ("fontsdir", "/srv/fonts"), ("force_style", "Fontname=X,Fontsize=24")]
+
+    command = prepare(executor, "-vf", "drawtext=fontfile=/customfonts/a.ttf:text=hi", "out.mp4")
+    assert command[5] == "drawtext=fontfile=/srv/fonts/a.ttf:text=hi"
+
+
+def test_drops_fonts_dir_without_server_fonts(tmp_path):
+    executor = FfmpegExecutor(str(tmp_path))
+    command = prepare(executor, "-vf", "subtitles=subs.srt:fontsdir=/customfonts", "out.mp4", subtitles_filename="subs.srt")
+    assert command[5] == "subtitles=subs.srt"
@@ -0,0 +1,103 @@
+import pytest
+
+from ffmpeg_templates import FfmpegTemplateEngine, atempo_chain, build_command, parse_duration, parse_prompt
+
+
+def command_for(prompt: str, input_filename: str = "my video.mp4", media_info=None) -> list:
+    plan = parse_prompt(prompt)
+    assert plan is not None, prompt
+    return build_command(plan, input_filename, media_info).command_array
+
+
+def test_parse_duration():
+    assert parse_duration("1:20") == 80
+    assert parse_duration("1:02:03") == 3723
+    assert parse_duration("1分20秒") == 80
+    assert parse_duration("20秒") == 20
+    assert parse_duration("2.5") == 2.5
+
+
+def test_atempo_chain():
+    assert atempo_chain(2) == ["atempo=2"]
+    assert atempo_chain(4) == ["atempo=2.0", "atempo=2"]
+    assert atempo_chain(0.25) == ["atempo=0.5", "atempo=0.5"]
+
+
+@pytest.mark.parametrize("prompt, expected", [
+    ("截取前10秒", ["-i", "my video.mp4", "-t", "10", "-c:v", "copy", "-c:a", "copy", "-movflags", "+faststart", "my_video_trimmed.mp4"]),
+    ("去掉开头5秒", ["-ss", "5", "-i", "my video.mp4", "-c:v", "copy", "-c:a", "copy", "-movflags", "+faststart", "my_video_trimmed.mp4"]),
+    ("最后10秒", ["-sseof", "-10", "-i", "my video.mp4", "-c:v", "copy", "-c:a", "copy", "-movflags", "+faststart", "my_video_trimmed.mp4"]),
+    ("从1:00到1:30", ["-ss", "60", "-to", "90", "-i", "my video.mp4", "-c:v", "copy", "-c:a", "copy", "-movflags", "+faststart", "my_video_trimmed.mp4"]),
+    ("提取音频", ["-i", "my video.mp4", "-vn", "-c:a", "libmp3lame", "-q:a", "2", "my_video_audio.mp3"]),
+    ("导出为wav", ["-i", "my video.mp4", "-vn", "-c:a", "pcm_s16le", "my_video_audio.wav"]),
+    ("静音并压缩", [
+        "-i", "my video.mp4", "-c:v", "libx264", "-preset", "veryfast", "-crf", "28", "-pix_fmt", "yuv420p", "-an",
+        "-movflags", "+faststart", "my_video_muted_compressed.mp4",
+    ]),
+    ("2倍速播放", [
+        "-i", "my video.mp4", "-vf", "setpts=PTS/2", "-af", "atempo=2", "-c:v", "libx264", "-preset", "veryfast", "-crf", "23",
+        "-pix_fmt", "yuv420p", "-c:a", "aac", "-b:a", "128k", "-movflags", "+faststart", "my_video_2x.mp4",
+    ]),
+    ("转成720p的webm", [
+        "-i", "my video.mp4", "-vf", "scale=-2:720", "-c:v", "libvpx-vp9", "-crf", "32", "-b:v", "0", "-deadline", "realtime",
+        "-cpu-used", "8", "-c:a", "libopus", "-b:a", "96k", "my_video_720p_webm.webm",
+    ]),
+])
+def test_build_command(prompt, expected):
+    assert command_for(prompt) == expected
+
+
+def test_slow_motion_and_rotation_chain_filters():
+    command = command_for("慢放并顺时针旋转90度")
+    assert command[command.index("-vf") + 1] == "setpts=PTS/0.5,transpose=1"
+    assert command[command.index("-af") + 1] == "atempo=0.5"
+
+
+def test_gif_uses_probed_width_and_drops_audio():
+    command = command_for("剪掉前10秒，转成gif", media_info={"video": {"width": 320}})
+    assert command == ["-ss", "10", "-i", "my video.mp4", "-vf", "fps=10,scale=320:-1:flags=lanczos", "-an", "-loop", "0", "my_video_trimmed_gif.gif"]
+
+
+def test_source_format_is_not_the_output_format():
+    assert command_for("把mov转成mp4", "clip.mov")[-1] == "clip_mp4.mp4"
+    assert command_for("把这个mp4转成gif")[-1] == "my_video_gif.gif"
+
+
+def test_video_without_audio_track():
+    command = command_for("加速2倍", media_info={"audio_streams": []})
+    assert "-af" not in command and "-an" in command
+
+
+@pytest.mark.parametrize("prompt", [
+    "这个视频讲了什么",
+    "给视频加上字幕",
+    "把人物抠出来",
+    "截取前10秒并加上水印",
+    "",
+])
+def test_unrecognized_prompts(prompt):
+    assert parse_prompt(prompt) is None
+
+
+@pytest.mark.parametrize("prompt", [
+    "前10秒和后10秒",
+    "去掉开头5秒，只保留最后10秒",
+    "从0:10到0:20，截取前5秒",
+    "720p并缩小一半",
+    "2倍速然后慢放",
+    "转成mp4和webm",
+    "转成gif和mp4",
+    "提取音频并静音",
+])
+def test_conflicting_prompts(prompt):
+    assert parse_prompt(prompt) is None
+
+
+def test_engine_counts_coverage():
+    engine = FfmpegTemplateEngine()
+    assert engine.match("截取前10秒", "a.mp4") is not None
+    assert engine.match("前10秒和后10秒", "a.mp4") is None
+    assert engine.match("从0:20到0:10", "a.mp4") is None
+    assert not engine.can_handle("前10秒和后10秒")
+    stats = engine.stats()
+    assert (stats["attempts"], stats["matched"], stats["operations"]) == (3, 1, {"trim": 1})
@@ -0,0 +1,158 @@
+import pytest
+
+from ffmpeg_validator import FfmpegCommandValidator, parse_filtergraph, format_filtergraph, split_top_level, validate_command
+
+INPUTS = ["my.mp4", "input.mp4"]
+
+
+def validate(command, output_filename="out.mp4", subtitles_filename=None):
+    return validate_command(command, output_filename, INPUTS, subtitles_filename)
+
+
+def test_valid_command_is_unchanged():
+    command = ["-i", "my.mp4", "-vf", "scale=-2:720", "-c:v", "libx264", "-c:a", "aac", "out.mp4"]
+    result = validate(list(command))
+    assert result.command_array == command
+    assert (result.fixes, result.errors, result.valid) == ([], [], True)
+
+
+def test_string_command_and_ffmpeg_prefix():
+    result = validate("ffmpeg -i my.mp4 -an out.mp4")
+    assert result.command_array == ["-i", "my.mp4", "-an", "out.mp4"]
+
+
+def test_filtergraph_round_trip():
+    graph = "[0:v]scale=w=640:h=-2,drawtext=text='a\\:b, c'[v];[v][1]overlay=x=10:y=10"
+    assert format_filtergraph(parse_filtergraph(graph)) == graph
+    assert split_top_level("a='x,y',b", ",") == ["a='x,y'", "b"]
+
+
+def test_misspelled_option():
+    result = validate(["-i", "my.mp4", "-pixfmt", "yuv420p", "out.mp4"])
+    assert result.command_array[2] == "-pix_fmt"
+    assert result.fixes == ["选项 -pixfmt -> -pix_fmt"]
+
+
+def test_unknown_option_is_a_warning():
+    result = validate(["-i", "my.mp4", "-frobnicate", "out.mp4"])
+    assert result.valid and result.warnings == ["未知选项 -frobnicate"]
+
+
+def test_option_without_value():
+    result = validate(["-i", "my.mp4", "out.mp4", "-t"])
+    assert "选项 -t 缺少参数值" in result.errors
+
+
+def test_missing_input_is_added():
+    result = validate(["-vf", "hflip", "out.mp4"])
+    assert result.command_array[:2] == ["-i", "my.mp4"]
+    assert result.fixes == ["补充输入文件 -i my.mp4"]
+
+
+@pytest.mark.parametrize("name, expected", [("My.mp4", "my.mp4"), ("my.mp", "my.mp4"), ("video.mp4", "my.mp4")])
+def test_misspelled_input_is_corrected(name, expected):
+    result = validate(["-i", name, "out.mp4"])
+    assert result.command_array == ["-i", expected, "out.mp4"]
+    assert result.fixes == [f"输入文件 {name} -> {expected}"]
+
+
+def test_unknown_extra_input_is_an_error():
+    # 叠加图片不能替换成源视频，交给修复请求
+    command = ["-i", "my.mp4", "-i", "logo.png", "-filter_complex", "[0][1]overlay=10:10", "out.mp4"]
+    result = validate(list(command))
+    assert result.command_array == command
+    assert not result.valid
+    assert result.errors[0].startswith("输入文件 logo.png 不存在")
+
+
+def test_placeholder_input_is_kept_when_main_input_is_used():
+    result = validate(["-i", "my.mp4", "-i", "video.mp4", "-filter_complex", "[0][1]hstack", "out.mp4"])
+    assert not result.valid
+
+
+def test_repeated_filters_are_merged():
+    result = validate(["-i", "my.mp4", "-vf", "hflip", "-af", "volume=2", "-vf", "scale=-2:480", "out.mp4"])
+    assert result.command_array == ["-i", "my.mp4", "-vf", "hflip,scale=-2:480", "-af", "volume=2", "out.mp4"]
+    assert result.fixes == ["合并 2 个 -vf 滤镜"]
+
+
+def test_misspelled_filter_and_parameter():
+    result = validate(["-i", "my.mp4", "-vf", "scal=width=640:height=-2,trasnpose=1", "out.mp4"])
+    assert result.command_array[3] == "scale=width=640:height=-2,transpose=1"
+    result = validate(["-i", "my.mp4", "-vf", "pad=width=100:heigth=100", "out.mp4"])
+    assert result.command_array[3] == "pad=width=100:height=100"
+
+
+def test_unknown_filter_and_parameter_are_errors():
+    assert validate(["-i", "my.mp4", "-vf", "foobarzz=5", "out.mp4"]).errors == ["未知滤镜 foobarzz"]
+    assert validate(["-i", "my.mp4", "-vf", "scale=zzz=1", "out.mp4"]).errors == ["scale 滤镜没有参数 zzz"]
+    assert validate(["-i", "my.mp4", "-vf", "hflip,,vflip", "out.mp4"]).errors == ["滤镜图中有空滤镜"]
+
+
+def test_subtitles_filter_is_completed():
+    result = validate(["-i", "my.mp4", "-vf", "subtitles=subs.srt:fontsize=24", "out.mp4"], subtitles_filename="sub.srt")
+    assert result.command_array[3] == "subtitles=sub.srt:fontsdir=/customfonts:force_style='Fontname=Source Han Sans SC,Fontsize=24'"
+    assert result.valid
+
+
+def test_subtitles_filter_keeps_existing_style():
+    result = validate(["-i", "my.mp4", "-vf", "subtitles='sub.srt':fontsdir=/customfonts:force_style='Fontname=Foo,Outline=1'", "out.mp4"],
+                      subtitles_filename="sub.srt")
+    assert result.command_array[3] == "subtitles=sub.srt:fontsdir=/customfonts:force_style='Fontname=Foo,Outline=1'"
+    assert result.fixes == []
+
+
+def test_subtitles_filter_without_subtitles_content():
+    result = validate(["-i", "my.mp4", "-vf", "subtitles=sub.srt", "out.mp4"])
+    assert "subtitles 滤镜引用了 sub.srt，但没有生成字幕内容" in result.errors
+
+
+def test_missing_output_is_appended():
+    result = validate(["-i", "my.mp4", "-vf", "hflip"])
+    assert result.command_array[-1] == "out.mp4"
+    assert result.fixes == ["补充输出文件 out.mp4"]
+    assert validate(["-i", "my.mp4", "-an"], output_filename="").errors == ["缺少输出文件"]
+
+
+def test_options_after_output_are_moved_before_it():
+    result = validate(["-i", "my.mp4", "-vf", "hflip", "out.mp4", "-t", "5", "-y"])
+    assert result.command_array == ["-i", "my.mp4", "-vf", "hflip", "-t", "5", "-y", "out.mp4"]
+    assert result.command_array.count("out.mp4") == 1
+    assert result.fixes == ["输出文件之后的选项 -t 5 -y 移到输出文件之前"]
+
+
+def test_output_filename_follows_command():
+    result = validate(["-i", "my.mp4", "-an", "result.mp4"])
+    assert result.output_filename == "result.mp4"
+    result = validate(["-i", "my.mp4", "-an", "result"])
+    assert result.command_array[-1] == "out.mp4"
+    assert validate(["-i", "my.mp4", "-an", "input.mp4"], output_filename="input.mp4").errors == ["输出文件 input.mp4 与输入文件同名"]
+
+
+def test_copy_with_filters_is_reencoded():
+    result = validate(["-i", "my.mp4", "-vf", "hflip", "-c", "copy", "out.mp4"])
+    assert result.command_array == ["-i", "my.mp4", "-vf", "hflip", "-c:v", "libx264", "-c:a", "copy", "out.mp4"]
+    result = validate(["-i", "my.mp4", "-af", "volume=2", "-c:a", "copy", "out.mp4"])
+    assert result.command_array[-2] == "aac"
+
+
+def test_encoder_aliases_and_container_mismatch():
+    result = validate(["-i", "my.mp4", "-c:v", "x264", "out.mp4"])
+    assert result.command_array[3] == "libx264"
+    result = validate(["-i", "my.mp4", "-c:v", "libx264", "out.webm"], output_filename="out.webm")
+    assert result.command_array[3] == "libvpx-vp9"
+
+
+def test_audio_output_drops_video_encoder():
+    result = validate(["-i", "my.mp4", "-c:v", "libx264", "-c:a", "libmp3lame", "out.mp3"], output_filename="out.mp3")
+    assert result.command_array == ["-i", "my.mp4", "-c:a", "libmp3lame", "-vn", "out.mp3"]
+
+
+def test_validator_stats():
+    validator = FfmpegCommandValidator()
+    validator.validate(["-i", "My.mp4", "out.mp4"], "out.mp4", INPUTS)
+    validator.validate(["-i", "my.mp4", "-vf", "foobarzz", "out.mp4"], "out.mp4", INPUTS)
+    validator.record_repair(False)
+    stats = validator.stats()
+    assert (stats["validated"], stats["corrected"], stats["invalid"], stats["repair_failures"]) == (2, 1, 1, 1)
+    assert stats["fixes"] == {"输入文件": 1} and stats["errors"] == {"未知滤镜": 1}
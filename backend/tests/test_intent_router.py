@@ -0,0 +1,92 @@
+import re
+
+import pytest
+
+from intent_router import INTENT_ANALYSIS, INTENT_SUBTITLE, INTENT_TRANSFORM, SHOT_BOUNDARY_PATTERN, classify_intent
+
+
+@pytest.mark.parametrize("prompt", [
+    "生成中文字幕",
+    "给视频加上英文subtitle",
+    "导出SRT",
+    "把对话转录成文字",
+    # 同时出现变换操作时仍按字幕处理
+    "生成字幕并转成mp4",
+])
+def test_subtitle_prompts(prompt):
+    decision = classify_intent(prompt)
+    assert decision.intent == INTENT_SUBTITLE
+    assert decision.needs_video
+
+
+@pytest.mark.parametrize("prompt, matched", [
+    ("转成gif", "转成"),
+    ("Convert to MP4", "mp4"),
+    ("裁剪前10秒", "前10秒"),
+    ("去掉开头5秒", "去掉开头"),
+    ("压缩到720p", "720p"),
+    ("2倍速播放", "倍速"),
+    ("静音", "静音"),
+    ("提取音频", "提取音频"),
+    ("旋转90度", "旋转"),
+])
+def test_metadata_only_transform_prompts(prompt, matched):
+    decision = classify_intent(prompt)
+    assert decision.intent == INTENT_TRANSFORM
+    assert not decision.needs_video
+    assert matched in decision.matched
+
+
+@pytest.mark.parametrize("prompt, content", [
+    ("剪掉片头", "片头"),
+    ("把广告部分裁剪掉", "广告"),
+    ("截取有人物出现的片段", "有人物出现的片段"),
+    ("把精彩片段导出为gif", "精彩"),
+    ("Cut the highlight scenes", "highlight"),
+])
+def test_transform_prompts_that_depend_on_content_need_the_video(prompt, content):
+    decision = classify_intent(prompt)
+    assert decision.intent == INTENT_TRANSFORM
+    assert decision.needs_video
+    assert content in decision.matched
+
+
+@pytest.mark.parametrize("prompt", [
+    "这个视频讲了什么",
+    "总结一下",
+    "找出精彩片段",
+    "Describe the video",
+    # 只有时间范围、没有变换操作时是内容分析
+    "前30秒讲了什么",
+    "",
+    None,
+])
+def test_analysis_prompts(prompt):
+    decision = classify_intent(prompt)
+    assert decision.intent == INTENT_ANALYSIS
+    assert decision.needs_video
+
+
+def test_time_range_is_only_matched_for_transforms():
+    assert "前30秒" in classify_intent("截取前30秒").matched
+    assert "前30秒" not in classify_intent("前30秒讲了什么").matched
+
+
+@pytest.mark.parametrize("prompt, expected", [
+    ("剪掉片头", True),
+    ("按场景切分", True),
+    ("把视频切成三段", True),
+    ("按镜头拆分后转成gif", True),
+    ("split by scene", True),
+    ("转成gif", False),
+    ("裁剪前10秒", False),
+    ("这个视频讲了什么", False),
+])
+def test_shot_boundary_prompts(prompt, expected):
+    assert (re.search(SHOT_BOUNDARY_PATTERN, prompt.lower()) is not None) == expected
+    assert classify_intent(prompt).needs_shot_index == expected
+
+
+def test_subtitle_prompts_do_not_wait_for_shot_index():
+    # 字幕分段只使用已有的镜头索引，不为此等待
+    assert not classify_intent("按场景生成字幕").needs_shot_index
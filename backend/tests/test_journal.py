@@ -0,0 +1,38 @@
+import os
+
+from journal import JobJournal
+
+
+def test_records_are_written_by_writer_thread(tmp_path):
+    journal = JobJournal(str(tmp_path), flush_interval=0.05)
+    journal.record("task", "created", prompt="p")
+    journal.record("task", "stream", durable=False, text="a")
+    journal.record("task", "stream", durable=False, text="b")
+    journal.record("task", "stage", stage="complete", percentage=100)
+    assert journal.flush(5)
+    record = journal.load("task")
+    assert record.prompt == "p"
+    assert record.partial_text == "ab"
+    assert record.is_finished
+
+
+def test_finish_removes_spooled_upload_after_writes(tmp_path):
+    journal = JobJournal(str(tmp_path), flush_interval=0.05)
+    spool_path = journal.spool_video("task", b"video", ".mp4")
+    journal.record("task", "created", prompt="p", spool_path=spool_path)
+    journal.finish("task")
+    assert journal.flush(5)
+    assert not os.path.exists(spool_path)
+    assert journal.load("task").spool_path == spool_path
+
+
+def test_created_entry_keeps_request_options(tmp_path):
+    journal = JobJournal(str(tmp_path), flush_interval=0.05)
+    journal.record("task", "created", prompt="p", sampling={"fps": 1}, execute_on_server=True, bypass_cache=True)
+    journal.record("legacy", "created", prompt="p")
+    assert journal.flush(5)
+    record = journal.load("task")
+    assert (record.sampling, record.execute_on_server, record.bypass_cache) == ({"fps": 1}, True, True)
+    # 旧版本写入的日志没有这些字段
+    legacy = journal.load("legacy")
+    assert (legacy.execute_on_server, legacy.bypass_cache) == (False, False)
@@ -0,0 +1,88 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+from keyframes import INDEX_FILENAME, KeyframeExtractor, build_keyframe_command
+
+# 代替 ffmpeg：按 KEYFRAME_TIMES 写出帧图片，并像 showinfo 一样在 stderr 输出 pts_time
+FAKE_FFMPEG = """#!{python}
+import os, sys
+if os.environ.get("KEYFRAME_FAIL"):
+    sys.exit(1)
+times = [t for t in os.environ.get("KEYFRAME_TIMES", "0,5,10").split(",") if t]
+for index, t in enumerate(times, 1):
+    with open(sys.argv[-1] % index, "wb") as f:
+        f.write(b"jpeg")
+    sys.stderr.write(f"[Parsed_showinfo_2 @ 0x1] n:{{index - 1}} pts_time:{{t}} duration:1\\n")
+if os.environ.get("KEYFRAME_EXTRA_FILE"):
+    with open(sys.argv[-1] % (len(times) + 1), "wb") as f:
+        f.write(b"jpeg")
+"""
+
+
+@pytest.fixture
+def extractor(tmp_path):
+    ffmpeg = tmp_path / "ffmpeg"
+    ffmpeg.write_text(FAKE_FFMPEG.format(python=sys.executable))
+    ffmpeg.chmod(0o755)
+    return KeyframeExtractor(str(tmp_path / "keyframes"), ffmpeg_binary=str(ffmpeg), max_frames=3)
+
+
+def test_keyframe_command_selects_scene_changes_and_gaps():
+    command = build_keyframe_command("ffmpeg", "in.mp4", "out/frame_%05d.jpg", 0.3, 1.0, 30.0, 360)
+    video_filter = command[command.index("-vf") + 1]
+    assert "isnan(prev_selected_t)" in video_filter
+    assert "gte(t-prev_selected_t,30)" in video_filter
+    assert "gt(scene,0.3)*gte(t-prev_selected_t,1)" in video_filter
+    assert "scale=-2:'min(360,ih)'" in video_filter and video_filter.endswith(",showinfo")
+    assert command[-1] == "out/frame_%05d.jpg"
+
+
+def test_extract_keeps_max_frames_and_caches(extractor, monkeypatch):
+    monkeypatch.setenv("KEYFRAME_TIMES", "0,4,8,12,16")
+    keyframes = asyncio.run(extractor.get_or_extract("hash", "in.mp4"))
+    assert [frame.timestamp for frame in keyframes.frames] == [0.0, 8.0, 16.0]
+    assert not keyframes.cached
+    frames_dir = os.path.join(extractor.directory, "hash")
+    assert sorted(os.listdir(frames_dir)) == ["frame_00001.jpg", "frame_00003.jpg", "frame_00005.jpg", INDEX_FILENAME]
+    assert all(os.path.dirname(frame.path) == frames_dir for frame in keyframes.frames)
+
+    cached = asyncio.run(extractor.get_or_extract("hash", "in.mp4"))
+    assert cached.cached
+    assert [frame.to_dict() for frame in cached.frames] == [frame.to_dict() for frame in keyframes.frames]
+    assert cached.total_bytes == 12
+    assert (extractor.stats()["extractions"], extractor.stats()["cache_hits"]) == (1, 1)
+
+
+def test_incomplete_cache_is_ignored(extractor):
+    keyframes = asyncio.run(extractor.get_or_extract("hash", "in.mp4"))
+    os.remove(keyframes.frames[0].path)
+    assert extractor.get_cached("hash") is None
+    assert extractor.get_cached(None) is None
+
+
+def test_mismatched_timestamps_fail(extractor, monkeypatch):
+    monkeypatch.setenv("KEYFRAME_EXTRA_FILE", "1")
+    assert asyncio.run(extractor.get_or_extract("hash", "in.mp4")) is None
+    assert os.listdir(extractor.directory) == []
+    # 失败的视频不再重试
+    monkeypatch.delenv("KEYFRAME_EXTRA_FILE")
+    assert asyncio.run(extractor.get_or_extract("hash", "in.mp4")) is None
+    assert extractor.stats()["failures"] == 1
+
+
+def test_ffmpeg_error_fails(extractor, monkeypatch):
+    monkeypatch.setenv("KEYFRAME_FAIL", "1")
+    assert asyncio.run(extractor.get_or_extract("hash", "in.mp4")) is None
+    assert extractor.stats()["failures"] == 1
+
+
+def test_cleanup_expired(extractor):
+    asyncio.run(extractor.get_or_extract("hash", "in.mp4"))
+    frames_dir = os.path.join(extractor.directory, "hash")
+    assert extractor.cleanup_expired() == 0
+    os.utime(frames_dir, (0, 0))
+    assert extractor.cleanup_expired() == 1
+    assert not os.path.exists(frames_dir)
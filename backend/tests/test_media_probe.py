@@ -0,0 +1,93 @@
+import asyncio
+import json
+
+from media_probe import MediaInfoCache, format_media_info, summarize_probe
+
+PROBE_OUTPUT = {
+    "format": {"duration": "62.500000", "size": "1048576", "bit_rate": "134217", "format_name": "mov,mp4,m4a,3gp,3g2,mj2"},
+    "streams": [
+        {"codec_type": "video", "codec_name": "mjpeg", "disposition": {"attached_pic": 1}},
+        {"codec_type": "video", "codec_name": "h264", "width": 1920, "height": 1080,
+         "avg_frame_rate": "30000/1001", "r_frame_rate": "30/1", "pix_fmt": "yuv420p", "bit_rate": "120000"},
+        {"codec_type": "audio", "codec_name": "aac", "channels": 2, "sample_rate": "48000", "tags": {"language": "eng"}},
+        {"codec_type": "audio", "codec_name": "opus", "channels": 1, "sample_rate": "16000"},
+    ],
+}
+
+
+def test_summarize_probe_skips_cover_art():
+    info = summarize_probe(PROBE_OUTPUT)
+    assert (info["duration"], info["size_bytes"], info["bit_rate"]) == (62.5, 1048576, 134217)
+    assert info["video"] == {"codec": "h264", "width": 1920, "height": 1080, "fps": 29.97, "pix_fmt": "yuv420p", "bit_rate": 120000}
+    assert info["audio_streams"][0] == {"codec": "aac", "channels": 2, "sample_rate": 48000, "language": "eng"}
+    assert info["audio_streams"][1]["language"] is None
+
+
+def test_summarize_probe_fallbacks():
+    info = summarize_probe({
+        "format": {"duration": "N/A"},
+        "streams": [{"codec_type": "video", "avg_frame_rate": "0/0", "r_frame_rate": "25", "duration": "10.0"}],
+    })
+    assert info["duration"] == 10.0
+    assert info["video"]["fps"] == 25
+    assert info["audio_streams"] == []
+    assert summarize_probe({}) == {
+        "duration": None, "size_bytes": None, "bit_rate": None, "format_name": None, "video": None, "audio_streams": []
+    }
+
+
+def test_format_media_info():
+    assert format_media_info(summarize_probe(PROBE_OUTPUT)) == (
+        "Media metadata: duration 62.50s, resolution 1920x1080, 29.97 fps, video codec h264, "
+        "audio aac 2ch 48000Hz, 2 audio streams, bitrate 134kbps"
+    )
+    assert format_media_info({"duration": 5.0, "video": None, "audio_streams": []}) == "Media metadata: duration 5.00s, no audio stream"
+    assert format_media_info(None) == "Media metadata: unavailable"
+
+
+def test_cache_persists_to_disk(tmp_path):
+    cache = MediaInfoCache(str(tmp_path))
+    cache.put("abc123", {"duration": 1.0})
+    assert json.loads((tmp_path / "abc123.json").read_text()) == {"duration": 1.0}
+    assert MediaInfoCache(str(tmp_path)).get("abc123") == {"duration": 1.0}
+    # 非十六进制的哈希不落盘
+    cache.put("../escape", {"duration": 2.0})
+    assert cache.get("../escape") == {"duration": 2.0}
+    assert MediaInfoCache(str(tmp_path)).get("../escape") is None
+    assert cache.get(None) is None
+
+
+def test_cache_evicts_least_recently_used():
+    cache = MediaInfoCache(max_entries=2)
+    cache.put("a", {"duration": 1.0})
+    cache.put("b", {"duration": 2.0})
+    cache.get("a")
+    cache.put("c", {"duration": 3.0})
+    assert cache.get("b") is None
+    assert cache.get("a") and cache.get("c")
+
+
+def test_get_or_probe_runs_probe_once_and_skips_failures():
+    cache = MediaInfoCache()
+    calls = []
+
+    async def probe():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return {"duration": 4.0}
+
+    async def failing_probe():
+        return None
+
+    async def main():
+        results = await asyncio.gather(cache.get_or_probe("hash", probe), cache.get_or_probe("hash", probe))
+        return results, await cache.get_or_probe("hash", probe)
+
+    results, cached = asyncio.run(main())
+    assert results == [{"duration": 4.0}, {"duration": 4.0}] and cached == {"duration": 4.0}
+    assert len(calls) == 1
+    assert cache.stats() == {"entries": 1, "persistent": False, "hits": 2, "misses": 1, "probes": 1}
+
+    # 失败的结果不缓存，下次重试
+    assert asyncio.run(cache.get_or_probe("other", failing_probe)) is None
+    assert cache.get("other") is None
@@ -0,0 +1,99 @@
+import asyncio
+
+import pytest
+
+from model_router import ROUTE_ANALYSIS, ROUTE_LONG_VIDEO, ROUTE_SUBTITLE, ROUTE_TRANSFORM, ModelRouter, estimate_cost
+
+ROUTES = {
+    ROUTE_TRANSFORM: "gemini-2.5-flash-lite",
+    ROUTE_SUBTITLE: "gemini-2.5-flash",
+    ROUTE_ANALYSIS: "gemini-2.5-pro",
+    ROUTE_LONG_VIDEO: "gemini-2.5-flash",
+}
+
+
+def make_router(waits=None, routes=ROUTES):
+    calls = []
+
+    async def wait_estimator(model, tokens):
+        calls.append((model, tokens))
+        return (waits or {}).get(model, 0.0)
+
+    router = ModelRouter(routes, "gemini-2.5-flash", long_video_seconds=1800, max_wait_seconds=30, wait_estimator=wait_estimator)
+    return router, calls
+
+
+def choose(router, intent, video_seconds=None, tokens=1000):
+    return asyncio.run(router.choose(intent, video_seconds, tokens))
+
+
+@pytest.mark.parametrize("intent, route, model", [
+    ("transform", ROUTE_TRANSFORM, "gemini-2.5-flash-lite"),
+    ("subtitle", ROUTE_SUBTITLE, "gemini-2.5-flash"),
+    ("analysis", ROUTE_ANALYSIS, "gemini-2.5-pro"),
+    (None, ROUTE_ANALYSIS, "gemini-2.5-pro"),
+])
+def test_route_per_intent(intent, route, model):
+    router, _ = make_router()
+    decision = choose(router, intent, 60)
+    assert (decision.route, decision.model) == (route, model)
+
+
+def test_long_analysis_video_uses_long_video_route():
+    router, _ = make_router()
+    decision = choose(router, "analysis", 3600)
+    assert (decision.route, decision.model) == (ROUTE_LONG_VIDEO, "gemini-2.5-flash")
+    assert "3600s" in decision.reason
+    # 只有分析请求换路由；正好等于阈值也不换
+    assert choose(router, "subtitle", 3600).route == ROUTE_SUBTITLE
+    assert choose(router, "transform", 3600).route == ROUTE_TRANSFORM
+    assert choose(router, "analysis", 1800).route == ROUTE_ANALYSIS
+
+
+def test_unconfigured_route_uses_default_model():
+    router, calls = make_router(routes={ROUTE_ANALYSIS: "gemini-2.5-pro"})
+    assert choose(router, "transform").model == "gemini-2.5-flash"
+    # 默认模型不检查排队
+    assert calls == []
+
+
+def test_fallback_to_default_when_queue_is_too_long():
+    router, calls = make_router(waits={"gemini-2.5-pro": 60, "gemini-2.5-flash": 5})
+    decision = choose(router, "analysis", 60, tokens=1234)
+    assert (decision.route, decision.model) == (ROUTE_ANALYSIS, "gemini-2.5-flash")
+    assert "fallback" in decision.reason
+    assert calls == [("gemini-2.5-pro", 1234), ("gemini-2.5-flash", 1234)]
+
+
+def test_no_fallback_within_headroom_or_when_default_is_busier():
+    router, _ = make_router(waits={"gemini-2.5-pro": 30, "gemini-2.5-flash": 0})
+    assert choose(router, "analysis").model == "gemini-2.5-pro"
+    router, _ = make_router(waits={"gemini-2.5-pro": 60, "gemini-2.5-flash": 90})
+    assert choose(router, "analysis").model == "gemini-2.5-pro"
+
+
+def test_estimate_cost():
+    assert estimate_cost("gemini-2.5-flash", 1_000_000, 0) == pytest.approx(0.30)
+    assert estimate_cost("gemini-2.5-pro", 200_000, 10_000) == pytest.approx(0.25 + 0.10)
+    assert estimate_cost("unknown-model", 1000, 1000) is None
+
+
+def test_record_and_stats():
+    router, _ = make_router()
+    decision = choose(router, "subtitle", 60)
+    cost = router.record(decision, 2.0, 1_000_000, 1_000)
+    assert cost == pytest.approx(0.30 + 0.0025)
+    assert decision.recorded
+    assert router.record(choose(router, "subtitle", 60), 9.0, 0, 0, success=False) is None
+    router.record(decision, 4.0, 0, 0)
+
+    stats = router.stats()
+    assert stats["routes"][ROUTE_LONG_VIDEO] == "gemini-2.5-flash"
+    assert stats["default_model"] == "gemini-2.5-flash"
+    [usage] = stats["usage"]
+    assert (usage["route"], usage["model"]) == (ROUTE_SUBTITLE, "gemini-2.5-flash")
+    assert (usage["requests"], usage["errors"]) == (3, 1)
+    # 失败的请求不计入平均延迟和费用
+    assert usage["avg_latency_seconds"] == 3.0
+    assert usage["cost_usd"] == pytest.approx(0.3025)
+    assert usage["avg_cost_usd"] == pytest.approx(0.15125)
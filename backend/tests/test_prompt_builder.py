@@ -0,0 +1,20 @@
+from prompt_builder import (
+    SRT_FORMAT_RULES, VIDEO_SYSTEM_INSTRUCTION, build_generate_config, build_subtitle_segment_config, video_system_instruction,
+)
+
+
+def test_srt_format_rules_only_when_requested():
+    assert SRT_FORMAT_RULES not in VIDEO_SYSTEM_INSTRUCTION
+    assert video_system_instruction() == VIDEO_SYSTEM_INSTRUCTION
+    with_rules = video_system_instruction(srt_format_rules=True)
+    assert SRT_FORMAT_RULES in with_rules
+    assert "HH:MM:SS,mmm" in with_rules
+    assert with_rules.endswith(VIDEO_SYSTEM_INSTRUCTION.split("**Key Rules**:\n")[1])
+
+
+def test_configs_carry_srt_format_rules():
+    assert SRT_FORMAT_RULES in build_generate_config(1.0, srt_format_rules=True).system_instruction
+    assert SRT_FORMAT_RULES not in build_generate_config(1.0).system_instruction
+    assert SRT_FORMAT_RULES in build_subtitle_segment_config(1.0, None, True).system_instruction
+    # 使用上下文缓存时系统指令在缓存中
+    assert build_generate_config(1.0, "cachedContents/x", srt_format_rules=True).system_instruction is None
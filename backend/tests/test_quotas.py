@@ -0,0 +1,74 @@
+import pytest
+
+import quotas
+from quotas import ClientQuotaManager, QuotaExceeded, resolve_client_id, hash_api_key, parse_trusted_proxies, SlidingWindowCounter
+
+PROXIES = parse_trusted_proxies("127.0.0.1, 10.0.0.0/8, not-an-ip")
+
+
+def test_unverified_api_key_uses_peer_address():
+    assert resolve_client_id({"x-api-key": "anything"}, "203.0.113.5") == "ip:203.0.113.5"
+    assert resolve_client_id({"x-api-key": "anything"}, "203.0.113.5", {hash_api_key("secret")}) == "ip:203.0.113.5"
+
+
+def test_verified_api_key():
+    assert resolve_client_id({"x-api-key": "secret"}, "203.0.113.5", {hash_api_key("secret")}) == "key:" + hash_api_key("secret")
+
+
+def test_forwarded_for_ignored_from_untrusted_peer():
+    headers = {"x-forwarded-for": "198.51.100.1"}
+    assert resolve_client_id(headers, "203.0.113.5", trusted_proxies=PROXIES) == "ip:203.0.113.5"
+    assert resolve_client_id(headers, "127.0.0.1") == "ip:127.0.0.1"
+
+
+def test_forwarded_for_from_trusted_proxy_skips_proxy_hops():
+    # 客户端伪造的最左侧地址不被采用
+    headers = {"x-forwarded-for": "1.2.3.4, 198.51.100.1, 10.1.2.3"}
+    assert resolve_client_id(headers, "127.0.0.1", trusted_proxies=PROXIES) == "ip:198.51.100.1"
+
+
+def test_sliding_window_counter():
+    counter = SlidingWindowCounter(window=60)
+    counter.add(5, now=0)
+    counter.add(3, now=30)
+    assert counter.total(now=59) == 8
+    assert counter.seconds_until_below(4, now=40) == 20
+    assert counter.seconds_until_below(9, now=40) == 0
+    assert counter.total(now=60) == 3
+
+
+def test_upload_larger_than_limit_is_rejected_permanently():
+    manager = ClientQuotaManager(0, 10 * 1024 * 1024, 0)
+    with pytest.raises(QuotaExceeded) as error:
+        manager.acquire("ip:a", "task", 11 * 1024 * 1024)
+    assert (error.value.status_code, error.value.retry_after) == (413, 0)
+    manager.acquire("ip:a", "task", 6 * 1024 * 1024)
+    with pytest.raises(QuotaExceeded) as error:
+        manager.acquire("ip:a", "task2", 6 * 1024 * 1024)
+    assert error.value.status_code == 429 and error.value.retry_after > 0
+
+
+def test_idle_clients_are_dropped(monkeypatch):
+    monkeypatch.setattr(quotas, "MIN_SWEEP_CLIENTS", 4)
+    manager = ClientQuotaManager(1, 0, 0)
+    manager.acquire("ip:busy", "task")
+    for index in range(3):
+        manager.acquire(f"ip:{index}", f"task{index}")
+        manager.release(f"ip:{index}", f"task{index}")
+    # 任务结束且窗口内没有用量的客户端立即删除
+    assert list(manager._clients) == ["ip:busy"]
+    assert manager.usage("ip:unknown")["active_tasks"] == 0
+    assert "ip:unknown" not in manager._clients
+
+
+def test_sweep_removes_clients_once_windows_expire(monkeypatch):
+    monkeypatch.setattr(quotas, "MIN_SWEEP_CLIENTS", 4)
+    now = [1000.0]
+    monkeypatch.setattr(quotas.time, "time", lambda: now[0])
+    manager = ClientQuotaManager(0, 0, 10)
+    for index in range(4):
+        manager.record_gemini_request(f"ip:{index}")
+    assert len(manager._clients) == 4
+    now[0] += 61
+    manager.record_gemini_request("ip:new")
+    assert list(manager._clients) == ["ip:new"]
@@ -0,0 +1,54 @@
+import asyncio
+
+import pytest
+
+import rate_limiter
+from rate_limiter import InMemoryBucketBackend, SQLiteBucketBackend, GeminiRateLimiter, BucketLimit
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(rate_limiter.time, "time", lambda: now[0])
+    return now
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def backend(request, tmp_path):
+    if request.param == "memory":
+        return InMemoryBucketBackend()
+    return SQLiteBucketBackend(str(tmp_path / "buckets.db"))
+
+
+def test_bucket_refills_over_time(backend, clock):
+    # 每分钟 60 个，即每秒补充 1 个
+    for _ in range(60):
+        assert backend.reserve("k", 1, 60, 1.0) == 0
+    assert backend.reserve("k", 1, 60, 1.0) == pytest.approx(1.0)
+    clock[0] += 3
+    assert backend.estimate("k", 1, 60, 1.0) == 0
+    assert backend.reserve("k", 1, 60, 1.0) == 0
+    assert backend.reserve("k", 1, 60, 1.0) == 0
+    assert backend.reserve("k", 1, 60, 1.0) == pytest.approx(1.0)
+
+
+def test_refill_is_capped_at_capacity(backend, clock):
+    backend.reserve("k", 10, 10, 1.0)
+    clock[0] += 3600
+    assert backend.reserve("k", 10, 10, 1.0) == 0
+    assert backend.reserve("k", 1, 10, 1.0) == pytest.approx(1.0)
+
+
+def test_estimate_does_not_consume(backend, clock):
+    backend.reserve("k", 10, 10, 1.0)
+    assert backend.estimate("k", 5, 10, 1.0) == pytest.approx(5.0)
+    assert backend.estimate("k", 5, 10, 1.0) == pytest.approx(5.0)
+
+
+def test_limiter_waits_for_slowest_bucket(tmp_path, clock):
+    limiter = GeminiRateLimiter(SQLiteBucketBackend(str(tmp_path / "buckets.db")), {
+        "generate": [BucketLimit("rpm", 60), BucketLimit("tpm", 600, unit="tokens")],
+    })
+    assert asyncio.run(limiter.estimate_wait("generate", 600)) == 0
+    assert asyncio.run(limiter.acquire("generate", 600)) == 0
+    assert asyncio.run(limiter.estimate_wait("generate", 100)) == pytest.approx(10.0)
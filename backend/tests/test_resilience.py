@@ -0,0 +1,74 @@
+import asyncio
+
+import pytest
+
+from resilience import CircuitBreaker, CircuitOpenError, RetryPolicy, call_with_retry, is_rejected_error, never_retry
+
+NO_DELAY = RetryPolicy(max_attempts=3, base_delay=0, max_delay=0)
+
+
+def open_breaker(breaker: CircuitBreaker):
+    for _ in range(breaker.failure_threshold):
+        breaker.record_failure()
+    breaker.opened_at -= breaker.reset_timeout
+
+
+def test_half_open_allows_single_probe():
+    breaker = CircuitBreaker("test", failure_threshold=2, reset_timeout=30)
+    open_breaker(breaker)
+    assert breaker.state == "half_open"
+    breaker.before_call()
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    breaker.record_success()
+    assert breaker.state == "closed"
+
+
+def test_cancelled_probe_releases_half_open_slot():
+    breaker = CircuitBreaker("test", failure_threshold=2, reset_timeout=30)
+    open_breaker(breaker)
+
+    async def main():
+        async def hang():
+            await asyncio.sleep(10)
+
+        task = asyncio.create_task(call_with_retry(hang, NO_DELAY, breaker))
+        await asyncio.sleep(0)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(main())
+    assert breaker.state == "half_open"
+    # 下一次调用可以作为新的试探请求
+    breaker.before_call()
+
+
+def test_non_idempotent_call_is_not_retried():
+    calls = []
+
+    async def fail():
+        calls.append(1)
+        raise TimeoutError("read timeout")
+
+    with pytest.raises(TimeoutError):
+        asyncio.run(call_with_retry(fail, NO_DELAY, should_retry=never_retry))
+    assert len(calls) == 1
+
+    calls.clear()
+    with pytest.raises(TimeoutError):
+        asyncio.run(call_with_retry(fail, NO_DELAY, should_retry=is_rejected_error))
+    assert len(calls) == 1
+
+
+def test_retryable_error_is_retried():
+    calls = []
+
+    async def flaky():
+        calls.append(1)
+        if len(calls) < 3:
+            raise ConnectionRefusedError()
+        return "ok"
+
+    assert asyncio.run(call_with_retry(flaky, NO_DELAY, should_retry=is_rejected_error)) == "ok"
+    assert len(calls) == 3
@@ -0,0 +1,53 @@
+import time
+
+from result_cache import ResultCache, make_cache_key, make_scope_key, normalize_prompt
+
+CONFIG = {"temperature": 1.0, "input_filename": "a.mp4"}
+
+
+def test_normalize_prompt():
+    assert normalize_prompt("  生成中文字幕。 ") == "生成中文字幕"
+    assert normalize_prompt("Convert  TO\tGIF!!") == "convert to gif"
+    # 全角字符转半角
+    assert normalize_prompt("转成ＧＩＦ？") == "转成gif"
+    assert normalize_prompt(None) == ""
+
+
+def test_scope_key_depends_on_file_model_and_config():
+    scope = make_scope_key("hash", "gemini-2.5-flash", CONFIG)
+    assert scope == make_scope_key("hash", "gemini-2.5-flash", dict(reversed(list(CONFIG.items()))))
+    assert scope != make_scope_key("other", "gemini-2.5-flash", CONFIG)
+    assert scope != make_scope_key("hash", "gemini-2.5-pro", CONFIG)
+    assert scope != make_scope_key("hash", "gemini-2.5-flash", {**CONFIG, "input_filename": "b.mp4"})
+
+
+def test_cache_key_uses_normalized_prompt():
+    scope = make_scope_key("hash", "gemini-2.5-flash", CONFIG)
+    assert make_cache_key(scope, "转成GIF。") == make_cache_key(scope, " 转成gif ")
+    assert make_cache_key(scope, "转成gif") != make_cache_key(scope, "转成mp4")
+    assert make_cache_key(scope, "转成gif") != make_cache_key(make_scope_key("hash", "gemini-2.5-pro", CONFIG), "转成gif")
+
+
+def test_lru_eviction():
+    cache = ResultCache(max_entries=2)
+    cache.put("a", {"text_response": "a"}, "a")
+    cache.put("b", {"text_response": "b"}, "b")
+    assert cache.get("a").streaming_text == "a"
+    cache.put("c", {"text_response": "c"}, "c")
+    # b 最久未使用，被淘汰
+    assert cache.get("b") is None
+    assert cache.get("a") and cache.get("c")
+    assert cache.stats() == {"entries": 2, "max_entries": 2, "hits": 3, "misses": 1}
+
+
+def test_ttl_expiry_and_invalidate():
+    cache = ResultCache(ttl_seconds=60)
+    cache.put("a", {}, "")
+    cache.put("b", {}, "")
+    cache._entries["a"].created_at = time.time() - 61
+    assert cache.get("a") is None
+    assert cache.get("b").hits == 1
+    cache.invalidate("b")
+    cache.invalidate("missing")
+    assert cache.get("b") is None
+    assert cache.stats()["entries"] == 0
@@ -0,0 +1,50 @@
+import pytest
+
+from semantic_cache import SemanticPromptCache, tokenize_prompt, extract_key_terms
+
+
+def test_synonyms_replace_whole_words_only():
+    assert tokenize_prompt("加字幕") == ["生成", "字幕"]
+    assert tokenize_prompt("帮我做个srt") == ["生成", "字幕"]
+    assert tokenize_prompt("加速2倍") == ["加速", "2", "倍"]
+
+
+@pytest.mark.parametrize("cached, prompt", [
+    ("顺时针旋转90度", "逆时针旋转90度"),
+    ("压缩到720p", "压缩到720p并静音"),
+    ("保留声音", "不要声音"),
+    ("裁剪前10秒", "裁剪前20秒"),
+    ("转成gif", "转成mp4"),
+    ("生成中文字幕", "生成英文字幕"),
+    ("加字幕", "加速"),
+])
+def test_different_requests_do_not_hit(cached, prompt):
+    cache = SemanticPromptCache()
+    cache.add("scope", cached, "key")
+    assert cache.find("scope", prompt) is None
+
+
+@pytest.mark.parametrize("cached, prompt", [
+    ("加字幕", "生成字幕文件"),
+    ("加字幕", "帮我做个srt"),
+    ("把视频转换成GIF", "请把视频转成gif"),
+])
+def test_paraphrases_hit(cached, prompt):
+    cache = SemanticPromptCache()
+    cache.add("scope", cached, "key")
+    match = cache.find("scope", prompt)
+    assert match and match[0].cache_key == "key"
+
+
+def test_key_terms_keep_numbers_and_directions():
+    assert extract_key_terms("顺时针旋转90度") == ["90", "旋转", "顺时针"]
+
+
+def test_scopes_are_evicted_least_recently_used():
+    cache = SemanticPromptCache(max_scopes=2)
+    cache.add("a", "加字幕", "key-a")
+    cache.add("b", "加字幕", "key-b")
+    assert cache.find("a", "加字幕")
+    cache.add("c", "加字幕", "key-c")
+    assert cache.find("b", "加字幕") is None
+    assert cache.find("a", "加字幕") and cache.find("c", "加字幕")
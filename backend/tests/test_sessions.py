@@ -0,0 +1,59 @@
+import os
+
+from sessions import VideoSessionStore
+
+
+def test_session_ids_are_generated_by_server():
+    store = VideoSessionStore(session_ttl_seconds=60, file_ttl_seconds=60)
+    session = store.get_or_create("chosen-by-client", "ip:a")
+    assert session.session_id != "chosen-by-client"
+    assert store.get("chosen-by-client", "ip:a") is None
+    assert store.get_or_create(session.session_id, "ip:a") is session
+
+
+def test_sessions_belong_to_their_client():
+    store = VideoSessionStore(session_ttl_seconds=60, file_ttl_seconds=60)
+    session = store.get_or_create(None, "ip:a")
+    store.attach_video(session, "hash", "a.mp4", "video/mp4")
+    assert store.get(session.session_id, "ip:a") is session
+    assert store.get(session.session_id, "ip:b") is None
+    # 其他客户端引用时得到自己的新会话，拿不到原会话的视频
+    other = store.get_or_create(session.session_id, "ip:b")
+    assert other is not session and other.file_hash is None
+    assert store.get(session.session_id, "ip:a") is session
+
+
+def test_expired_sessions_release_local_video(tmp_path):
+    store = VideoSessionStore(session_ttl_seconds=60, file_ttl_seconds=60)
+    session = store.get_or_create(None, "ip:a")
+    path = tmp_path / "video.mp4"
+    path.write_bytes(b"video")
+    store.retain_local_video(session, str(path))
+    session.last_used_at -= 61
+    assert store.get(session.session_id, "ip:a") is None
+    assert not os.path.exists(path)
+
+    expired = store.get_or_create(None, "ip:a")
+    kept = store.get_or_create(None, "ip:a")
+    expired.last_used_at -= 61
+    assert store.cleanup_expired() == 1
+    assert store.get(kept.session_id, "ip:a") is kept
+
+
+def test_restore_keeps_id_and_owner():
+    store = VideoSessionStore(session_ttl_seconds=60, file_ttl_seconds=60)
+    session = store.restore("journaled-id", "ip:a")
+    assert store.restore("journaled-id", "ip:a") is session
+    assert store.get("journaled-id", "ip:a") is session
+    assert store.get("journaled-id", "ip:b") is None
+
+
+def test_gemini_files_expire():
+    store = VideoSessionStore(session_ttl_seconds=60, file_ttl_seconds=60)
+    ref = store.register_file("hash", "files/1", "video/mp4", is_proxy=True)
+    assert store.find_file("hash") is ref and ref.is_proxy
+    ref.created_at -= 61
+    assert store.find_file("hash") is None
+    store.register_file("hash", "files/2", "video/mp4")
+    store.invalidate_file("hash")
+    assert store.find_file("hash") is None
@@ -0,0 +1,101 @@
+import asyncio
+import json
+import sys
+
+import pytest
+
+from shot_index import ShotIndex, ShotIndexer, build_scene_score_command, format_shot_boundaries
+
+# 代替 ffmpeg：像 metadata=print:file=- 一样在 stdout 输出 SHOT_SCORES 中每帧的时间和场景分数
+FAKE_FFMPEG = """#!{python}
+import os, sys
+if os.environ.get("SHOT_FAIL"):
+    sys.exit(1)
+with open(os.environ["SHOT_CALLS"], "a") as f:
+    f.write("call\\n")
+for index, item in enumerate(os.environ.get("SHOT_SCORES", "").split()):
+    t, score = item.split(":")
+    print(f"frame:{{index}}    pts:{{index * 100}}    pts_time:{{t}}")
+    print(f"lavfi.scene_score={{score}}")
+"""
+
+
+@pytest.fixture
+def ffmpeg(tmp_path, monkeypatch):
+    path = tmp_path / "ffmpeg"
+    path.write_text(FAKE_FFMPEG.format(python=sys.executable))
+    path.chmod(0o755)
+    monkeypatch.setenv("SHOT_CALLS", str(tmp_path / "calls"))
+    (tmp_path / "calls").write_text("")
+    return str(path)
+
+
+def ffmpeg_calls(tmp_path) -> int:
+    return len((tmp_path / "calls").read_text().splitlines())
+
+
+def test_scene_score_command():
+    command = build_scene_score_command("ffmpeg", "in.mp4", 0.3, 320)
+    assert command[command.index("-vf") + 1] == "scale=320:-2,select='gt(scene,0.3)',metadata=print:file=-"
+    assert command[-3:] == ["-f", "null", "-"]
+
+
+def test_shots_and_format():
+    shot_index = ShotIndex("hash", [(4.0, 0.5), (12.5, 0.9)], duration=20.0)
+    assert shot_index.boundary_times == [4.0, 12.5]
+    assert shot_index.shots == [(0.0, 4.0), (4.0, 12.5), (12.5, 20.0)]
+    assert ShotIndex("hash", []).shots == [(0.0, None)]
+    assert format_shot_boundaries(shot_index).startswith("Shot boundaries detected by scene analysis (seconds): 4.00, 12.50.")
+    # 超过 limit 时按时间顺序列出分数最高的边界
+    limited = format_shot_boundaries(ShotIndex("hash", [(1.0, 0.4), (2.0, 0.9), (3.0, 0.8)]), limit=2)
+    assert "2.00, 3.00." in limited and "Only the 2 strongest of 3 cuts" in limited
+    assert "single continuous shot" in format_shot_boundaries(ShotIndex("hash", []))
+
+
+def test_build_merges_and_persists(tmp_path, ffmpeg, monkeypatch):
+    monkeypatch.setenv("SHOT_SCORES", "0.5:0.9 4:0.4 4.5:0.8 12:0.6 19.5:0.7")
+    indexer = ShotIndexer(str(tmp_path / "shots"), ffmpeg_binary=ffmpeg, min_shot_seconds=1.0)
+    shot_index = asyncio.run(indexer.get_or_build("abc", "in.mp4", duration=20.0))
+    # 紧挨开头、相距太近、紧挨结尾的边界被去掉
+    assert shot_index.boundaries == [(4.5, 0.8), (12.0, 0.6)]
+    assert not shot_index.cached
+    assert json.loads((tmp_path / "shots" / "abc.json").read_text())["boundaries"] == [[4.5, 0.8], [12.0, 0.6]]
+
+    cached = asyncio.run(indexer.get_or_build("abc", "in.mp4", duration=20.0))
+    assert cached.cached and cached.boundaries == shot_index.boundaries
+    restored = ShotIndexer(str(tmp_path / "shots"), ffmpeg_binary=ffmpeg).get("abc")
+    assert restored.boundaries == shot_index.boundaries and restored.duration == 20.0
+    assert ffmpeg_calls(tmp_path) == 1
+
+
+def test_concurrent_requests_share_one_build(tmp_path, ffmpeg, monkeypatch):
+    monkeypatch.setenv("SHOT_SCORES", "5:0.5")
+    indexer = ShotIndexer(ffmpeg_binary=ffmpeg)
+
+    async def main():
+        return await asyncio.gather(*(indexer.get_or_build("abc", "in.mp4") for _ in range(3)))
+
+    results = asyncio.run(main())
+    assert all(result.boundary_times == [5.0] for result in results)
+    assert ffmpeg_calls(tmp_path) == 1
+    assert indexer.stats()["builds"] == 1
+
+
+def test_failed_build_is_not_retried_immediately(tmp_path, ffmpeg, monkeypatch):
+    monkeypatch.setenv("SHOT_FAIL", "1")
+    indexer = ShotIndexer(ffmpeg_binary=ffmpeg, retry_seconds=3600)
+    assert asyncio.run(indexer.get_or_build("abc", "in.mp4")) is None
+    monkeypatch.delenv("SHOT_FAIL")
+    assert asyncio.run(indexer.get_or_build("abc", "in.mp4")) is None
+    assert indexer.stats()["failures"] == 1
+
+    indexer.retry_seconds = 0
+    assert asyncio.run(indexer.get_or_build("abc", "in.mp4")) is not None
+
+
+def test_memory_cache_is_bounded(tmp_path, ffmpeg):
+    indexer = ShotIndexer(ffmpeg_binary=ffmpeg, max_entries=2)
+    for file_hash in ("a", "b", "c"):
+        asyncio.run(indexer.get_or_build(file_hash, "in.mp4"))
+    assert indexer.get("a") is None
+    assert indexer.get("b") and indexer.get("c")
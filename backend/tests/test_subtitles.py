@@ -0,0 +1,125 @@
+from subtitles import SrtCue, StreamingSrtParser, fix_srt, merge_segment_cues, parse_srt, plan_segments
+
+SRT = (
+    "1\n00:00:01,000 --> 00:00:03,500\n今天我们来看一下这个视频\n\n"
+    "2\n00:00:04,000 --> 00:00:06,000\n第二条字幕的内容在这里\n\n"
+)
+
+
+def feed_in_chunks(parser: StreamingSrtParser, text: str, size: int) -> list:
+    cues = []
+    for offset in range(0, len(text), size):
+        cues.extend(parser.feed(text[offset:offset + size]))
+    return cues
+
+
+def test_streaming_parser_emits_cues_once_complete():
+    parser = StreamingSrtParser()
+    assert parser.feed("1\n00:00:01,000 --> 00:00:03,500\n今天我们来看一下这个视频\n") == []
+    # 空行之后第一条才算完整
+    cues = parser.feed("\n2\n00:00:04,000 --> 00:00:06,000\n")
+    assert [(cue.start, cue.end, cue.text) for cue in cues] == [(1.0, 3.5, "今天我们来看一下这个视频")]
+    assert cues[0].issues == []
+    cues = parser.feed("第二条字幕的内容在这里")
+    assert cues == []
+    cues = parser.finish()
+    assert [cue.text for cue in cues] == ["第二条字幕的内容在这里"]
+    assert parser.cue_count == 2
+
+
+def test_streaming_parser_is_independent_of_chunk_boundaries():
+    expected = [(cue.start, cue.end, cue.text) for cue in parse_srt(SRT)]
+    for size in (1, 3, 7, len(SRT)):
+        parser = StreamingSrtParser()
+        cues = feed_in_chunks(parser, SRT.replace("\n", "\r\n"), size) + parser.finish()
+        assert [(cue.start, cue.end, cue.text) for cue in cues] == expected
+
+
+def test_streaming_parser_numbering_without_blank_line():
+    # 缺少空行时，文本后的纯数字行是下一条的序号
+    cues = parse_srt(
+        "1\n00:00:01,000 --> 00:00:02,000\n第一条字幕内容很短呀\n"
+        "2\n00:00:02,000 --> 00:00:03,000\n第二条\n2024\n"
+    )
+    assert [cue.text for cue in cues] == ["第一条字幕内容很短呀", "第二条\n2024"]
+
+
+def test_streaming_parser_flags_rule_violations():
+    cues = parse_srt("1\n00:00:05.000 --> 00:00:04,000\n这是一条非常非常长的字幕内容超过了二十个字的限制。\n\n")
+    assert set(cues[0].issues) == {"timestamp_format", "non_positive_duration", "too_long", "ending_punctuation"}
+    # 没有文本的字幕块被丢弃
+    assert parse_srt("1\n00:00:01,000 --> 00:00:02,000\n\n") == []
+
+
+def test_fix_srt_normalizes_format_and_numbering():
+    content = (
+        "3\n0:00:01.5 --> 0:00:03.000\n今天我们来看一下这个视频。\n\n"
+        "7\n00:00:04,000 --> 00:00:06,000\n第二条字幕的内容在这里\n\n"
+    )
+    fixed, report = fix_srt(content)
+    assert fixed == (
+        "1\n00:00:01,500 --> 00:00:03,000\n今天我们来看一下这个视频\n\n"
+        "2\n00:00:04,000 --> 00:00:06,000\n第二条字幕的内容在这里\n\n"
+    )
+    assert report.fixes == {"timestamp_format": 1, "numbering": 1, "ending_punctuation": 1}
+    assert (report.input_cues, report.output_cues) == (2, 2)
+
+
+def test_fix_srt_splits_long_and_multi_line_cues():
+    fixed, report = fix_srt(
+        "1\n00:00:00,000 --> 00:00:06,000\n第一行字幕内容就在这里\n第二行字幕内容也在这里\n\n"
+        "2\n00:00:06,000 --> 00:00:10,000\n这一条字幕实在是太长了，需要在标点的位置拆成两条字幕\n\n"
+    )
+    cues = parse_srt(fixed)
+    assert [cue.text for cue in cues] == [
+        "第一行字幕内容就在这里", "第二行字幕内容也在这里", "这一条字幕实在是太长了", "需要在标点的位置拆成两条字幕",
+    ]
+    assert [(cue.start, cue.end) for cue in cues[:2]] == [(0.0, 3.0), (3.0, 6.0)]
+    assert cues[-1].end == 10.0
+    assert all(not cue.issues for cue in cues)
+    assert report.fixes == {"multi_line": 1, "too_long": 1}
+
+
+def test_fix_srt_repairs_timing():
+    fixed, report = fix_srt(
+        "1\n00:00:05,000 --> 00:00:07,000\n第二条字幕的内容在这里\n\n"
+        "2\n00:00:01,000 --> 00:00:06,000\n第一条字幕的内容在这里\n\n"
+        "3\n00:00:08,000 --> 00:00:08,000\n第三条字幕的内容在这里\n\n"
+    )
+    cues = parse_srt(fixed)
+    assert [cue.text for cue in cues] == ["第一条字幕的内容在这里", "第二条字幕的内容在这里", "第三条字幕的内容在这里"]
+    assert [(cue.start, cue.end) for cue in cues[:2]] == [(1.0, 5.0), (5.0, 7.0)]
+    assert cues[2].end > cues[2].start
+    assert report.fixes == {"order": 1, "non_positive_duration": 1, "overlap": 1}
+
+
+def test_fix_srt_keeps_valid_content():
+    fixed, report = fix_srt(SRT)
+    assert fixed == SRT
+    assert not report.changed
+
+
+def test_plan_segments():
+    assert plan_segments(200, 300, 10) == [(0.0, 200)]
+    assert plan_segments(1000, 300, 10) == [(0.0, 310.0), (300.0, 610.0), (600.0, 910.0), (900.0, 1000)]
+    # 最后一段太短时并入前一段
+    assert plan_segments(950, 300, 10) == [(0.0, 310.0), (300.0, 610.0), (600.0, 950)]
+
+
+def test_plan_segments_snaps_to_shot_boundaries():
+    segments = plan_segments(1000, 300, 10, snap_points=[295, 420, 604], snap_window=20)
+    assert segments == [(0.0, 305.0), (295, 614), (604, 914), (904, 1000)]
+
+
+def test_merge_segment_cues_splits_overlap_and_drops_duplicates():
+    segments = [(0.0, 310.0), (300.0, 610.0)]
+    first = [SrtCue(100, 102, "第一段的字幕"), SrtCue(304, 306, "重复的一句话"), SrtCue(308, 309, "只在第一段的尾部")]
+    second = [SrtCue(302, 304, "只在第二段的开头"), SrtCue(305.2, 307, "重复的，一句话。"), SrtCue(306.5, 309, "下一句字幕")]
+    merged = merge_segment_cues(segments, [first, second])
+    assert [(cue.start, cue.end, cue.text) for cue in merged] == [
+        (100, 102, "第一段的字幕"),
+        (304, 306.5, "重复的一句话"),
+        (306.5, 309, "下一句字幕"),
+    ]
+    # 输入的字幕不被修改
+    assert first[1].end == 306
@@ -0,0 +1,99 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+from video_proxy import PROXY_AUDIO, PROXY_VIDEO, UploadProxyTranscoder, build_audio_command, build_proxy_command
+
+# 代替 ffmpeg：把 PROXY_BYTES 个字节写到最后一个参数（输出文件）
+FAKE_FFMPEG = """#!{python}
+import os, sys
+if os.environ.get("PROXY_FAIL"):
+    sys.exit(1)
+with open(sys.argv[-1], "wb") as f:
+    f.write(b"x" * int(os.environ.get("PROXY_BYTES", "100")))
+"""
+
+
+@pytest.fixture
+def transcoder(tmp_path):
+    ffmpeg = tmp_path / "ffmpeg"
+    ffmpeg.write_text(FAKE_FFMPEG.format(python=sys.executable))
+    ffmpeg.chmod(0o755)
+    return UploadProxyTranscoder(str(tmp_path / "proxies"), ffmpeg_binary=str(ffmpeg), min_input_bytes=500)
+
+
+def test_proxy_command_caps_height_and_fps():
+    command = build_proxy_command("ffmpeg", "in.mov", "out.mp4", 480, 0.5, 32, 32)
+    assert command[command.index("-vf") + 1] == "fps=0.5,scale=-2:'min(480,ih)'"
+    assert command[command.index("-crf") + 1] == "32"
+    assert command[command.index("-b:a") + 1] == "32k"
+    assert command[-1] == "out.mp4"
+
+
+def test_audio_command_extracts_mono_opus():
+    command = build_audio_command("ffmpeg", "in.mov", "out.ogg", 24)
+    assert "-vn" in command
+    assert command[command.index("-c:a") + 1] == "libopus"
+    assert command[command.index("-ac") + 1] == "1"
+    assert command[command.index("-b:a") + 1] == "24k"
+
+
+def test_should_transcode(transcoder, tmp_path):
+    assert transcoder.should_transcode(1000)
+    assert transcoder.should_transcode(1000, {"video": {"height": 2160}})
+    # 小文件、纯音频文件不转码
+    assert not transcoder.should_transcode(100)
+    assert not transcoder.should_transcode(1000, {"video": None, "audio_streams": 1})
+    missing = UploadProxyTranscoder(str(tmp_path / "other"), ffmpeg_binary=str(tmp_path / "missing-ffmpeg"))
+    assert not missing.should_transcode(1000)
+    assert not missing.can_extract_audio()
+
+
+def test_can_extract_audio(transcoder):
+    assert transcoder.can_extract_audio()
+    assert transcoder.can_extract_audio({"audio_streams": 1})
+    assert not transcoder.can_extract_audio({"video": {}, "audio_streams": 0})
+
+
+def test_transcode_then_cache_hit(transcoder, monkeypatch):
+    monkeypatch.setenv("PROXY_BYTES", "100")
+    result = asyncio.run(transcoder.get_or_create("hash", "in.mov", 1000))
+    assert (result.kind, result.proxy_bytes, result.ratio, result.cached) == (PROXY_VIDEO, 100, 10, False)
+    assert result.path == transcoder.proxy_path("hash") and os.path.exists(result.path)
+
+    cached = asyncio.run(transcoder.get_or_create("hash", "in.mov", 1000))
+    assert cached.cached and cached.path == result.path
+    assert transcoder.stats()[PROXY_VIDEO]["transcodes"] == 1
+    assert transcoder.stats()[PROXY_VIDEO]["cache_hits"] == 1
+
+
+def test_proxy_without_enough_savings_is_not_used(transcoder, monkeypatch):
+    monkeypatch.setenv("PROXY_BYTES", "900")
+    assert asyncio.run(transcoder.get_or_create("hash", "in.mov", 1000)) is None
+    assert not os.path.exists(transcoder.proxy_path("hash"))
+    # 音轨即使没有变小也使用
+    audio = asyncio.run(transcoder.get_or_create("hash", "in.mov", 1000, PROXY_AUDIO))
+    assert audio.mime_type == "audio/ogg"
+    # 不可用的结果被记住，不再重复转码
+    monkeypatch.setenv("PROXY_BYTES", "10")
+    assert asyncio.run(transcoder.get_or_create("hash", "in.mov", 1000)) is None
+
+
+def test_failed_transcode_is_remembered(transcoder, monkeypatch):
+    monkeypatch.setenv("PROXY_FAIL", "1")
+    assert asyncio.run(transcoder.get_or_create("hash", "in.mov", 1000)) is None
+    assert transcoder.stats()[PROXY_VIDEO]["failures"] == 1
+    assert os.listdir(transcoder.directory) == []
+    monkeypatch.delenv("PROXY_FAIL")
+    assert asyncio.run(transcoder.get_or_create("hash", "in.mov", 1000)) is None
+
+
+def test_cleanup_expired(transcoder):
+    asyncio.run(transcoder.get_or_create("hash", "in.mov", 1000))
+    path = transcoder.proxy_path("hash")
+    assert transcoder.cleanup_expired() == 0
+    os.utime(path, (0, 0))
+    assert transcoder.cleanup_expired() == 1
+    assert not os.path.exists(path)
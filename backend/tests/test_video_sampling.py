@@ -0,0 +1,108 @@
+import pytest
+
+from video_sampling import AUDIO_TOKENS_PER_SECOND, VideoSampling, extract_time_window, resolve_sampling, segment_sampling, subtitle_segment_plan
+
+
+def plan(duration, sampling=None, **kwargs):
+    return subtitle_segment_plan(duration, sampling or VideoSampling(), 900, 300, 10, **kwargs)
+
+
+def test_short_or_unknown_duration_is_not_segmented():
+    assert plan(None) is None
+    assert plan(0) is None
+    assert plan(900) is None
+
+
+def test_long_video_is_segmented_with_overlap():
+    segments = plan(1200)
+    assert segments[0] == (0.0, 310.0)
+    assert segments[-1][1] == 1200
+    for previous, current in zip(segments, segments[1:]):
+        assert current[0] < previous[1]
+
+
+def test_audio_only_or_clipped_requests_are_not_segmented():
+    assert plan(1200, VideoSampling(audio_only=True)) is None
+    assert plan(1200, VideoSampling(start_offset=60)) is None
+    assert plan(1200, VideoSampling(end_offset=600)) is None
+    # 只指定帧率/分辨率不影响分段
+    assert plan(1200, VideoSampling(fps=0.5, media_resolution="low", source="request"))
+
+
+def test_split_points_snap_to_shot_boundaries():
+    segments = plan(1200, snap_points=[290.0, 610.0], snap_window=30)
+    assert segments[1][0] == 290.0
+    assert segments[2][0] == 610.0
+
+
+def test_segment_sampling_defaults_to_low_cost_settings():
+    sampling = segment_sampling(VideoSampling(), 0.2, "low")
+    assert (sampling.fps, sampling.media_resolution, sampling.source) == (0.2, "low", "intent")
+    assert sampling.start_offset is None and sampling.end_offset is None
+
+
+def test_segment_sampling_keeps_request_parameters():
+    sampling = segment_sampling(VideoSampling(fps=1.0, media_resolution="high", source="request"), 0.2, "low")
+    assert (sampling.fps, sampling.media_resolution, sampling.source) == (1.0, "high", "request")
+    sampling = segment_sampling(VideoSampling(media_resolution="medium", source="request"), 0.2, "low")
+    assert (sampling.fps, sampling.media_resolution) == (0.2, "medium")
+
+
+@pytest.mark.parametrize("prompt, window", [
+    ("前30秒讲了什么", (0.0, 30.0)),
+    ("1:00到2:30发生了什么", (60.0, 150.0)),
+    ("从10秒到20秒", (10.0, 20.0)),
+    # 去掉开头时要看的是剩余部分
+    ("去掉前10秒", None),
+    ("总结一下", None),
+    ("", None),
+])
+def test_extract_time_window(prompt, window):
+    assert extract_time_window(prompt) == window
+
+
+def test_prompt_window_limits_analysis():
+    sampling = resolve_sampling("前30秒讲了什么", "analysis", True)
+    assert (sampling.start_offset, sampling.end_offset, sampling.source) == (0.0, 30.0, "intent")
+    assert (sampling.fps, sampling.media_resolution) == (None, None)
+    assert resolve_sampling("前30秒讲了什么", "analysis", True, auto_clip=False).is_default
+
+
+def test_transform_uses_low_cost_sampling():
+    sampling = resolve_sampling("转成gif", "transform", False, transform_fps=0.5, transform_media_resolution="low")
+    assert (sampling.fps, sampling.media_resolution, sampling.source) == (0.5, "low", "intent")
+    assert resolve_sampling("总结一下", "analysis", True, transform_fps=0.5, transform_media_resolution="low").is_default
+
+
+def test_request_parameters_take_precedence():
+    sampling = resolve_sampling(
+        "前30秒转成gif", "transform", False, clip_start=5, fps=2, media_resolution="high",
+        transform_fps=0.5, transform_media_resolution="low"
+    )
+    assert (sampling.start_offset, sampling.end_offset) == (5, None)
+    assert (sampling.fps, sampling.media_resolution, sampling.source) == (2, "high", "request")
+    metadata = sampling.video_metadata()
+    assert (metadata.start_offset, metadata.end_offset, metadata.fps) == ("5s", None, 2)
+
+
+def test_video_metadata_only_for_video_parts():
+    assert VideoSampling(media_resolution="low").video_metadata() is None
+    assert VideoSampling(fps=1, audio_only=True).video_metadata() is None
+    assert VideoSampling(fps=1, keyframes=8).video_metadata() is None
+
+
+def test_tokens_per_second():
+    assert VideoSampling().tokens_per_second() == 258 + AUDIO_TOKENS_PER_SECOND
+    assert VideoSampling(fps=2, media_resolution="low").tokens_per_second() == 66 * 2 + AUDIO_TOKENS_PER_SECOND
+    assert VideoSampling(audio_only=True).tokens_per_second() == AUDIO_TOKENS_PER_SECOND
+    # 关键帧数量固定，按时长折算
+    assert VideoSampling(keyframes=10, media_resolution="low").tokens_per_second(100) == pytest.approx(6.6)
+    assert VideoSampling(keyframes=10, keyframe_audio=True).tokens_per_second(100) == pytest.approx(25.8 + AUDIO_TOKENS_PER_SECOND)
+    assert VideoSampling(keyframes=10).tokens_per_second(None) == 0
+
+
+def test_effective_duration():
+    assert VideoSampling(start_offset=10, end_offset=500).effective_duration(100) == 90
+    assert VideoSampling(end_offset=50).effective_duration(None) == 50
+    assert VideoSampling().effective_duration(None) is None
+    assert VideoSampling().effective_duration(120) == 120
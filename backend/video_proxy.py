@@ -0,0 +1,232 @@
+import asyncio
+import os
+import re
+import shutil
+import subprocess
+import time
+from functools import lru_cache
+from typing import Optional, Dict, Hashable, Callable, Any
+
+# --- Upload Proxy ---
+# 上传前用本地 ffmpeg 把视频转成低码率的分析代理（默认 480p、低帧率、单声道），
+# Gemini 只按约 1 fps 采样，原始的 4K/60fps 视频大部分字节对分析没有帮助。
+# 字幕请求只需要语音，提取压缩音轨（16 kHz 单声道 Opus）上传，tokens 和 Google 处理时间都大幅减少。
+# 代理文件按原始内容哈希缓存，相同视频只转码一次；原视频仍由前端用于实际的 FFmpeg 编辑。
+
+PROXY_VIDEO = "video"
+PROXY_AUDIO = "audio"
+
+PROXY_MIME_TYPES = {PROXY_VIDEO: "video/mp4", PROXY_AUDIO: "audio/ogg"}
+PROXY_EXTENSIONS = {PROXY_VIDEO: ".mp4", PROXY_AUDIO: ".ogg"}
+# showinfo / metadata=print 输出中的帧时间
+PTS_TIME_PATTERN = re.compile(r"\bpts_time:\s*(-?\d+(?:\.\d+)?)")
+
+
+@lru_cache(maxsize=4)
+def ffmpeg_available(ffmpeg_binary: str = "ffmpeg") -> bool:
+    return shutil.which(ffmpeg_binary) is not None
+
+
+class FfmpegWorkerPool:
+    """在线程池中运行本地 ffmpeg 任务：限制同时运行的进程数，同一 key 的并发请求等待同一次执行"""
+    def __init__(self, max_workers: int):
+        self._workers = asyncio.Semaphore(max_workers)
+        self._pending: Dict[Hashable, asyncio.Future] = {}
+
+    async def run(self, key: Hashable, fn: Callable[..., Any], *args) -> Any:
+        pending = self._pending.get(key)
+        if pending:
+            return await asyncio.shield(pending)
+
+        future = asyncio.get_running_loop().create_future()
+        self._pending[key] = future
+        try:
+            async with self._workers:
+                result = await asyncio.to_thread(fn, *args)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            # 没有其他等待者时避免 "exception was never retrieved" 警告
+            future.exception()
+            raise
+        finally:
+            self._pending.pop(key, None)
+
+
+def build_proxy_command(ffmpeg_binary: str, input_path: str, output_path: str, height: int, fps: float, audio_bitrate_kbps: int, crf: int) -> list:
+    """生成代理文件的 ffmpeg 命令；不放大低于目标高度的视频"""
+    return [
+        ffmpeg_binary, "-y", "-v", "error", "-i", input_path,
+        "-map", "0:v:0?", "-map", "0:a:0?", "-sn", "-dn",
+        "-vf", f"fps={fps:g},scale=-2:'min({height},ih)'",
+        "-c:v", "libx264", "-preset", "veryfast", "-crf", str(crf), "-pix_fmt", "yuv420p",
+        "-c:a", "aac", "-ac", "1", "-ar", "16000", "-b:a", f"{audio_bitrate_kbps}k",
+        "-movflags", "+faststart",
+        output_path
+    ]
+
+
+def build_audio_command(ffmpeg_binary: str, input_path: str, output_path: str, audio_bitrate_kbps: int) -> list:
+    """提取第一条音轨，转成 16 kHz 单声道 Opus"""
+    return [
+        ffmpeg_binary, "-y", "-v", "error", "-i", input_path,
+        "-vn", "-sn", "-dn", "-map", "0:a:0",
+        "-c:a", "libopus", "-ac", "1", "-ar", "16000", "-b:a", f"{audio_bitrate_kbps}k",
+        output_path
+    ]
+
+
+class ProxyResult:
+    def __init__(self, kind: str, path: str, original_bytes: int, proxy_bytes: int, transcode_seconds: float, cached: bool):
+        self.kind = kind
+        self.path = path
+        self.original_bytes = original_bytes
+        self.proxy_bytes = proxy_bytes
+        self.transcode_seconds = transcode_seconds
+        self.cached = cached
+
+    @property
+    def ratio(self) -> float:
+        return self.original_bytes / self.proxy_bytes if self.proxy_bytes else 0
+
+    @property
+    def mime_type(self) -> str:
+        return PROXY_MIME_TYPES[self.kind]
+
+    def to_dict(self) -> Dict:
+        return {
+            "kind": self.kind,
+            "original_bytes": self.original_bytes,
+            "proxy_bytes": self.proxy_bytes,
+            "ratio": round(self.ratio, 1),
+            "transcode_seconds": round(self.transcode_seconds, 2),
+            "cached": self.cached,
+        }
+
+
+class UploadProxyTranscoder:
+    def __init__(self, directory: str, ffmpeg_binary: str = "ffmpeg", max_workers: int = 2, height: int = 480, fps: float = 1.0,
+                 audio_bitrate_kbps: int = 32, speech_bitrate_kbps: int = 24, crf: int = 32, min_input_bytes: int = 0, min_ratio: float = 1.5,
+                 timeout: float = 600, ttl_seconds: float = 24 * 3600):
+        self.directory = directory
+        self.ffmpeg_binary = ffmpeg_binary
+        self.height = height
+        self.fps = fps
+        self.audio_bitrate_kbps = audio_bitrate_kbps
+        self.speech_bitrate_kbps = speech_bitrate_kbps
+        self.crf = crf
+        # 小文件转码省下的上传时间不够抵消转码耗时
+        self.min_input_bytes = min_input_bytes
+        # 代理文件没有明显变小时直接上传原视频
+        self.min_ratio = min_ratio
+        self.timeout = timeout
+        self.ttl_seconds = ttl_seconds
+        # ffmpeg 转码是 CPU 密集型，限制同时运行的进程数；同一视频的并发请求等待同一次转码
+        self._pool = FfmpegWorkerPool(max_workers)
+        self._unusable: Dict[tuple, float] = {}
+        self._stats = {kind: {"transcodes": 0, "cache_hits": 0, "failures": 0, "original_bytes": 0, "proxy_bytes": 0} for kind in PROXY_MIME_TYPES}
+        os.makedirs(directory, exist_ok=True)
+
+    @property
+    def available(self) -> bool:
+        return ffmpeg_available(self.ffmpeg_binary)
+
+    def proxy_path(self, file_hash: str, kind: str = PROXY_VIDEO) -> str:
+        return os.path.join(self.directory, f"{file_hash}.{kind}{PROXY_EXTENSIONS[kind]}")
+
+    def should_transcode(self, size_bytes: int, media_info: Optional[Dict] = None) -> bool:
+        if not self.available or size_bytes < self.min_input_bytes:
+            return False
+        video = (media_info or {}).get("video")
+        if media_info and not video:
+            # 纯音频文件不需要画面代理
+            return False
+        return True
+
+    def can_extract_audio(self, media_info: Optional[Dict] = None) -> bool:
+        """ffprobe 确认没有音轨时不提取（无法确认时交给 ffmpeg 判断）"""
+        if not self.available:
+            return False
+        return not media_info or bool(media_info.get("audio_streams"))
+
+    async def get_or_create(self, file_hash: str, input_path: str, size_bytes: int, kind: str = PROXY_VIDEO) -> Optional[ProxyResult]:
+        """返回代理文件；转码失败或视频代理没有明显变小时返回 None，调用方上传原视频"""
+        key = (file_hash, kind)
+        if key in self._unusable:
+            return None
+        path = self.proxy_path(file_hash, kind)
+        if os.path.exists(path):
+            os.utime(path)
+            self._stats[kind]["cache_hits"] += 1
+            return ProxyResult(kind, path, size_bytes, os.path.getsize(path), 0, cached=True)
+        return await self._pool.run(key, self._transcode, file_hash, input_path, size_bytes, kind)
+
+    def _transcode(self, file_hash: str, input_path: str, size_bytes: int, kind: str) -> Optional[ProxyResult]:
+        path = self.proxy_path(file_hash, kind)
+        temp_path = f"{path}.{os.getpid()}.tmp{PROXY_EXTENSIONS[kind]}"
+        if kind == PROXY_AUDIO:
+            command = build_audio_command(self.ffmpeg_binary, input_path, temp_path, self.speech_bitrate_kbps)
+        else:
+            command = build_proxy_command(self.ffmpeg_binary, input_path, temp_path, self.height, self.fps, self.audio_bitrate_kbps, self.crf)
+        start_time = time.time()
+        try:
+            subprocess.run(command, capture_output=True, timeout=self.timeout, check=True)
+        except FileNotFoundError:
+            print(f"[Proxy] 未找到 {self.ffmpeg_binary}，上传原视频")
+            return self._failed(file_hash, kind, temp_path)
+        except subprocess.TimeoutExpired:
+            print(f"[Proxy] ffmpeg 转码超时 ({self.timeout}s): {input_path}")
+            return self._failed(file_hash, kind, temp_path)
+        except subprocess.CalledProcessError as e:
+            print(f"[Proxy] ffmpeg 转码失败 ({kind}): {e.stderr.decode('utf-8', 'replace')[:500]}")
+            return self._failed(file_hash, kind, temp_path)
+
+        transcode_seconds = time.time() - start_time
+        proxy_bytes = os.path.getsize(temp_path)
+        # 音轨即使没有变小也值得上传：tokens 按音频计算，远少于视频帧
+        if not proxy_bytes or (kind == PROXY_VIDEO and size_bytes / proxy_bytes < self.min_ratio):
+            print(f"[Proxy] 代理文件 {proxy_bytes} 字节，相比原视频 {size_bytes} 字节没有明显变小，上传原视频")
+            os.remove(temp_path)
+            self._unusable[(file_hash, kind)] = time.time()
+            return None
+        os.replace(temp_path, path)
+        stats = self._stats[kind]
+        stats["transcodes"] += 1
+        stats["original_bytes"] += size_bytes
+        stats["proxy_bytes"] += proxy_bytes
+        return ProxyResult(kind, path, size_bytes, proxy_bytes, transcode_seconds, cached=False)
+
+    def _failed(self, file_hash: str, kind: str, temp_path: str) -> None:
+        self._stats[kind]["failures"] += 1
+        self._unusable[(file_hash, kind)] = time.time()
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        return None
+
+    def cleanup_expired(self) -> int:
+        """删除超过有效期未使用的代理文件"""
+        now = time.time()
+        removed = 0
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                if now - os.path.getmtime(path) > self.ttl_seconds:
+                    os.remove(path)
+                    removed += 1
+            except OSError:
+                continue
+        for key in [k for k, ts in self._unusable.items() if now - ts > self.ttl_seconds]:
+            del self._unusable[key]
+        return removed
+
+    def stats(self) -> Dict:
+        return {
+            "available": self.available,
+            "height": self.height,
+            "fps": self.fps,
+            **{
+                kind: {**stats, "ratio": round(stats["original_bytes"] / stats["proxy_bytes"], 1) if stats["proxy_bytes"] else None}
+                for kind, stats in self._stats.items()
+            },
+        }
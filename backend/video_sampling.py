@@ -0,0 +1,156 @@
+import re
+import unicodedata
+from typing import Optional, Dict, List, Tuple
+
+from google.genai import types
+
+from ffmpeg_templates import DURATION, NUMBER, parse_duration
+from subtitles import plan_segments
+
+# --- Video Sampling ---
+# 控制 Gemini 对视频 Part 的采样方式：起止时间（video_metadata.start/end_offset）、帧率（fps）
+# 和 media_resolution。指令只涉及某一段时，只让模型看这一段；生成FFmpeg命令时用低分辨率、低帧率采样。
+# 请求参数优先于根据指令自动推断的设置。
+
+MEDIA_RESOLUTIONS = {
+    "low": types.MediaResolution.MEDIA_RESOLUTION_LOW,
+    "medium": types.MediaResolution.MEDIA_RESOLUTION_MEDIUM,
+    "high": types.MediaResolution.MEDIA_RESOLUTION_HIGH,
+}
+
+# Gemini 每帧 tokens：默认/高分辨率约 258，低分辨率约 66；音频约 32 tokens/秒
+FRAME_TOKENS = {"low": 66, "medium": 258, "high": 258}
+DEFAULT_FRAME_TOKENS = 258
+AUDIO_TOKENS_PER_SECOND = 32
+
+
+class VideoSampling:
+    def __init__(self, start_offset: Optional[float] = None, end_offset: Optional[float] = None,
+                 fps: Optional[float] = None, media_resolution: Optional[str] = None, source: str = "default", audio_only: bool = False,
+                 keyframes: Optional[int] = None, keyframe_audio: bool = False):
+        self.start_offset = start_offset
+        self.end_offset = end_offset
+        self.fps = fps
+        self.media_resolution = media_resolution
+        self.source = source  # default / intent / request
+        # 只上传提取的音轨（字幕请求），没有画面帧
+        self.audio_only = audio_only
+        # 关键帧模式：发送 keyframes 张图片（keyframe_audio 时附带音轨）而不是视频
+        self.keyframes = keyframes
+        self.keyframe_audio = keyframe_audio
+
+    @property
+    def is_default(self) -> bool:
+        return self.start_offset is None and self.end_offset is None and self.fps is None and self.media_resolution is None and not self.audio_only and self.keyframes is None
+
+    @property
+    def has_video_metadata(self) -> bool:
+        return self.start_offset is not None or self.end_offset is not None or self.fps is not None
+
+    def effective_duration(self, duration: Optional[float]) -> Optional[float]:
+        """实际送入模型的视频时长"""
+        if duration is None and self.end_offset is None:
+            return None
+        start = self.start_offset or 0
+        end = self.end_offset if self.end_offset is not None else duration
+        if duration is not None:
+            end = min(end, duration)
+        return max(0.0, end - start)
+
+    def tokens_per_second(self, duration: Optional[float] = None) -> float:
+        if self.audio_only:
+            return AUDIO_TOKENS_PER_SECOND
+        frame_tokens = FRAME_TOKENS.get(self.media_resolution, DEFAULT_FRAME_TOKENS)
+        if self.keyframes is not None:
+            # 关键帧数量固定，按时长折算
+            frame_rate = self.keyframes / duration if duration else 0
+            return frame_tokens * frame_rate + (AUDIO_TOKENS_PER_SECOND if self.keyframe_audio else 0)
+        return frame_tokens * (self.fps or 1.0) + AUDIO_TOKENS_PER_SECOND
+
+    def video_metadata(self) -> Optional[types.VideoMetadata]:
+        if self.audio_only or self.keyframes is not None or not self.has_video_metadata:
+            return None
+        return types.VideoMetadata(
+            start_offset=f"{self.start_offset:g}s" if self.start_offset is not None else None,
+            end_offset=f"{self.end_offset:g}s" if self.end_offset is not None else None,
+            fps=self.fps
+        )
+
+    def to_dict(self) -> Dict:
+        return {
+            "start_offset": self.start_offset,
+            "end_offset": self.end_offset,
+            "fps": self.fps,
+            "media_resolution": self.media_resolution,
+            "source": self.source,
+            "audio_only": self.audio_only,
+            "keyframes": self.keyframes,
+        }
+
+
+def extract_time_window(prompt: str) -> Optional[Tuple[float, float]]:
+    """从指令中提取明确的时间段，如 '前30秒'、'1:00到2:30'；没有或有多个时间段时返回 None"""
+    text = unicodedata.normalize("NFKC", prompt or "").lower()
+    windows = []
+    for match in re.finditer(rf"(?:从|第|from)?\s*(?P<start>{DURATION}|{NUMBER})\s*(?:到|至|~|-|to)\s*第?\s*(?P<end>{DURATION})", text):
+        windows.append((parse_duration(match.group("start")), parse_duration(match.group("end"))))
+    text = re.sub(rf"(?P<start>{DURATION}|{NUMBER})\s*(?:到|至|~|-|to)\s*第?\s*(?P<end>{DURATION})", " ", text)
+    for match in re.finditer(rf"(?:前|开头|first)\s*(?P<d>{DURATION})", text):
+        # "去掉前10秒" 需要看的是剩余部分，不限制时间段
+        if re.search(r"(?:去掉|删掉|删除|跳过|剪掉|去除|切掉)\s*(?:开头|开始|前面)?\s*的?\s*$", text[:match.start()]):
+            return None
+        windows.append((0.0, parse_duration(match.group("d"))))
+    if len(windows) != 1 or windows[0][1] <= windows[0][0]:
+        return None
+    return windows[0]
+
+
+def resolve_sampling(prompt: str, intent: Optional[str], needs_video: bool,
+                     clip_start: Optional[float] = None, clip_end: Optional[float] = None,
+                     fps: Optional[float] = None, media_resolution: Optional[str] = None,
+                     auto_clip: bool = True, transform_fps: Optional[float] = None,
+                     transform_media_resolution: Optional[str] = None) -> VideoSampling:
+    """合并请求参数和根据指令推断的采样设置"""
+    sampling = VideoSampling()
+    if auto_clip:
+        window = extract_time_window(prompt)
+        if window:
+            sampling.start_offset, sampling.end_offset = window
+            sampling.source = "intent"
+    if intent == "transform":
+        # 生成FFmpeg命令只需要大致定位画面，低分辨率、低帧率即可
+        sampling.fps = transform_fps
+        sampling.media_resolution = transform_media_resolution
+        sampling.source = "intent"
+
+    if clip_start is not None or clip_end is not None:
+        sampling.start_offset, sampling.end_offset = clip_start, clip_end
+        sampling.source = "request"
+    if fps is not None:
+        sampling.fps = fps
+        sampling.source = "request"
+    if media_resolution:
+        sampling.media_resolution = media_resolution
+        sampling.source = "request"
+    return sampling
+
+
+def subtitle_segment_plan(duration: Optional[float], sampling: VideoSampling, min_seconds: float,
+                           segment_seconds: float, overlap_seconds: float,
+                           snap_points: Optional[List[float]] = None, snap_window: float = 0) -> Optional[List[Tuple[float, float]]]:
+    """超过 min_seconds 的视频返回字幕分段计划，否则返回 None。
+    只上传音轨或已限定时间段的请求不分段"""
+    if not duration or duration <= min_seconds:
+        return None
+    if sampling.audio_only or sampling.start_offset is not None or sampling.end_offset is not None:
+        return None
+    return plan_segments(duration, segment_seconds, overlap_seconds, snap_points=snap_points, snap_window=snap_window)
+
+
+def segment_sampling(sampling: VideoSampling, fps: Optional[float], media_resolution: Optional[str]) -> VideoSampling:
+    """分段请求的采样设置：请求参数优先，否则使用给定的低帧率、低分辨率"""
+    return VideoSampling(
+        fps=sampling.fps or fps,
+        media_resolution=sampling.media_resolution or media_resolution,
+        source=sampling.source if sampling.source == "request" else "intent"
+    )
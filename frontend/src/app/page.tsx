@@ -101,6 +101,8 @@ export default function VideoAiPage() {
   // 视频缓存状态 - 跟踪已上传的视频文件
   const [lastUploadedVideoFile, setLastUploadedVideoFile] =
     useState<File | null>(null);
+  // 后端视频会话ID - 后续指令通过它引用已上传的视频
+  const [videoSessionId, setVideoSessionId] = useState<string | null>(null);
 
   // 智能滚动相关状态和引用
   const logsContainerRef = useRef<HTMLDivElement>(null);
@@ -336,6 +338,9 @@ export default function VideoAiPage() {
       process.env.NEXT_PUBLIC_BACKEND_URL || "http://localhost:8002";
     const formData = new FormData();
     formData.append("prompt", currentPrompt);
+    if (videoSessionId) {
+      formData.append("video_session_id", videoSessionId);
+    }
 
     // 智能缓存逻辑：只有在文件真正改变时才上传
     const shouldUploadVideo =
@@ -376,6 +381,9 @@ export default function VideoAiPage() {
     }
 
     const data = await response.json();
+    if (data.video_session_id) {
+      setVideoSessionId(data.video_session_id);
+    }
     return data.task_id;
   };
 